@@ -449,6 +449,30 @@ CREATE VIEW fullreviewuserfiles (review, changeset, file, deleted, inserted, sta
        FROM reviewfiles
        JOIN reviewuserfiles ON (reviewuserfiles.file=reviewfiles.id);
 
+-- Summary of the progress of each review, maintained by the functions in
+-- reviewing/progress.py.  Lines are counted as deleted + inserted lines.
+CREATE TABLE reviewprogress
+  ( review INTEGER PRIMARY KEY REFERENCES reviews ON DELETE CASCADE,
+
+    pending_files INTEGER NOT NULL,
+    pending INTEGER NOT NULL,
+    reviewed INTEGER NOT NULL,
+    issues INTEGER NOT NULL );
+
+-- Changes pending review assigned to each reviewer of each review.  Only
+-- reviewers with pending changes have rows.
+CREATE TABLE reviewuserprogress
+  ( review INTEGER NOT NULL REFERENCES reviews ON DELETE CASCADE,
+    uid INTEGER NOT NULL REFERENCES users ON DELETE CASCADE,
+
+    pending_files INTEGER NOT NULL,
+    deleted INTEGER NOT NULL,
+    inserted INTEGER NOT NULL,
+
+    PRIMARY KEY (review, uid) );
+
+CREATE INDEX reviewuserprogress_uid ON reviewuserprogress (uid);
+
 CREATE TABLE reviewmessageids
   ( uid INTEGER NOT NULL REFERENCES users ON DELETE CASCADE,
     review INTEGER NOT NULL REFERENCES reviews ON DELETE CASCADE,
@@ -606,3 +630,19 @@ CREATE TABLE oauthstates
   ( state VARCHAR(64) PRIMARY KEY,
     url TEXT,
     time TIMESTAMP NOT NULL DEFAULT NOW() );
+
+-- Aggregated statistics of (normalized) queries, per context (page, operation
+-- or process.)  See src/querystatistics.py.
+CREATE TABLE querystatistics
+  ( context VARCHAR(256) NOT NULL,
+    query_hash CHAR(32) NOT NULL,
+    query TEXT NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    slow BIGINT NOT NULL DEFAULT 0,
+    total_ms FLOAT8 NOT NULL DEFAULT 0,
+    max_ms FLOAT8 NOT NULL DEFAULT 0,
+    rows BIGINT NOT NULL DEFAULT 0,
+    first_seen TIMESTAMP NOT NULL DEFAULT NOW(),
+    last_seen TIMESTAMP NOT NULL DEFAULT NOW(),
+
+    PRIMARY KEY (context, query_hash) );
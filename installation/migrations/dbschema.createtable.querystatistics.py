@@ -0,0 +1,61 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2014 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import sys
+import psycopg2
+import argparse
+import os
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--uid", type=int)
+parser.add_argument("--gid", type=int)
+
+arguments = parser.parse_args()
+
+os.setgid(arguments.gid)
+os.setuid(arguments.uid)
+
+import configuration
+
+db = psycopg2.connect(**configuration.database.PARAMETERS)
+cursor = db.cursor()
+
+try:
+    # Make sure the table doesn't already exist.
+    cursor.execute("SELECT 1 FROM querystatistics")
+
+    # Above statement should have thrown a psycopg2.ProgrammingError, but it
+    # didn't, so just exit.
+    sys.exit(0)
+except psycopg2.ProgrammingError: db.rollback()
+except: raise
+
+cursor.execute("""CREATE TABLE querystatistics
+                    ( context VARCHAR(256) NOT NULL,
+                      query_hash CHAR(32) NOT NULL,
+                      query TEXT NOT NULL,
+                      count BIGINT NOT NULL DEFAULT 0,
+                      slow BIGINT NOT NULL DEFAULT 0,
+                      total_ms FLOAT8 NOT NULL DEFAULT 0,
+                      max_ms FLOAT8 NOT NULL DEFAULT 0,
+                      rows BIGINT NOT NULL DEFAULT 0,
+                      first_seen TIMESTAMP NOT NULL DEFAULT NOW(),
+                      last_seen TIMESTAMP NOT NULL DEFAULT NOW(),
+
+                      PRIMARY KEY (context, query_hash) )""")
+
+db.commit()
+db.close()
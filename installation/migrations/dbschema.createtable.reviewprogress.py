@@ -0,0 +1,96 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2014 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import sys
+import psycopg2
+import argparse
+import os
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--uid", type=int)
+parser.add_argument("--gid", type=int)
+
+arguments = parser.parse_args()
+
+os.setgid(arguments.gid)
+os.setuid(arguments.uid)
+
+import configuration
+
+db = psycopg2.connect(**configuration.database.PARAMETERS)
+cursor = db.cursor()
+
+try:
+    # Make sure the table doesn't already exist.
+    cursor.execute("SELECT 1 FROM reviewprogress")
+
+    # Above statement should have thrown a psycopg2.ProgrammingError, but it
+    # didn't, so just exit.
+    sys.exit(0)
+except psycopg2.ProgrammingError: db.rollback()
+except: raise
+
+cursor.execute("""CREATE TABLE reviewprogress
+                    ( review INTEGER PRIMARY KEY REFERENCES reviews ON DELETE CASCADE,
+
+                      pending_files INTEGER NOT NULL,
+                      pending INTEGER NOT NULL,
+                      reviewed INTEGER NOT NULL,
+                      issues INTEGER NOT NULL )""")
+
+cursor.execute("""CREATE TABLE reviewuserprogress
+                    ( review INTEGER NOT NULL REFERENCES reviews ON DELETE CASCADE,
+                      uid INTEGER NOT NULL REFERENCES users ON DELETE CASCADE,
+
+                      pending_files INTEGER NOT NULL,
+                      deleted INTEGER NOT NULL,
+                      inserted INTEGER NOT NULL,
+
+                      PRIMARY KEY (review, uid) )""")
+
+cursor.execute("CREATE INDEX reviewuserprogress_uid ON reviewuserprogress (uid)")
+
+# Populate the tables with the current progress of all reviews.  This is the
+# same as what reviewing.progress.rebuildReviewProgress() does, but done with
+# a few set-based queries, which is much faster for a large system.
+
+cursor.execute("""INSERT INTO reviewprogress (review, pending_files, pending, reviewed, issues)
+                       SELECT reviews.id, COALESCE(files.pending_files, 0),
+                              COALESCE(files.pending, 0), COALESCE(files.reviewed, 0),
+                              COALESCE(issues.count, 0)
+                         FROM reviews
+              LEFT OUTER JOIN (SELECT review,
+                                      SUM(CASE WHEN state='pending' THEN 1 ELSE 0 END) AS pending_files,
+                                      SUM(CASE WHEN state='pending' THEN deleted + inserted ELSE 0 END) AS pending,
+                                      SUM(CASE WHEN state!='pending' THEN deleted + inserted ELSE 0 END) AS reviewed
+                                 FROM reviewfiles
+                             GROUP BY review) AS files ON (files.review=reviews.id)
+              LEFT OUTER JOIN (SELECT review, COUNT(id) AS count
+                                 FROM commentchains
+                                WHERE type='issue'
+                                  AND state='open'
+                             GROUP BY review) AS issues ON (issues.review=reviews.id)""")
+
+cursor.execute("""INSERT INTO reviewuserprogress (review, uid, pending_files, deleted, inserted)
+                       SELECT reviewfiles.review, reviewuserfiles.uid, COUNT(reviewfiles.id),
+                              SUM(reviewfiles.deleted), SUM(reviewfiles.inserted)
+                         FROM reviewfiles
+                         JOIN reviewuserfiles ON (reviewuserfiles.file=reviewfiles.id)
+                        WHERE reviewfiles.state='pending'
+                     GROUP BY reviewfiles.review, reviewuserfiles.uid""")
+
+db.commit()
+db.close()
@@ -17,3 +17,38 @@
 # Dictionary whose members are passed as keyword arguments to
 # psycopg2.connect().
 PARAMETERS = { "database": "critic", "user": "%(installation.system.username)s" }
+
+# Maximum number of idle connections kept per process (web front-end process
+# or background service) for reuse, instead of connecting anew every time.
+# Connections are reset (rolled back, and temporary tables and session settings
+# discarded) before being reused.  Set to zero to disable connection pooling.
+POOL_SIZE = 4
+
+# Idle connections not reused within this many seconds are closed.
+POOL_MAX_IDLE_TIME = 300
+
+# Queries executed this many times on a connection are prepared (using
+# PREPARE), and from then on executed using EXECUTE, saving the database server
+# the work of parsing and planning them again.  Set to zero to disable.
+PREPARE_THRESHOLD = 5
+
+# Maximum number of prepared statements per connection.  The least recently
+# used statement is deallocated when another is prepared.
+PREPARED_STATEMENTS_MAX = 100
+
+# Fraction (0.0 - 1.0) of database sessions (in the web front-end, typically
+# one per request) in which the execution time of every query is recorded.
+# Recorded queries are normalized (literal values replaced by '?'), aggregated
+# per page, operation or background service, and periodically added to the
+# "querystatistics" table, which can be inspected using "criticctl querystats"
+# or the /querystatistics page.  Set to zero to disable.
+QUERY_STATISTICS_SAMPLE_RATE = 0.0
+
+# Queries taking at least this many milliseconds are counted as slow, and
+# recorded (as such) in all database sessions, sampled or not.  Set to zero to
+# disable.
+SLOW_QUERY_THRESHOLD = 1000
+
+# Interval (in seconds) at which each process adds the query statistics it has
+# recorded to the "querystatistics" table.
+QUERY_STATISTICS_FLUSH_INTERVAL = 60
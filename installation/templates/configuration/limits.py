@@ -35,3 +35,51 @@ MAXIMUM_REACHABLE_COMMITS = 4000
 # Maximum number of commits when /createreview is loaded with the
 # 'branch' URI parameter to create a review of all commits on a branch.
 MAXIMUM_REVIEW_COMMITS = 2000
+
+# Maximum number of 'git cat-file' processes that each Critic process (such as
+# a WSGI daemon process or a background service) keeps running for reading
+# objects from Git repositories.  Processes are reused across requests instead
+# of being started anew for each request.
+GIT_BATCH_POOL_SIZE = 16
+
+# Number of seconds an unused pooled 'git cat-file' process is kept running
+# before being terminated.
+GIT_BATCH_IDLE_TIMEOUT = 300
+
+# Number of seconds to wait for a 'git cat-file' process to be returned to a
+# full pool before starting an extra (unpooled) process instead.
+GIT_BATCH_WAIT_TIMEOUT = 1
+
+# Number of times a pooled 'git cat-file' process is reused before it is
+# terminated and replaced by a fresh process.
+GIT_BATCH_MAX_USES = 1000
+
+# Memory budgets, in bytes, per object type for the per-process cache of Git
+# objects that is shared between requests.  Objects larger than a quarter of
+# their type's budget are never cached.  Blobs are only cached by pages that
+# specifically ask for it.
+GIT_OBJECT_CACHE_SIZE = { "commit": 16 * 1024 ** 2,
+                          "tree": 32 * 1024 ** 2,
+                          "tag": 1024 ** 2,
+                          "blob": 64 * 1024 ** 2 }
+
+# Maximum number of parsed Git tree objects, and of resolved directory paths,
+# that each Critic process caches between requests.
+GIT_TREE_CACHE_SIZE = 10000
+GIT_PATH_CACHE_SIZE = 100000
+
+# How Git objects are read from repositories: "cat-file" (a 'git cat-file'
+# process) or "packfile" (Critic reads pack files directly, falling back to
+# 'git cat-file' for loose objects and anything else it can't handle.)
+GIT_OBJECT_BACKEND = "cat-file"
+
+# Per-repository overrides of GIT_OBJECT_BACKEND, keyed by repository name.
+GIT_OBJECT_BACKEND_OVERRIDES = {}
+
+# Memory budget, in bytes, per repository for inflated delta base objects
+# cached by the "packfile" object backend.
+GIT_DELTA_BASE_CACHE_SIZE = 32 * 1024 ** 2
+
+# Maximum number of blamed files that each Critic process keeps in memory.
+# (Blame results are also cached on disk, without any size limit.)
+BLAME_CACHE_SIZE = 100
@@ -46,12 +46,62 @@ HIGHLIGHT["max_context_length"] = 256
 HIGHLIGHT["max_workers"] = 4
 HIGHLIGHT["compact_at"] = (3, 15)
 
+# How highlighted files are stored: "files" (one file per highlighted file,
+# compressed with bzip2 when unused for a week) or "packed" (compressed and
+# appended to large segment files, with an index.)  Switching discards the
+# previously stored highlighting (it is regenerated on demand.)
+HIGHLIGHT["storage"] = "files"
+# Compression used with "packed" storage: "zlib", "bz2" or "none".
+HIGHLIGHT["storage_codec"] = "zlib"
+# Size (in bytes) at which a new segment file is started with "packed" storage.
+HIGHLIGHT["storage_segment_size"] = 64 * 1024 ** 2
+
+# Highlight new versions of files incrementally, reusing the highlighting of
+# the old version for lines not near changes: "off", "on" or "check".  In
+# "check" mode, files are also highlighted fully, mismatches are logged as
+# errors, and the fully highlighted version is stored.  Only used for languages
+# highlighted using Pygments.
+HIGHLIGHT["incremental"] = "off"
+
 CHANGESET["max_workers"] = 4
 CHANGESET["rss_limit"] = 1024 ** 3
 CHANGESET["purge_at"] = (2, 15)
 
+# Maximum number of processes used to diff a merge commit against its parents
+# in parallel, per merge changeset being created.
+CHANGESET["max_merge_workers"] = 4
+
+# Perform jobs in a pool of long-running worker processes instead of starting
+# a new process per job.  A worker is replaced after performing
+# "worker_max_jobs" jobs, or when its RSS exceeds "rss_limit" (if set.)
+HIGHLIGHT["worker_pool"] = False
+HIGHLIGHT["worker_max_jobs"] = 100
+CHANGESET["worker_pool"] = False
+CHANGESET["worker_max_jobs"] = 100
+
+# Request (in the background) changesets and syntax highlighting for pushed
+# commits, so that they are ready when first viewed.  At most
+# "prefetch_max_commits" commits, and "prefetch_max_blobs" changed files in
+# them, are processed per push.  Disabled by default; set "prefetch" to True
+# to enable.
+GITHOOK["prefetch"] = False
+GITHOOK["prefetch_max_commits"] = 100
+GITHOOK["prefetch_max_blobs"] = 1000
+
+# Maximum number of remotes fetched from concurrently when updating tracked
+# branches.  All due tracked branches in a repository that track the same
+# remote are updated using a single fetch.
+BRANCHTRACKER["max_fetchers"] = 4
+
 # Timeout (in seconds) passed to smtplib.SMTP().
 MAILDELIVERY["timeout"] = 10
+# Maximum number of concurrent connections to the SMTP server, each used to
+# send queued messages back-to-back.
+MAILDELIVERY["max_connections"] = 4
+# Maximum number of messages sent per minute to recipients in a given domain,
+# e.g. { "example.com": 60 }.  The key "*" sets a limit for all other domains.
+# Domains not limited are not rate limited at all.
+MAILDELIVERY["domain_rate_limits"] = {}
 
 WATCHDOG["rss_soft_limit"] = 1024 ** 3
 WATCHDOG["rss_hard_limit"] = 2 * WATCHDOG["rss_soft_limit"]
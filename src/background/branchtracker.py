@@ -18,6 +18,8 @@ import sys
 import os
 import time
 import traceback
+import threading
+import Queue
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), "..")))
 
@@ -27,99 +29,319 @@ import gitutils
 import mailutils
 import configuration
 
-class BranchTracker(background.utils.BackgroundProcess):
-    def __init__(self):
-        super(BranchTracker, self).__init__(service=configuration.services.BRANCHTRACKER)
+class FetchJob(object):
+    """Update of all due tracked branches in one repository from one remote
+
+       The tracked branches are (trackedbranch_id, local_name, remote_name)
+       tuples; local_name is "*" for tracking of tags.  After the job has
+       been performed, 'outcomes' maps each trackedbranch_id to a tuple:
+
+         ("unchanged", None)
+         ("failed", <error message>)
+         ("pushed", (<current>, <new>, <tags>, <returncode>, <stderr>))"""
+
+    def __init__(self, repository, remote, branches):
+        self.repository = repository
+        self.remote = remote
+        self.branches = branches
+        self.outcomes = {}
+        self.ls_remote_time = None
+        self.fetch_time = None
+
+    def failed(self, branches, message, include_traceback=True):
+        if include_traceback:
+            message += "\n" + traceback.format_exc()
+        for trackedbranch_id, local_name, remote_name in branches:
+            self.outcomes[trackedbranch_id] = ("failed", message)
+
+    def perform(self):
+        repository = self.repository
+        remote = self.remote
+
+        tags_branch = None
+        branches = []
+
+        for branch in self.branches:
+            if branch[1] == "*":
+                tags_branch = branch
+            else:
+                branches.append(branch)
+
+        # Check which branches (and tags) have changed using "git ls-remote",
+        # which is much cheaper than creating a relay copy and fetching.
+        try:
+            before = time.time()
+            if tags_branch:
+                output = repository.run("ls-remote", "--heads", "--tags", remote)
+            else:
+                output = repository.run("ls-remote", "--heads", remote)
+            self.ls_remote_time = time.time() - before
+        except Exception:
+            self.failed(self.branches, "git ls-remote failed")
+            return
+
+        remote_refs = {}
+        for line in output.splitlines():
+            sha1, _, ref = line.partition("\t")
+            if not ref.endswith("^{}"):
+                remote_refs[ref] = sha1
+
+        fetch_branches = []
+
+        for branch in branches:
+            trackedbranch_id, local_name, remote_name = branch
+            remote_sha1 = remote_refs.get("refs/heads/%s" % remote_name)
+
+            if remote_sha1 is None:
+                self.failed([branch], "no such branch in remote: %s" % remote_name,
+                            include_traceback=False)
+                continue
+
+            try:
+                current = repository.revparse("refs/heads/%s" % local_name)
+            except gitutils.GitReferenceError:
+                # It's okay if the local branch doesn't exist (yet).
+                current = None
 
-    def update(self, trackedbranch_id, repository_id, local_name, remote, remote_name, forced):
-        repository = gitutils.Repository.fromId(self.db, repository_id)
+            if current == remote_sha1:
+                self.outcomes[trackedbranch_id] = ("unchanged", None)
+            else:
+                fetch_branches.append((branch, current))
+
+        fetch_tags = False
+
+        if tags_branch:
+            local_tags = set(repository.run("for-each-ref", "--format=%(refname)", "refs/tags/").splitlines())
+            remote_tags = set(ref for ref in remote_refs if ref.startswith("refs/tags/"))
+
+            if remote_tags - local_tags:
+                fetch_tags = True
+            else:
+                self.outcomes[tags_branch[0]] = ("unchanged", None)
+
+        if not fetch_branches and not fetch_tags:
+            return
 
         try:
             with repository.relaycopy("branchtracker") as relay:
                 relay.run("remote", "add", "source", remote)
 
-                current = None
-                new = None
+                before = time.time()
+
+                if fetch_branches:
+                    # Fetch all changed branches with a single command.
+                    try:
+                        relay.run("fetch", "--quiet", "--no-tags", "source",
+                                  *["refs/heads/%s:refs/remotes/source/%s" % (remote_name, remote_name)
+                                    for (_, _, remote_name), _ in fetch_branches])
+                    except Exception:
+                        self.failed([branch for branch, _ in fetch_branches], "git fetch failed")
+                        fetch_branches = []
+
                 tags = []
 
-                if local_name == "*":
-                    output = relay.run("fetch", "source", "refs/tags/*:refs/tags/*", include_stderr=True)
-                    for line in output.splitlines():
-                        if "[new tag]" in line:
-                            tags.append(line.rsplit(" ", 1)[-1])
-                else:
-                    relay.run("fetch", "--quiet", "--no-tags", "source", "refs/heads/%s:refs/remotes/source/%s" % (remote_name, remote_name))
+                if fetch_tags:
+                    # Fetched separately, since a tag that can't be updated makes
+                    # the whole fetch fail.
                     try:
-                        current = repository.revparse("refs/heads/%s" % local_name)
-                    except gitutils.GitReferenceError:
-                        # It's okay if the local branch doesn't exist (yet).
-                        pass
-                    new = relay.run("rev-parse", "refs/remotes/source/%s" % remote_name).strip()
-
-                if current != new or tags:
-                    if local_name == "*":
-                        refspecs = [("refs/tags/%s" % tag) for tag in tags]
-                    else:
-                        refspecs = ["refs/remotes/source/%s:refs/heads/%s"
-                                    % (remote_name, local_name)]
-
-                    returncode, stdout, stderr = relay.run(
-                        "push", "--force", "origin", *refspecs,
-                        env={ "CRITIC_FLAGS": "trackedbranch_id=%d" % trackedbranch_id },
-                        check_errors=False)
-
-                    stderr = stderr.replace("\x1b[K", "")
-
-                    if returncode == 0:
-                        if local_name == "*":
-                            for tag in tags:
-                                self.info("  updated tag: %s" % tag)
-                        elif current:
-                            self.info("  updated branch: %s: %s..%s" % (local_name, current[:8], new[:8]))
-                        else:
-                            self.info("  created branch: %s: %s" % (local_name, new[:8]))
+                        output = relay.run("fetch", "source", "refs/tags/*:refs/tags/*", include_stderr=True)
+                        for line in output.splitlines():
+                            if "[new tag]" in line:
+                                tags.append(line.rsplit(" ", 1)[-1])
+                    except Exception:
+                        self.failed([tags_branch], "git fetch failed")
+                        fetch_tags = False
 
-                        hook_output = ""
+                self.fetch_time = time.time() - before
 
-                        for line in stderr.splitlines():
-                            if line.startswith("remote: "):
-                                self.debug("  [hook] " + line[8:])
-                                hook_output += line[8:] + "\n"
+                for branch, current in fetch_branches:
+                    trackedbranch_id, local_name, remote_name = branch
 
-                        if local_name != "*":
-                            cursor = self.db.cursor()
-                            cursor.execute("INSERT INTO trackedbranchlog (branch, from_sha1, to_sha1, hook_output, successful) VALUES (%s, %s, %s, %s, %s)",
-                                           (trackedbranch_id, current if current else '0' * 40, new if new else '0' * 40, hook_output, True))
-                            self.db.commit()
-                    else:
-                        if local_name == "*":
-                            error = "update of tags from %s failed" % remote
+                    try:
+                        new = relay.run("rev-parse", "refs/remotes/source/%s" % remote_name).strip()
+
+                        if current == new:
+                            self.outcomes[trackedbranch_id] = ("unchanged", None)
+                            continue
+
+                        returncode, stdout, stderr = relay.run(
+                            "push", "--force", "origin",
+                            "refs/remotes/source/%s:refs/heads/%s" % (remote_name, local_name),
+                            env={ "CRITIC_FLAGS": "trackedbranch_id=%d" % trackedbranch_id },
+                            check_errors=False)
+                    except Exception:
+                        self.failed([branch], "git push failed")
+                        continue
+
+                    self.outcomes[trackedbranch_id] = (
+                        "pushed", (current, new, [], returncode, stderr))
+
+                if fetch_tags:
+                    if tags:
+                        try:
+                            returncode, stdout, stderr = relay.run(
+                                "push", "--force", "origin",
+                                *[("refs/tags/%s" % tag) for tag in tags],
+                                env={ "CRITIC_FLAGS": "trackedbranch_id=%d" % tags_branch[0] },
+                                check_errors=False)
+                        except Exception:
+                            self.failed([tags_branch], "git push failed")
                         else:
-                            error = "update of branch %s from %s in %s failed" % (local_name, remote_name, remote)
+                            self.outcomes[tags_branch[0]] = (
+                                "pushed", (None, None, tags, returncode, stderr))
+                    else:
+                        self.outcomes[tags_branch[0]] = ("unchanged", None)
+        except Exception:
+            self.failed([branch for branch in self.branches
+                         if branch[0] not in self.outcomes],
+                        "relay copy failed")
+
+class Fetcher(threading.Thread):
+    def __init__(self, tracker, index):
+        super(Fetcher, self).__init__(name="fetcher-%d" % index)
+        self.daemon = True
+        self.tracker = tracker
+
+    def run(self):
+        while True:
+            job = self.tracker.jobs.get()
+
+            if job is None:
+                # Service is shutting down.
+                break
+
+            try:
+                job.perform()
+            except Exception:
+                job.failed([branch for branch in job.branches
+                            if branch[0] not in job.outcomes],
+                           "unexpected error")
+
+            self.tracker.finished(job)
+
+class BranchTracker(background.utils.BackgroundProcess):
+    def __init__(self):
+        service = configuration.services.BRANCHTRACKER
+
+        super(BranchTracker, self).__init__(service=service)
+
+        # Remotes are fetched from concurrently, by this many threads.  All
+        # database access is done by the main thread.
+        self.max_fetchers = max(1, service.get("max_fetchers", 1))
+        self.jobs = Queue.Queue()
+        self.results = Queue.Queue()
+        self.wakeup = background.utils.Wakeup()
+
+        self.metrics.describe("remote_checks_total", "counter",
+                              "Checks of remotes for changes, per remote.")
+        self.metrics.describe("remote_fetches_total", "counter",
+                              "Fetches from remotes that had changes, per remote.")
+        self.metrics.describe("remote_seconds", "histogram",
+                              "Time spent checking and fetching from a remote, per remote.")
+        self.metrics.describe("branch_updates_total", "counter",
+                              "Updates of tracked branches, by outcome.")
+
+    def finished(self, job):
+        # Called by the fetcher threads.
+        seconds = (job.ls_remote_time or 0) + (job.fetch_time or 0)
+        labels = { "remote": job.remote }
+
+        self.metrics.increment("remote_checks_total", labels=labels)
+        if job.fetch_time is not None:
+            self.metrics.increment("remote_fetches_total", labels=labels)
+        self.metrics.observe("remote_seconds", seconds, labels)
+
+        self.results.put(job)
+        self.wakeup.wakeup()
+
+    def record(self, repository, trackedbranch_id, local_name, remote, remote_name, outcome):
+        """Log and record the outcome of updating a tracked branch
+
+           Returns false if the tracking should be disabled."""
+
+        kind, details = outcome
+
+        if kind == "unchanged":
+            if local_name == "*":
+                self.debug("  fetched tags from %s; no changes" % remote)
+            else:
+                self.debug("  fetched %s in %s; no changes" % (remote_name, remote))
+            return True
 
-                        hook_output = ""
+        if kind == "failed":
+            if local_name == "*":
+                error = "  update of tags from %s failed" % remote
+            else:
+                error = "  update of branch %s from %s in %s failed" % (local_name, remote_name, remote)
 
-                        for line in stderr.splitlines():
-                            error += "\n    " + line
-                            if line.startswith("remote: "):
-                                hook_output += line[8:] + "\n"
+            for line in details.splitlines():
+                error += "\n    " + line
 
-                        self.error(error)
+            self.error(error)
 
-                        cursor = self.db.cursor()
+            # The expected failure (in case of diverged branches, or review branch
+            # irregularities) is a failed "git push" and is handled below.  This is
+            # an unexpected failure, so might be intermittent.  Leave the tracking
+            # enabled and spam the system administrator(s).
+            return True
+
+        current, new, tags, returncode, stderr = details
+
+        stderr = stderr.replace("\x1b[K", "")
+
+        if returncode == 0:
+            if local_name == "*":
+                for tag in tags:
+                    self.info("  updated tag: %s" % tag)
+            elif current:
+                self.info("  updated branch: %s: %s..%s" % (local_name, current[:8], new[:8]))
+            else:
+                self.info("  created branch: %s: %s" % (local_name, new[:8]))
 
-                        if local_name != "*":
-                            cursor.execute("""INSERT INTO trackedbranchlog (branch, from_sha1, to_sha1, hook_output, successful)
-                                                   VALUES (%s, %s, %s, %s, %s)""",
-                                           (trackedbranch_id, current, new, hook_output, False))
-                            self.db.commit()
+            hook_output = ""
 
-                        cursor.execute("SELECT uid FROM trackedbranchusers WHERE branch=%s", (trackedbranch_id,))
-                        recipients = [dbutils.User.fromId(self.db, user_id) for (user_id,) in cursor]
+            for line in stderr.splitlines():
+                if line.startswith("remote: "):
+                    self.debug("  [hook] " + line[8:])
+                    hook_output += line[8:] + "\n"
 
-                        if local_name == "*":
-                            mailutils.sendMessage(recipients, "%s: update of tags from %s stopped!" % (repository.name, remote),
-                                                  """\
+            if local_name != "*":
+                cursor = self.db.cursor()
+                cursor.execute("INSERT INTO trackedbranchlog (branch, from_sha1, to_sha1, hook_output, successful) VALUES (%s, %s, %s, %s, %s)",
+                               (trackedbranch_id, current if current else '0' * 40, new if new else '0' * 40, hook_output, True))
+                self.db.commit()
+
+            # Everything went well; keep the tracking enabled.
+            return True
+
+        if local_name == "*":
+            error = "update of tags from %s failed" % remote
+        else:
+            error = "update of branch %s from %s in %s failed" % (local_name, remote_name, remote)
+
+        hook_output = ""
+
+        for line in stderr.splitlines():
+            error += "\n    " + line
+            if line.startswith("remote: "):
+                hook_output += line[8:] + "\n"
+
+        self.error(error)
+
+        cursor = self.db.cursor()
+
+        if local_name != "*":
+            cursor.execute("""INSERT INTO trackedbranchlog (branch, from_sha1, to_sha1, hook_output, successful)
+                                   VALUES (%s, %s, %s, %s, %s)""",
+                           (trackedbranch_id, current, new, hook_output, False))
+            self.db.commit()
+
+        cursor.execute("SELECT uid FROM trackedbranchusers WHERE branch=%s", (trackedbranch_id,))
+        recipients = [dbutils.User.fromId(self.db, user_id) for (user_id,) in cursor]
+
+        if local_name == "*":
+            mailutils.sendMessage(recipients, "%s: update of tags from %s stopped!" % (repository.name, remote),
+                                  """\
 The automatic update of tags in
   %s:%s
 from the remote
@@ -131,9 +353,9 @@ Output from Critic's git hook
 -----------------------------
 
 %s""" % (configuration.base.HOSTNAME, repository.path, remote, hook_output))
-                        else:
-                            mailutils.sendMessage(recipients, "%s: update from %s in %s stopped!" % (local_name, remote_name, remote),
-                                                  """\
+        else:
+            mailutils.sendMessage(recipients, "%s: update from %s in %s stopped!" % (local_name, remote_name, remote),
+                                  """\
 The automatic update of the branch '%s' in
   %s:%s
 from the branch '%s' in
@@ -146,47 +368,44 @@ Output from Critic's git hook
 
 %s""" % (local_name, configuration.base.HOSTNAME, repository.path, remote_name, remote, hook_output))
 
-                        # Disable the tracking.
-                        return False
-                else:
-                    self.debug("  fetched %s in %s; no changes" % (remote_name, remote))
+        # Disable the tracking.
+        return False
 
-            # Everything went well; keep the tracking enabled.
-            return True
-        except:
-            exception = traceback.format_exc()
+    def dispatch(self, in_progress):
+        """Start jobs for due tracked branches, as many as there are fetchers
 
-            if local_name == "*":
-                error = "  update of tags from %s failed" % remote
-            else:
-                error = "  update of branch %s from %s in %s failed" % (local_name, remote_name, remote)
+           Returns true if there are due tracked branches left."""
 
-            for line in exception.splitlines():
-                error += "\n    " + line
+        cursor = self.db.cursor()
+        cursor.execute("""SELECT id, repository, local_name, remote, remote_name
+                            FROM trackedbranches
+                           WHERE NOT disabled
+                             AND (next IS NULL OR next < NOW())
+                        ORDER BY next ASC NULLS FIRST""")
+        rows = cursor.fetchall()
 
-            self.error(error)
+        # Group the tracked branches by repository and remote, so that each
+        # remote is fetched from once, in the order of the most overdue branch.
+        groups = []
+        branches = {}
 
-            # The expected failure (in case of diverged branches, or review branch
-            # irregularities) is a failed "git push" and is handled above.  This is
-            # an unexpected failure, so might be intermittent.  Leave the tracking
-            # enabled and spam the system administrator(s).
-            return True
+        for trackedbranch_id, repository_id, local_name, remote, remote_name in rows:
+            key = (repository_id, remote)
+            if key not in branches:
+                groups.append(key)
+                branches[key] = []
+            branches[key].append((trackedbranch_id, local_name, remote_name))
 
-    def run(self):
-        self.db = dbutils.Database()
+        left = False
 
-        while not self.terminated:
-            self.interrupted = False
+        for key in groups:
+            if key in in_progress or len(in_progress) >= self.max_fetchers:
+                left = True
+                continue
 
-            cursor = self.db.cursor()
-            cursor.execute("""SELECT id, repository, local_name, remote, remote_name, forced
-                                FROM trackedbranches
-                               WHERE NOT disabled
-                                 AND (next IS NULL OR next < NOW())
-                            ORDER BY next ASC NULLS FIRST""")
-            rows = cursor.fetchall()
+            repository_id, remote = key
 
-            for trackedbranch_id, repository_id, local_name, remote, remote_name, forced in rows:
+            for trackedbranch_id, local_name, remote_name in branches[key]:
                 if local_name == "*":
                     self.info("checking tags in %s" % remote)
                 else:
@@ -196,73 +415,133 @@ Output from Critic's git hook
                                      SET previous=NOW(),
                                          next=NOW() + delay,
                                          updating=TRUE
-                                   WHERE repository=%s
-                                     AND local_name=%s
+                                   WHERE id=%s""",
+                               (trackedbranch_id,))
+
+            self.db.commit()
+
+            repository = gitutils.Repository.fromId(self.db, repository_id)
+            job = FetchJob(repository, remote, branches[key])
+
+            in_progress[key] = job
+            self.jobs.put(job)
+
+        return left
+
+    def process(self, job):
+        if job.fetch_time is not None:
+            self.info("fetched from %s in %.2f seconds (ls-remote: %.2f seconds)"
+                      % (job.remote, job.fetch_time, job.ls_remote_time))
+        elif job.ls_remote_time is not None:
+            self.debug("no changes in %s (ls-remote: %.2f seconds)"
+                       % (job.remote, job.ls_remote_time))
+
+        cursor = self.db.cursor()
+
+        for trackedbranch_id, local_name, remote_name in job.branches:
+            outcome = job.outcomes.get(trackedbranch_id, ("failed", "not updated"))
+
+            self.metrics.increment("branch_updates_total", labels={ "outcome": outcome[0] })
+
+            if self.record(job.repository, trackedbranch_id, local_name, job.remote, remote_name, outcome):
+                cursor.execute("""UPDATE trackedbranches
+                                     SET updating=FALSE
+                                   WHERE id=%s
                                RETURNING next::text""",
-                               (repository_id, local_name))
-                next_at = cursor.fetchone()[0]
+                               (trackedbranch_id,))
+                self.info("  next scheduled update of %s at %s"
+                          % ("tags" if local_name == "*" else local_name, cursor.fetchone()[0]))
+            else:
+                cursor.execute("""UPDATE trackedbranches
+                                     SET updating=FALSE,
+                                         disabled=TRUE
+                                   WHERE id=%s""",
+                               (trackedbranch_id,))
+                self.info("  tracking of %s disabled"
+                          % ("tags" if local_name == "*" else local_name))
 
-                self.db.commit()
+            self.db.commit()
 
-                if self.update(trackedbranch_id, repository_id, local_name, remote, remote_name, forced):
-                    cursor.execute("""UPDATE trackedbranches
-                                         SET updating=FALSE
-                                       WHERE repository=%s
-                                         AND local_name=%s""",
-                                   (repository_id, local_name))
-                    self.info("  next scheduled update at %s" % next_at)
-                else:
-                    cursor.execute("""UPDATE trackedbranches
-                                         SET updating=FALSE,
-                                             disabled=TRUE
-                                       WHERE repository=%s
-                                         AND local_name=%s""",
-                                   (repository_id, local_name))
-                    self.info("  tracking disabled")
+    def run(self):
+        self.db = dbutils.Database()
 
-                self.db.commit()
+        fetchers = [Fetcher(self, index) for index in range(self.max_fetchers)]
+
+        for fetcher in fetchers:
+            fetcher.start()
+
+        in_progress = {}
+
+        def processResults():
+            while True:
+                try:
+                    job = self.results.get_nowait()
+                except Queue.Empty:
+                    break
+                del in_progress[(job.repository.id, job.remote)]
+                self.process(job)
+
+        try:
+            while not self.terminated:
+                self.interrupted = False
 
-                if self.terminated: break
+                processResults()
 
-            cursor.execute("""SELECT 1
-                                FROM trackedbranches
-                               WHERE NOT disabled
-                                 AND next IS NULL""")
+                if self.dispatch(in_progress):
+                    # Wait for a fetcher to become available, or for a
+                    # running update of the same remote to finish.
+                    self.wakeup.wait(3600)
+                    continue
 
-            if not cursor.fetchone():
                 maintenance_delay = self.run_maintenance()
 
                 if maintenance_delay is None:
                     maintenance_delay = 3600
 
-                cursor.execute("""SELECT COUNT(*), EXTRACT('epoch' FROM (MIN(next) - NOW()))
+                cursor = self.db.cursor()
+                cursor.execute("""SELECT COUNT(*), EXTRACT('epoch' FROM (MIN(COALESCE(next, NOW())) - NOW()))
                                     FROM trackedbranches
                                    WHERE NOT disabled""")
 
                 enabled_branches, update_delay = cursor.fetchone()
 
                 if not enabled_branches:
-                    self.info("nothing to do")
+                    if not in_progress:
+                        self.info("nothing to do")
                     update_delay = 3600
                 else:
-                    update_delay = max(0, int(update_delay))
+                    update_delay = max(0, update_delay)
 
                 delay = min(maintenance_delay, update_delay)
 
-                if delay:
-                    self.signal_idle_state()
+                self.db.commit()
 
-                    self.debug("sleeping %d seconds" % delay)
+                if delay <= 0:
+                    continue
+
+                if not in_progress:
+                    self.signal_idle_state()
 
                     gitutils.Repository.forEach(self.db, lambda db, repository: repository.stopBatch())
 
                     self.db.commit()
 
-                    before = time.time()
-                    time.sleep(delay)
-                    if self.interrupted:
-                        self.debug("sleep interrupted after %.2f seconds" % (time.time() - before))
+                self.debug("sleeping %.1f seconds" % delay)
+
+                before = time.time()
+                self.wakeup.wait(delay)
+                if self.interrupted:
+                    self.debug("sleep interrupted after %.2f seconds" % (time.time() - before))
+        finally:
+            # Let running updates finish, and record their outcomes.
+            for fetcher in fetchers:
+                self.jobs.put(None)
+            for fetcher in fetchers:
+                fetcher.join()
+
+            processResults()
 
+            self.wakeup.close()
             self.db.commit()
 
 def start_service():
@@ -29,22 +29,26 @@ if "--json-job" in sys.argv[1:]:
     from resource import getrlimit, setrlimit, RLIMIT_RSS
     from traceback import print_exc
 
+    from changeset.create import createChangeset
+
     def perform_job():
         soft_limit, hard_limit = getrlimit(RLIMIT_RSS)
         rss_limit = configuration.services.CHANGESET["rss_limit"]
         if soft_limit < rss_limit:
             setrlimit(RLIMIT_RSS, (rss_limit, hard_limit))
 
-        from changeset.create import createChangeset
-
         request = json_decode(sys.stdin.read())
 
         try:
             db = dbutils.Database()
 
-            createChangeset(db, request)
-
-            db.close()
+            # This process performs many jobs, so make sure the connection is
+            # rolled back and released (to the connection pool) even if one
+            # fails.
+            try:
+                createChangeset(db, request)
+            finally:
+                db.close()
 
             sys.stdout.write(json_encode(request))
         except:
@@ -54,7 +58,8 @@ if "--json-job" in sys.argv[1:]:
 
             print_exc(file=sys.stdout)
 
-    background.utils.call("changeset_job", perform_job)
+    background.utils.call("changeset_job", background.utils.json_job, perform_job,
+                          configuration.services.CHANGESET)
 else:
     from background.utils import JSONJobServer
 
@@ -99,6 +104,11 @@ else:
                                  parent_sha1[:8], request["child_sha1"][:8],
                                  request["repository_name"], job.pid))
 
+                for parent_sha1, timings in sorted(result.get("timings", {}).items()):
+                    self.debug("  parent %s: %s"
+                               % (parent_sha1[:8],
+                                  ", ".join("%s=%.2fs" % item for item in sorted(timings.items()))))
+
         def __purge(self):
             db = dbutils.Database()
             cursor = db.cursor()
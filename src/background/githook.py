@@ -17,6 +17,7 @@
 import sys
 import os
 import os.path
+import time
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), "..")))
 
@@ -27,6 +28,10 @@ from textutils import json_decode, json_encode
 
 sys_stdout = sys.stdout
 
+# Prefix of lines of progress information written by the slave process before
+# its final (JSON) result.
+PROGRESS_PREFIX = "progress: "
+
 def slave():
     import StringIO
     import traceback
@@ -65,7 +70,7 @@ def slave():
 
         index.init()
 
-        commits_to_process = set()
+        commits_to_process = []
 
         for ref in request["refs"]:
             name = ref["name"]
@@ -78,7 +83,7 @@ def slave():
                 reject("unexpected ref name: '%s'" % name)
 
             if new_sha1 != '0000000000000000000000000000000000000000':
-                commits_to_process.add(new_sha1)
+                commits_to_process.append(new_sha1)
 
             name = name[len("refs/"):]
 
@@ -109,8 +114,14 @@ def slave():
         multiple = (len(delete_branches) + len(update_branches) + len(create_branches) + len(delete_tags) + len(update_tags) + len(create_tags)) > 1
         info = []
 
-        for sha1 in commits_to_process:
-            index.processCommits(repository_name, sha1)
+        def progress(message):
+            # Sent ahead of the final result; see ChildProcess below.
+            sys_stdout.write(PROGRESS_PREFIX + message + "\n")
+            sys_stdout.flush()
+
+        # Index the new commits of all refs at once, with a single walk of the
+        # commit graph, rather than one walk per ref.
+        new_commits = index.processCommits(repository_name, commits_to_process, progress=progress)
 
         for name, old in delete_branches:
             index.deleteBranch(user_name, repository_name, name, old)
@@ -125,18 +136,30 @@ def slave():
         for name, new in create_branches:
             info.append("branch created: %s (%s)" % (name, new[:8]))
 
+        # Tags are processed in batches, since a release or mirror push can
+        # contain very many of them.
+        if delete_tags:
+            index.deleteTags(repository_name, delete_tags)
+
         for name in delete_tags:
-            index.deleteTag(repository_name, name)
             info.append("tag deleted: %s" % name)
 
+        if update_tags:
+            index.updateTags(repository_name, update_tags)
+
         for name, old, new in update_tags:
-            index.updateTag(repository_name, name, old, new)
             info.append("tag updated: %s (%s..%s)" % (name, old[:8], new[:8]))
 
+        if create_tags:
+            index.createTags(repository_name, create_tags)
+
         for name, new in create_tags:
-            index.createTag(repository_name, name, new)
             info.append("tag created: %s (%s)" % (name, new[:8]))
 
+        # Get the changeset and highlight services started on the new commits
+        # before anyone asks for them.
+        index.prefetchCommits(repository_name, new_commits)
+
         sys_stdout.write(json_encode({ "status": "ok", "accept": True, "output": sys.stdout.getvalue(), "info": info }))
 
         index.finish()
@@ -163,6 +186,18 @@ class GitHookServer(background.utils.PeerServer):
         def __init__(self, server, client):
             super(GitHookServer.ChildProcess, self).__init__(server, [sys.executable, sys.argv[0], "--slave"])
             self.__client = client
+            self.__started_at = time.time()
+
+        def handle_partial_input(self, data):
+            # Forward progress lines to the client as they arrive.
+            consumed = 0
+            while data.startswith(PROGRESS_PREFIX, consumed):
+                linebreak = data.find("\n", consumed)
+                if linebreak == -1:
+                    break
+                self.__client.write(data[consumed + len(PROGRESS_PREFIX):linebreak + 1])
+                consumed = linebreak + 1
+            return consumed
 
         def handle_input(self, data):
             try:
@@ -171,6 +206,14 @@ class GitHookServer(background.utils.PeerServer):
                 result = { "status": "error",
                            "error": ("invalid response:\n" +
                                      background.utils.indent(data)) }
+            if result["status"] != "ok":
+                outcome = result["status"]
+            elif result["accept"]:
+                outcome = "accept"
+            else:
+                outcome = "reject"
+            self.server.metrics.increment("pushes_total", labels={ "outcome": outcome })
+            self.server.metrics.observe("push_seconds", time.time() - self.__started_at)
             if result["status"] == "ok":
                 for item in result["info"]:
                     self.server.info(item)
@@ -235,6 +278,11 @@ been sent to the system administrator(s).
 
         os.chmod(configuration.services.GITHOOK["address"], 0770)
 
+        self.metrics.describe("pushes_total", "counter",
+                              "Pushes processed, by outcome (accept, reject or error.)")
+        self.metrics.describe("push_seconds", "histogram",
+                              "Time spent processing pushes.")
+
     def handle_peer(self, peersocket, peeraddress):
         return GitHookServer.Client(self, peersocket)
 
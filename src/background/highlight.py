@@ -17,7 +17,7 @@
 import sys
 import os
 import time
-from subprocess import Popen as process
+import bz2
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), "..")))
 
@@ -25,17 +25,24 @@ import background.utils
 from textutils import json_decode, json_encode
 
 if "--json-job" in sys.argv[1:]:
-    def perform_job():
-        import syntaxhighlight.generate
+    import configuration
+    import syntaxhighlight.generate
 
+    def perform_job():
         request = json_decode(sys.stdin.read())
+        statistics = {}
         request["highlighted"] = syntaxhighlight.generate.generateHighlight(
             repository_path=request["repository_path"],
             sha1=request["sha1"],
-            language=request["language"])
+            language=request["language"],
+            base_sha1=request.get("base_sha1"),
+            statistics=statistics)
+        if statistics:
+            request["incremental"] = statistics
         sys.stdout.write(json_encode(request))
 
-    background.utils.call("highlight_job", perform_job)
+    background.utils.call("highlight_job", background.utils.json_job, perform_job,
+                          configuration.services.HIGHLIGHT)
 else:
     import background.utils
     from syntaxhighlight import isHighlighted
@@ -73,6 +80,13 @@ else:
             failed = "" if "error" not in result else " (failed!)"
             self.info("finished: %s:%s (%s) in %s [pid=%d]%s" % (request["path"], request["sha1"][:8], request["language"], request["repository_path"], job.pid, failed))
 
+            incremental = result.get("incremental")
+            if incremental:
+                self.debug("  incremental: lexed %d of %d lines" % (incremental["lexed"], incremental["lines"]))
+                if incremental.get("check") == "mismatch":
+                    self.error("incremental highlighting mismatch: %s:%s (%s) based on %s in %s"
+                               % (request["path"], request["sha1"][:8], request["language"], request.get("base_sha1", "")[:8], request["repository_path"]))
+
             ncontexts = importCodeContexts(self.db, request["sha1"], request["language"])
 
             if ncontexts: self.debug("  added %d code contexts" % ncontexts)
@@ -102,67 +116,118 @@ else:
 
             self.info("cache compacting started")
 
-            now = time.time()
-
             max_age_uncompressed = 7 * 24 * 60 * 60
             max_age_compressed = 90 * 24 * 60 * 60
 
+            store = syntaxhighlight.getPackedStore()
+
+            if store:
+                # Everything in the packed store is compressed, and unused
+                # data is purged a segment at a time.
+                purged = store.purge(max_age_compressed)
+                statistics = store.statistics()
+
+                self.info("cache compacting finished: entries=%d / segments=%d / purged=%d"
+                          % (statistics["entries"], statistics["segments"], len(purged)))
+
+                uncompressed_count = 0
+                compressed_count = statistics["entries"]
+                purged_count = len(purged)
+                highlighted_sha1s = store.sha1s()
+            else:
+                uncompressed_count, compressed_count, purged_count, highlighted_sha1s = \
+                    self.__compactFiles(cache_dir, max_age_uncompressed, max_age_compressed)
+
+            # Code context files are left behind by highlighting jobs in both
+            # storage modes.  Normally they are imported and deleted right
+            # away, so any still around are stale.
+            for section in os.listdir(cache_dir):
+                if len(section) == 2:
+                    for filename in os.listdir(os.path.join(cache_dir, section)):
+                        if filename.endswith(".ctx"):
+                            self.debug("deleting context file: %s/%s" % (section, filename))
+                            os.unlink(os.path.join(cache_dir, section, filename))
+
+            purged_contexts = self.__purgeCodeContexts(highlighted_sha1s)
+
+            return uncompressed_count, compressed_count, purged_count, purged_contexts
+
+        def __compactFiles(self, cache_dir, max_age_uncompressed, max_age_compressed):
+            import syntaxhighlight
+
+            now = time.time()
+
             uncompressed_count = 0
             compressed_count = 0
 
+            highlighted_sha1s = set()
             purged_paths = []
 
-            db = dbutils.Database()
-            cursor = db.cursor()
-
-            cursor.execute("CREATE TEMPORARY TABLE purged (sha1 CHAR(40) PRIMARY KEY)")
-            cursor.execute("INSERT INTO purged (sha1) SELECT DISTINCT sha1 FROM codecontexts")
-
             for section in sorted(os.listdir(cache_dir)):
                 if len(section) == 2:
                     for filename in os.listdir("%s/%s" % (cache_dir, section)):
                         fullname = "%s/%s/%s" % (cache_dir, section, filename)
-                        age = now - os.stat(fullname).st_mtime
 
                         if len(filename) > 38 and filename[38] == "." and filename[39:] in syntaxhighlight.LANGUAGES:
-                            cursor.execute("DELETE FROM purged WHERE sha1=%s", (section + filename[:38],))
+                            highlighted_sha1s.add(section + filename[:38])
+                            age = now - os.stat(fullname).st_mtime
                             if age > max_age_uncompressed:
                                 self.debug("compressing: %s/%s" % (section, filename))
-                                worker = process(["/bin/bzip2", fullname])
-                                worker.wait()
+                                self.__compressFile(fullname)
                                 compressed_count += 1
                             else:
                                 uncompressed_count += 1
                         elif len(filename) > 41 and filename[38] == "." and filename[-4] == "." and filename[39:-4] in syntaxhighlight.LANGUAGES:
                             if filename.endswith(".bz2"):
+                                age = now - os.stat(fullname).st_mtime
                                 if age > max_age_compressed:
                                     self.debug("purging: %s/%s" % (section, filename))
                                     purged_paths.append(fullname)
                                 else:
-                                    cursor.execute("DELETE FROM purged WHERE sha1=%s", (section + filename[:38],))
+                                    highlighted_sha1s.add(section + filename[:38])
                                     compressed_count += 1
                             elif filename.endswith(".ctx"):
-                                self.debug("deleting context file: %s/%s" % (section, filename))
-                                os.unlink(fullname)
+                                # Handled by the caller.
+                                pass
                         else:
                             os.unlink(fullname)
 
             self.info("cache compacting finished: uncompressed=%d / compressed=%d / purged=%d"
                       % (uncompressed_count, compressed_count, len(purged_paths)))
 
-            if purged_paths:
-                for path in purged_paths: os.unlink(path)
+            for path in purged_paths: os.unlink(path)
+
+            return uncompressed_count, compressed_count, len(purged_paths), highlighted_sha1s
+
+        def __compressFile(self, path):
+            # Like running "bzip2 <path>", but without a process per file.
+            compressed_path = path + ".bz2"
+            status = os.stat(path)
+            with open(path, "rb") as source:
+                with open(compressed_path + ".tmp", "wb") as target:
+                    target.write(bz2.compress(source.read()))
+            os.chmod(compressed_path + ".tmp", status.st_mode & 07777)
+            os.utime(compressed_path + ".tmp", (status.st_atime, status.st_mtime))
+            os.rename(compressed_path + ".tmp", compressed_path)
+            os.unlink(path)
+
+        def __purgeCodeContexts(self, highlighted_sha1s):
+            # Delete code contexts for files that are no longer highlighted.
+            db = dbutils.Database()
+            cursor = db.cursor()
 
-            cursor.execute("SELECT COUNT(*) FROM purged")
+            cursor.execute("SELECT DISTINCT sha1 FROM codecontexts")
 
-            purged_contexts = cursor.fetchone()[0]
+            purged_sha1s = [sha1 for (sha1,) in cursor if sha1 not in highlighted_sha1s]
 
-            cursor.execute("DELETE FROM codecontexts USING purged WHERE codecontexts.sha1=purged.sha1")
+            for offset in xrange(0, len(purged_sha1s), 10000):
+                cursor.execute("DELETE FROM codecontexts WHERE sha1=ANY (%s)",
+                               (purged_sha1s[offset:offset + 10000],))
 
             db.commit()
             db.close()
 
-            return uncompressed_count, compressed_count, len(purged_paths), purged_contexts
+            return len(purged_sha1s)
 
     def start_service():
         server = HighlightServer()
@@ -18,6 +18,10 @@ import sys
 import os
 import time
 import json
+import errno
+import threading
+import Queue
+import ast
 
 import smtplib
 import email.mime.text
@@ -28,6 +32,15 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), ".
 
 import configuration
 import background.utils
+from textutils import json_decode
+
+# Seconds between scans of the outbox when not woken up by anything.  When
+# notified of new files via inotify, this is just a safety net.
+SCAN_INTERVAL = 30
+SCAN_INTERVAL_WITHOUT_INOTIFY = 5
+
+# Seconds after which an idle SMTP connection is closed.
+IDLE_DISCONNECT = 25
 
 class User:
     def __init__(self, *args):
@@ -36,273 +49,642 @@ class User:
         else:
             self.fullname, self.email = email.utils.parseaddr(args[0])
 
-class MailDelivery(background.utils.PeerServer):
-    def __init__(self, credentials):
-        # We disable the automatic administrator mails (using the
-        # 'send_administrator_mails' argument) since
-        #
-        # 1) it's pretty pointless to report mail delivery problems
-        #    via mail, and
-        #
-        # 2) it can cause runaway mail generation, since failure to
-        #    timely deliver the mail delivery problem report emails
-        #    would trigger further automatic problem report emails.
-        #
-        # Instead, we keep track of having encountered any problems,
-        # and send a single administrator mail ("check the logs")
-        # after having successfully delivered an email.
+class InvalidMessage(Exception):
+    pass
+
+def parseLegacyHeader(line):
+    """Parse a message header in the format written by earlier versions
+
+       That format is the repr() of a dictionary, with users represented as
+       "User(...)".  Rather than eval():ing it, only literals and User(...)
+       expressions are accepted."""
+
+    constants = { "None": None, "True": True, "False": False }
+
+    def convert(node):
+        if isinstance(node, ast.Dict):
+            return dict((convert(key), convert(value))
+                        for key, value in zip(node.keys, node.values))
+        elif isinstance(node, (ast.List, ast.Tuple)):
+            return [convert(element) for element in node.elts]
+        elif isinstance(node, ast.Str):
+            return node.s
+        elif isinstance(node, ast.Num):
+            return node.n
+        elif isinstance(node, ast.Name) and node.id in constants:
+            return constants[node.id]
+        elif (isinstance(node, ast.Call)
+              and isinstance(node.func, ast.Name) and node.func.id == "User"
+              and not (node.keywords or node.starargs or node.kwargs)):
+            return User(*map(convert, node.args))
+        raise InvalidMessage("unexpected expression: %s" % ast.dump(node))
+
+    try:
+        return convert(ast.parse(line.strip(), mode="eval").body)
+    except SyntaxError as error:
+        raise InvalidMessage("invalid header: %s" % error)
+
+def readMessage(filename):
+    """Read the header (first line) of a queued mail file
+
+       Returns a dictionary of arguments for createMessage().  The header is a
+       JSON object (see mailutils.queueMail()), or, in files queued by earlier
+       versions, the repr() of a dictionary."""
+
+    with open(filename) as file:
+        line = file.readline()
+
+    try:
+        message = json_decode(line)
+    except ValueError:
+        message = parseLegacyHeader(line)
+    else:
+        def user(value):
+            return User(value["email"], value["fullname"])
 
-        service = configuration.services.MAILDELIVERY
+        try:
+            message["from_user"] = user(message["from_user"])
+            message["to_user"] = user(message["to_user"])
+            message["recipients"] = map(user, message["recipients"])
+        except (KeyError, TypeError) as error:
+            raise InvalidMessage("invalid user: %s" % error)
 
-        super(MailDelivery, self).__init__(service=service,
-                                           send_administrator_mails=False)
+    if not isinstance(message, dict):
+        raise InvalidMessage("invalid header: not a dictionary")
 
-        self.__credentials = credentials
-        self.__connection = None
-        self.__connection_timeout = service.get("timeout")
-        self.__has_logged_warning = 0
-        self.__has_logged_error = 0
+    return message
 
-        self.register_maintenance(hour=3, minute=45, callback=self.__cleanup)
+def getDomain(address):
+    return address.rpartition("@")[2].lower()
 
-    def __sendAdministratorMessage(self):
-        from_user = User(configuration.base.SYSTEM_USER_EMAIL, "Critic System")
-        recipients = []
+def createMessage(message_id, parent_message_id, headers, from_user, to_user, recipients, subject, body):
+    def isascii(s):
+        return all(ord(c) < 128 for c in s)
 
-        for recipient in configuration.base.SYSTEM_RECIPIENTS:
-            recipients.append(User(recipient))
+    def usersAsHeader(users, header_name):
+        header = email.header.Header(header_name=header_name)
 
-        if self.__has_logged_warning and self.__has_logged_error:
-            what = "%d warning%s and %d error%s" % (self.__has_logged_warning,
-                                                    "s" if self.__has_logged_warning > 1 else "",
-                                                    self.__has_logged_error,
-                                                    "s" if self.__has_logged_error > 1 else "")
-        elif self.__has_logged_warning:
-            what = "%d warning%s" % (self.__has_logged_warning,
-                                     "s" if self.__has_logged_warning > 1 else "")
-        else:
-            what = "%d error%s" % (self.__has_logged_error,
-                                     "s" if self.__has_logged_error > 1 else "")
+        for index, user in enumerate(users):
+            if isascii(user.fullname):
+                header.append(user.fullname, "us-ascii")
+            else:
+                header.append(user.fullname, "utf-8")
+            if index < len(users) - 1:
+                header.append("<%s>," % user.email, "us-ascii")
+            else:
+                header.append("<%s>" % user.email, "us-ascii")
 
-        for to_user in recipients:
-            self.__send(message_id=None,
-                        parent_message_id=None,
-                        headers={},
-                        from_user=from_user,
-                        to_user=to_user,
-                        recipients=recipients,
-                        subject="maildelivery: check the logs!",
-                        body="%s have been logged.\n\n-- critic\n" % what,
-                        try_once=True)
+        return header
 
-        self.__has_logged_warning = 0
-        self.__has_logged_error = 0
+    def stringAsHeader(s, name):
+        if isascii(s): return email.header.Header(s, "us-ascii", header_name=name)
+        else: return email.header.Header(s, "utf-8", header_name=name)
 
-    def run(self):
-        try:
-            sleeptime = 0
+    message = email.mime.text.MIMEText(body, "plain", "utf-8")
+    recipients = filter(lambda user: bool(user.email), recipients)
 
-            while not self.terminated:
-                self.interrupted = False
+    if message_id:
+        message_id = "<%s@%s>" % (message_id, configuration.base.HOSTNAME)
+        message["Message-ID"] = message_id
+    else:
+        message_id = "N/A"
 
-                filenames = os.listdir(configuration.paths.OUTBOX)
-                pending = []
+    if parent_message_id:
+        message["In-Reply-To"] = parent_message_id
+        message["References"] = parent_message_id
 
-                for filename in filenames:
-                    if filename.endswith(".txt"):
-                        pending.append("%s/%s" % (configuration.paths.OUTBOX, filename))
+    message["From"] = usersAsHeader([from_user], "From")
+    message["To"] = usersAsHeader(recipients, "To")
+    message["Subject"] = stringAsHeader(subject, "Subject")
 
-                if pending:
-                    self.__connect()
+    for name, value in headers.items():
+        message[name] = value
 
-                    # We may have been terminated while attempting to connect.
-                    if self.terminated:
-                        return
+    return message_id, message.as_string()
 
-                    sleeptime = 0
+class RateLimiter(object):
+    """Limits the number of messages sent per minute per recipient domain
 
-                    now = time.time()
+       The limits are configured as a dictionary mapping domain names (or "*"
+       for any other domain) to a number of messages per minute.  Bursts of up
+       to a minute's worth of messages are allowed (a token bucket.)"""
 
-                    def age(filename):
-                        return now - os.stat(filename).st_ctime
+    def __init__(self, limits):
+        self.__limits = dict((domain.lower(), limit) for domain, limit in limits.items())
+        self.__buckets = {}
 
-                    too_old = len(filter(lambda filename: age(filename) > 60, pending))
-                    oldest_age = max(map(age, pending))
+    def acquire(self, domain, now):
+        """Consume one message's worth of the domain's limit
 
-                    if too_old > 0:
-                        self.warning(("%d files were created more than 60 seconds ago\n"
-                                      "  The oldest is %s which is %d seconds old.")
-                                     % (too_old, os.path.basename(filename), oldest_age))
-                        self.__has_logged_warning += 1
+           Returns zero if a message may be sent now, otherwise the number of
+           seconds until one may be sent."""
 
-                    for filename in sorted(pending):
-                        lines = open(filename).readlines()
+        limit = self.__limits.get(domain, self.__limits.get("*"))
 
-                        try:
-                            if self.__send(**eval(lines[0])):
-                                os.rename(filename, "%s/sent/%s.sent" % (configuration.paths.OUTBOX, os.path.basename(filename)))
+        if not limit:
+            return 0
 
-                                if self.__has_logged_warning or self.__has_logged_error:
-                                    try: self.__sendAdministratorMessage()
-                                    except:
-                                        self.exception()
-                                        self.__has_logged_error += 1
+        tokens, updated = self.__buckets.get(domain, (limit, now))
+        tokens = min(limit, tokens + (now - updated) * limit / 60.0)
 
-                            # We may have been terminated while attempting to send.
-                            if self.terminated:
-                                return
-                        except:
-                            self.exception()
-                            self.__has_logged_error += 1
-                            os.rename(filename, "%s/%s.invalid" % (configuration.paths.OUTBOX, os.path.basename(filename)))
-                            continue
-                else:
-                    self.signal_idle_state()
+        if tokens >= 1:
+            self.__buckets[domain] = (tokens - 1, now)
+            return 0
 
-                    if sleeptime > 25:
-                        self.__disconnect()
+        self.__buckets[domain] = (tokens, now)
+        return (1 - tokens) * 60.0 / limit
 
-                    before = time.time()
-                    timeout = (30 - sleeptime) if self.__connection else self.run_maintenance()
+class OutboxWatcher(object):
+    """Notification of files being added to the outbox, using inotify
 
-                    self.debug("sleeping %d seconds" % timeout)
+       Used via ctypes, since there is no inotify module in the standard
+       library.  If inotify is not available, fileno() returns None, and the
+       outbox is scanned more often instead."""
 
-                    time.sleep(timeout)
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 02000000
 
-                    if self.interrupted:
-                        self.debug("sleep interrupted after %.2f seconds" % (time.time() - before))
+    def __init__(self, path):
+        self.__fd = None
 
-                    sleeptime += (time.time() - before)
-        finally:
-            self.__disconnect()
+        try:
+            import ctypes
+            import ctypes.util
 
-    def __connect(self):
-        if not self.__connection:
-            attempts = 0
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
 
-            while not self.terminated:
-                attempts += 1
+            fd = libc.inotify_init1(OutboxWatcher.IN_NONBLOCK | OutboxWatcher.IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1() failed")
 
-                try:
-                    if configuration.smtp.USE_SSL:
-                        self.__connection = smtplib.SMTP_SSL(timeout=self.__connection_timeout)
-                    else:
-                        self.__connection = smtplib.SMTP(timeout=self.__connection_timeout)
+            if libc.inotify_add_watch(fd, path, OutboxWatcher.IN_CLOSE_WRITE | OutboxWatcher.IN_MOVED_TO) < 0:
+                error = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(error, "inotify_add_watch() failed")
+
+            self.__fd = fd
+        except (ImportError, OSError, AttributeError):
+            pass
 
-                    self.__connection.connect(configuration.smtp.HOST, configuration.smtp.PORT)
+    def fileno(self):
+        return self.__fd
 
-                    if configuration.smtp.USE_STARTTLS:
-                        self.__connection.starttls()
+    def drain(self):
+        # The events themselves are not interesting; the outbox is scanned.
+        try:
+            while os.read(self.__fd, 65536):
+                pass
+        except OSError as error:
+            if error.errno != errno.EAGAIN:
+                raise
 
-                    if self.__credentials:
-                        self.__connection.login(self.__credentials["username"],
-                                                self.__credentials["password"])
+    def close(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
 
-                    self.debug("connected")
-                    return
-                except:
-                    self.debug("failed to connect to SMTP server")
-                    if (attempts % 5) == 0:
-                        self.error("Failed to connect to SMTP server %d times.  "
-                                   "Will keep retrying." % attempts)
-                        self.__has_logged_error += 1
-                    self.__connection = None
+class Sender(threading.Thread):
+    """Delivers messages over one SMTP connection
+
+       Messages are taken from the delivery's queue and sent back-to-back over
+       the same connection, which is closed after being idle for a while."""
+
+    def __init__(self, delivery, index):
+        super(Sender, self).__init__(name="sender-%d" % index)
+        self.daemon = True
+        self.delivery = delivery
+        self.connection = None
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    filename = self.delivery.queue.get(timeout=IDLE_DISCONNECT)
+                except Queue.Empty:
+                    self.disconnect()
+                    continue
 
-                seconds = min(60, 2 ** attempts)
+                if filename is None:
+                    # Service is shutting down.
+                    break
 
-                self.debug("sleeping %d seconds" % seconds)
+                try:
+                    self.deliver(filename)
+                except:
+                    self.delivery.exception()
+                    self.delivery.problem("error")
+        finally:
+            self.disconnect()
 
-                time.sleep(seconds)
+    def deliver(self, filename):
+        sent = False
 
-    def __disconnect(self):
-        if self.__connection:
+        try:
             try:
-                self.__connection.quit()
-                self.debug("disconnected")
-            except: pass
+                message = readMessage(filename)
+                to_user = message["to_user"]
+                message_id, data = createMessage(**message)
+            except:
+                self.delivery.exception()
+                self.delivery.problem("error")
+                os.rename(filename, "%s/%s.invalid" % (configuration.paths.OUTBOX, os.path.basename(filename)))
+                return
+
+            sent = self.send(message["from_user"], to_user, message_id, data)
+
+            if sent:
+                os.rename(filename, "%s/sent/%s.sent" % (configuration.paths.OUTBOX, os.path.basename(filename)))
+
+                warnings, errors = self.delivery.takeProblems()
+                if warnings or errors:
+                    try: self.sendAdministratorMessage(warnings, errors)
+                    except:
+                        self.delivery.exception()
+                        self.delivery.problem("error")
+        finally:
+            self.delivery.messageDone(filename, sent)
+
+    def sendAdministratorMessage(self, warnings, errors):
+        from_user = User(configuration.base.SYSTEM_USER_EMAIL, "Critic System")
+        recipients = []
+
+        for recipient in configuration.base.SYSTEM_RECIPIENTS:
+            recipients.append(User(recipient))
 
-            self.__connection = None
+        if warnings and errors:
+            what = "%d warning%s and %d error%s" % (warnings, "s" if warnings > 1 else "",
+                                                    errors, "s" if errors > 1 else "")
+        elif warnings:
+            what = "%d warning%s" % (warnings, "s" if warnings > 1 else "")
+        else:
+            what = "%d error%s" % (errors, "s" if errors > 1 else "")
 
-    def __send(self, message_id, parent_message_id, headers, from_user, to_user, recipients, subject, body, **kwargs):
-        def isascii(s):
-            return all(ord(c) < 128 for c in s)
+        for to_user in recipients:
+            message_id, message = createMessage(message_id=None,
+                                                parent_message_id=None,
+                                                headers={},
+                                                from_user=from_user,
+                                                to_user=to_user,
+                                                recipients=recipients,
+                                                subject="maildelivery: check the logs!",
+                                                body="%s have been logged.\n\n-- critic\n" % what)
+            self.send(from_user, to_user, message_id, message, try_once=True)
+
+    def connect(self):
+        attempts = 0
 
-        def usersAsHeader(users, header_name):
-            header = email.header.Header(header_name=header_name)
+        while not self.connection and not self.delivery.terminated:
+            attempts += 1
 
-            for index, user in enumerate(users):
-                if isascii(user.fullname):
-                    header.append(user.fullname, "us-ascii")
-                else:
-                    header.append(user.fullname, "utf-8")
-                if index < len(users) - 1:
-                    header.append("<%s>," % user.email, "us-ascii")
+            try:
+                if configuration.smtp.USE_SSL:
+                    self.connection = smtplib.SMTP_SSL(timeout=self.delivery.connection_timeout)
                 else:
-                    header.append("<%s>" % user.email, "us-ascii")
+                    self.connection = smtplib.SMTP(timeout=self.delivery.connection_timeout)
 
-            return header
+                self.connection.connect(configuration.smtp.HOST, configuration.smtp.PORT)
 
-        def stringAsHeader(s, name):
-            if isascii(s): return email.header.Header(s, "us-ascii", header_name=name)
-            else: return email.header.Header(s, "utf-8", header_name=name)
+                if configuration.smtp.USE_STARTTLS:
+                    self.connection.starttls()
 
-        message = email.mime.text.MIMEText(body, "plain", "utf-8")
-        recipients = filter(lambda user: bool(user.email), recipients)
+                if self.delivery.credentials:
+                    self.connection.login(self.delivery.credentials["username"],
+                                          self.delivery.credentials["password"])
 
-        if not to_user.email:
-            return True
+                self.delivery.debug("%s: connected" % self.name)
+                return
+            except:
+                self.delivery.debug("%s: failed to connect to SMTP server" % self.name)
+                if (attempts % 5) == 0:
+                    self.delivery.error("Failed to connect to SMTP server %d times.  "
+                                        "Will keep retrying." % attempts)
+                    self.delivery.problem("error")
+                self.connection = None
 
-        if message_id:
-            message_id = "<%s@%s>" % (message_id, configuration.base.HOSTNAME)
-            message["Message-ID"] = message_id
-        else:
-            message_id = "N/A"
+            seconds = min(60, 2 ** attempts)
 
-        if parent_message_id:
-            message["In-Reply-To"] = parent_message_id
-            message["References"] = parent_message_id
+            self.delivery.debug("%s: sleeping %d seconds" % (self.name, seconds))
+            self.delivery.stopping.wait(seconds)
 
-        message["From"] = usersAsHeader([from_user], "From")
-        message["To"] = usersAsHeader(recipients, "To")
-        message["Subject"] = stringAsHeader(subject, "Subject")
+    def disconnect(self):
+        if self.connection:
+            try:
+                self.connection.quit()
+                self.delivery.debug("%s: disconnected" % self.name)
+            except: pass
 
-        for name, value in headers.items():
-            message[name] = value
+            self.connection = None
 
-        self.debug("%s => %s (%s)" % (from_user.email, to_user.email, message_id))
+    def send(self, from_user, to_user, message_id, message, try_once=False):
+        if not to_user.email:
+            return True
 
-        # Used from __sendAdministratorMessage(); we'll try once to send it even
-        # if self.terminated.
-        try_once = kwargs.get("try_once", False)
+        self.delivery.debug("%s => %s (%s)" % (from_user.email, to_user.email, message_id))
 
+        # Used from sendAdministratorMessage(); we'll try once to send it even
+        # if terminated.
         attempts = 0
 
-        while try_once or not self.terminated:
+        while try_once or not self.delivery.terminated:
             try_once = False
 
             try:
-                self.__connection.sendmail(configuration.base.SYSTEM_USER_EMAIL, [to_user.email], message.as_string())
+                self.connect()
+                if not self.connection:
+                    break
+                self.connection.sendmail(configuration.base.SYSTEM_USER_EMAIL, [to_user.email], message)
                 return True
             except:
-                self.exception()
-                self.__has_logged_error += 1
+                self.delivery.exception()
+                self.delivery.problem("error")
 
-                if self.terminated:
+                self.disconnect()
+
+                if self.delivery.terminated:
                     return False
 
                 attempts += 1
                 sleeptime = min(60, 2 ** attempts)
 
-                self.error("delivery failure: sleeping %d seconds" % sleeptime)
-
-                self.__disconnect()
-                time.sleep(sleeptime)
-                self.__connect()
+                self.delivery.error("delivery failure: sleeping %d seconds" % sleeptime)
+                self.delivery.stopping.wait(sleeptime)
 
         # We were terminated before the mail was sent.  Return false to keep the
         # mail in the outbox for later delivery.
         return False
 
+class MailDelivery(background.utils.PeerServer):
+    def __init__(self, credentials):
+        # We disable the automatic administrator mails (using the
+        # 'send_administrator_mails' argument) since
+        #
+        # 1) it's pretty pointless to report mail delivery problems
+        #    via mail, and
+        #
+        # 2) it can cause runaway mail generation, since failure to
+        #    timely deliver the mail delivery problem report emails
+        #    would trigger further automatic problem report emails.
+        #
+        # Instead, we keep track of having encountered any problems,
+        # and send a single administrator mail ("check the logs")
+        # after having successfully delivered an email.
+
+        service = configuration.services.MAILDELIVERY
+
+        super(MailDelivery, self).__init__(service=service,
+                                           send_administrator_mails=False)
+
+        self.credentials = credentials
+        self.connection_timeout = service.get("timeout")
+
+        # Messages to send, consumed by the senders.  Holds at most a few
+        # messages per sender, so that rate limiting applies to the rest.
+        self.queue = Queue.Queue()
+        self.stopping = threading.Event()
+
+        self.__max_connections = max(1, service.get("max_connections", 1))
+        self.__rate_limiter = RateLimiter(service.get("domain_rate_limits", {}))
+        self.__lock = threading.Lock()
+        self.__has_logged_warning = 0
+        self.__has_logged_error = 0
+        self.__last_warning = 0
+
+        # Messages read from the outbox but not yet queued for sending, as
+        # (filename, domain, queued at) tuples, and messages that have been
+        # queued for sending (filename => queued at.)
+        self.__pending = []
+        self.__in_flight = {}
+
+        # Delivery latency, i.e. the time from a message being added to the
+        # outbox until it has been sent, is recorded both in the service's
+        # metrics and per burst of messages (for the summary logged when the
+        # outbox has been emptied.)
+        self.metrics.describe("messages_delivered_total", "counter",
+                              "Messages sent to the SMTP server.")
+        self.metrics.describe("messages_invalid_total", "counter",
+                              "Messages in the outbox that could not be read or sent.")
+        self.metrics.describe("delivery_latency_seconds", "histogram",
+                              "Time from a message being added to the outbox until it was sent.")
+        self.metrics.describe("problems_total", "counter",
+                              "Warnings and errors reported to the system administrator.")
+        self.metrics.describe("rate_limited_total", "counter",
+                              "Times sending to a domain was delayed by its rate limit.")
+        self.metrics.callback("messages_pending", "gauge",
+                              "Messages in the outbox not yet handed to a sender.",
+                              lambda: len(self.__pending))
+        self.metrics.callback("messages_in_flight", "gauge",
+                              "Messages handed to a sender but not yet sent.",
+                              lambda: len(self.__in_flight))
+        self.__burst = None
+
+        # Woken up by senders finishing messages, and by signals.
+        self.__wakeup = background.utils.Wakeup()
+
+        self.__watcher = OutboxWatcher(configuration.paths.OUTBOX)
+
+        if self.__watcher.fileno() is None:
+            self.debug("inotify not available; scanning outbox every %d seconds"
+                       % SCAN_INTERVAL_WITHOUT_INOTIFY)
+
+        self.register_maintenance(hour=3, minute=45, callback=self.__cleanup)
+
+    def problem(self, kind):
+        self.metrics.increment("problems_total", labels={ "kind": kind })
+        with self.__lock:
+            if kind == "warning":
+                self.__has_logged_warning += 1
+            else:
+                self.__has_logged_error += 1
+
+    def takeProblems(self):
+        with self.__lock:
+            problems = self.__has_logged_warning, self.__has_logged_error
+            self.__has_logged_warning = self.__has_logged_error = 0
+            return problems
+
+    def messageDone(self, filename, sent):
+        # A message that wasn't sent and is no longer in the outbox was
+        # renamed as invalid by the sender.
+        invalid = not sent and not os.path.exists(filename)
+
+        with self.__lock:
+            queued_at = self.__in_flight.pop(filename)
+
+            if sent:
+                latency = time.time() - queued_at
+
+                self.__burst["delivered"] += 1
+                self.__burst["latency_total"] += latency
+                self.__burst["latency_max"] = max(self.__burst["latency_max"], latency)
+            elif invalid:
+                self.__burst["invalid"] += 1
+
+        if sent:
+            self.metrics.increment("messages_delivered_total")
+            self.metrics.observe("delivery_latency_seconds", latency)
+        elif invalid:
+            self.metrics.increment("messages_invalid_total")
+
+        self.__wakeup.wakeup()
+
+    def __scanOutbox(self):
+        now = time.time()
+
+        with self.__lock:
+            known = set(self.__in_flight.keys())
+        known.update(filename for filename, _, _ in self.__pending)
+
+        added = []
+
+        for filename in os.listdir(configuration.paths.OUTBOX):
+            if not filename.endswith(".txt"):
+                continue
+
+            filename = "%s/%s" % (configuration.paths.OUTBOX, filename)
+
+            if filename in known:
+                continue
+
+            try:
+                message = readMessage(filename)
+                queued_at = os.stat(filename).st_ctime
+            except (InvalidMessage, IOError, OSError):
+                self.exception()
+                self.problem("error")
+                self.metrics.increment("messages_invalid_total")
+                os.rename(filename, "%s/%s.invalid" % (configuration.paths.OUTBOX, os.path.basename(filename)))
+                continue
+
+            added.append((filename, getDomain(message["to_user"].email or ""), queued_at))
+
+        if added:
+            self.__pending.extend(sorted(added))
+
+        if self.__pending:
+            too_old = [(now - queued_at, filename)
+                       for filename, _, queued_at in self.__pending
+                       if now - queued_at > 60]
+
+            # Only warn once a minute, not on every scan of a big backlog.
+            if too_old and now - self.__last_warning > 60:
+                oldest_age, oldest_filename = max(too_old)
+                self.warning(("%d files were created more than 60 seconds ago\n"
+                              "  The oldest is %s which is %d seconds old.")
+                             % (len(too_old), os.path.basename(oldest_filename), oldest_age))
+                self.problem("warning")
+                self.__last_warning = now
+
+    def __dispatch(self):
+        """Queue pending messages for sending, as permitted by rate limits
+
+           Returns the number of seconds until a rate limited message can be
+           sent, or None if there are no such messages."""
+
+        now = time.time()
+        delayed = {}
+        remaining = []
+
+        for message in self.__pending:
+            filename, domain, queued_at = message
+
+            with self.__lock:
+                outstanding = len(self.__in_flight)
+
+            if outstanding >= 2 * self.__max_connections or domain in delayed:
+                remaining.append(message)
+                continue
+
+            delay = self.__rate_limiter.acquire(domain, now)
+
+            if delay:
+                self.metrics.increment("rate_limited_total")
+                delayed[domain] = delay
+                remaining.append(message)
+                continue
+
+            with self.__lock:
+                self.__in_flight[filename] = queued_at
+
+                if self.__burst is None:
+                    self.__burst = { "delivered": 0,
+                                     "invalid": 0,
+                                     "latency_total": 0.0,
+                                     "latency_max": 0.0,
+                                     "started": now }
+
+            self.queue.put(filename)
+
+        self.__pending = remaining
+
+        if delayed:
+            return min(delayed.values())
+        return None
+
+    def __wait(self, timeout):
+        if self.__watcher.fileno() is not None:
+            self.__wakeup.wait(timeout, [self.__watcher.fileno()])
+            self.__watcher.drain()
+        else:
+            self.__wakeup.wait(timeout)
+
+    def run(self):
+        senders = [Sender(self, index) for index in range(self.__max_connections)]
+
+        for sender in senders:
+            sender.start()
+
+        if self.__watcher.fileno() is not None:
+            scan_interval = SCAN_INTERVAL
+        else:
+            scan_interval = SCAN_INTERVAL_WITHOUT_INOTIFY
+
+        try:
+            while not self.terminated:
+                self.interrupted = False
+
+                self.__scanOutbox()
+
+                timeout = self.__dispatch()
+
+                with self.__lock:
+                    busy = self.__pending or self.__in_flight
+
+                    if busy:
+                        burst = None
+                    else:
+                        burst, self.__burst = self.__burst, None
+
+                if burst and burst["delivered"]:
+                    self.info("delivered %d messages in %.1f seconds "
+                              "(latency: average %.1f seconds, maximum %.1f seconds)"
+                              % (burst["delivered"], time.time() - burst["started"],
+                                 burst["latency_total"] / burst["delivered"],
+                                 burst["latency_max"]))
+
+                if not busy:
+                    self.signal_idle_state()
+
+                maintenance_timeout = self.run_maintenance()
+
+                if timeout is None:
+                    timeout = scan_interval
+                if maintenance_timeout is not None:
+                    timeout = min(timeout, maintenance_timeout)
+
+                self.__wait(timeout)
+        finally:
+            self.stopping.set()
+
+            for sender in senders:
+                self.queue.put(None)
+            for sender in senders:
+                sender.join(self.connection_timeout or 10)
+
+            self.__wakeup.close()
+            self.__watcher.close()
+
     def __cleanup(self):
         now = time.time()
         deleted = 0
@@ -24,6 +24,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), ".
 import configuration
 import dbutils
 import gitutils
+import commitgraph
 import background.utils
 
 class Maintenance(background.utils.BackgroundProcess):
@@ -99,7 +100,8 @@ class Maintenance(background.utils.BackgroundProcess):
                 db.commit()
 
             # Run a garbage collect in all Git repositories, to keep them neat
-            # and tidy.  Also pack keepalive refs.
+            # and tidy.  Also pack keepalive refs, and rebuild the commit graph
+            # index.
             cursor.execute("SELECT name FROM repositories")
             for (repository_name,) in cursor:
                 self.debug("repository GC: %s" % repository_name)
@@ -108,12 +110,20 @@ class Maintenance(background.utils.BackgroundProcess):
                     repository.packKeepaliveRefs()
                     repository.run("gc", "--prune=1 day", "--quiet")
                     repository.stopBatch()
+                    commitgraph.CommitGraph.build(repository)
                 except Exception:
                     self.exception("repository GC failed: %s" % repository_name)
 
                 if self.terminated:
                     return
 
+            # Remove cached blame results that haven't been used in a while.
+            # (They are touched whenever they are used.)
+            self.__purgeBlameCache()
+
+            if self.terminated:
+                return
+
             if configuration.extensions.ENABLED:
                 now = time.time()
                 max_age = 7 * 24 * 60 * 60
@@ -137,6 +147,24 @@ class Maintenance(background.utils.BackgroundProcess):
                                           % repository_dir)
                                 shutil.rmtree(repository_dir)
 
+    def __purgeBlameCache(self):
+        now = time.time()
+        max_age = 30 * 24 * 60 * 60
+        purged = 0
+
+        for dirpath, _, filenames in os.walk(gitutils.BLAME_CACHE_DIR):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    if now - os.stat(path).st_mtime > max_age:
+                        os.unlink(path)
+                        purged += 1
+                except OSError:
+                    pass
+
+        if purged:
+            self.info("purged %d cached blame results" % purged)
+
 def start_service():
     maintenance = Maintenance()
     maintenance.run()
@@ -0,0 +1,277 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2014 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Metrics of background services.
+#
+# Each background service records counters, gauges and histograms in its
+# Metrics object (BackgroundProcess.metrics.)  Recording is a dictionary update;
+# nothing else is done unless someone asks for the metrics, by connecting to the
+# service's metrics socket (see MetricsServer), which is normally done by the
+# service manager on behalf of "criticctl metrics" or the /metrics page.  The
+# service manager adds a "service" label, and the result is formatted in the
+# Prometheus text exposition format.
+
+import os
+import socket
+import threading
+import bisect
+import math
+
+# Upper bounds of histogram buckets for durations, in seconds.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Upper bounds of histogram buckets for memory sizes, in bytes (16 MB - 4 GB.)
+SIZE_BUCKETS = tuple(2 ** n * 1024 ** 2 for n in range(4, 13))
+
+def getAddress(service_name):
+    import configuration
+    return os.path.join(configuration.paths.SOCKETS_DIR, service_name + ".metrics.unix")
+
+def freezeLabels(labels):
+    if not labels:
+        return ()
+    return tuple(sorted(labels.items()))
+
+class Metrics(object):
+    """Registry of metrics, safe to update from any thread
+
+       Metrics are named, and are either counters (only ever incremented),
+       gauges (set to arbitrary values) or histograms (of observed values.)
+       Each sample of a metric can have a set of labels (a dictionary.)"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # name => [type, help, buckets, { frozen labels => value }]
+        self.__metrics = {}
+        # (name, type, help, callback)
+        self.__callbacks = []
+
+    def describe(self, name, kind, help, buckets=DURATION_BUCKETS):
+        """Declare a metric, so that it is included (with no samples) even
+           before any value has been recorded"""
+
+        assert kind in ("counter", "gauge", "histogram")
+        with self.__lock:
+            if name not in self.__metrics:
+                self.__metrics[name] = [kind, help, buckets if kind == "histogram" else None, {}]
+
+    def __samples(self, name, kind):
+        metric = self.__metrics.get(name)
+        if metric is None:
+            metric = self.__metrics[name] = [kind, "", DURATION_BUCKETS if kind == "histogram" else None, {}]
+        return metric
+
+    def increment(self, name, value=1, labels=None):
+        key = freezeLabels(labels)
+        with self.__lock:
+            samples = self.__samples(name, "counter")[3]
+            samples[key] = samples.get(key, 0) + value
+
+    def set(self, name, value, labels=None):
+        key = freezeLabels(labels)
+        with self.__lock:
+            self.__samples(name, "gauge")[3][key] = value
+
+    def observe(self, name, value, labels=None):
+        key = freezeLabels(labels)
+        with self.__lock:
+            _, _, buckets, samples = self.__samples(name, "histogram")
+            sample = samples.get(key)
+            if sample is None:
+                # Per-bucket (not cumulative) counts, sum, count.
+                sample = samples[key] = [[0] * len(buckets), 0.0, 0]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                sample[0][index] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    def callback(self, name, kind, help, callback):
+        """Register a metric whose value is computed when it is collected
+
+           The callback returns either a number, or a list of (labels, value)
+           tuples.  It is called from the thread serving the metrics, so it
+           must not do anything that isn't safe to do from another thread
+           than the service's main thread, such as iterating over a dict that
+           the main thread might be modifying."""
+
+        assert kind in ("counter", "gauge")
+        with self.__lock:
+            self.__callbacks.append((name, kind, help, callback))
+
+    def collect(self):
+        """Return all metrics as a JSON-compatible list"""
+
+        collected = []
+
+        with self.__lock:
+            for name, (kind, help, buckets, samples) in sorted(self.__metrics.items()):
+                metric = { "name": name, "type": kind, "help": help, "samples": [] }
+                for key, value in sorted(samples.items()):
+                    if kind == "histogram":
+                        counts, total, count = value
+                        cumulative = 0
+                        bucket_counts = []
+                        for upper_bound, bucket_count in zip(buckets, counts):
+                            cumulative += bucket_count
+                            bucket_counts.append([upper_bound, cumulative])
+                        value = { "buckets": bucket_counts, "sum": total, "count": count }
+                    metric["samples"].append([dict(key), value])
+                collected.append(metric)
+
+            callbacks = list(self.__callbacks)
+
+        for name, kind, help, callback in callbacks:
+            try:
+                value = callback()
+            except Exception:
+                # Rather skip the metric than fail to report the rest.
+                continue
+            if isinstance(value, list):
+                samples = [[dict(labels), sample_value] for labels, sample_value in value]
+            else:
+                samples = [[{}, value]]
+            collected.append({ "name": name, "type": kind, "help": help, "samples": samples })
+
+        return collected
+
+class MetricsServer(object):
+    """Serves a service's metrics on a UNIX socket, from a separate thread
+
+       Each connection is sent the result of Metrics.collect() as JSON, and
+       is then closed.  The thread is blocked in accept() at all other
+       times, so this costs nothing unless the metrics are collected."""
+
+    def __init__(self, metrics, address):
+        from textutils import json_encode
+
+        self.__address = address
+
+        try: os.unlink(address)
+        except OSError: pass
+
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__socket.bind(address)
+        self.__socket.listen(4)
+
+        def serve():
+            while True:
+                try:
+                    connection, _ = self.__socket.accept()
+                except socket.error:
+                    # Most likely closed by stop().
+                    return
+                try:
+                    connection.sendall(json_encode(metrics.collect()))
+                except Exception:
+                    pass
+                finally:
+                    connection.close()
+
+        thread = threading.Thread(target=serve, name="metrics")
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        try: self.__socket.shutdown(socket.SHUT_RDWR)
+        except socket.error: pass
+        self.__socket.close()
+        try: os.unlink(self.__address)
+        except OSError: pass
+
+def fetch(address, timeout=5):
+    """Collect metrics from the metrics socket at 'address'
+
+       Returns None if the service isn't running (or doesn't respond.)"""
+
+    from textutils import json_decode
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+
+    try:
+        connection.connect(address)
+        data = ""
+        while True:
+            received = connection.recv(65536)
+            if not received:
+                break
+            data += received
+        return json_decode(data)
+    except (socket.error, ValueError):
+        return None
+    finally:
+        connection.close()
+
+def formatValue(value):
+    if value is None:
+        return "NaN"
+    elif isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        elif math.isnan(value):
+            return "NaN"
+        return repr(value)
+    return str(value)
+
+def formatLabels(labels):
+    if not labels:
+        return ""
+    def escape(value):
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{%s}" % ",".join("%s=\"%s\"" % (name, escape(value))
+                             for name, value in sorted(labels.items()))
+
+def formatPrometheus(services, prefix="critic_"):
+    """Format collected metrics in the Prometheus text exposition format
+
+       The 'services' argument is a dictionary mapping service names to lists
+       as returned by Metrics.collect().  A "service" label is added to every
+       sample, and metrics with the same name from different services are
+       grouped together."""
+
+    metrics = {}
+
+    for service_name, collected in sorted(services.items()):
+        for metric in collected or []:
+            name = prefix + metric["name"]
+            if name not in metrics:
+                metrics[name] = [metric["type"], metric["help"], []]
+            elif not metrics[name][1]:
+                metrics[name][1] = metric["help"]
+            for labels, value in metric["samples"]:
+                labels = dict(labels, service=service_name)
+                metrics[name][2].append((labels, value))
+
+    lines = []
+
+    for name, (kind, help, samples) in sorted(metrics.items()):
+        if help:
+            lines.append("# HELP %s %s" % (name, help.replace("\\", "\\\\").replace("\n", "\\n")))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for labels, value in samples:
+            if kind == "histogram":
+                for upper_bound, count in value["buckets"]:
+                    lines.append("%s_bucket%s %d" % (name, formatLabels(dict(labels, le=formatValue(float(upper_bound)))), count))
+                lines.append("%s_bucket%s %d" % (name, formatLabels(dict(labels, le="+Inf")), value["count"]))
+                lines.append("%s_sum%s %s" % (name, formatLabels(labels), formatValue(value["sum"])))
+                lines.append("%s_count%s %d" % (name, formatLabels(labels), value["count"]))
+            else:
+                lines.append("%s%s %s" % (name, formatLabels(labels), formatValue(value)))
+
+    return "\n".join(lines) + "\n"
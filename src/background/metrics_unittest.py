@@ -0,0 +1,78 @@
+import sys
+
+def collect():
+    # Imported directly (sys.path[0] is the directory containing this file)
+    # since the background package itself depends on the configuration.
+    import metrics
+
+    registry = metrics.Metrics()
+    registry.describe("requests_total", "counter", "Requests.")
+    registry.describe("unused_total", "counter", "Never incremented.")
+    registry.describe("duration_seconds", "histogram", "Durations.", buckets=(1, 10))
+
+    registry.increment("requests_total", labels={ "priority": "interactive" })
+    registry.increment("requests_total", 2, labels={ "priority": "interactive" })
+    registry.increment("requests_total", labels={ "priority": "background" })
+    registry.set("level", 3.5)
+    registry.set("level", 4)
+
+    for value in (0.5, 1, 5, 100):
+        registry.observe("duration_seconds", value)
+
+    registry.callback("computed", "gauge", "Computed.", lambda: 17)
+    registry.callback("labelled", "gauge", "Labelled.",
+                      lambda: [({ "kind": "a" }, 1), ({ "kind": "b" }, 2)])
+    registry.callback("broken", "gauge", "Broken.", lambda: 1 / 0)
+
+    collected = dict((metric["name"], metric) for metric in registry.collect())
+
+    assert "broken" not in collected
+    assert collected["unused_total"]["samples"] == []
+    assert collected["requests_total"]["type"] == "counter"
+    assert collected["requests_total"]["samples"] == [[{ "priority": "background" }, 1],
+                                                      [{ "priority": "interactive" }, 3]]
+    assert collected["level"]["type"] == "gauge"
+    assert collected["level"]["samples"] == [[{}, 4]]
+    assert collected["computed"]["samples"] == [[{}, 17]]
+    assert collected["labelled"]["samples"] == [[{ "kind": "a" }, 1], [{ "kind": "b" }, 2]]
+
+    [[labels, histogram]] = collected["duration_seconds"]["samples"]
+    assert labels == {}
+    assert histogram["buckets"] == [[1, 2], [10, 3]]
+    assert histogram["sum"] == 106.5
+    assert histogram["count"] == 4
+
+def format():
+    import metrics
+
+    registry = metrics.Metrics()
+    registry.describe("requests_total", "counter", "Requests.")
+    registry.describe("duration_seconds", "histogram", "Durations.", buckets=(1,))
+    registry.increment("requests_total", labels={ "path": "a\"b\\c" })
+    registry.observe("duration_seconds", 0.25)
+
+    other = metrics.Metrics()
+    other.increment("requests_total", 5)
+
+    text = metrics.formatPrometheus({ "highlight": registry.collect(),
+                                      "changeset": other.collect(),
+                                      "maildelivery": None })
+
+    assert text == """\
+# HELP critic_duration_seconds Durations.
+# TYPE critic_duration_seconds histogram
+critic_duration_seconds_bucket{le="1.0",service="highlight"} 1
+critic_duration_seconds_bucket{le="+Inf",service="highlight"} 1
+critic_duration_seconds_sum{service="highlight"} 0.25
+critic_duration_seconds_count{service="highlight"} 1
+# HELP critic_requests_total Requests.
+# TYPE critic_requests_total counter
+critic_requests_total{service="changeset"} 5
+critic_requests_total{path="a\\"b\\\\c",service="highlight"} 1
+""", text
+
+if __name__ == "__main__":
+    if "collect" in sys.argv[1:]:
+        collect()
+    if "format" in sys.argv[1:]:
+        format()
@@ -25,6 +25,7 @@ import configuration
 
 if "--slave" in sys.argv:
     import background.utils
+    import background.metrics
 
     class ServiceManager(background.utils.PeerServer):
         class Service(object):
@@ -92,6 +93,8 @@ if "--slave" in sys.argv:
                     self.manager.info("%s: exited normally" % self.name)
                 self.process = None
                 if restart:
+                    self.manager.metrics.increment("service_restarts_total",
+                                                   labels={ "name": self.name })
                     self.restart()
                 else:
                     self.signal_callbacks("stopped")
@@ -130,6 +133,25 @@ if "--slave" in sys.argv:
                                                    "uptime": uptime,
                                                    "pid": pid }
 
+                    return result({ "status": "ok", "services": services })
+                elif request.get("query") == "metrics":
+                    services = { "manager": self.__manager.metrics.collect() }
+
+                    for service in self.__manager.services:
+                        if service.process:
+                            address = background.metrics.getAddress(service.name)
+                            collected = background.metrics.fetch(address, timeout=2)
+                        else:
+                            collected = None
+                        services[service.name] = collected
+
+                    for name, collected in services.items():
+                        up = { "name": "up",
+                               "type": "gauge",
+                               "help": "Whether the service is running and reported its metrics.",
+                               "samples": [[{}, 0 if collected is None else 1]] }
+                        services[name] = (collected or []) + [up]
+
                     return result({ "status": "ok", "services": services })
                 elif request.get("command") == "restart":
                     if "service" not in request:
@@ -166,6 +188,9 @@ if "--slave" in sys.argv:
             self.services = []
             self.started = time.time()
 
+            self.metrics.describe("service_restarts_total", "counter",
+                                  "Services restarted after exiting, per service.")
+
         def handle_peer(self, peersocket, peeraddress):
             return ServiceManager.Client(self, peersocket)
 
@@ -30,6 +30,7 @@ import time
 import datetime
 
 import configuration
+import background.metrics
 from textutils import json_encode, json_decode, indent
 
 def freeze(d):
@@ -55,6 +56,53 @@ class AdministratorMailHandler(logging.Handler):
         if db:
             db.close()
 
+class Wakeup(object):
+    """Pipe used to wake up a service's main loop
+
+       Written to by other threads (via wakeup()) and, using
+       signal.set_wakeup_fd(), when a signal is received, so that a signal
+       that arrives just before wait() is called still wakes it up."""
+
+    def __init__(self):
+        self.__read, self.__write = os.pipe()
+        for fd in (self.__read, self.__write):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        signal.set_wakeup_fd(self.__write)
+
+    def wakeup(self):
+        try:
+            os.write(self.__write, "\0")
+        except OSError as error:
+            # The pipe is full, meaning a wakeup is pending anyway.
+            if error.errno != errno.EAGAIN:
+                raise
+
+    def wait(self, timeout, fds=()):
+        """Wait until woken up, any of 'fds' is readable, or 'timeout' seconds"""
+
+        poll = select.poll()
+        poll.register(self.__read, select.POLLIN)
+        for fd in fds:
+            poll.register(fd, select.POLLIN)
+
+        try:
+            poll.poll(timeout * 1000)
+        except select.error as error:
+            if error[0] != errno.EINTR:
+                raise
+
+        try:
+            while os.read(self.__read, 4096):
+                pass
+        except OSError as error:
+            if error.errno != errno.EAGAIN:
+                raise
+
+    def close(self):
+        signal.set_wakeup_fd(-1)
+        os.close(self.__read)
+        os.close(self.__write)
+
 class BackgroundProcess(object):
     def __init__(self, service, send_administrator_mails=True):
         try: loglevel = getattr(logging, service["loglevel"].upper())
@@ -87,6 +135,28 @@ class BackgroundProcess(object):
         self.__pidfile_path = service.get("pidfile_path")
         self.__create_pidfile()
 
+        self.started_at = time.time()
+        self.metrics = background.metrics.Metrics()
+        self.metrics.callback("process_resident_memory_bytes", "gauge",
+                              "Resident memory size in bytes.", getrss)
+        self.metrics.callback("process_cpu_seconds_total", "counter",
+                              "User and system CPU time spent in seconds.",
+                              lambda: sum(os.times()[:2]))
+        self.metrics.callback("process_start_time_seconds", "gauge",
+                              "Start time of the process since the epoch in seconds.",
+                              lambda: self.started_at)
+
+        # The metrics are collected (by the service manager) via a socket
+        # served by a separate thread, so that it works regardless of what
+        # the service's main thread is busy with.
+        self.__metrics_server = None
+        if service.get("name"):
+            try:
+                self.__metrics_server = background.metrics.MetricsServer(
+                    self.metrics, background.metrics.getAddress(service["name"]))
+            except socket.error as error:
+                self.warning("failed to serve metrics: %s" % error)
+
         signal.signal(signal.SIGHUP, self.__handle_SIGHUP)
         signal.signal(signal.SIGTERM, self.__handle_SIGTERM)
         signal.signal(signal.SIGUSR1, self.__handle_SIGUSR1)
@@ -132,6 +202,8 @@ class BackgroundProcess(object):
 
     def __stopped(self):
         self.info("service stopped")
+        if self.__metrics_server:
+            self.__metrics_server.stop()
         self.__delete_pidfile()
 
     def signal_idle_state(self):
@@ -251,6 +323,13 @@ class PeerServer(BackgroundProcess):
         def is_finished(self):
             return not self.__writing and not self.__reading
 
+        def is_active(self):
+            # Whether this peer represents ongoing work.  Peers that merely
+            # wait for something to do (such as idle pooled workers) override
+            # this, so that they don't keep the server from being considered
+            # idle, or from restarting.
+            return True
+
         def writing(self):
             if self.__write_data or self.__write_closed: return self.__writing
             else: return None
@@ -267,7 +346,15 @@ class PeerServer(BackgroundProcess):
 
         def do_write(self):
             while self.__write_data:
-                nwritten = os.write(self.__writing.fileno(), self.__write_data)
+                try:
+                    nwritten = os.write(self.__writing.fileno(), self.__write_data)
+                except OSError as error:
+                    if error.errno != errno.EPIPE:
+                        raise
+                    # The other end has gone away; nothing more can be written.
+                    self.__write_data = ""
+                    self.__write_closed = True
+                    break
                 self.__write_data = self.__write_data[nwritten:]
             if self.__write_closed:
                 self.writing_done(self.__writing)
@@ -291,6 +378,24 @@ class PeerServer(BackgroundProcess):
                     self.handle_input(self.__read_data)
                     break
                 self.__read_data += read
+                consumed = self.handle_partial_input(self.__read_data)
+                if consumed:
+                    self.__read_data = self.__read_data[consumed:]
+
+        def watching(self):
+            # Returns a file that is polled for hang-ups (only) while neither
+            # reading from nor writing to it, or None.
+            return None
+
+        def handle_hangup(self):
+            pass
+
+        def handle_partial_input(self, data):
+            # Called with the input received so far (minus anything already
+            # consumed), before all input has been received.  Returns the
+            # number of bytes consumed, which are then not included in what is
+            # passed to handle_input().
+            return 0
 
         def writing_done(self, writing):
             writing.close()
@@ -402,11 +507,13 @@ class PeerServer(BackgroundProcess):
                 while not self.terminated:
                     self.interrupted = False
 
+                    active_peers = [peer for peer in self.__peers if peer.is_active()]
+
                     if self.restart_requested:
-                        if not self.__peers:
+                        if not active_peers:
                             break
                         else:
-                            self.debug("restart delayed; have %d peers" % len(self.__peers))
+                            self.debug("restart delayed; have %d peers" % len(active_peers))
 
                     poll = select.poll()
                     poll.register(self.__listening_socket, select.POLLIN)
@@ -416,6 +523,8 @@ class PeerServer(BackgroundProcess):
                             poll.register(peer.writing(), select.POLLOUT)
                         if peer.reading():
                             poll.register(peer.reading(), select.POLLIN)
+                        elif peer.watching() and not peer.writing():
+                            poll.register(peer.watching(), 0)
 
                     def fileno(file):
                         if file:
@@ -427,14 +536,14 @@ class PeerServer(BackgroundProcess):
                         timeout_seconds = self.run_maintenance()
 
                         if timeout_seconds:
-                            if not self.__peers:
+                            if not active_peers:
                                 self.debug("next maintenance task check scheduled in %d seconds"
                                            % timeout_seconds)
                             timeout_ms = timeout_seconds * 1000
                         else:
                             timeout_ms = None
 
-                        if self.synchronize_when_idle and not self.__peers:
+                        if self.synchronize_when_idle and not active_peers:
                             # We seem to be idle, but poll once, non-blocking,
                             # just to be sure.
                             timeout_ms = 0
@@ -450,7 +559,7 @@ class PeerServer(BackgroundProcess):
 
                     if self.terminated:
                         break
-                    elif not (self.__peers or events):
+                    elif not (active_peers or events):
                         self.signal_idle_state()
 
                     def catch_error(fn):
@@ -480,6 +589,8 @@ class PeerServer(BackgroundProcess):
                                     catch_error(peer.do_write)
                                 if fd == fileno(peer.reading()) and event != select.POLLOUT:
                                     catch_error(peer.do_read)
+                                elif fd == fileno(peer.watching()) and event & (select.POLLHUP | select.POLLERR):
+                                    peer.handle_hangup()
                                 if peer.is_finished():
                                     peer.destroy()
                                     self.peer_destroyed(peer)
@@ -554,62 +665,280 @@ class JSONJobServer(PeerServer):
             self.close()
 
         def handle_input(self, value):
-            try: result = json_decode(value)
-            except ValueError:
-                self.server.error("invalid response:\n" + indent(value))
-                result = self.request.copy()
-                result["error"] = value
-            for client in self.clients: client.add_result(result)
-            self.server.request_finished(self, self.request, result)
+            self.server.job_finished(self, value)
+
+    class Worker(PeerServer.ChildProcess):
+        """Long-lived child process that performs one job at a time
+
+           Requests are written to the worker as single lines of JSON, and the
+           worker responds with one line per request.  See json_job() below
+           for the other end."""
+
+        def __init__(self, server):
+            super(JSONJobServer.Worker, self).__init__(server, [sys.executable, sys.argv[0], "--json-job", "--worker"], stderr=subprocess.STDOUT)
+            self.job = None
+            self.retiring = False
+            self.exited = False
+
+        def is_active(self):
+            return self.job is not None
+
+        def is_idle(self):
+            return self.job is None and not (self.retiring or self.exited)
+
+        def start(self, job):
+            assert self.is_idle()
+            self.job = job
+            self.write(json_encode(job.request) + "\n")
+
+        def handle_partial_input(self, data):
+            consumed = 0
+            while True:
+                linebreak = data.find("\n", consumed)
+                if linebreak == -1:
+                    return consumed
+                line = data[consumed:linebreak]
+                consumed = linebreak + 1
+                try:
+                    response = json_decode(line)
+                except ValueError:
+                    # Not a response; probably something that the worker
+                    # itself (rather than the job) wrote to stderr.
+                    self.server.error("invalid output from worker (pid=%d):\n%s" % (self.pid, indent(line)))
+                    continue
+                job, self.job = self.job, None
+                self.retiring = response["retiring"]
+                if "rss" in response:
+                    self.server.metrics.observe("worker_resident_memory_bytes", response["rss"])
+                self.server.job_finished(job, response["output"])
+                self.server.worker_idle(self)
+
+        def handle_input(self, value):
+            # The worker process has exited (or at least closed its stdout.)
+            self.exited = True
+            if value:
+                self.server.error("invalid output from worker (pid=%d):\n%s" % (self.pid, indent(value)))
+            self.close()
+
+        def destroy(self):
+            if not self.exited:
+                # Shutting down.  An idle worker exits when its stdin is
+                # closed; a busy one is told to abandon its job.
+                if self.job:
+                    self.kill(signal.SIGTERM)
+                else:
+                    self.close()
+                    self.do_write()
+            super(JSONJobServer.Worker, self).destroy()
+
+    class PooledJob(object):
+        def __init__(self, worker, client, request):
+            self.pid = worker.pid
+            self.clients = [client]
+            self.request = request
 
     class JobClient(PeerServer.SocketPeer):
+        def __init__(self, server, peersocket):
+            super(JSONJobServer.JobClient, self).__init__(server, peersocket)
+            self.__socket = peersocket
+            self.__requests = None
+            self.__pending_requests = []
+            self.__results = []
+            self.priority = None
+            self.queued_at = None
+            self.virtual_time = 0
+            self.cancelled = False
+            self.detached = False
+
         def handle_input(self, value):
             decoded = json_decode(value)
             if isinstance(decoded, list):
-                self.__requests = decoded
-                self.__pending_requests = map(freeze, decoded)
-                self.__results = []
-                self.server.add_requests(self)
+                requests = decoded
+                priority = "interactive"
+                detached = False
+            elif isinstance(decoded, dict) and "requests" in decoded:
+                requests = decoded["requests"]
+                priority = decoded.get("priority", "interactive")
+                detached = decoded.get("detached", False)
             else:
                 assert isinstance(decoded, dict)
                 self.server.execute_command(self, decoded)
+                return
+            if priority not in JSONJobServer.PRIORITIES:
+                self.write(json_encode({ "status": "error", "error": "invalid priority: %r" % priority }))
+                self.close()
+                return
+            self.__requests = requests
+            self.__pending_requests = map(freeze, requests)
+            self.priority = priority
+            self.queued_at = time.time()
+            if detached:
+                # The client doesn't want the results; acknowledge right away.
+                # The requests stay queued after the client disconnects.
+                self.detached = True
+                self.write(json_encode({ "status": "ok", "queued": len(requests) }))
+                self.close()
+            self.server.add_requests(self)
+
+        def watching(self):
+            # While waiting for results, watch for the client disconnecting.
+            if self.__requests is not None and not (self.cancelled or self.detached) \
+                    and len(self.__results) < len(self.__requests):
+                return self.__socket
+            return None
+
+        def handle_hangup(self):
+            self.cancelled = True
+            self.server.cancel_requests(self)
+            self.close()
 
         def has_requests(self):
             return bool(self.__pending_requests)
 
+        def count_requests(self):
+            return len(self.__pending_requests)
+
         def get_request(self):
             return self.__pending_requests.pop()
 
+        def drop_requests(self):
+            dropped = len(self.__pending_requests)
+            self.__pending_requests = []
+            return dropped
+
         def add_result(self, result):
+            if self.cancelled or self.detached:
+                return
             self.__results.append(result)
             if len(self.__results) == len(self.__requests):
                 self.write(json_encode(self.__results))
                 self.close()
 
+    # Request priorities, and their relative weights when sharing job slots
+    # between clients.  A plain list of requests from a client has the
+    # priority "interactive".
+    PRIORITIES = { "interactive": 100,
+                   "background": 10,
+                   "maintenance": 1 }
+
     def __init__(self, service):
         super(JSONJobServer, self).__init__(service)
         self.__clients_with_requests = []
         self.__started_requests = {}
         self.__max_jobs = service.get("max_jobs", 4)
+        self.__workers = [] if service.get("worker_pool") else None
+        self.__shutting_down = False
+        # Keep one job slot for interactive requests, if there's more than one.
+        self.__max_background_jobs = max(1, self.__max_jobs - 1)
+        self.__virtual_time = 0
+        self.__wait_times = dict((priority, [0, 0.0, 0.0]) for priority in JSONJobServer.PRIORITIES)
+        self.__cancelled_count = 0
+
+        self.metrics.describe("requests_total", "counter",
+                              "Requests handled, by priority and by whether a job was "
+                              "started, the result was already available, or the request "
+                              "was shared with an identical running request.")
+        self.metrics.describe("requests_cancelled_total", "counter",
+                              "Queued requests cancelled because the client disconnected.")
+        self.metrics.describe("request_wait_seconds", "histogram",
+                              "Time requests spent queued before being handled.")
+        self.metrics.describe("job_duration_seconds", "histogram",
+                              "Time from starting a job until its result was available.")
+        self.metrics.describe("jobs_failed_total", "counter",
+                              "Jobs that failed to produce a valid result.")
+        self.metrics.callback("jobs_running", "gauge",
+                              "Jobs currently running.",
+                              lambda: len(self.__started_requests))
+        self.metrics.callback("requests_queued", "gauge",
+                              "Requests waiting for a job slot, by priority.",
+                              self.__countQueuedRequests)
+        if self.__workers is not None:
+            self.metrics.describe("worker_resident_memory_bytes", "histogram",
+                                  "Resident memory size of pooled workers after each job.",
+                                  buckets=background.metrics.SIZE_BUCKETS)
+            self.metrics.describe("workers_retired_total", "counter",
+                                  "Pooled workers replaced after reaching their job or "
+                                  "memory limit.")
+            self.metrics.callback("workers", "gauge",
+                                  "Pooled worker processes.",
+                                  lambda: len(self.__workers))
+
+    def __countQueuedRequests(self):
+        # Called from the metrics thread; copy the list rather than iterate
+        # over it while the main thread might modify it.
+        counts = dict((priority, 0) for priority in JSONJobServer.PRIORITIES)
+        for client in list(self.__clients_with_requests):
+            counts[client.priority] += client.count_requests()
+        return [({ "priority": priority }, count) for priority, count in counts.items()]
+
+    def __startWorker(self):
+        worker = JSONJobServer.Worker(self)
+        self.__workers.append(worker)
+        self.add_peer(worker)
+        return worker
+
+    def __getIdleWorker(self):
+        for worker in self.__workers:
+            if worker.is_idle():
+                return worker
+        # All workers are busy or retiring.  The number of concurrent jobs is
+        # limited separately, so there's room for another worker.
+        return self.__startWorker()
+
+    def __replaceWorkers(self):
+        # Keep 'max_jobs' workers that will accept new jobs running.
+        if self.__shutting_down:
+            return
+        available = [worker for worker in self.__workers
+                     if not (worker.retiring or worker.exited)]
+        for _ in range(self.__max_jobs - len(available)):
+            self.__startWorker()
+
+    def __nextClient(self):
+        # Weighted fair queuing between clients: each client has a virtual
+        # time that advances by the inverse of its priority's weight every
+        # time one of its requests is handled, and the client with the lowest
+        # virtual time goes next.  Ties are broken in order of arrival.
+        if len(self.__started_requests) < self.__max_background_jobs:
+            candidates = self.__clients_with_requests
+        else:
+            candidates = [client for client in self.__clients_with_requests
+                          if client.priority == "interactive"]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda client: client.virtual_time)
 
     def __startJobs(self):
         # Repeat "start a job" while there are jobs to start and we haven't
         # reached the limit on number of concurrent jobs to run.
         while self.__clients_with_requests and len(self.__started_requests) < self.__max_jobs:
-            # Fetch next request from first client in list of clients with
-            # pending requests.
-            client = self.__clients_with_requests.pop(0)
+            client = self.__nextClient()
+            if not client:
+                break
+
             frozen = client.get_request()
 
-            if client.has_requests():
-                # Client has more pending requests, so put it back at the end of
-                # the list of clients with pending requests.
-                self.__clients_with_requests.append(client)
+            if not client.has_requests():
+                self.__clients_with_requests.remove(client)
+
+            self.__virtual_time = client.virtual_time
+            client.virtual_time += 1.0 / JSONJobServer.PRIORITIES[client.priority]
+
+            wait_time = time.time() - client.queued_at
+            wait_times = self.__wait_times[client.priority]
+            wait_times[0] += 1
+            wait_times[1] += wait_time
+            wait_times[2] = max(wait_times[2], wait_time)
+
+            self.metrics.observe("request_wait_seconds", wait_time,
+                                 { "priority": client.priority })
 
             if frozen in self.__started_requests:
                 # Another client has requested the same thing, piggy-back on
                 # that job instead of starting another.
                 self.__started_requests[frozen].clients.append(client)
+                self.metrics.increment("requests_total", labels={ "priority": client.priority,
+                                                                  "outcome": "shared" })
                 continue
 
             request = thaw(frozen)
@@ -622,6 +951,19 @@ class JSONJobServer(PeerServer):
                 # Request is already finished; don't bother starting a child
                 # process, just report result directly to the client.
                 client.add_result(result)
+                self.metrics.increment("requests_total", labels={ "priority": client.priority,
+                                                                  "outcome": "cached" })
+                continue
+
+            self.metrics.increment("requests_total", labels={ "priority": client.priority,
+                                                              "outcome": "started" })
+
+            if self.__workers is not None:
+                # Hand the request to an idle worker.
+                worker = self.__getIdleWorker()
+                job = JSONJobServer.PooledJob(worker, client, request)
+                worker.start(job)
+                self.request_started(job, request)
             else:
                 # Start child process.
                 job = JSONJobServer.Job(self, client, request)
@@ -630,26 +972,173 @@ class JSONJobServer(PeerServer):
 
     def add_requests(self, client):
         assert client.has_requests()
+        # Don't let a new client catch up on the time it wasn't queued.
+        client.virtual_time = self.__virtual_time
         self.__clients_with_requests.append(client)
         self.__startJobs()
 
+    def cancel_requests(self, client):
+        if client in self.__clients_with_requests:
+            self.__clients_with_requests.remove(client)
+        cancelled = client.drop_requests()
+        if cancelled:
+            self.__cancelled_count += cancelled
+            self.metrics.increment("requests_cancelled_total", cancelled)
+            self.debug("client disconnected; cancelled %d queued requests" % cancelled)
+
+    def get_status(self):
+        now = time.time()
+        queued = {}
+        for priority in JSONJobServer.PRIORITIES:
+            clients = [client for client in self.__clients_with_requests
+                       if client.priority == priority]
+            count, total, maximum = self.__wait_times[priority]
+            queued[priority] = {
+                "clients": len(clients),
+                "requests": sum(client.count_requests() for client in clients),
+                "oldest": max([now - client.queued_at for client in clients] or [0]),
+                "started": count,
+                "average_wait": total / count if count else 0,
+                "max_wait": maximum }
+        status = { "running": len(self.__started_requests),
+                   "max_jobs": self.__max_jobs,
+                   "queued": queued,
+                   "cancelled": self.__cancelled_count }
+        if self.__workers is not None:
+            status["workers"] = len(self.__workers)
+        return status
+
     def execute_command(self, client, command):
-        client.write(json_encode({ "status": "error", "error": "command not supported" }))
+        if command.get("command") == "status":
+            result = self.get_status()
+            result["status"] = "ok"
+            client.write(json_encode(result))
+        else:
+            client.write(json_encode({ "status": "error", "error": "command not supported" }))
         client.close()
 
     def handle_peer(self, peersocket, peeraddress):
         return JSONJobServer.JobClient(self, peersocket)
 
+    def job_finished(self, job, value):
+        try: result = json_decode(value)
+        except ValueError:
+            self.error("invalid response:\n" + indent(value))
+            result = job.request.copy()
+            result["error"] = value
+        if "error" in result:
+            self.metrics.increment("jobs_failed_total")
+        for client in job.clients: client.add_result(result)
+        self.request_finished(job, job.request, result)
+
+    def worker_idle(self, worker):
+        if worker.retiring:
+            self.debug("retiring worker (pid=%d)" % worker.pid)
+            self.metrics.increment("workers_retired_total")
+            self.__replaceWorkers()
+        self.__startJobs()
+
+    def startup(self):
+        super(JSONJobServer, self).startup()
+        if self.__workers is not None:
+            # Start all workers up-front, so that they have done their imports
+            # (and whatever other initialization they do) before the first
+            # requests arrive.
+            self.__replaceWorkers()
+
+    def shutdown(self):
+        self.__shutting_down = True
+        super(JSONJobServer, self).shutdown()
+
     def peer_destroyed(self, peer):
         if isinstance(peer, JSONJobServer.Job): self.__startJobs()
+        elif isinstance(peer, JSONJobServer.Worker):
+            self.__workers.remove(peer)
+            if peer.job:
+                # The worker died while performing a job.
+                self.job_finished(peer.job, "worker process died (pid=%d, returncode=%d)"
+                                  % (peer.pid, peer.returncode))
+                peer.job = None
+            if not self.__shutting_down:
+                self.__replaceWorkers()
+                self.__startJobs()
 
     def request_result(self, request):
         pass
     def request_started(self, job, request):
+        job.started_at = time.time()
         self.__started_requests[freeze(request)] = job
     def request_finished(self, job, request, result):
+        self.metrics.observe("job_duration_seconds", time.time() - job.started_at)
         del self.__started_requests[freeze(request)]
 
+def getrss():
+    """Return the current resident set size of this process, in bytes"""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def json_job(perform_job, service):
+    """Perform one JSON job, or many if running as a pooled worker
+
+       The 'perform_job' callable reads a JSON request from sys.stdin and
+       writes the result to sys.stdout.  When started by JSONJobServer as a
+       pooled worker (the "--worker" argument), requests are instead read one
+       per line, and 'perform_job' is called once per request with sys.stdin
+       and sys.stdout redirected, until the worker has performed the
+       configured maximum number of jobs, or its RSS exceeds the configured
+       limit, after which it exits and is replaced by the server."""
+
+    if "--worker" not in sys.argv[1:]:
+        perform_job()
+        return
+
+    import cStringIO
+
+    def handle_SIGTERM(signum, frame):
+        # Sent by the server when it shuts down.
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, handle_SIGTERM)
+
+    max_jobs = service.get("worker_max_jobs", 100)
+    rss_limit = service.get("rss_limit")
+
+    stdin = sys.stdin
+    stdout = sys.stdout
+    stderr = sys.stderr
+
+    performed = 0
+
+    while True:
+        line = stdin.readline()
+        if not line:
+            break
+
+        sys.stdin = cStringIO.StringIO(line)
+        sys.stdout = sys.stderr = output = cStringIO.StringIO()
+
+        try:
+            perform_job()
+        except Exception:
+            traceback.print_exc(file=output)
+        finally:
+            sys.stdin = stdin
+            sys.stdout = stdout
+            sys.stderr = stderr
+
+        performed += 1
+
+        rss = getrss()
+        retiring = performed >= max_jobs or (rss_limit and rss > rss_limit)
+
+        stdout.write(json_encode({ "output": output.getvalue().decode("utf-8", "replace"),
+                                   "retiring": bool(retiring),
+                                   "rss": rss }) + "\n")
+        stdout.flush()
+
+        if retiring:
+            break
+
 if configuration.debug.COVERAGE_DIR:
     import coverage
     call = coverage.call
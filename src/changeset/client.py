@@ -25,11 +25,13 @@ class ChangesetBackgroundServiceError(base.ImplementationError):
         super(ChangesetBackgroundServiceError, self).__init__(
             "Changeset background service failed: %s" % message)
 
-def requestChangesets(requests):
+def requestChangesets(requests, priority="interactive", wait=True):
     try:
         connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         connection.connect(configuration.services.CHANGESET["address"])
-        connection.send(json_encode(requests))
+        connection.send(json_encode({ "requests": requests,
+                                      "priority": priority,
+                                      "detached": not wait }))
         connection.shutdown(socket.SHUT_WR)
 
         data = ""
@@ -49,6 +51,12 @@ def requestChangesets(requests):
         raise ChangesetBackgroundServiceError(
             "returned an invalid response: %r" % data)
 
+    if not wait:
+        # The service only acknowledges that the requests were queued.
+        if type(results) != dict or results.get("status") != "ok":
+            raise ChangesetBackgroundServiceError(str(results))
+        return
+
     if type(results) != list:
         # If not a list, the result is probably an error message.
         raise ChangesetBackgroundServiceError(str(results))
@@ -14,18 +14,33 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
+import configuration
 import dbutils
 import gitutils
 import diff.merge
 import diff.parse
 
+# Number of files inserted into the database at a time when a changeset is
+# created.  Bounds the number of parsed files held in memory.
+INSERT_BATCH_SIZE = 100
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 def createChangeset(db, request):
     repository_name = request["repository_name"]
     changeset_type = request["changeset_type"]
 
     repository = gitutils.Repository.fromName(db, repository_name)
 
-    def insertChangeset(db, parent, child, files):
+    def findFiles(files_db, files):
         while True:
             # Inserting new files will often clash when creating multiple
             # related changesets in parallel.  It's a simple operation, so if it
@@ -33,42 +48,52 @@ def createChangeset(db, request):
             # fail.  (It will typically succeed the second time because then the
             # new files already exist, and it doesn't need to insert anything.)
             try:
-                dbutils.find_files(db, files)
-                db.commit()
+                dbutils.find_files(files_db, files)
+                files_db.commit()
                 break
             except dbutils.IntegrityError:
-                db.rollback()
+                files_db.rollback()
 
+    def insertChangeset(db, parent, child, files):
         cursor = db.cursor()
         cursor.execute("INSERT INTO changesets (type, parent, child) VALUES (%s, %s, %s) RETURNING id",
                        (changeset_type, parent.getId(db) if parent else None, child.getId(db)))
         changeset_id = cursor.fetchone()[0]
 
-        fileversions_values = []
-        chunks_values = []
-
         file_ids = set()
 
-        for file in files:
-            if file.id in file_ids: raise Exception("duplicate:%d:%s" % (file.id, file.path))
-            file_ids.add(file.id)
+        # Files are looked up (or inserted) using a separate connection, so
+        # that new files are committed right away, while the changeset itself
+        # is inserted in a single transaction.  The files are processed in
+        # batches as they are produced, since 'files' may be an iterator that
+        # parses the diff while we consume it.
+        with dbutils.Database() as files_db:
+            for batch in batches(files, INSERT_BATCH_SIZE):
+                findFiles(files_db, batch)
+
+                fileversions_values = []
+                chunks_values = []
 
-            fileversions_values.append((changeset_id, file.id, file.old_sha1, file.new_sha1, file.old_mode, file.new_mode))
+                for file in batch:
+                    if file.id in file_ids: raise Exception("duplicate:%d:%s" % (file.id, file.path))
+                    file_ids.add(file.id)
 
-            for index, chunk in enumerate(file.chunks):
-                chunk.analyze(file, index == len(file.chunks) - 1)
-                chunks_values.append((changeset_id, file.id, chunk.delete_offset, chunk.delete_count, chunk.insert_offset, chunk.insert_count, chunk.analysis, 1 if chunk.is_whitespace else 0))
+                    fileversions_values.append((changeset_id, file.id, file.old_sha1, file.new_sha1, file.old_mode, file.new_mode))
 
-            file.clean()
+                    for index, chunk in enumerate(file.chunks):
+                        chunk.analyze(file, index == len(file.chunks) - 1)
+                        chunks_values.append((changeset_id, file.id, chunk.delete_offset, chunk.delete_count, chunk.insert_offset, chunk.insert_count, chunk.analysis, 1 if chunk.is_whitespace else 0))
 
-        if fileversions_values:
-            cursor.executemany("""INSERT INTO fileversions (changeset, file, old_sha1, new_sha1, old_mode, new_mode)
-                                       VALUES (%s, %s, %s, %s, %s, %s)""",
-                               fileversions_values)
-        if chunks_values:
-            cursor.executemany("""INSERT INTO chunks (changeset, file, deleteOffset, deleteCount, insertOffset, insertCount, analysis, whitespace)
-                                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
-                               chunks_values)
+                    file.clean()
+
+                if fileversions_values:
+                    cursor.executemany("""INSERT INTO fileversions (changeset, file, old_sha1, new_sha1, old_mode, new_mode)
+                                               VALUES (%s, %s, %s, %s, %s, %s)""",
+                                       fileversions_values)
+                if chunks_values:
+                    cursor.executemany("""INSERT INTO chunks (changeset, file, deleteOffset, deleteCount, insertOffset, insertCount, analysis, whitespace)
+                                               VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
+                                       chunks_values)
 
         return changeset_id
 
@@ -116,11 +141,20 @@ def createChangeset(db, request):
         # Parse diff and insert changeset(s) into the database.
 
         if changeset_type == "merge":
-            changes = diff.merge.parseMergeDifferences(db, repository, child)
+            changes = diff.merge.parseMergeDifferences(
+                db, repository, child,
+                max_workers=configuration.services.CHANGESET.get("max_merge_workers", 1),
+                timings=request.setdefault("timings", {}))
         elif changeset_type == "direct":
-            changes = diff.parse.parseDifferences(repository, commit=child)
+            # Stream the differences straight into the database.
+            if child.parents:
+                parent_sha1 = child.parents[0]
+            else:
+                parent_sha1 = None
+            changes = { parent_sha1: diff.parse.iterateDifferences(repository, commit=child) }
         else:
-            changes = diff.parse.parseDifferences(repository, from_commit=parent, to_commit=child)
+            changes = { parent_sha1 if parent else None:
+                            diff.parse.iterateDifferences(repository, from_commit=parent, to_commit=child) }
 
         for parent_sha1, files in changes.items():
             if parent_sha1 is None:
@@ -22,9 +22,9 @@ from changeset.utils import getCodeContext
 def unified(db, changeset, context_lines=3):
     result = ""
 
+    diff.File.loadPlainLines(changeset.files)
+
     for file in changeset.files:
-        file.loadOldLines()
-        file.loadNewLines()
 
         try:
             lines = diff.context.ContextLines(file, file.chunks)
@@ -215,6 +215,7 @@ def createChangeset(db, user, repository, commit=None, from_commit=None, to_comm
 
     if do_highlight:
         highlights = {}
+        bases = {}
 
         for changeset in changesets:
             for file in changeset.files:
@@ -223,11 +224,67 @@ def createChangeset(db, user, repository, commit=None, from_commit=None, to_comm
                         highlights[file.old_sha1] = (file.path, file.getLanguage())
                     if file.new_sha1 and file.new_sha1 != '0' * 40:
                         highlights[file.new_sha1] = (file.path, file.getLanguage())
+                        if file.old_sha1 and file.old_sha1 != '0' * 40:
+                            bases[file.new_sha1] = file.old_sha1
 
-        syntaxhighlight.request.requestHighlights(repository, highlights)
+        syntaxhighlight.request.requestHighlights(repository, highlights, bases=bases)
 
     return changesets
 
+def prefetchCommits(repository, commits, max_commits, max_blobs):
+    """Request changesets and syntax highlighting for newly pushed commits
+
+       The 'commits' argument is a list of (SHA-1, list of parent SHA-1s)
+       tuples, newest first.  Changesets are requested for the first (at most)
+       'max_commits' commits, and highlighting of at most 'max_blobs' files
+       added or modified by those commits.  Requests are made with background
+       priority, and this function doesn't wait for them to finish."""
+
+    commits = commits[:max_commits]
+
+    requests = [{ "repository_name": repository.name,
+                  "changeset_type": "merge" if len(parents) > 1 else "direct",
+                  "child_sha1": sha1 }
+                for sha1, parents in commits]
+
+    if requests:
+        client.requestChangesets(requests, priority="background", wait=False)
+
+    # List the files changed by each non-merge commit.  Merge commits are
+    # skipped; the blobs they introduce are typically introduced by one of
+    # their parents too.
+    simple = [sha1 for sha1, parents in commits if len(parents) <= 1]
+
+    if not simple:
+        return
+
+    output = repository.run("diff-tree", "--stdin", "-r", "--root", "-z", "--no-renames",
+                            input="\n".join(simple) + "\n")
+
+    highlights = {}
+    bases = {}
+    tokens = iter(output.split("\0"))
+
+    for token in tokens:
+        if len(highlights) >= max_blobs:
+            break
+        if not token.startswith(":"):
+            # Commit SHA-1 or empty.
+            continue
+        new_mode, old_sha1, new_sha1 = token[1:].split()[1:4]
+        path = next(tokens)
+        if new_sha1 == "0" * 40 or new_mode not in ("100644", "100755"):
+            continue
+        language = diff.File(path=path).getLanguage()
+        if language in syntaxhighlight.LANGUAGES:
+            highlights[new_sha1] = (path, language)
+            if old_sha1 != "0" * 40:
+                bases[new_sha1] = old_sha1
+
+    if highlights:
+        syntaxhighlight.request.requestHighlights(
+            repository, highlights, priority="background", wait=False, bases=bases)
+
 def getCodeContext(db, sha1, line, minimized=False):
     cursor = db.cursor()
     cursor.execute("SELECT context FROM codecontexts WHERE sha1=%s AND first_line<=%s AND last_line>=%s ORDER BY first_line DESC LIMIT 1", [sha1, line, line])
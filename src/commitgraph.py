@@ -0,0 +1,339 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2014 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""In-process index of a repository's commit graph.
+
+   The graph is persisted in a file named "critic-commit-graph" in the
+   repository directory, one commit per line in topological order (parents
+   before children):
+
+     <sha1> <parent index> <parent index> ...
+
+   where a parent index is the (zero-based) line number of the parent.  The
+   file is only ever appended to (by index.processCommits() when new commits
+   are pushed) or atomically replaced (when rebuilt by the maintenance service),
+   so readers can update their in-memory copy by reading whatever was appended
+   since they last looked.
+
+   The graph need not contain every commit in the repository, but it is always
+   closed: every parent of a commit in the graph is also in the graph.  Queries
+   involving commits not in the graph must be answered some other way (that is,
+   by running Git.)"""
+
+import os
+import fcntl
+import heapq
+import threading
+
+FILENAME = "critic-commit-graph"
+
+# Flags used by CommitGraph.mergeBases().
+PARENT1 = 1
+PARENT2 = 2
+STALE = 4
+
+class CommitGraphError(Exception):
+    pass
+
+class CommitGraph(object):
+    def __init__(self, path):
+        self.path = path
+        self.__sha1s = []
+        self.__indices = {}
+        self.__parents = []
+        self.__generations = []
+        self.__inode = None
+        self.__offset = 0
+
+    def __len__(self):
+        return len(self.__sha1s)
+
+    def __contains__(self, sha1):
+        return str(sha1) in self.__indices
+
+    def getParents(self, sha1):
+        return [self.__sha1s[index]
+                for index in self.__parents[self.__indices[str(sha1)]]]
+
+    def getGeneration(self, sha1):
+        """Return the generation number of a commit
+
+           Root commits have generation 1, and every other commit has a
+           generation one higher than the highest generation of its parents.
+           A commit can thus only be an ancestor of commits with higher
+           generation numbers."""
+        return self.__generations[self.__indices[str(sha1)]]
+
+    def __addLine(self, line):
+        items = line.split()
+        if not items or len(items[0]) != 40:
+            raise CommitGraphError("%s: malformed line: %r" % (self.path, line))
+        index = len(self.__sha1s)
+        parents = tuple(map(int, items[1:]))
+        for parent in parents:
+            if parent >= index:
+                raise CommitGraphError("%s: parent after child: %r" % (self.path, line))
+        generation = 1 + max([self.__generations[parent] for parent in parents] or [0])
+        self.__sha1s.append(items[0])
+        self.__indices[items[0]] = index
+        self.__parents.append(parents)
+        self.__generations.append(generation)
+
+    def __reset(self):
+        self.__sha1s = []
+        self.__indices = {}
+        self.__parents = []
+        self.__generations = []
+        self.__inode = None
+        self.__offset = 0
+
+    def __read(self, graph_file):
+        status = os.fstat(graph_file.fileno())
+
+        if status.st_ino != self.__inode or status.st_size < self.__offset:
+            # The file has been replaced; start over.
+            self.__reset()
+            self.__inode = status.st_ino
+
+        if status.st_size == self.__offset:
+            return
+
+        graph_file.seek(self.__offset)
+        data = graph_file.read()
+
+        # Ignore a trailing incomplete line; it's being written right now.
+        complete = data.rfind("\n") + 1
+
+        for line in data[:complete].splitlines():
+            self.__addLine(line)
+
+        self.__offset += complete
+
+    def refresh(self):
+        """Read any commits added to the file since it was last read
+
+           Returns False if the file doesn't exist."""
+
+        try:
+            graph_file = open(os.path.join(self.path, FILENAME), "r")
+        except IOError:
+            self.__reset()
+            return False
+
+        with graph_file:
+            self.__read(graph_file)
+
+        return True
+
+    def __sortNew(self, commits):
+        # Return 'commits' (a dictionary mapping SHA-1 to list of parent
+        # SHA-1s) as a list of (sha1, parents) in topological order, or None
+        # if some parent is neither in 'commits' nor in the graph.
+        ordered = []
+        processed = set()
+
+        for sha1 in commits:
+            stack = [(sha1, False)]
+            while stack:
+                sha1, expanded = stack.pop()
+                if sha1 in processed or sha1 in self.__indices:
+                    continue
+                if expanded:
+                    processed.add(sha1)
+                    ordered.append((sha1, commits[sha1]))
+                    continue
+                if sha1 not in commits:
+                    return None
+                stack.append((sha1, True))
+                for parent in commits[sha1]:
+                    stack.append((parent, False))
+
+        return ordered
+
+    def append(self, commits):
+        """Append new commits to the file
+
+           'commits' is a dictionary mapping SHA-1 to list of parent SHA-1s.
+           Commits already in the graph are ignored.  Returns False (and adds
+           nothing) if the graph file doesn't exist, or if some parent of the
+           new commits is missing, since the graph must be closed."""
+
+        try:
+            graph_file = open(os.path.join(self.path, FILENAME), "r+")
+        except IOError:
+            return False
+
+        with graph_file:
+            fcntl.flock(graph_file, fcntl.LOCK_EX)
+
+            # Another process may have appended commits since we last read.
+            self.__read(graph_file)
+
+            ordered = self.__sortNew(commits)
+
+            if ordered is None:
+                return False
+
+            lines = []
+            indices = dict((sha1, len(self.__sha1s) + offset)
+                           for offset, (sha1, _) in enumerate(ordered))
+            for sha1, parents in ordered:
+                parent_indices = [self.__indices.get(parent, indices.get(parent))
+                                  for parent in parents]
+                lines.append(" ".join([sha1] + map(str, parent_indices)) + "\n")
+
+            # Overwrite any incomplete line left behind by a crashed writer.
+            graph_file.seek(self.__offset)
+            graph_file.write("".join(lines))
+            graph_file.truncate()
+            graph_file.flush()
+
+            self.__read(graph_file)
+
+        return True
+
+    def isAncestor(self, ancestor, descendant):
+        """Return true if 'ancestor' is an ancestor of (or the same commit
+           as) 'descendant'
+
+           Both commits must be in the graph.  Only commits with a generation
+           number higher than that of 'ancestor' need to be visited, which for
+           typical queries is a small part of the graph."""
+
+        ancestor = self.__indices[str(ancestor)]
+        descendant = self.__indices[str(descendant)]
+
+        if ancestor == descendant:
+            return True
+
+        minimum = self.__generations[ancestor]
+
+        if self.__generations[descendant] <= minimum:
+            return False
+
+        stack = [descendant]
+        visited = set(stack)
+
+        while stack:
+            for parent in self.__parents[stack.pop()]:
+                if parent == ancestor:
+                    return True
+                if parent not in visited and self.__generations[parent] > minimum:
+                    visited.add(parent)
+                    stack.append(parent)
+
+        return False
+
+    def mergeBases(self, first, second):
+        """Return the best common ancestors of two commits
+
+           This is the same set of commits as 'git merge-base --all' returns,
+           in no particular order.  Both commits must be in the graph."""
+
+        first = self.__indices[str(first)]
+        second = self.__indices[str(second)]
+
+        if first == second:
+            return [self.__sha1s[first]]
+
+        generations = self.__generations
+        flags = { first: PARENT1, second: PARENT2 }
+        queue = [(-generations[first], first), (-generations[second], second)]
+        heapq.heapify(queue)
+        candidates = []
+
+        def nonstale():
+            for _, index in queue:
+                if not flags[index] & STALE:
+                    return True
+            return False
+
+        # Walk from both commits towards the roots in generation order,
+        # painting each commit with the side(s) it is reachable from.  A commit
+        # reachable from both sides is a candidate, and everything below it is
+        # stale.
+        while nonstale():
+            _, index = heapq.heappop(queue)
+            index_flags = flags[index] & (PARENT1 | PARENT2 | STALE)
+
+            if index_flags & (PARENT1 | PARENT2) == PARENT1 | PARENT2:
+                if not index_flags & STALE:
+                    candidates.append(index)
+                    flags[index] |= STALE
+                index_flags |= STALE
+
+            for parent in self.__parents[index]:
+                parent_flags = flags.get(parent, 0)
+                if parent_flags & index_flags != index_flags:
+                    flags[parent] = parent_flags | index_flags
+                    heapq.heappush(queue, (-generations[parent], parent))
+
+        # Some candidates may be ancestors of other candidates (criss-cross
+        # merges); drop those.
+        result = []
+        for index in candidates:
+            sha1 = self.__sha1s[index]
+            for other in candidates:
+                if other != index \
+                        and self.isAncestor(sha1, self.__sha1s[other]):
+                    break
+            else:
+                result.append(sha1)
+
+        return result
+
+    @staticmethod
+    def build(repository):
+        """(Re)build the graph file from all commits reachable from any ref"""
+
+        output = repository.run("rev-list", "--all", "--parents",
+                                "--topo-order", "--reverse")
+        graph = CommitGraph(repository.path)
+        lines = []
+        indices = {}
+
+        for line in output.splitlines():
+            items = line.split()
+            indices[items[0]] = len(lines)
+            lines.append(" ".join([items[0]] + [str(indices[parent])
+                                                for parent in items[1:]]) + "\n")
+
+        path = os.path.join(repository.path, FILENAME)
+        temporary_path = path + ".new"
+
+        with open(temporary_path, "w") as graph_file:
+            graph_file.write("".join(lines))
+
+        os.rename(temporary_path, path)
+
+        graph.refresh()
+        return graph
+
+graphs = {}
+graphs_lock = threading.Lock()
+
+def get(repository):
+    """Return the (up-to-date) commit graph of a repository
+
+       Returns None if no graph has been built for the repository."""
+
+    with graphs_lock:
+        graph = graphs.get(repository.path)
+        if graph is None:
+            graph = graphs[repository.path] = CommitGraph(repository.path)
+        if not graph.refresh():
+            return None
+        return graph
@@ -0,0 +1,81 @@
+import sys
+import os
+import shutil
+import tempfile
+
+def basic():
+    import commitgraph
+
+    path = tempfile.mkdtemp()
+
+    try:
+        def sha1(name):
+            return name * 40
+
+        graph = commitgraph.CommitGraph(path)
+
+        # No graph file => nothing can be appended.
+        assert not graph.refresh()
+        assert not graph.append({ sha1("a"): [] })
+
+        open(os.path.join(path, commitgraph.FILENAME), "w").close()
+
+        assert graph.refresh()
+        assert len(graph) == 0
+
+        # History:
+        #
+        #   a - b - c - e - g
+        #        \     /
+        #         - d -- f
+        assert graph.append({ sha1("e"): [sha1("c"), sha1("d")],
+                              sha1("c"): [sha1("b")],
+                              sha1("d"): [sha1("b")],
+                              sha1("b"): [sha1("a")],
+                              sha1("a"): [] })
+
+        assert len(graph) == 5
+        assert graph.getGeneration(sha1("a")) == 1
+        assert graph.getGeneration(sha1("e")) == 4
+        assert graph.getParents(sha1("e")) == [sha1("c"), sha1("d")]
+
+        # Missing parent => nothing appended.
+        assert not graph.append({ sha1("g"): [sha1("e")],
+                                  sha1("f"): [sha1("x")] })
+        assert len(graph) == 5
+
+        assert graph.append({ sha1("g"): [sha1("e")],
+                              sha1("f"): [sha1("d")] })
+        assert len(graph) == 7
+
+        assert graph.isAncestor(sha1("a"), sha1("g"))
+        assert graph.isAncestor(sha1("d"), sha1("g"))
+        assert graph.isAncestor(sha1("g"), sha1("g"))
+        assert not graph.isAncestor(sha1("g"), sha1("a"))
+        assert not graph.isAncestor(sha1("f"), sha1("g"))
+        assert not graph.isAncestor(sha1("c"), sha1("f"))
+
+        assert graph.mergeBases(sha1("c"), sha1("d")) == [sha1("b")]
+        assert graph.mergeBases(sha1("g"), sha1("f")) == [sha1("d")]
+        assert graph.mergeBases(sha1("a"), sha1("g")) == [sha1("a")]
+        assert graph.mergeBases(sha1("e"), sha1("e")) == [sha1("e")]
+
+        # Criss-cross merge: both b and c are best merge bases of h and i.
+        assert graph.append({ sha1("h"): [sha1("e"), sha1("f")],
+                              sha1("i"): [sha1("f"), sha1("e")] })
+        assert sorted(graph.mergeBases(sha1("h"), sha1("i"))) \
+            == [sha1("e"), sha1("f")]
+
+        # A second reader picks up appended commits.
+        other = commitgraph.CommitGraph(path)
+        assert other.refresh()
+        assert len(other) == len(graph)
+        assert graph.append({ sha1("j"): [sha1("i")] })
+        assert other.refresh()
+        assert other.isAncestor(sha1("a"), sha1("j"))
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == "__main__":
+    if "basic" in sys.argv[1:]:
+        basic()
@@ -88,6 +88,7 @@ import page.checkbranch
 import page.search
 import page.repositories
 import page.services
+import page.querystatistics
 import page.rebasetrackingreview
 import page.createuser
 import page.verifyemail
@@ -464,6 +465,7 @@ OPERATIONS = { "fetchlines": operation.fetchlines.FetchLines(),
                "showfilters": showfilters,
                "rebasebranch": rebasebranch,
                "checkserial": checkserial,
+               "metrics": page.services.renderMetrics,
                "suggestreview": suggestreview,
                "blame": operation.blame.Blame(),
                "checkbranchtext": page.checkbranch.renderCheckBranch,
@@ -522,6 +524,7 @@ PAGES = { "showreview": page.showreview.renderShowReview,
           "search": page.search.renderSearch,
           "repositories": page.repositories.renderRepositories,
           "services": page.services.renderServices,
+          "querystatistics": page.querystatistics.renderQueryStatistics,
           "rebasetrackingreview": page.rebasetrackingreview.RebaseTrackingReview(),
           "createuser": page.createuser.CreateUser(),
           "verifyemail": page.verifyemail.renderVerifyEmail,
@@ -701,6 +704,7 @@ def process_request(environ, start_response):
     request_start = time.time()
 
     db = dbutils.Database()
+    db.query_context = "request"
     user = None
 
     try:
@@ -851,6 +855,8 @@ def process_request(environ, start_response):
                 operationfn = OPERATIONS.get(req.path)
 
             if operationfn:
+                db.query_context = "operation: %s" % ("download" if operationfn is download else req.path)
+
                 result = operationfn(req, db, user)
 
                 if isinstance(result, (OperationResult, OperationError)):
@@ -881,6 +887,8 @@ def process_request(environ, start_response):
 
                         req.setContentType("text/html")
 
+                        db.query_context = "page: %s" % req.path
+
                         result = pagefn(req, db, user)
 
                         if db.profiling and not (isinstance(result, str) or
@@ -14,12 +14,401 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
+import os
+import re
+import threading
+import time
+import collections
+
 import psycopg2
+import psycopg2.extensions
+
+# Matches the placeholders in queries executed with parameters: "%s",
+# "%(name)s" and "%%" (a literal percent sign.)
+RE_PLACEHOLDER = re.compile(r"%(?:\(([^)]*)\))?s|%%")
+
+def convertQuery(query, params):
+    """Convert a query to the form used with PREPARE
+
+       Returns a tuple (text, names) where 'text' uses $1, $2, ... as
+       placeholders, and 'names' is the list of parameter names in order, if
+       'params' is a dictionary, or None otherwise.  Returns None if the
+       query can't be converted."""
+
+    if params is None:
+        # No parameters: psycopg2 sends the query as is.
+        return query, None
+
+    named = isinstance(params, dict)
+    names = []
+    count = [0]
+
+    def replace(match):
+        if match.group(0) == "%%":
+            return "%"
+        name = match.group(1)
+        if named != (name is not None):
+            raise ValueError("mixed placeholder types")
+        if name is None:
+            count[0] += 1
+            return "$%d" % count[0]
+        if name not in names:
+            names.append(name)
+        return "$%d" % (names.index(name) + 1)
+
+    try:
+        text = RE_PLACEHOLDER.sub(replace, query)
+    except ValueError:
+        return None
+
+    if named:
+        return text, names
+    elif count[0] != len(params):
+        return None
+    else:
+        return text, None
+
+# Types of values that are passed to a prepared statement unchanged.
+PREPARABLE_TYPES = (type(None), bool, int, long, str, unicode)
+
+def isPreparable(value):
+    """Return true if 'value' can be passed as a parameter to EXECUTE
+
+       The values passed to EXECUTE are converted to the parameter types that
+       the server inferred when the statement was prepared, while values
+       formatted into a plain query are interpreted as written.  For example,
+       a float passed where an integer was inferred would be rounded, and a
+       datetime passed where a date was inferred would be truncated.  So only
+       values whose meaning can't change that way (integers, strings, booleans
+       and NULL, and lists of those) are passed to prepared statements.
+       Tuples are adapted to "(x, y, z)", for use as "IN %s", which isn't
+       something a single parameter can be."""
+
+    if isinstance(value, list):
+        return all(isinstance(item, PREPARABLE_TYPES) for item in value)
+    return isinstance(value, PREPARABLE_TYPES)
+
+class PreparedStatement(object):
+    def __init__(self, name, names):
+        self.name = name
+        self.names = names
+
+    def bind(self, params):
+        """Return a tuple (query, params) that executes this statement
+
+           Returns None if a parameter value can't be passed to the prepared
+           statement (see isPreparable()), in which case the original query
+           should be executed instead."""
+
+        if params is None:
+            return "EXECUTE %s" % self.name, None
+        if self.names is not None:
+            values = [params[name] for name in self.names]
+        else:
+            values = list(params)
+        if not all(isPreparable(value) for value in values):
+            return None
+        if not values:
+            return "EXECUTE %s" % self.name, None
+        return "EXECUTE %s (%s)" % (self.name, ", ".join(["%s"] * len(values))), values
+
+class StatementCache(object):
+    """Prepared statements of a connection, keyed by query text
+
+       A query is prepared (using PREPARE) the 'threshold'th time it is
+       executed, and subsequently executed using EXECUTE, which saves the
+       server parsing and planning it again.  At most 'size' statements are
+       kept prepared; the least recently used is deallocated to make room
+       for another.  Queries that the server fails to prepare (typically
+       because the types of their parameters can't be inferred) are executed
+       as plain queries from then on.  So are individual executions with
+       parameter values whose meaning could change by being converted to the
+       inferred parameter types, such as floats; see isPreparable()."""
+
+    def __init__(self, threshold, size):
+        self.threshold = threshold
+        self.size = size
+        self.__counts = {}
+        self.__statements = collections.OrderedDict()
+        self.__unpreparable = set()
+        self.__serial = 0
+
+    def lookup(self, cursor, query, params, repetitions=1):
+        """Return a PreparedStatement for 'query', or None
+
+           The statement is prepared using 'cursor' if this execution of the
+           query (or executions, for executemany()) reaches the threshold."""
+
+        key = (query, params is None)
+
+        statement = self.__statements.pop(key, None)
+        if statement:
+            # Re-insert to mark as most recently used.
+            self.__statements[key] = statement
+            return statement
+
+        if key in self.__unpreparable:
+            return None
+
+        count = self.__counts.get(key, 0) + repetitions
+        if count < self.threshold:
+            if len(self.__counts) >= 10 * self.size:
+                # Probably lots of queries with values formatted into them,
+                # which will never be executed again.  Start over.
+                self.__counts.clear()
+            self.__counts[key] = count
+            return None
+
+        self.__counts.pop(key, None)
+
+        converted = convertQuery(query, params)
+        if converted is None:
+            self.__unpreparable.add(key)
+            return None
+
+        text, names = converted
+
+        if len(self.__statements) >= self.size:
+            _, evicted = self.__statements.popitem(last=False)
+            cursor.execute("DEALLOCATE %s" % evicted.name)
+
+        self.__serial += 1
+        name = "critic_%d" % self.__serial
+
+        # A failed PREPARE would abort the current transaction, so do it in a
+        # savepoint.  Prepared statements aren't affected by transactions
+        # being rolled back, otherwise.
+        cursor.execute("SAVEPOINT critic_prepare")
+        try:
+            cursor.execute("PREPARE %s AS %s" % (name, text))
+        except psycopg2.Error:
+            cursor.execute("ROLLBACK TO SAVEPOINT critic_prepare")
+            cursor.execute("RELEASE SAVEPOINT critic_prepare")
+            self.__unpreparable.add(key)
+            return None
+        cursor.execute("RELEASE SAVEPOINT critic_prepare")
+
+        statement = self.__statements[key] = PreparedStatement(name, names)
+        return statement
+
+class Connection(psycopg2.extensions.connection):
+    """Connection with a cache of prepared statements"""
+
+    def __init__(self, *args, **kwargs):
+        super(Connection, self).__init__(*args, **kwargs)
+
+        # The process that opened the connection.  No other process (such as
+        # a child process, after a fork) may use or close it.
+        self.pid = os.getpid()
+
+        import configuration
+
+        threshold = configuration.database.PREPARE_THRESHOLD
+        if threshold:
+            self.statements = StatementCache(threshold, configuration.database.PREPARED_STATEMENTS_MAX)
+        else:
+            self.statements = None
 
 def connect():
     import configuration
-    return psycopg2.connect(**configuration.database.PARAMETERS)
+    return psycopg2.connect(connection_factory=Connection,
+                            **configuration.database.PARAMETERS)
+
+# Connections idle in the pool for longer than this (in seconds) are checked
+# with a trivial query before being reused, in case the server has closed them.
+LIVENESS_CHECK_AFTER = 30
+
+# Connections inherited from a parent process.  See ConnectionPool.__forget().
+_inherited = []
+
+class ConnectionPool(object):
+    """Per-process pool of idle database connections
+
+       Connections are reset (rolled back, and session state such as
+       temporary tables, settings and open cursors discarded) when returned
+       to the pool, so a reused connection is in the same state as a new one,
+       except that its prepared statements (see StatementCache) are kept.  At
+       most 'size' idle connections are kept; connections returned when the
+       pool is full are closed, as are connections that have been idle for
+       longer than 'max_idle_time' seconds.  Safe to use from multiple
+       threads."""
+
+    def __init__(self, size, max_idle_time):
+        self.size = size
+        self.max_idle_time = max_idle_time
+        self.__lock = threading.Lock()
+        self.__pid = os.getpid()
+        # List of (connection, returned at) tuples, most recently returned
+        # last.
+        self.__idle = []
+        self.__in_use = 0
+        self.__statistics = { "opened": 0,
+                              "reused": 0,
+                              "discarded": 0 }
+
+    def __forget(self):
+        # We've been forked.  The idle connections' sockets are shared with
+        # the parent process, so we must not use them, and not close them
+        # either, since that would end the parent's sessions.  Freeing the
+        # connection objects would close them, so keep them referenced for
+        # as long as this process lives.
+        self.__pid = os.getpid()
+        _inherited.extend(connection for connection, _ in self.__idle)
+        self.__idle = []
+        self.__in_use = 0
+
+    def __discard(self, connection):
+        self.__statistics["discarded"] += 1
+        try: connection.close()
+        except psycopg2.Error: pass
+
+    def acquire(self):
+        """Return a tuple (connection, reused)"""
+
+        while True:
+            with self.__lock:
+                if os.getpid() != self.__pid:
+                    self.__forget()
+                if not self.__idle:
+                    self.__in_use += 1
+                    self.__statistics["opened"] += 1
+                    break
+                connection, returned_at = self.__idle.pop()
+                self.__in_use += 1
+
+            idle_time = time.time() - returned_at
+
+            if idle_time > self.max_idle_time:
+                self.__drop(connection)
+                continue
+
+            if idle_time > LIVENESS_CHECK_AFTER:
+                try:
+                    cursor = connection.cursor()
+                    cursor.execute("SELECT 1")
+                    connection.rollback()
+                except psycopg2.Error:
+                    self.__drop(connection)
+                    continue
+
+            with self.__lock:
+                self.__statistics["reused"] += 1
+
+            return connection, True
+
+        try:
+            return connect(), False
+        except:
+            with self.__lock:
+                self.__in_use -= 1
+            raise
+
+    def __drop(self, connection):
+        # Release a connection without returning it to the pool.
+        with self.__lock:
+            self.__in_use -= 1
+            self.__discard(connection)
+
+    def release(self, connection):
+        with self.__lock:
+            if os.getpid() != self.__pid:
+                self.__forget()
+            if getattr(connection, "pid", self.__pid) != self.__pid:
+                # The connection was opened before we were forked, so it's not
+                # ours to reset, close or keep.  (Nor was it counted as in use
+                # by this process's pool.)
+                _inherited.append(connection)
+                return
+            keep = not connection.closed and len(self.__idle) < self.size
+
+        if not keep:
+            self.__drop(connection)
+            return
+
+        try:
+            connection.rollback()
+            connection.autocommit = True
+            # Like "DISCARD ALL", but without "DEALLOCATE ALL".
+            connection.cursor().execute("CLOSE ALL; RESET ALL; DISCARD TEMP; "
+                                        "UNLISTEN *; SELECT pg_advisory_unlock_all()")
+            connection.autocommit = False
+        except psycopg2.Error:
+            # Most likely a broken connection.
+            self.__drop(connection)
+            return
+
+        with self.__lock:
+            self.__in_use -= 1
+            # Close connections that have been idle for too long.  Since the
+            # most recently returned connections are reused first, these are
+            # the ones at the start of the list.
+            now = time.time()
+            while self.__idle and now - self.__idle[0][1] > self.max_idle_time:
+                self.__discard(self.__idle.pop(0)[0])
+            if len(self.__idle) < self.size:
+                self.__idle.append((connection, time.time()))
+            else:
+                # Another thread filled the pool while we reset the connection.
+                self.__discard(connection)
+
+    def clear(self):
+        """Close all idle connections"""
+
+        with self.__lock:
+            idle, self.__idle = self.__idle, []
+            for connection, _ in idle:
+                self.__discard(connection)
+
+    def getStatistics(self):
+        with self.__lock:
+            statistics = self.__statistics.copy()
+            statistics["idle"] = len(self.__idle)
+            statistics["in_use"] = self.__in_use
+            statistics["size"] = self.size
+            return statistics
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def getPool():
+    """Return this process's connection pool, or None if pooling is disabled"""
+
+    global _pool
+
+    if _pool is None:
+        import configuration
+
+        size = configuration.database.POOL_SIZE
+        if not size:
+            return None
+
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(size, configuration.database.POOL_MAX_IDLE_TIME)
+
+    return _pool
+
+def acquire():
+    """Return a tuple (connection, reused)
+
+       The connection is taken from this process's connection pool, if it
+       has any idle connections, otherwise a new connection is opened.  It
+       should be handed back using release() when no longer needed."""
+
+    pool = getPool()
+    if pool is None:
+        return connect(), False
+    return pool.acquire()
+
+def release(connection):
+    pool = getPool()
+    if pool is None:
+        connection.rollback()
+        connection.close()
+    else:
+        pool.release(connection)
 
+Error = psycopg2.Error
 IntegrityError = psycopg2.IntegrityError
 OperationalError = psycopg2.OperationalError
 ProgrammingError = psycopg2.ProgrammingError
@@ -0,0 +1,223 @@
+import sys
+import os
+
+class FakeCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, params=None):
+        self.connection.executed.append(query)
+        if self.connection.fail(query):
+            import psycopg2
+            raise psycopg2.ProgrammingError("failed: %s" % query)
+
+class FakeConnection(object):
+    def __init__(self):
+        self.pid = os.getpid()
+        self.closed = False
+        self.autocommit = False
+        self.executed = []
+        self.fail = lambda query: False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+class FakeTime(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+def pool():
+    import dbaccess
+
+    opened = []
+
+    def connect():
+        connection = FakeConnection()
+        opened.append(connection)
+        return connection
+
+    dbaccess.connect = connect
+    dbaccess.time = fake_time = FakeTime()
+
+    # Reuse: the most recently returned connection is reused first.
+    pool = dbaccess.ConnectionPool(2, 300)
+    first, reused = pool.acquire()
+    assert not reused
+    second, reused = pool.acquire()
+    assert not reused and second is not first
+    pool.release(first)
+    pool.release(second)
+    connection, reused = pool.acquire()
+    assert reused and connection is second
+    pool.release(connection)
+    assert not first.closed and not second.closed
+
+    statistics = pool.getStatistics()
+    assert (statistics["opened"], statistics["reused"], statistics["idle"], statistics["in_use"]) == (2, 1, 2, 0), statistics
+
+    # Size limit: a connection returned to a full pool is closed.
+    connections = [pool.acquire()[0] for _ in range(3)]
+    assert len(opened) == 3
+    for connection in connections:
+        pool.release(connection)
+    assert pool.getStatistics()["idle"] == 2
+    assert [connection.closed for connection in connections] == [False, False, True]
+
+    # Idle expiry: connections idle for too long are closed instead of
+    # reused, and connections idle for a while are checked first.
+    fake_time.now += 60
+    connection, reused = pool.acquire()
+    assert reused and connection.executed[-1] == "SELECT 1"
+    pool.release(connection)
+    fake_time.now += 301
+    connection, reused = pool.acquire()
+    assert not reused
+    assert all(connection.closed for connection in opened[:3])
+    pool.release(connection)
+
+    # Fork: the child process must neither use nor close the connections it
+    # inherited from the parent.
+    inherited = opened[-1]
+    in_use, _ = pool.acquire()
+    assert in_use is inherited
+    idle, _ = pool.acquire()
+    pool.release(idle)
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            connection, reused = pool.acquire()
+            assert not reused and connection is not idle
+            pool.release(connection)
+            pool.release(in_use)
+            assert not idle.closed and not in_use.closed
+            assert idle in dbaccess._inherited and in_use in dbaccess._inherited
+            statistics = pool.getStatistics()
+            assert (statistics["idle"], statistics["in_use"]) == (1, 0), statistics
+        except:
+            import traceback
+            traceback.print_exc()
+            os._exit(1)
+        os._exit(0)
+
+    _, status = os.waitpid(pid, 0)
+    assert status == 0, "child process failed"
+
+    pool.release(in_use)
+    assert pool.getStatistics()["idle"] == 2
+
+def convert():
+    from dbaccess import convertQuery
+
+    # No parameters: the query is sent as is, so "%" is not special.
+    assert convertQuery("SELECT 1 %% 2", None) == ("SELECT 1 %% 2", None)
+
+    # Positional parameters, and "%%" escaping.
+    assert (convertQuery("SELECT id FROM users WHERE name=%s AND id %% 2=%s", ("alice", 1))
+            == ("SELECT id FROM users WHERE name=$1 AND id % 2=$2", None))
+    assert convertQuery("SELECT %s, %s", [1, 2]) == ("SELECT $1, $2", None)
+
+    # Named parameters: each name is one parameter, numbered in order of first
+    # use, and unused values are ignored.
+    assert (convertQuery("SELECT %(b)s, %(a)s, %(b)s", { "a": 1, "b": 2, "c": 3 })
+            == ("SELECT $1, $2, $1", ["b", "a"]))
+
+    # Queries that can't be converted.
+    assert convertQuery("SELECT %s, %(a)s", { "a": 1 }) is None
+    assert convertQuery("SELECT %(a)s, %s", (1,)) is None
+    assert convertQuery("SELECT %s, %s", (1,)) is None
+    assert convertQuery("SELECT %s", (1, 2)) is None
+
+def statements():
+    import dbaccess
+
+    # Binding parameters.
+    statement = dbaccess.PreparedStatement("critic_1", None)
+    assert statement.bind(None) == ("EXECUTE critic_1", None)
+    assert statement.bind(()) == ("EXECUTE critic_1", None)
+    assert (statement.bind((1, 2L, "x", u"y", True, None, [1, 2]))
+            == ("EXECUTE critic_1 (%s, %s, %s, %s, %s, %s, %s)",
+                [1, 2L, "x", u"y", True, None, [1, 2]]))
+
+    statement = dbaccess.PreparedStatement("critic_2", ["b", "a"])
+    assert (statement.bind({ "a": 1, "b": 2, "c": 3 })
+            == ("EXECUTE critic_2 (%s, %s)", [2, 1]))
+
+    # Values that can't be passed to a prepared statement: tuples ("IN %s"),
+    # and values the server might convert to the type it inferred, such as
+    # floats (rounded if an integer was inferred) and datetimes.
+    import datetime
+    import decimal
+    for value in ((1, 2), [1.5], [(1, 2)], 1.5, decimal.Decimal("1.5"),
+                  datetime.datetime.now()):
+        assert statement.bind({ "a": value, "b": 1 }) is None, value
+
+    connection = FakeConnection()
+    cursor = connection.cursor()
+    cache = dbaccess.StatementCache(3, 2)
+
+    def executed():
+        result = connection.executed[:]
+        del connection.executed[:]
+        return result
+
+    # Threshold: the query is prepared the third time it is executed.
+    assert cache.lookup(cursor, "SELECT %s", (1,)) is None
+    assert cache.lookup(cursor, "SELECT %s", (1,)) is None
+    assert not executed()
+    first = cache.lookup(cursor, "SELECT %s", (1,))
+    assert first.name == "critic_1"
+    assert executed() == ["SAVEPOINT critic_prepare",
+                          "PREPARE critic_1 AS SELECT $1",
+                          "RELEASE SAVEPOINT critic_prepare"]
+    assert cache.lookup(cursor, "SELECT %s", (2,)) is first
+    assert not executed()
+
+    # A query executed without parameters is a different statement.
+    assert cache.lookup(cursor, "SELECT %s", None, repetitions=3).name == "critic_2"
+    assert executed()[1] == "PREPARE critic_2 AS SELECT %s"
+
+    # LRU eviction: "SELECT %s" with parameters is the most recently used, so
+    # "SELECT %s" without parameters is deallocated to make room.
+    cache.lookup(cursor, "SELECT %s", (3,))
+    third = cache.lookup(cursor, "SELECT 3", None, repetitions=3)
+    assert executed() == ["DEALLOCATE critic_2",
+                          "SAVEPOINT critic_prepare",
+                          "PREPARE critic_3 AS SELECT 3",
+                          "RELEASE SAVEPOINT critic_prepare"]
+    assert cache.lookup(cursor, "SELECT %s", (4,)) is first
+    assert cache.lookup(cursor, "SELECT 3", None) is third
+    assert cache.lookup(cursor, "SELECT %s", None) is None
+    assert not executed()
+
+    # Queries that fail to prepare, or can't be converted, are never
+    # prepared.  (The least recently used statement is still deallocated.)
+    connection.fail = lambda query: query.startswith("PREPARE")
+    assert cache.lookup(cursor, "SELECT %s, 4", (1,), repetitions=3) is None
+    assert executed() == ["DEALLOCATE critic_1",
+                          "SAVEPOINT critic_prepare",
+                          "PREPARE critic_4 AS SELECT $1, 4",
+                          "ROLLBACK TO SAVEPOINT critic_prepare",
+                          "RELEASE SAVEPOINT critic_prepare"]
+    connection.fail = lambda query: False
+    assert cache.lookup(cursor, "SELECT %s, 4", (1,), repetitions=3) is None
+    assert cache.lookup(cursor, "SELECT %s, %s", (1,), repetitions=3) is None
+    assert cache.lookup(cursor, "SELECT %s, %s", (1,), repetitions=3) is None
+    assert not executed()
+
+if __name__ == "__main__":
+    if "pool" in sys.argv[1:]:
+        pool()
+    if "convert" in sys.argv[1:]:
+        convert()
+    if "statements" in sys.argv[1:]:
+        statements()
@@ -49,10 +49,12 @@ class Database(Session):
             def invalidate(self):
                 self.__invalid = True
 
-        def __init__(self, db, cursor, profiling):
+        def __init__(self, db, cursor, profiling, statements, statistics):
             self.__db = db
             self.__cursor = cursor
             self.__profiling = profiling is not None
+            self.__statements = statements
+            self.__statistics = statistics is not None
             self.__rows = None
             self.__iterators = []
 
@@ -86,56 +88,109 @@ class Database(Session):
             else:
                 return self.__rows
 
+        def __prepared(self, query, params, repetitions=1):
+            # Returns the prepared statement to execute instead of the query,
+            # or None.
+            if self.__statements is None:
+                return None
+            return self.__statements.lookup(self.__cursor, query, params, repetitions)
+
         def execute(self, query, params=None, for_update=False):
             if for_update:
                 assert query.upper().startswith("SELECT ")
                 query += " FOR UPDATE"
                 if for_update is NOWAIT:
                     query += " NOWAIT"
+            statement = self.__prepared(query, params)
+            prepared = statement.bind(params) if statement else None
             try:
                 if not self.__profiling:
-                    self.__cursor.execute(query, params)
+                    if not self.__statistics:
+                        self.__cursor.execute(*(prepared or (query, params)))
+                    else:
+                        before = time.time()
+                        self.__cursor.execute(*(prepared or (query, params)))
+                        after = time.time()
+                        self.__db.recordStatistics(query, after - before, self.__cursor.rowcount)
                 else:
                     map(Database.Cursor.Iterator.invalidate, self.__iterators)
                     self.__iterators = []
                     before = time.time()
-                    self.__cursor.execute(query, params)
+                    self.__cursor.execute(*(prepared or (query, params)))
                     try:
                         self.__rows = self.__cursor.fetchall()
                     except dbaccess.ProgrammingError:
                         self.__rows = None
                     after = time.time()
-                    self.__db.recordProfiling(query, after - before, rows=len(self.__rows) if self.__rows else 0)
+                    self.__db.recordProfiling(query, after - before, rows=len(self.__rows) if self.__rows else 0,
+                                              prepared=bool(prepared))
+                    if self.__statistics:
+                        self.__db.recordStatistics(query, after - before, len(self.__rows) if self.__rows else 0)
             except dbaccess.OperationalError:
                 if for_update is NOWAIT:
                     raise FailedToLock()
                 raise
 
         def executemany(self, query, params):
-            if self.__profiling is None:
-                self.__cursor.executemany(query, params)
+            params = list(params)
+            if not params:
+                return
+            statement = self.__prepared(query, params[0], len(params))
+            prepared_params = None
+            if statement:
+                prepared = map(statement.bind, params)
+                # If some parameter value can't be passed to the prepared
+                # statement, execute the query as is.
+                if all(prepared):
+                    prepared_query = prepared[0][0]
+                    prepared_params = [values for _, values in prepared]
+            before = time.time()
+            if prepared_params is not None:
+                self.__cursor.executemany(prepared_query, prepared_params)
             else:
-                before = time.time()
-                params = list(params)
                 self.__cursor.executemany(query, params)
-                after = time.time()
-                self.__db.recordProfiling(query, after - before, repetitions=len(params))
+            after = time.time()
+            if self.__profiling:
+                self.__db.recordProfiling(query, after - before, repetitions=len(params),
+                                          prepared=prepared_params is not None)
+            if self.__statistics:
+                self.__db.recordStatistics(query, after - before, self.__cursor.rowcount)
+
+        def copy_from(self, source, table, columns):
+            """Load rows into 'table' using COPY
+
+               'source' is a file-like object containing one line per row, with
+               tab-separated values for 'columns'."""
+            before = time.time()
+            self.__cursor.copy_from(source, table, columns=columns)
+            after = time.time()
+            if self.__profiling:
+                self.__db.recordProfiling("COPY %s (%s)" % (table, ", ".join(columns)),
+                                          after - before, rows=self.__cursor.rowcount)
 
         def mogrify(self, *args):
             return self.__cursor.mogrify(*args)
 
     def __init__(self):
         super(Database, self).__init__()
-        self.__connection = dbaccess.connect()
+        before = time.time()
+        self.__connection, reused = dbaccess.acquire()
+        after = time.time()
+        self.recordProfiling("<connect: reused>" if reused else "<connect>", after - before, 0)
 
     def cursor(self):
-        return Database.Cursor(self, self.__connection.cursor(), self.profiling)
+        return Database.Cursor(self, self.__connection.cursor(), self.profiling,
+                               getattr(self.__connection, "statements", None),
+                               self.query_statistics)
 
     def commit(self):
         before = time.time()
         self.__connection.commit()
         after = time.time()
         self.recordProfiling("<commit>", after - before, 0)
+        if self.query_statistics:
+            # Does nothing unless it's time to flush.
+            self.query_statistics.flush()
 
     def rollback(self):
         before = time.time()
@@ -146,9 +201,12 @@ class Database(Session):
     def close(self):
         super(Database, self).close()
         if self.__connection:
-            self.__connection.rollback()
-            self.__connection.close()
+            # Rolls back any uncommitted changes, and either closes the
+            # connection or returns it to the connection pool.
+            dbaccess.release(self.__connection)
             self.__connection = None
+        if self.query_statistics:
+            self.query_statistics.flush()
 
     def __enter__(self):
         return self
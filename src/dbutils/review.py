@@ -216,46 +216,20 @@ class Review(object):
 
     @staticmethod
     def isAccepted(db, review_id):
-        cursor = db.cursor()
-
-        cursor.execute("SELECT 1 FROM reviewfiles WHERE review=%s AND state='pending' LIMIT 1", (review_id,))
-        if cursor.fetchone(): return False
-
-        cursor.execute("SELECT 1 FROM commentchains WHERE review=%s AND type='issue' AND state='open' LIMIT 1", (review_id,))
-        if cursor.fetchone(): return False
-
-        return True
+        import reviewing.progress
+        return reviewing.progress.fetchReviewProgress(db, [review_id])[review_id].isAccepted()
 
     def accepted(self, db):
         if self.state != 'open': return False
         else: return Review.isAccepted(db, self.id)
 
     def getReviewState(self, db):
-        cursor = db.cursor()
-
-        cursor.execute("""SELECT state, SUM(deleted) + SUM(inserted)
-                            FROM reviewfiles
-                           WHERE reviewfiles.review=%s
-                        GROUP BY state""",
-                       (self.id,))
-
-        pending = 0
-        reviewed = 0
-
-        for state, count in cursor.fetchall():
-            if state == "pending": pending = count
-            else: reviewed = count
-
-        cursor.execute("""SELECT count(id)
-                            FROM commentchains
-                           WHERE review=%s
-                             AND type='issue'
-                             AND state='open'""",
-                       (self.id,))
+        import reviewing.progress
 
-        issues = cursor.fetchone()[0]
+        progress = reviewing.progress.fetchReviewProgress(db, [self.id])[self.id]
+        accepted = self.state == 'open' and progress.isAccepted()
 
-        return ReviewState(self, self.accepted(db), pending, reviewed, issues)
+        return ReviewState(self, accepted, progress.pending, progress.reviewed, progress.issues)
 
     def setPerformedRebase(self, old_head, new_head, old_upstream, new_upstream, user):
         self.performed_rebase = ReviewRebase(self, old_head, new_head, old_upstream, new_upstream, user)
@@ -288,10 +262,12 @@ class Review(object):
                            WHERE reviewchangesets.review=%s""",
                        (self.id,))
 
-        commits = []
+        rows = cursor.fetchall()
+        gitobjects = self.repository.fetchMany(
+            commit_sha1 for _, commit_sha1 in rows)
 
-        for commit_id, commit_sha1 in cursor:
-            commits.append(gitutils.Commit.fromSHA1(db, self.repository, commit_sha1, commit_id))
+        commits = [gitutils.Commit.fromGitObject(db, self.repository, gitobject, commit_id)
+                   for (commit_id, _), gitobject in zip(rows, gitobjects)]
 
         return log.commitset.CommitSet(commits)
 
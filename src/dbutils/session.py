@@ -14,6 +14,12 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
+import os
+import sys
+import random
+
+import querystatistics
+
 class Session(object):
     def __init__(self):
         self.__atexit = []
@@ -23,6 +29,17 @@ class Session(object):
                          "CommitUserTime": {},
                          "Timezones": {} }
         self.profiling = {}
+        # Number of executions of each query that used a prepared statement.
+        self.profiling_prepared = {}
+
+        # Query statistics across sessions (see querystatistics.py.)  Recorded
+        # for all queries in sampled sessions, and for slow queries in all
+        # sessions.  The context identifies what executed the queries; the
+        # web front-end sets it to the page or operation requested.
+        self.query_statistics = querystatistics.getStatistics()
+        self.sampled = (self.query_statistics is not None and
+                        random.random() < self.query_statistics.sample_rate)
+        self.query_context = "process: " + os.path.splitext(os.path.basename(sys.argv[0]))[0]
 
     def atexit(self, fn):
         self.__atexit.append(fn)
@@ -35,9 +52,13 @@ class Session(object):
 
     def disableProfiling(self):
         self.profiling = None
+        self.profiling_prepared = None
 
-    def recordProfiling(self, item, duration, rows=None, repetitions=1):
+    def recordProfiling(self, item, duration, rows=None, repetitions=1, prepared=False):
         if self.profiling is not None:
+            if prepared:
+                self.profiling_prepared[item] = self.profiling_prepared.get(item, 0) + repetitions
+
             count, accumulated_ms, maximum_ms, accumulated_rows, maximum_rows = self.profiling.get(item, (0, 0.0, 0.0, None, None))
 
             count += repetitions
@@ -51,3 +72,7 @@ class Session(object):
                 maximum_rows = max(maximum_rows, rows)
 
             self.profiling[item] = count, accumulated_ms, maximum_ms, accumulated_rows, maximum_rows
+
+    def recordStatistics(self, query, duration, rows):
+        if self.sampled or self.query_statistics.isSlow(duration):
+            self.query_statistics.record(self.query_context, query, duration, rows, self.sampled)
@@ -14,6 +14,9 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
+import time
+import multiprocessing
+
 import diff
 import diff.parse
 import gitutils
@@ -62,45 +65,123 @@ def filterChunks(log, file_on_branch, file_in_merge, path):
 
     return result
 
-def parseMergeDifferences(db, repository, commit):
-    mergebase = gitutils.Commit.fromSHA1(db, repository, repository.mergebase(commit, db=db))
+def diffAgainstParent(repository, commit, parent, mergebase):
+    """diffAgainstParent(...) => ([diff.File, ...], dict(timings))
 
-    result = {}
+    Return the relevant differences between a merge commit and one of its
+    parents, and the time spent in the different steps."""
+
+    before = time.time()
+    timings = {}
+
+    if parent == mergebase:
+        result = diff.parse.parseDifferences(repository, from_commit=parent, to_commit=commit)[parent.sha1]
+        timings["diff"] = time.time() - before
+        return result, timings
+
+    paths_on_branch = set(repository.run('diff', '--name-only', "%s..%s" % (mergebase, parent)).splitlines())
+    paths_in_merge = set(repository.run('diff', '--name-only', "%s..%s" % (parent, commit)).splitlines())
+
+    filter_paths = paths_on_branch & paths_in_merge
+
+    on_branch = diff.parse.parseDifferences(repository, from_commit=mergebase, to_commit=parent, filter_paths=filter_paths)[mergebase.sha1]
+    in_merge = diff.parse.parseDifferences(repository, from_commit=parent, to_commit=commit, filter_paths=filter_paths)[parent.sha1]
+
+    timings["diff"] = time.time() - before
+    before = time.time()
+
+    files_on_branch = dict([(file.path, file) for file in on_branch])
+
+    result = []
     log = [""]
 
-    for parent_sha1 in commit.parents:
-        parent = gitutils.Commit.fromSHA1(db, repository, parent_sha1)
+    for file_in_merge in in_merge:
+        file_on_branch = files_on_branch.get(file_in_merge.path)
+        if file_on_branch:
+            filtered_chunks = filterChunks(log, file_on_branch, file_in_merge, file_in_merge.path)
+
+            if filtered_chunks:
+                result.append(diff.File(id=None,
+                                        repository=repository,
+                                        path=file_in_merge.path,
+                                        old_sha1=file_in_merge.old_sha1,
+                                        new_sha1=file_in_merge.new_sha1,
+                                        old_mode=file_in_merge.old_mode,
+                                        new_mode=file_in_merge.new_mode,
+                                        chunks=filtered_chunks))
+
+    timings["filter"] = time.time() - before
 
-        if parent_sha1 == mergebase:
-            result[parent_sha1] = diff.parse.parseDifferences(repository, from_commit=parent, to_commit=commit)[parent_sha1]
-        else:
-            paths_on_branch = set(repository.run('diff', '--name-only', "%s..%s" % (mergebase, parent)).splitlines())
-            paths_in_merge = set(repository.run('diff', '--name-only', "%s..%s" % (parent, commit)).splitlines())
+    return result, timings
 
-            filter_paths = paths_on_branch & paths_in_merge
+def diffAgainstParentInWorker(arguments):
+    # Run in a pool worker process.  diff.File objects reference the
+    # repository, so they are returned as plain tuples instead.
+    repository_path, repository_name, commit_sha1, parent_sha1, mergebase_sha1 = arguments
 
-            on_branch = diff.parse.parseDifferences(repository, from_commit=mergebase, to_commit=parent, filter_paths=filter_paths)[mergebase.sha1]
-            in_merge = diff.parse.parseDifferences(repository, from_commit=parent, to_commit=commit, filter_paths=filter_paths)[parent_sha1]
+    repository = gitutils.Repository(path=repository_path, name=repository_name)
+    commit, parent, mergebase = [gitutils.Commit.fromSHA1(None, repository, sha1)
+                                 for sha1 in (commit_sha1, parent_sha1, mergebase_sha1)]
 
-            files_on_branch = dict([(file.path, file) for file in on_branch])
+    files, timings = diffAgainstParent(repository, commit, parent, mergebase)
 
-            result_for_parent = []
+    return ([(file.path, file.old_sha1, file.new_sha1, file.old_mode, file.new_mode,
+              [(chunk.delete_offset, chunk.delete_count, chunk.insert_offset,
+                chunk.insert_count, chunk.is_whitespace, chunk.analysis)
+               for chunk in file.chunks])
+             for file in files],
+            timings)
 
-            for file_in_merge in in_merge:
-                file_on_branch = files_on_branch.get(file_in_merge.path)
-                if file_on_branch:
-                    filtered_chunks = filterChunks(log, file_on_branch, file_in_merge, file_in_merge.path)
+def parseMergeDifferences(db, repository, commit, max_workers=1, timings=None):
+    """parseMergeDifferences(...) => dict(parent_sha1 => [diff.File, ...])
 
-                    if filtered_chunks:
-                        result_for_parent.append(diff.File(id=None,
-                                                           repository=repository,
-                                                           path=file_in_merge.path,
-                                                           old_sha1=file_in_merge.old_sha1,
-                                                           new_sha1=file_in_merge.new_sha1,
-                                                           old_mode=file_in_merge.old_mode,
-                                                           new_mode=file_in_merge.new_mode,
-                                                           chunks=filtered_chunks))
+    If 'max_workers' is greater than one, the differences against different
+    parents are computed in parallel, by a pool of at most that many worker
+    processes.  If 'timings' is a dictionary, it is updated to map each parent
+    SHA-1 to a dictionary with the time spent diffing against that parent."""
+
+    mergebase = gitutils.Commit.fromSHA1(db, repository, repository.mergebase(commit, db=db))
+
+    result = {}
 
-            result[parent_sha1] = result_for_parent
+    if timings is None:
+        timings = {}
+
+    processes = min(max_workers, len(commit.parents))
+
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+
+        try:
+            # Results are returned in the same order as the arguments, so the
+            # result doesn't depend on which worker finishes first.
+            per_parent = pool.map(diffAgainstParentInWorker,
+                                  [(repository.path, repository.name, commit.sha1, parent_sha1, mergebase.sha1)
+                                   for parent_sha1 in commit.parents])
+        finally:
+            pool.terminate()
+            pool.join()
+
+        for parent_sha1, (files, parent_timings) in zip(commit.parents, per_parent):
+            result[parent_sha1] = [diff.File(id=None,
+                                             repository=repository,
+                                             path=path,
+                                             old_sha1=old_sha1,
+                                             new_sha1=new_sha1,
+                                             old_mode=old_mode,
+                                             new_mode=new_mode,
+                                             chunks=[diff.Chunk(delete_offset, delete_count,
+                                                                insert_offset, insert_count,
+                                                                is_whitespace=is_whitespace,
+                                                                analysis=analysis)
+                                                     for (delete_offset, delete_count, insert_offset, insert_count,
+                                                          is_whitespace, analysis)
+                                                     in chunks])
+                                   for path, old_sha1, new_sha1, old_mode, new_mode, chunks in files]
+            timings[parent_sha1] = parent_timings
+    else:
+        for parent_sha1 in commit.parents:
+            parent = gitutils.Commit.fromSHA1(db, repository, parent_sha1)
+            result[parent_sha1], timings[parent_sha1] = diffAgainstParent(repository, commit, parent, mergebase)
 
     return result
@@ -176,6 +176,32 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
          dict(parent_sha1 => [diff.File, ...] (if selected_path is None)
          diff.File                            (if selected_path is not None)"""
 
+    files = list(iterateDifferences(repository, commit, from_commit, to_commit,
+                                    filter_paths, selected_path, simple))
+
+    if to_commit:
+        if selected_path is not None:
+            for file in files:
+                if file.path == selected_path:
+                    return file
+            return None
+        elif from_commit:
+            return { from_commit.sha1: files }
+        else:
+            return { None: files }
+    elif not commit.parents:
+        return { None: files }
+    else:
+        return { commit.parents[0]: files }
+
+def iterateDifferences(repository, commit=None, from_commit=None, to_commit=None, filter_paths=None, selected_path=None, simple=False):
+    """iterateDifferences(repository, [commit] | [from_commit, to_commit][, selected_path]) =>
+         iterator over diff.File
+
+       Git's output is parsed as it is produced, and each file is yielded as
+       soon as it is complete, so memory usage is proportional to the largest
+       file rather than to the whole diff."""
+
     options = []
 
     if to_commit:
@@ -215,8 +241,7 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
         options.append('--')
         options.append(selected_path)
 
-    stdout = repository.run(command, '--full-index', '--unified=1', '--patience', *options)
-    selected_file = None
+    lines = repository.runLines(command, '--full-index', '--unified=1', '--patience', *options)
 
     re_chunk = re.compile('^@@ -(\\d+)(?:,\\d+)? \\+(\\d+)(?:,\\d+)? @@')
     re_binary = re.compile('^Binary files (?:a/(.+)|/dev/null) and (?:b/(.+)|/dev/null) differ')
@@ -224,31 +249,28 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
     re_old_path = re.compile("--- ([\"']?)a/(.*?)\\1\t?$")
     re_new_path = re.compile("\\+\\+\\+ ([\"']?)b/(.*?)\\1\t?$")
 
-    def isplitlines(text):
-        start = 0
-        length = len(text)
-
-        while start < length:
-            try:
-                end = text.index('\n', start)
-                yield text[start:end]
-                start = end + 1
-            except ValueError:
-                yield text[start:]
-                break
-
-    lines = isplitlines(stdout)
-
     included = set()
     files = []
     files_by_path = {}
 
     def addFile(new_file):
-        assert new_file.path not in files_by_path, "duplicate path: %s" % new_file.path
+        assert new_file.path not in included, "duplicate path: %s" % new_file.path
         files.append(new_file)
         files_by_path[new_file.path] = new_file
         included.add(new_file.path)
 
+    def completeFiles():
+        # Finish the files in 'files' and remove them from it and from
+        # 'files_by_path'.
+        completed = files[:]
+        del files[:]
+        files_by_path.clear()
+        if not simple:
+            diff.File.loadPlainLines([file for file in completed if len(file.chunks) > 1])
+            for file in completed:
+                mergeChunks(file)
+        return completed
+
     old_mode = None
     new_mode = None
 
@@ -261,6 +283,16 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
             old_mode = None
             new_mode = None
 
+            # All files but the last one are complete; the last one may still
+            # be amended if the next file has the same path (which happens
+            # when a path changes type.)
+            if len(files) > 1:
+                last_file = files.pop()
+                for file in completeFiles():
+                    yield file
+                files.append(last_file)
+                files_by_path[last_file.path] = last_file
+
             # Scan to the 'index <sha1>..<sha1>' line that marks the beginning
             # of the differences in one file.
             while not line.startswith("index "):
@@ -410,8 +442,8 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
                 inserted_lines = []
 
                 if old_path and new_path and not simple:
-                    old_lines = splitlines(repository.fetch(old_sha1).data)
-                    new_lines = splitlines(repository.fetch(new_sha1).data)
+                    old_lines, new_lines = [splitlines(gitobject.data) for gitobject
+                                            in repository.fetchMany([old_sha1, new_sha1])]
                 else:
                     old_lines = None
                     new_lines = None
@@ -432,9 +464,6 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
 
                 old_mode = new_mode = None
 
-                if selected_path is not None and selected_path == path:
-                    selected_file = new_file
-
                 if path not in files_by_path: addFile(new_file)
 
                 previous_delete_offset = 1
@@ -520,8 +549,11 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
 
             addFile(diff.File(None, names[0], None, None, repository, old_mode=old_mode, new_mode=new_mode, chunks=[]))
 
-    for path in (paths - included):
-        lines = isplitlines(repository.run(command, '--full-index', '--unified=1', *(what + ['--', path])))
+    for file in completeFiles():
+        yield file
+
+    for path in sorted(paths - included):
+        lines = repository.runLines(command, '--full-index', '--unified=1', *(what + ['--', path]))
 
         try:
             line = lines.next()
@@ -542,9 +574,9 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
 
             addFile(diff.File(None, path, old_sha1, new_sha1, repository, chunks=[]))
 
-            old_data = repository.fetch(old_sha1).data
+            old_data, new_data = [gitobject.data for gitobject
+                                  in repository.fetchMany([old_sha1, new_sha1])]
             old_lines = splitlines(old_data)
-            new_data = repository.fetch(new_sha1).data
             new_lines = splitlines(new_data)
 
             assert len(old_lines) == len(new_lines), "%s:%d != %s:%d" % (old_sha1, len(old_lines), new_sha1, len(new_lines))
@@ -554,19 +586,8 @@ def parseDifferences(repository, commit=None, from_commit=None, to_commit=None,
             detectWhiteSpaceChanges(files[-1], old_lines, 1, len(old_lines) + 1, endsWithLinebreak(old_data), new_lines, 1, len(new_lines) + 1, endsWithLinebreak(new_data))
         except StopIteration:
             pass
+        finally:
+            lines.close()
 
-    if not simple:
-        for file in files:
-            mergeChunks(file)
-
-    if to_commit:
-        if selected_path is not None:
-            return selected_file
-        elif from_commit:
-            return { from_commit.sha1: files }
-        else:
-            return { None: files }
-    elif not commit.parents:
-        return { None: files }
-    else:
-        return { commit.parents[0]: files }
+        for file in completeFiles():
+            yield file
@@ -25,13 +25,17 @@ import tempfile
 import shutil
 import stat
 import contextlib
+import collections
+import zlib
+import hashlib
 
 import base
 import configuration
 import textutils
 import htmlutils
 import communicate
-import diff.parse
+import commitgraph
+import packfile
 
 re_author_committer = re.compile("(.*) <(.*)> ([0-9]+ [-+][0-9]+)")
 re_sha1 = re.compile("^[A-Za-z0-9]{40}$")
@@ -39,6 +43,11 @@ re_sha1 = re.compile("^[A-Za-z0-9]{40}$")
 REPOSITORY_RELAYCOPY_DIR = os.path.join(configuration.paths.DATA_DIR, "relay")
 REPOSITORY_WORKCOPY_DIR = os.path.join(configuration.paths.DATA_DIR, "temporary")
 
+# Where Blame stores the results of blaming files.  Results are never
+# invalidated (they are keyed by immutable commit SHA-1s) but files not used in
+# a while are removed by the maintenance service.
+BLAME_CACHE_DIR = os.path.join(configuration.paths.CACHE_DIR, "blame")
+
 # Reference used to keep various commits alive.
 KEEPALIVE_REF_CHAIN = "refs/internal/keepalive-chain"
 KEEPALIVE_REF_PREFIX = "refs/keepalive/"
@@ -128,6 +137,400 @@ class NoSuchRepository(base.Error):
         super(NoSuchRepository, self).__init__("No such repository: %s" % str(value))
         self.value = value
 
+class BatchProcess(object):
+    """A running 'git cat-file --batch' or 'git cat-file --batch-check' process
+
+       Instances are owned by the process-wide BatchPool, and are checked out
+       from it by Repository objects for as long as they need them."""
+
+    def __init__(self, path, check, pooled=True):
+        if check:
+            mode = "--batch-check"
+        else:
+            mode = "--batch"
+
+        self.path = path
+        self.check = check
+        self.pooled = pooled
+        self.process = subprocess.Popen(
+            [configuration.executables.GIT, 'cat-file', mode],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, cwd=path, bufsize=-1)
+        self.stdin = self.process.stdin
+        self.stdout = self.process.stdout
+        self.last_used = time.time()
+        self.uses = 0
+        self.broken = False
+        self.expired = False
+
+    def isHealthy(self):
+        return not (self.broken or self.expired) \
+            and self.process.poll() is None
+
+    def kill(self):
+        try: os.kill(self.process.pid, 9)
+        except: pass
+        try: self.process.wait()
+        except: pass
+
+    def writeObjectNames(self, sha1s):
+        try:
+            for sha1 in sha1s:
+                self.stdin.write(sha1 + "\n")
+            self.stdin.flush()
+        except IOError:
+            self.broken = True
+
+    def readObject(self, sha1):
+        """Read the next object from the process's output
+
+           Returns None if the process reported the object as missing."""
+
+        line = self.stdout.readline()
+
+        if line == ("%s missing\n" % sha1):
+            return None
+
+        try: object_sha1, object_type, object_size = line.split()
+        except ValueError:
+            raise GitError("unexpected output from 'git cat-file': %r" % line)
+
+        object_size = int(object_size)
+
+        if self.check:
+            object_data = None
+        else:
+            object_data = self.stdout.read(object_size)
+            self.stdout.read(1)
+
+        return GitObject(object_sha1, object_type, object_size, object_data)
+
+    def readObjects(self, sha1s):
+        """Request all objects in 'sha1s' and yield them as they arrive
+
+           The object names are written from a separate thread while objects
+           are being read, so that neither pipe fills up and blocks, and so
+           that Git can start producing output immediately.  Yields pairs of
+           requested SHA-1 and GitObject (or None if missing) in order.
+
+           If iteration is abandoned early, the process is killed, since its
+           output is no longer in sync with what has been read."""
+
+        writer = threading.Thread(target=self.writeObjectNames, args=(sha1s,))
+        writer.daemon = True
+        writer.start()
+
+        remaining = len(sha1s)
+
+        try:
+            for sha1 in sha1s:
+                git_object = self.readObject(sha1)
+                remaining -= 1
+                yield sha1, git_object
+        finally:
+            if remaining:
+                self.broken = True
+                self.kill()
+            writer.join()
+
+class BatchPool(object):
+    """Per-process pool of warm 'git cat-file' processes
+
+       Processes are keyed by repository path and mode, checked out by
+       Repository objects when first needed and checked back in when the
+       repository object's database connection is closed.  Idle processes
+       are terminated after configuration.limits.GIT_BATCH_IDLE_TIMEOUT
+       seconds.
+
+       The total number of processes is capped at
+       configuration.limits.GIT_BATCH_POOL_SIZE.  If the pool is full and no
+       idle process can be evicted, checkout() waits a short while for one to
+       be returned, and then starts an unpooled process that is terminated
+       when checked in.  (Waiting indefinitely could deadlock, since a single
+       request may hold processes for several repositories.)"""
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__pid = os.getpid()
+        self.__idle = {}
+        self.__busy = set()
+
+        self.spawned = 0
+        self.reused = 0
+        self.reaped = 0
+
+    def __checkPid(self):
+        # If we've forked since the pool was last used, the processes belong to
+        # our parent.  Just forget about them.
+        if self.__pid != os.getpid():
+            self.__pid = os.getpid()
+            self.__idle = {}
+            self.__busy = set()
+
+    def __count(self):
+        return len(self.__busy) + sum(map(len, self.__idle.values()))
+
+    def __reapIdle(self, now):
+        deadline = now - configuration.limits.GIT_BATCH_IDLE_TIMEOUT
+        for key, workers in self.__idle.items():
+            for worker in workers[:]:
+                if worker.last_used < deadline or not worker.isHealthy():
+                    workers.remove(worker)
+                    worker.kill()
+                    self.reaped += 1
+            if not workers:
+                del self.__idle[key]
+
+    def __evictOldest(self):
+        oldest = None
+        for workers in self.__idle.values():
+            for worker in workers:
+                if oldest is None or worker.last_used < oldest.last_used:
+                    oldest = worker
+        if oldest is None:
+            return False
+        key = (oldest.path, oldest.check)
+        self.__idle[key].remove(oldest)
+        if not self.__idle[key]:
+            del self.__idle[key]
+        oldest.kill()
+        self.reaped += 1
+        return True
+
+    def checkout(self, path, check=False):
+        with self.__condition:
+            self.__checkPid()
+
+            now = time.time()
+            self.__reapIdle(now)
+
+            key = (path, check)
+            deadline = now + configuration.limits.GIT_BATCH_WAIT_TIMEOUT
+            pooled = True
+
+            while True:
+                workers = self.__idle.get(key)
+                while workers:
+                    worker = workers.pop()
+                    if not workers:
+                        del self.__idle[key]
+                    if worker.isHealthy():
+                        worker.uses += 1
+                        self.__busy.add(worker)
+                        self.reused += 1
+                        return worker
+                    worker.kill()
+                    self.reaped += 1
+                    workers = self.__idle.get(key)
+
+                if self.__count() < configuration.limits.GIT_BATCH_POOL_SIZE:
+                    break
+                if self.__evictOldest():
+                    break
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    pooled = False
+                    break
+
+                self.__condition.wait(remaining)
+
+            worker = BatchProcess(path, check, pooled=pooled)
+            worker.uses += 1
+            if pooled:
+                self.__busy.add(worker)
+            self.spawned += 1
+            return worker
+
+    def checkin(self, worker, discard=False):
+        with self.__condition:
+            self.__checkPid()
+
+            if worker not in self.__busy:
+                # Unpooled process, or one started before a fork.
+                worker.kill()
+                return
+
+            self.__busy.remove(worker)
+            worker.last_used = time.time()
+
+            if discard or not worker.isHealthy() \
+                    or worker.uses >= configuration.limits.GIT_BATCH_MAX_USES:
+                worker.kill()
+                self.reaped += 1
+            else:
+                self.__idle.setdefault((worker.path, worker.check), []).append(worker)
+
+            self.__reapIdle(worker.last_used)
+            self.__condition.notify()
+
+    def discard(self, path):
+        """Terminate all idle processes for the repository at 'path'
+
+           Processes currently checked out are terminated when checked in.
+           This is used after operations (such as 'git gc') that may leave
+           running 'git cat-file' processes with stale pack files open."""
+
+        with self.__condition:
+            self.__checkPid()
+
+            for check in (False, True):
+                for worker in self.__idle.pop((path, check), []):
+                    worker.kill()
+                    self.reaped += 1
+            for worker in self.__busy:
+                if worker.path == path:
+                    worker.expired = True
+
+    def terminate(self):
+        with self.__condition:
+            self.__checkPid()
+
+            for workers in self.__idle.values():
+                for worker in workers:
+                    worker.kill()
+            self.__idle = {}
+
+BATCH_POOL = BatchPool()
+atexit.register(BATCH_POOL.terminate)
+
+class LRUCache(object):
+    """Thread-safe mapping holding at most 'maximum' items
+
+       When full, adding an item evicts the least recently used item."""
+
+    def __init__(self, maximum):
+        self.__lock = threading.Lock()
+        self.__maximum = maximum
+        self.__items = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.__items)
+
+    def get(self, key, default=None):
+        with self.__lock:
+            try:
+                value = self.__items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.__items[key] = value
+            self.hits += 1
+            return value
+
+    def add(self, key, value):
+        with self.__lock:
+            self.__items.pop(key, None)
+            self.__items[key] = value
+            while len(self.__items) > self.__maximum:
+                self.__items.popitem(last=False)
+                self.evictions += 1
+
+class ObjectCache(object):
+    """Process-wide LRU cache of Git objects with per-type byte budgets
+
+       Since Git objects are content-addressed and thus immutable, fetched
+       objects can be shared freely between requests (and threads) handled by
+       the same process.  Objects are keyed by repository path and SHA-1, so
+       that an object is never returned from a repository that doesn't have
+       it.
+
+       Each object type has a separate budget, from
+       configuration.limits.GIT_OBJECT_CACHE_SIZE, so that a few large blobs
+       can't evict all commits and trees of active reviews.  Objects larger
+       than a quarter of their type's budget are not cached at all."""
+
+    # Approximate per-object memory overhead (object, key and LRU entry.)
+    OVERHEAD = 256
+
+    def __init__(self, budgets):
+        self.__lock = threading.Lock()
+        self.__budgets = budgets
+        self.__objects = dict((object_type, collections.OrderedDict())
+                              for object_type in budgets)
+        self.__types = {}
+        self.__sizes = dict.fromkeys(budgets, 0)
+
+        self.hits = dict.fromkeys(budgets, 0)
+        self.misses = dict.fromkeys(budgets, 0)
+        self.evictions = dict.fromkeys(budgets, 0)
+
+    def __cost(self, git_object):
+        return len(git_object.data) + ObjectCache.OVERHEAD
+
+    def get(self, path, sha1):
+        key = (path, sha1)
+        with self.__lock:
+            object_type = self.__types.get(key)
+            if object_type is None:
+                return None
+            objects = self.__objects[object_type]
+            # Move the object to the most recently used end.
+            git_object = objects.pop(key)
+            objects[key] = git_object
+            self.hits[object_type] += 1
+            return git_object
+
+    def add(self, path, git_object):
+        """Add a freshly fetched object to the cache
+
+           Returns the number of objects evicted to make room for it."""
+
+        object_type = git_object.type
+        budget = self.__budgets.get(object_type, 0)
+        cost = self.__cost(git_object)
+        key = (path, git_object.sha1)
+        evicted = 0
+
+        with self.__lock:
+            if object_type in self.misses:
+                self.misses[object_type] += 1
+            if cost > budget / 4 or key in self.__types:
+                return 0
+
+            objects = self.__objects[object_type]
+
+            while objects and self.__sizes[object_type] + cost > budget:
+                evicted_key, evicted_object = objects.popitem(last=False)
+                del self.__types[evicted_key]
+                self.__sizes[object_type] -= self.__cost(evicted_object)
+                evicted += 1
+
+            objects[key] = git_object
+            self.__types[key] = object_type
+            self.__sizes[object_type] += cost
+            self.evictions[object_type] += evicted
+
+        return evicted
+
+    def getStatistics(self):
+        with self.__lock:
+            return dict((object_type,
+                         { "count": len(self.__objects[object_type]),
+                           "bytes": self.__sizes[object_type],
+                           "budget": self.__budgets[object_type],
+                           "hits": self.hits[object_type],
+                           "misses": self.misses[object_type],
+                           "evictions": self.evictions[object_type] })
+                        for object_type in self.__budgets)
+
+OBJECT_CACHE = ObjectCache(configuration.limits.GIT_OBJECT_CACHE_SIZE)
+
+# Parsed Tree objects, keyed by (repository path, tree SHA-1).
+TREE_CACHE = LRUCache(configuration.limits.GIT_TREE_CACHE_SIZE)
+
+# Resolved directory paths, keyed by (repository path, root tree SHA-1, path),
+# with the directory's tree SHA-1 (or None if there is no such directory) as
+# value.
+PATH_CACHE = LRUCache(configuration.limits.GIT_PATH_CACHE_SIZE)
+
+# Blame results keyed by (repository path, from SHA-1, to SHA-1, path).
+BLAME_CACHE = LRUCache(configuration.limits.BLAME_CACHE_SIZE)
+
 class Repository:
     class FromParameter:
         def __init__(self, db): self.db = db
@@ -147,6 +550,8 @@ class Repository:
         self.__batchCheck = None
         self.__cacheBlobs = False
         self.__cacheDisabled = False
+        self.__backend = configuration.limits.GIT_OBJECT_BACKEND_OVERRIDES.get(
+            name, configuration.limits.GIT_OBJECT_BACKEND)
 
         if db:
             self.__db = db
@@ -157,8 +562,6 @@ class Repository:
             self.__db = None
             atexit.register(self.__terminate)
 
-        self.__startBatch()
-
     def __str__(self):
         return self.path
 
@@ -190,12 +593,18 @@ class Repository:
         return url_format % (configuration.base.HOSTNAME, path)
 
     def enableBlobCache(self):
-        assert self.__db
         self.__cacheBlobs = True
 
     def disableCache(self):
         self.__cacheDisabled = True
 
+    def getObjectBackend(self):
+        return self.__backend
+
+    def setObjectBackend(self, backend):
+        assert backend in ("cat-file", "packfile")
+        self.__backend = backend
+
     def hasMainBranch(self):
         return self.__main_branch_id is not None
 
@@ -261,36 +670,28 @@ class Repository:
         raise NoSuchRepository(path)
 
     def __terminate(self, db=None):
-        self.stopBatch()
+        self.__returnBatch()
 
     def __startBatch(self):
         if self.__batch is None:
-            self.__batch = subprocess.Popen(
-                [configuration.executables.GIT, 'cat-file', '--batch'],
-                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT, cwd=self.path)
+            self.__batch = BATCH_POOL.checkout(self.path)
 
     def __startBatchCheck(self):
         if self.__batchCheck is None:
-            self.__batchCheck = subprocess.Popen(
-                [configuration.executables.GIT, 'cat-file', '--batch-check'],
-                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT, cwd=self.path)
+            self.__batchCheck = BATCH_POOL.checkout(self.path, check=True)
 
-    def stopBatch(self):
+    def __returnBatch(self, discard=False):
         if self.__batch:
-            try: os.kill(self.__batch.pid, 9)
-            except: pass
-            try: self.__batch.wait()
-            except: pass
+            BATCH_POOL.checkin(self.__batch, discard=discard)
             self.__batch = None
         if self.__batchCheck:
-            try: os.kill(self.__batchCheck.pid, 9)
-            except: pass
-            try: self.__batchCheck.wait()
-            except: pass
+            BATCH_POOL.checkin(self.__batchCheck, discard=discard)
             self.__batchCheck = None
 
+    def stopBatch(self):
+        self.__returnBatch(discard=True)
+        BATCH_POOL.discard(self.path)
+
     @staticmethod
     def forEach(db, fn):
         for key, repository in db.storage["Repository"].items():
@@ -332,52 +733,166 @@ class Repository:
             return None
 
     def fetch(self, sha1, fetchData=True):
-        if self.__db:
-            cache = self.__db.storage["Repository"]
-            cached_object = cache.get("object:" + sha1)
-            if cached_object:
-                self.__db.recordProfiling("fetch: " + cached_object.type + " (cached)", 0)
-                return cached_object
+        cached_object = self.__getCachedObject(sha1)
+        if cached_object:
+            return cached_object
 
         before = time.time()
 
+        git_object = self.__readFromPack(sha1, fetchData)
+        if git_object:
+            after = time.time()
+            self.__cacheObject(git_object, fetchData)
+            if self.__db:
+                self.__db.recordProfiling("fetch: " + git_object.type, after - before)
+            return git_object
+
         if fetchData:
             self.__startBatch()
-            stdin, stdout = self.__batch.stdin, self.__batch.stdout
+            batch = self.__batch
         else:
             self.__startBatchCheck()
-            stdin, stdout = self.__batchCheck.stdin, self.__batchCheck.stdout
+            batch = self.__batchCheck
 
-        try: stdin.write(sha1 + '\n')
-        except: raise GitError("failed when writing to 'git cat-file' stdin: %s" % stdout.read())
+        try:
+            batch.stdin.write(sha1 + '\n')
+            batch.stdin.flush()
+        except:
+            batch.broken = True
+            raise GitError("failed when writing to 'git cat-file' stdin: %s" % batch.stdout.read())
 
-        line = stdout.readline()
+        try:
+            git_object = batch.readObject(sha1)
+        except:
+            # The process is in an unknown state; make sure it isn't reused.
+            batch.broken = True
+            raise
 
-        if line == ("%s missing\n" % sha1):
+        if git_object is None:
             raise GitReferenceError("%s missing from %s" % (sha1[:8], self.path), sha1=sha1, repository=self)
 
-        try: sha1, type, size = line.split()
-        except: raise GitError("unexpected output from 'git cat-file --batch': %s" % line)
+        after = time.time()
+
+        self.__cacheObject(git_object, fetchData)
 
-        size = int(size)
+        if self.__db:
+            self.__db.recordProfiling("fetch: " + git_object.type, after - before)
 
-        if fetchData:
-            data = stdout.read(size)
-            stdout.read(1)
+        return git_object
+
+    def fetchMany(self, sha1s, fetchData=True):
+        """Fetch several objects, yielding GitObject objects in order
+
+           Unlike calling fetch() repeatedly, all object names are written to
+           'git cat-file' up front (from a separate thread) and the objects are
+           parsed as they are streamed back, so the whole sequence costs one
+           round-trip instead of one per object.  Objects already cached are
+           yielded without involving Git.
+
+           A separate 'git cat-file' process is used, so it is safe to call
+           fetch() while iterating.  With the "packfile" object backend, only
+           objects not found in pack files are requested from Git."""
+
+        sha1s = list(sha1s)
+
+        # Decide up front which objects to request, so that the stream of
+        # objects stays in sync even if the cache changes while iterating.
+        cached_objects = map(self.__getCachedObject, sha1s)
+
+        if self.__backend == "packfile":
+            reader = self.__getPackReader()
+            packed = set(sha1 for sha1, cached_object in zip(sha1s, cached_objects)
+                         if not cached_object and reader.contains(sha1))
         else:
-            data = None
+            packed = set()
 
-        git_object = GitObject(sha1, type, size, data)
+        requested = [sha1 for sha1, cached_object in zip(sha1s, cached_objects)
+                     if not cached_object and sha1 not in packed]
 
-        after = time.time()
+        remaining = len(requested)
 
-        if not self.__cacheDisabled and (type != "blob" or self.__cacheBlobs):
-            cache["object:" + sha1] = git_object
+        if remaining:
+            batch = BATCH_POOL.checkout(self.path, check=not fetchData)
+            objects = batch.readObjects(requested)
+        else:
+            batch = None
 
-        if self.__db:
-            self.__db.recordProfiling("fetch: " + type, after - before)
+        try:
+            for sha1, cached_object in zip(sha1s, cached_objects):
+                if cached_object:
+                    yield cached_object
+                    continue
 
-        return git_object
+                if sha1 in packed:
+                    # Falls back to 'git cat-file' if the pack reader fails.
+                    yield self.fetch(sha1, fetchData)
+                    continue
+
+                before = time.time()
+
+                _, git_object = next(objects)
+
+                remaining -= 1
+                if not remaining:
+                    # Return the process to the pool right away, rather than
+                    # when this generator is finished or garbage collected.
+                    objects.close()
+                    BATCH_POOL.checkin(batch)
+                    batch = None
+
+                if git_object is None:
+                    raise GitReferenceError("%s missing from %s" % (sha1[:8], self.path), sha1=sha1, repository=self)
+
+                after = time.time()
+
+                self.__cacheObject(git_object, fetchData)
+
+                if self.__db:
+                    self.__db.recordProfiling("fetch: " + git_object.type, after - before)
+
+                yield git_object
+        finally:
+            if batch:
+                objects.close()
+                BATCH_POOL.checkin(batch)
+
+    def __getPackReader(self):
+        return packfile.get(self.path, configuration.limits.GIT_DELTA_BASE_CACHE_SIZE)
+
+    def __readFromPack(self, sha1, fetchData):
+        # Returns None if the object should be read using 'git cat-file'
+        # instead: if the "packfile" backend isn't used, or if the object is
+        # loose, in an alternate object store, or otherwise unreadable here.
+        if self.__backend != "packfile":
+            return None
+        try:
+            result = self.__getPackReader().read(sha1, fetchData)
+        except (EnvironmentError, ValueError, zlib.error, packfile.PackError):
+            return None
+        if result is None:
+            return None
+        object_type, size, data = result
+        return GitObject(sha1, object_type, size, data)
+
+    def __getCachedObject(self, sha1):
+        if self.__cacheDisabled:
+            return None
+        cached_object = OBJECT_CACHE.get(self.path, sha1)
+        if cached_object and self.__db:
+            self.__db.recordProfiling("fetch: " + cached_object.type + " (cached)", 0)
+        return cached_object
+
+    def __cacheObject(self, git_object, fetchData):
+        # Objects fetched without data are never cached, since a later fetch()
+        # with data would otherwise return the data-less object.  Blobs are
+        # only cached on request, since most blobs are read once per request
+        # and would just push commits and trees out of the cache.
+        if fetchData and not self.__cacheDisabled \
+                and (git_object.type != "blob" or self.__cacheBlobs):
+            evicted = OBJECT_CACHE.add(self.path, git_object)
+            if evicted and self.__db:
+                self.__db.recordProfiling("object cache: %s evicted" % git_object.type,
+                                          0, repetitions=evicted)
 
     def run(self, command, *arguments, **kwargs):
         return self.runCustom(self.path, command, *arguments, **kwargs)
@@ -388,11 +903,7 @@ class Repository:
         stdin_data = kwargs.get("input")
         if stdin_data is None: stdin = None
         else: stdin = subprocess.PIPE
-        env = {}
-        env.update(os.environ)
-        env.update(configuration.executables.GIT_ENV)
-        env.update(kwargs.get("env", {}))
-        if "GIT_DIR" in env: del env["GIT_DIR"]
+        env = Repository.__environment(kwargs.get("env", {}))
         git = subprocess.Popen(argv, stdin=stdin, stdout=subprocess.PIPE,
                                stderr=subprocess.PIPE, cwd=cwd, env=env)
         stdout, stderr = git.communicate(stdin_data)
@@ -409,6 +920,47 @@ class Repository:
         else:
             return git.returncode, stdout, stderr
 
+    def runLines(self, command, *arguments):
+        """Run a Git command, yielding its output one line at a time
+
+           Lines are yielded (without their linebreaks) as Git produces them,
+           so the whole output is never held in memory.  If Git fails, a
+           GitCommandError is raised once its output has been consumed."""
+
+        argv = [configuration.executables.GIT, command]
+        argv.extend(arguments)
+        env = Repository.__environment({})
+
+        with tempfile.TemporaryFile() as stderr:
+            git = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=stderr,
+                                   cwd=self.path, env=env)
+
+            try:
+                for line in git.stdout:
+                    if line.endswith("\n"):
+                        line = line[:-1]
+                    yield line
+                git.wait()
+            finally:
+                if git.returncode is None:
+                    # Abandoned before all output was read.
+                    git.kill()
+                    git.wait()
+                git.stdout.close()
+
+            if git.returncode != 0:
+                stderr.seek(0)
+                raise GitCommandError(" ".join(argv), stderr.read().strip(), self.path)
+
+    @staticmethod
+    def __environment(extra):
+        env = {}
+        env.update(os.environ)
+        env.update(configuration.executables.GIT_ENV)
+        env.update(extra)
+        if "GIT_DIR" in env: del env["GIT_DIR"]
+        return env
+
     def createBranch(self, name, startpoint):
         argv = [configuration.executables.GIT, 'branch', name, startpoint]
         git = subprocess.Popen(argv, stdout=subprocess.PIPE,
@@ -445,6 +997,15 @@ class Repository:
 
         assert len(sha1s) >= 2
 
+        if len(sha1s) == 2:
+            graph = self.getCommitGraph()
+            if graph and sha1s[0] in graph and sha1s[1] in graph:
+                mergebases = graph.mergeBases(*sha1s)
+                # If there are several equally good merge bases, let Git pick
+                # one, so that we're consistent with what it would have said.
+                if len(mergebases) == 1:
+                    return mergebases[0]
+
         argv = [configuration.executables.GIT, 'merge-base'] + sha1s
         git = subprocess.Popen(argv, stdout=subprocess.PIPE,
                                stderr=subprocess.PIPE, cwd=self.path)
@@ -455,6 +1016,10 @@ class Repository:
             output = stderr.strip()
             raise GitCommandError(cmdline, output, self.path)
 
+    def getCommitGraph(self):
+        """Return the repository's commit graph index, or None if not built"""
+        return commitgraph.get(self)
+
     def getCommonAncestor(self, commit_or_commits):
         try: sha1s = commit_or_commits.parents
         except: sha1s = list(commit_or_commits)
@@ -1008,9 +1573,10 @@ class Commit:
         self.committer = committer
         self.message = message
         self.tree = tree
-        self.__treeCache = {}
 
     def __cache(self, db):
+        if not db:
+            return
         cache = db.storage["Commit"]
         if self.id: cache[self.id] = self
         cache[self.sha1] = self
@@ -1129,6 +1695,10 @@ class Commit:
         else:
             other_sha1 = str(other)
 
+        graph = self.repository.getCommitGraph()
+        if graph and self.sha1 in graph and other_sha1 in graph:
+            return graph.isAncestor(self.sha1, other_sha1)
+
         try:
             mergebase_sha1 = self.repository.mergebase([self.sha1, other_sha1])
         except GitCommandError:
@@ -1140,16 +1710,10 @@ class Commit:
             return mergebase_sha1 == self.sha1
 
     def getTree(self, path):
-        path = "/" + path.lstrip("/")
-        if path not in self.__treeCache:
-            self.__treeCache[path] = Tree.fromPath(self, path)
-        return self.__treeCache[path]
+        return Tree.fromPath(self, "/" + path.lstrip("/"))
 
     def getFileEntry(self, path):
-        tree = self.getTree(os.path.dirname(path))
-        if tree is None:
-            return None
-        return tree.get(os.path.basename(path))
+        return Tree.resolvePath(self, path)
 
     def getFileSHA1(self, path):
         entry = self.getFileEntry(path)
@@ -1160,10 +1724,6 @@ class Commit:
     def isDirectory(self, path):
         return self.getTree(path) is not None
 
-RE_LSTREE_LINE = re.compile(
-    "(?P<mode>[0-9]{6}) (?P<type>blob|tree|commit) (?P<sha1>[0-9a-f]{40}) +"
-    "(?P<size>[0-9]+|-)\t(?P<quote>[\"']?)(?P<name>.*)(?P=quote)$")
-
 class Tree:
     class Entry:
         class Mode(int):
@@ -1183,9 +1743,8 @@ class Tree:
                     return string + flags[(self & 0700) >> 6] + flags[(self & 070) >> 3] + flags[self & 07]
 
         def __init__(self, name, mode, type, sha1, size):
-            if len(name) > 2 and name[0] in ('"', "'") and name[-1] == name[0]:
-                name = diff.parse.demunge(name[1:-1])
-
+            # Names come from raw tree objects (see Tree.parse()), where they
+            # are never quoted, unlike in the output of 'git ls-tree'.
             self.name = name
             self.mode = Tree.Entry.Mode(mode)
             self.type = type
@@ -1223,68 +1782,133 @@ class Tree:
         return self.__entries_dict.get(key, default)
 
     @staticmethod
-    def fromPath(commit, path):
-        assert path[0] == "/"
+    def parse(data):
+        """Parse raw tree object data into a list of (mode, name, sha1)"""
 
-        if path == "/":
-            what = commit.sha1
-        else:
-            if path[-1] != "/": path += "/"
-            what = "%s:%s" % (commit.sha1, path[1:])
-
-        entries = []
+        offset = 0
+        parsed = []
 
-        try:
-            lstree_output = commit.repository.run("ls-tree", "-l", what)
-        except GitCommandError as error:
-            if error.output == "fatal: Not a valid object name %s" % what:
-                return None
-            raise
+        while offset < len(data):
+            space = data.index(" ", offset)
+            null = data.index("\0", space + 1)
 
-        for line in lstree_output.splitlines():
-            match = RE_LSTREE_LINE.match(line)
+            mode = data[offset:space]
+            name = data[space + 1:null]
 
-            assert match, "Unexpected output from 'git ls-tree': %r" % line
+            sha1_binary = data[null + 1:null + 21]
+            sha1 = "".join([("%02x" % ord(c)) for c in sha1_binary])
 
-            name = match.group("name")
-            if match.group("quote"):
-                name = diff.parse.demunge(name)
+            parsed.append((mode, name, sha1))
 
-            if match.group("type") == "blob":
-                size = int(match.group("size"))
-            else:
-                size = None
+            offset = null + 21
 
-            entries.append(Tree.Entry(name=name,
-                                      mode=match.group("mode"),
-                                      type=match.group("type"),
-                                      sha1=match.group("sha1"),
-                                      size=size))
+        return parsed
 
-        return Tree(entries)
+    @staticmethod
+    def fromSHA1s(repository, sha1s):
+        """Return a list of Tree objects, one per tree SHA-1 in 'sha1s'
+
+           Trees are looked up in (and added to) the process-wide TREE_CACHE.
+           Trees not cached are fetched with one pipelined fetch, and the sizes
+           of all blobs in them with another."""
+
+        trees = [TREE_CACHE.get((repository.path, sha1)) for sha1 in sha1s]
+        missing = [sha1 for sha1, tree in zip(sha1s, trees) if tree is None]
+
+        if missing:
+            parsed = dict((git_object.sha1, Tree.parse(git_object.data))
+                          for git_object in repository.fetchMany(missing))
+
+            blob_sha1s = set()
+            for items in parsed.values():
+                for mode, _, sha1 in items:
+                    if Tree.typeFromMode(mode) == "blob":
+                        blob_sha1s.add(sha1)
+            blob_sha1s = list(blob_sha1s)
+
+            sizes = dict((sha1, git_object.size)
+                         for sha1, git_object
+                         in zip(blob_sha1s, repository.fetchMany(blob_sha1s, fetchData=False)))
+
+            for index, sha1 in enumerate(sha1s):
+                if trees[index] is None:
+                    entries = []
+                    for mode, name, entry_sha1 in parsed[sha1]:
+                        entry_type = Tree.typeFromMode(mode)
+                        entries.append(Tree.Entry(name, mode, entry_type, entry_sha1,
+                                                  sizes.get(entry_sha1)))
+                    trees[index] = Tree(entries)
+                    TREE_CACHE.add((repository.path, sha1), trees[index])
+
+        return trees
 
     @staticmethod
     def fromSHA1(repository, sha1):
-        data = repository.fetch(sha1).data
-        entries = []
+        return Tree.fromSHA1s(repository, [sha1])[0]
 
-        while len(data):
-            space = data.index(" ")
-            null = data.index("\0", space + 1)
+    @staticmethod
+    def typeFromMode(mode):
+        mode = int(mode, 8)
+        if stat.S_ISDIR(mode):
+            return "tree"
+        elif mode == 0160000:
+            return "commit"
+        else:
+            return "blob"
 
-            mode = data[:space]
-            name = data[space + 1:null]
+    @staticmethod
+    def fromPath(commit, path):
+        assert path[0] == "/"
 
-            sha1_binary = data[null + 1:null + 21]
-            sha1 = "".join([("%02x" % ord(c)) for c in sha1_binary])
+        return Tree.resolvePath(commit, path, directory=True)
+
+    @staticmethod
+    def resolvePath(commit, path, directory=False):
+        """Resolve a path in a commit's tree
 
-            entry_object = repository.fetch(sha1, fetchData=False)
+           Returns the path's Tree.Entry (or the Tree object, if 'directory' is
+           true), or None if there is no such file (or directory.)
 
-            entries.append(Tree.Entry(name, mode, entry_object.type, sha1, entry_object.size))
+           Resolved directories are remembered across requests in PATH_CACHE,
+           keyed by the commit's root tree, so only the trees of directories
+           not resolved before in the same tree need to be read."""
 
-            data = data[null + 21:]
+        repository = commit.repository
+        path = "/".join(filter(None, path.split("/")))
 
-        return Tree(entries)
+        def lookupDirectory(directory):
+            # Returns the directory's tree SHA-1, or None.
+            if not directory:
+                return commit.tree
+
+            key = (repository.path, commit.tree, directory)
+            sha1 = PATH_CACHE.get(key, False)
+
+            if sha1 is False:
+                sha1 = None
+                parent_sha1 = lookupDirectory(os.path.dirname(directory))
+                if parent_sha1 is not None:
+                    entry = Tree.fromSHA1(repository, parent_sha1).get(
+                        os.path.basename(directory))
+                    if entry and entry.type == "tree":
+                        sha1 = entry.sha1
+                PATH_CACHE.add(key, sha1)
+
+            return sha1
+
+        if directory:
+            sha1 = lookupDirectory(path)
+            if sha1 is None:
+                return None
+            return Tree.fromSHA1(repository, sha1)
+
+        if not path:
+            return None
+
+        parent_sha1 = lookupDirectory(os.path.dirname(path))
+        if parent_sha1 is None:
+            return None
+        return Tree.fromSHA1(repository, parent_sha1).get(os.path.basename(path))
 
 def getTaggedCommit(repository, sha1):
     """Returns the SHA-1 of the tagged commit.
@@ -1303,7 +1927,40 @@ def getTaggedCommit(repository, sha1):
 
         sha1 = git_object.data.split("\n", 1)[0].split(" ", 1)[-1]
 
+def getTaggedCommits(repository, sha1s):
+    """Returns a dictionary mapping each SHA-1 sum to the tagged commit.
+
+       Like getTaggedCommit(), but reads the objects of all the SHA-1 sums
+       with one 'git cat-file' round-trip (per level of tags of tags.)  Sums
+       that don't reference a commit are mapped to None."""
+
+    tagged = {}
+    current = dict((sha1, sha1) for sha1 in sha1s)
+
+    while current:
+        sha1s = list(current)
+        following = {}
+
+        for sha1, git_object in zip(sha1s, repository.fetchMany(current[sha1] for sha1 in sha1s)):
+            if git_object.type == "commit":
+                tagged[sha1] = current[sha1]
+            elif git_object.type == "tag":
+                following[sha1] = git_object.data.split("\n", 1)[0].split(" ", 1)[-1]
+            else:
+                tagged[sha1] = None
+
+        current = following
+
+    return tagged
+
 class Blame:
+    """Line-by-line blame of files between two commits
+
+       The first time a file is blamed between a given pair of commits, the
+       whole file is blamed, and the result is stored in an in-process cache
+       and on disk (under BLAME_CACHE_DIR), so that blaming other ranges of
+       the same file, now or in later requests, doesn't run Git again."""
+
     def __init__(self, from_commit, to_commit):
         assert from_commit.repository == to_commit.repository
 
@@ -1313,51 +1970,124 @@ class Blame:
         self.commits = []
         self.__commit_ids = {}
 
-    def blame(self, db, path, first_line, last_line):
+    def __cachePath(self, path):
+        key = hashlib.sha1("\0".join([self.repository.path,
+                                       self.from_commit.sha1,
+                                       self.to_commit.sha1,
+                                       path])).hexdigest()
+        return os.path.join(BLAME_CACHE_DIR, key[:2], key[2:] + ".json")
+
+    def __blameFile(self, path):
+        # Returns a dictionary with the keys "commits", a list of
+        # [sha1, author name, author email], and "lines", a list containing
+        # for each line in the file an index into "commits".
         output = self.repository.run("blame",
                                      "--porcelain",
-                                     "-L", "%d,%d" % (first_line, last_line),
                                      "%s..%s" % (self.from_commit.sha1, self.to_commit.sha1),
                                      "--", path)
 
         inlines = iter(output.splitlines())
+        commits = []
+        commit_indices = {}
         lines = []
 
         try:
             while True:
-                sha1, original_line, current_line = inlines.next().split(" ")[:3]
-
-                original_line = int(original_line)
-                current_line = int(current_line)
+                sha1 = inlines.next().split(" ")[0]
 
                 author = None
                 author_email = None
 
                 line = inlines.next()
                 while not line.startswith("\t"):
-                    if line.startswith("author "): author = line[7:]
-                    elif line.startswith("author-mail "): author_email = line[13:-1]
-                    elif line.startswith("summary "): pass
+                    # Decoded, so that the result can be stored as JSON even if
+                    # the name or email isn't valid UTF-8.
+                    if line.startswith("author "): author = textutils.decode(line[7:])
+                    elif line.startswith("author-mail "): author_email = textutils.decode(line[13:-1])
                     line = inlines.next()
 
-                if sha1 not in self.__commit_ids:
-                    commit = Commit.fromSHA1(db, self.repository, sha1)
-
-                    self.__commit_ids[sha1] = len(self.commits)
-                    self.commits.append({ "sha1": sha1,
-                                          "author_name": author,
-                                          "author_email": author_email,
-                                          "summary": commit.niceSummary(),
-                                          "message": commit.message,
-                                          "original": sha1 == self.from_commit.sha1,
-                                          "current": sha1 == self.to_commit.sha1 })
+                if sha1 not in commit_indices:
+                    commit_indices[sha1] = len(commits)
+                    commits.append([sha1, author, author_email])
 
-                lines.append({ "offset": current_line,
-                               "commit": self.__commit_ids[sha1] })
+                lines.append(commit_indices[sha1])
         except StopIteration:
             pass
 
-        return lines
+        return { "commits": commits, "lines": lines }
+
+    def __getFileBlame(self, db, path):
+        key = (self.repository.path, self.from_commit.sha1, self.to_commit.sha1, path)
+
+        file_blame = BLAME_CACHE.get(key)
+        if file_blame:
+            if db: db.recordProfiling("blame (cached)", 0)
+            return file_blame
+
+        cache_path = self.__cachePath(path)
+
+        try:
+            with open(cache_path) as cache_file:
+                file_blame = textutils.json_decode(cache_file.read())
+        except (IOError, ValueError):
+            before = time.time()
+            file_blame = self.__blameFile(path)
+            if db: db.recordProfiling("blame", time.time() - before)
+
+            temporary_path = "%s.%d" % (cache_path, os.getpid())
+
+            try:
+                if not os.path.isdir(os.path.dirname(cache_path)):
+                    os.makedirs(os.path.dirname(cache_path), 0750)
+                with open(temporary_path, "w") as cache_file:
+                    cache_file.write(textutils.json_encode(file_blame))
+                os.rename(temporary_path, cache_path)
+            except (IOError, OSError, ValueError, UnicodeError):
+                # Failing to store the result is not a problem; we'll just have
+                # to blame again in a later request.
+                try: os.unlink(temporary_path)
+                except OSError: pass
+        else:
+            if db: db.recordProfiling("blame (cached on disk)", 0)
+
+            # Keep it from being purged by the maintenance service.
+            try: os.utime(cache_path, None)
+            except OSError: pass
+
+        BLAME_CACHE.add(key, file_blame)
+        return file_blame
+
+    def blame(self, db, path, first_line, last_line):
+        file_blame = self.__getFileBlame(db, path)
+        file_commits = file_blame["commits"]
+        indices = file_blame["lines"][first_line - 1:last_line]
+
+        # Fetch all commits not seen before with one round-trip to Git.
+        new_commits = []
+        for index in indices:
+            sha1 = file_commits[index][0]
+            if sha1 not in self.__commit_ids:
+                self.__commit_ids[sha1] = None
+                new_commits.append(file_commits[index])
+
+        new_sha1s = [sha1 for sha1, _, _ in new_commits]
+
+        for (sha1, author, author_email), gitobject \
+                in zip(new_commits, self.repository.fetchMany(new_sha1s)):
+            commit = Commit.fromGitObject(db, self.repository, gitobject)
+
+            self.__commit_ids[sha1] = len(self.commits)
+            self.commits.append({ "sha1": sha1,
+                                  "author_name": author,
+                                  "author_email": author_email,
+                                  "summary": commit.niceSummary(),
+                                  "message": commit.message,
+                                  "original": sha1 == self.from_commit.sha1,
+                                  "current": sha1 == self.to_commit.sha1 })
+
+        return [{ "offset": first_line + offset,
+                  "commit": self.__commit_ids[file_commits[index][0]] }
+                for offset, index in enumerate(indices)]
 
 class FetchCommits(threading.Thread):
     def __init__(self, repository, sha1s):
@@ -1373,37 +2103,28 @@ class FetchCommits(threading.Thread):
         self.start()
 
     def run(self):
-        try:
-            batch = subprocess.Popen(
-                [configuration.executables.GIT, 'cat-file', '--batch'],
-                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT, cwd=self.repository.path)
-
-            stdout, stderr = batch.communicate("\n".join(self.sha1s.keys()) + "\n")
+        batch = BATCH_POOL.checkout(self.repository.path)
 
+        try:
+            sha1s = self.sha1s.keys()
+            objects = batch.readObjects(sha1s)
             gitobjects = []
 
-            for sha1, commit_id in self.sha1s.items():
-                line, stdout = stdout.split("\n", 1)
-
-                try:
-                    object_sha1, object_type, object_size = line.split(" ")
-                except ValueError:
-                    raise SyntaxError("unexpected line: %r" % line)
-
-                assert object_sha1 == sha1, "%s != %s" % (object_sha1, sha1)
-                assert object_type == "commit"
-
-                object_size = int(object_size)
-
-                object_data = stdout[:object_size]
-                stdout = stdout[object_size + 1:]
+            try:
+                for sha1, gitobject in objects:
+                    assert gitobject is not None, "%s missing" % sha1
+                    assert gitobject.sha1 == sha1, "%s != %s" % (gitobject.sha1, sha1)
+                    assert gitobject.type == "commit"
 
-                gitobjects.append((GitObject(object_sha1, object_type, object_size, object_data), commit_id))
+                    gitobjects.append((gitobject, self.sha1s[sha1]))
+            finally:
+                objects.close()
 
             self.gitobjects = gitobjects
         except Exception:
             self.error = traceback.format_exc()
+        finally:
+            BATCH_POOL.checkin(batch)
 
     def getCommits(self, db):
         self.join()
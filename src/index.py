@@ -15,6 +15,7 @@
 # the License.
 
 import sys
+import cStringIO
 
 from subprocess import Popen as process, PIPE
 from re import compile, split
@@ -25,7 +26,9 @@ from os import getuid
 import gitutils
 from log.commitset import CommitSet
 
+import base
 import dbutils
+import changeset.utils as changeset_utils
 import reviewing.utils
 import reviewing.mail
 import reviewing.rebase
@@ -75,20 +78,33 @@ db = None
 class IndexException(Exception):
     pass
 
-def processCommits(repository_name, sha1):
+# Number of rows per set-based query when looking up commits.
+QUERY_BATCH_SIZE = 10000
+
+# Pushes adding at least this many new commits report progress to the client.
+PROGRESS_THRESHOLD = 1000
+
+def batches(items, size):
+    for offset in xrange(0, len(items), size):
+        yield items[offset:offset + size]
+
+def processCommits(repository_name, sha1s, progress=None):
+    """Add commits reachable from the pushed SHA-1s to the database
+
+       The commits of all pushed refs are listed with a single walk of the
+       commit graph.  Returns a list of (sha1, parents) tuples for the new
+       commits."""
+
     repository = gitutils.Repository.fromName(db, repository_name)
 
     if not repository: raise IndexException("No such repository: %r" % repository_name)
 
-    sha1 = repository.run("rev-parse", "--verify", "--quiet", sha1 + "^{commit}").strip()
+    if not sha1s:
+        return []
 
-    stack = []
-    edges_values = []
+    sha1s = repository.run("rev-parse", *[sha1 + "^{commit}" for sha1 in sha1s]).split()
 
     cursor = db.cursor()
-    cursor.execute("SELECT 1 FROM commits LIMIT 1")
-    emptydb = cursor.fetchone() is None
-
     cursor.execute("""SELECT commits.sha1
                         FROM commits
                         JOIN branches ON (branches.head=commits.id)
@@ -98,9 +114,17 @@ def processCommits(repository_name, sha1):
                     ORDER BY branches.id ASC""",
                    (repository.id,))
 
+    def countCommits(base_sha1, heads):
+        revisions = ["^" + base_sha1] + heads
+        return int(repository.run("rev-list", "--count", "--stdin",
+                                  input="\n".join(revisions) + "\n").strip())
+
     try:
         base_sha1 = cursor.fetchone()[0]
-        count = int(repository.run("rev-list", "--count", "%s..%s" % (base_sha1, sha1)).strip())
+        count = countCommits(base_sha1, sha1s)
+        if count > configuration.limits.PUSH_COMMIT_LIMIT and len(sha1s) > 1:
+            # The limit applies to each pushed ref separately.
+            count = max(countCommits(base_sha1, [sha1]) for sha1 in sha1s)
     except:
         count = 0
 
@@ -109,51 +133,162 @@ def processCommits(repository_name, sha1):
 You're trying to add %d new commits to this repository.  Are you
 perhaps pushing to the wrong repository?""" % count)
 
-    commits_values = []
-    commits = set()
+    def findExisting(sha1s):
+        existing = set()
+        for batch in batches(list(sha1s), QUERY_BATCH_SIZE):
+            cursor.execute("SELECT sha1 FROM commits WHERE sha1=ANY (%s)", (batch,))
+            existing.update(existing_sha1 for (existing_sha1,) in cursor)
+        return existing
+
+    def listNewCommits(excluded):
+        # List the candidate new commits, and their parents, with a single
+        # 'git rev-list', and filter out those already in the database (for
+        # instance because they are in another repository.)  Returns None if
+        # some parent of a new commit is neither new nor in the database.
+        revisions = sha1s + ["^" + excluded_sha1 for excluded_sha1 in excluded]
+        output = repository.run("rev-list", "--parents", "--stdin", "--ignore-missing",
+                                input="\n".join(revisions) + "\n")
+        candidates = [line.split() for line in output.splitlines()]
+        existing = findExisting(items[0] for items in candidates)
+        new_sha1s = [items[0] for items in candidates if items[0] not in existing]
+        parents = set()
+        for items in candidates:
+            if items[0] not in existing:
+                parents.update(items[1:])
+        parents -= set(new_sha1s)
+        if len(findExisting(parents)) != len(parents):
+            return None
+        return new_sha1s
 
-    while True:
-        if sha1 not in commits:
-            commit = gitutils.Commit.fromSHA1(db, repository, sha1)
+    # Exclude everything reachable from the heads of the repository's
+    # branches, whose commits should all have been processed already.  If
+    # that turns out not to be the case, list all commits instead.
+    cursor.execute("""SELECT DISTINCT commits.sha1
+                        FROM commits
+                        JOIN branches ON (branches.head=commits.id)
+                       WHERE branches.repository=%s""",
+                   (repository.id,))
 
-            if commit.author.email: author_id = commit.author.getGitUserId(db)
-            else: author_id = 0
+    new_sha1s = listNewCommits([head_sha1 for (head_sha1,) in cursor])
+
+    if new_sha1s is None:
+        new_sha1s = listNewCommits([])
+
+    if not new_sha1s:
+        return []
+
+    if len(new_sha1s) < PROGRESS_THRESHOLD:
+        progress = None
+    if progress:
+        progress("Indexing %d new commits ..." % len(new_sha1s))
+
+    # Read the commits with one pipelined 'git cat-file' run.
+    new_commits = {}
+    commits = []
+    users = set()
+
+    for index, gitobject in enumerate(repository.fetchMany(new_sha1s)):
+        commit = gitutils.Commit.fromGitObject(None, repository, gitobject)
+        commits.append((commit.sha1, commit.parents, commit.author, commit.committer))
+        new_commits[commit.sha1] = commit.parents
+
+        for user in (commit.author, commit.committer):
+            if user.email:
+                users.add((user.name, user.email))
+
+        if progress and (index + 1) % (len(new_sha1s) // 10 or 1) == 0:
+            progress("  read %d/%d commits" % (index + 1, len(new_sha1s)))
+
+    # Look up (or insert) all authors and committers.
+    def findGitUsers(wanted):
+        found = {}
+        emails = list(set(email for _, email in wanted))
+        for batch in batches(emails, QUERY_BATCH_SIZE):
+            cursor.execute("""SELECT id, fullname, email
+                                FROM gitusers
+                               WHERE email=ANY (%s)""",
+                           (batch,))
+            for gituser_id, fullname, email in cursor:
+                if (fullname, email) in wanted:
+                    found[(fullname, email)] = gituser_id
+        return found
+
+    gituser_ids = findGitUsers(users)
+    missing_users = users - set(gituser_ids)
+
+    if missing_users:
+        cursor.executemany("""INSERT INTO gitusers (fullname, email)
+                                   VALUES (%s, %s)""",
+                           list(missing_users))
+        gituser_ids.update(findGitUsers(missing_users))
+
+    def gitUserId(user):
+        if user.email: return gituser_ids[(user.name, user.email)]
+        else: return 0
+
+    commits_data = cStringIO.StringIO()
+    for commit_sha1, _, author, committer in commits:
+        commits_data.write("%s\t%d\t%d\t%s\t%s\n" % (commit_sha1,
+                                                     gitUserId(author),
+                                                     gitUserId(committer),
+                                                     timestamp(author.time),
+                                                     timestamp(committer.time)))
+    commits_data.seek(0)
+
+    cursor.copy_from(commits_data, "commits",
+                     ("sha1", "author_gituser", "commit_gituser", "author_time", "commit_time"))
+
+    # Look up the ids of the new commits and of their parents, and insert the
+    # edges between them.
+    commit_ids = {}
+    involved = set(new_sha1s)
+    for _, parents, _, _ in commits:
+        involved.update(parents)
+    for batch in batches(list(involved), QUERY_BATCH_SIZE):
+        cursor.execute("SELECT id, sha1 FROM commits WHERE sha1=ANY (%s)", (batch,))
+        commit_ids.update((commit_sha1, commit_id) for commit_id, commit_sha1 in cursor)
+
+    edges_data = cStringIO.StringIO()
+    for commit_sha1, parents, _, _ in commits:
+        for parent_sha1 in set(parents):
+            edges_data.write("%d\t%d\n" % (commit_ids[parent_sha1], commit_ids[commit_sha1]))
+    edges_data.seek(0)
+
+    cursor.copy_from(edges_data, "edges", ("parent", "child"))
 
-            if commit.committer.email: committer_id = commit.committer.getGitUserId(db)
-            else: committer_id = 0
+    db.commit()
 
-            if emptydb: row = None
-            else:
-                cursor.execute("SELECT id FROM commits WHERE sha1=%s", (commit.sha1,))
-                row = cursor.fetchone()
-                new_commit = False
+    if progress:
+        progress("Indexed %d new commits." % len(new_sha1s))
 
-            if not row:
-                commits_values.append((commit.sha1, author_id, committer_id, timestamp(commit.author.time), timestamp(commit.committer.time)))
-                new_commit = True
+    # Keep the repository's commit graph index (if one has been built) up to
+    # date.  If this fails because some parent commit isn't in it, it is
+    # simply left as is until the maintenance service rebuilds it.
+    graph = repository.getCommitGraph()
+    if graph:
+        graph.append(new_commits)
 
-            commits.add(sha1)
+    return [(new_sha1, new_commits[new_sha1]) for new_sha1 in new_sha1s]
 
-            if new_commit:
-                edges_values.extend([(parent_sha1, commit.sha1) for parent_sha1 in set(commit.parents)])
-                stack.extend(set(commit.parents))
+def prefetchCommits(repository_name, commits):
+    """Request changesets and highlighting for new commits in the background
 
-        if not stack: break
+       Does nothing unless enabled by GITHOOK["prefetch"].  Failures are
+       ignored; the same work is done on demand when needed."""
 
-        sha1 = stack.pop(0)
+    service = configuration.services.GITHOOK
 
-    cursor.executemany("""INSERT INTO commits (sha1, author_gituser, commit_gituser, author_time, commit_time)
-                               VALUES (%s, %s, %s, %s, %s)""",
-                       commits_values)
+    if not commits or not service.get("prefetch", False):
+        return
 
-    cursor.executemany("""INSERT INTO edges (parent, child)
-                               SELECT parents.id, children.id
-                                 FROM commits AS parents,
-                                      commits AS children
-                                WHERE parents.sha1=%s AND children.sha1=%s""",
-                       edges_values)
+    repository = gitutils.Repository.fromName(db, repository_name)
 
-    db.commit()
+    try:
+        changeset_utils.prefetchCommits(repository, commits,
+                                        max_commits=service.get("prefetch_max_commits", 100),
+                                        max_blobs=service.get("prefetch_max_blobs", 1000))
+    except (base.ImplementationError, gitutils.GitError):
+        pass
 
 def init():
     global db
@@ -888,32 +1023,32 @@ def deleteBranch(user_name, repository_name, name, old):
         if user_name != configuration.base.SYSTEM_USER_NAME:
             print "Deleted branch containing %d commit%s." % (ncommits, "s" if ncommits > 1 else "")
 
-def createTag(repository_name, name, sha1):
+def createTags(repository_name, tags):
     repository = gitutils.Repository.fromName(db, repository_name)
 
-    sha1 = gitutils.getTaggedCommit(repository, sha1)
+    tagged = gitutils.getTaggedCommits(repository, [sha1 for _, sha1 in tags])
 
-    if sha1:
-        cursor = db.cursor()
-        cursor.execute("INSERT INTO tags (name, repository, sha1) VALUES (%s, %s, %s)",
-                       (name, repository.id, sha1))
+    cursor = db.cursor()
+    cursor.executemany("INSERT INTO tags (name, repository, sha1) VALUES (%s, %s, %s)",
+                       [(name, repository.id, tagged[sha1])
+                        for name, sha1 in tags if tagged[sha1]])
 
-def updateTag(repository_name, name, old_sha1, new_sha1):
+def updateTags(repository_name, tags):
     repository = gitutils.Repository.fromName(db, repository_name)
 
-    sha1 = gitutils.getTaggedCommit(repository, new_sha1)
+    tagged = gitutils.getTaggedCommits(repository, [new_sha1 for _, _, new_sha1 in tags])
     cursor = db.cursor()
 
-    if sha1:
-        cursor.execute("UPDATE tags SET sha1=%s WHERE name=%s AND repository=%s",
-                       (sha1, name, repository.id))
-    else:
-        cursor.execute("DELETE FROM tags WHERE name=%s AND repository=%s",
-                       (name, repository.id))
+    cursor.executemany("UPDATE tags SET sha1=%s WHERE name=%s AND repository=%s",
+                       [(tagged[new_sha1], name, repository.id)
+                        for name, _, new_sha1 in tags if tagged[new_sha1]])
+    cursor.executemany("DELETE FROM tags WHERE name=%s AND repository=%s",
+                       [(name, repository.id)
+                        for name, _, new_sha1 in tags if not tagged[new_sha1]])
 
-def deleteTag(repository_name, name):
+def deleteTags(repository_name, names):
     repository = gitutils.Repository.fromName(db, repository_name)
 
     cursor = db.cursor()
-    cursor.execute("DELETE FROM tags WHERE name=%s AND repository=%s",
-                   (name, repository.id))
+    cursor.executemany("DELETE FROM tags WHERE name=%s AND repository=%s",
+                       [(name, repository.id) for name in names])
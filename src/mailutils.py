@@ -21,6 +21,7 @@ import email.utils
 
 import configuration
 import dbutils
+from textutils import json_encode, decode
 
 def generateMessageId(index=1):
     now = time.time()
@@ -47,15 +48,20 @@ def queueMail(from_user, to_user, recipients, subject, body, message_id=None,
                                             from_user.name, to_user.name,
                                             message_id)
 
+    def user(user):
+        return { "email": user.email, "fullname": user.fullname }
+
+    # The first line is a JSON object, read by the maildelivery service.  The
+    # subject and body are decoded first, since JSON requires valid UTF-8.
     with open(filename, "w") as file:
-        print >> file, repr({ "message_id": message_id,
-                              "parent_message_id": parent_message_id,
-                              "headers": headers,
-                              "from_user": from_user,
-                              "to_user": to_user,
-                              "recipients": recipients,
-                              "subject": subject,
-                              "body": body })
+        print >> file, json_encode({ "message_id": message_id,
+                                     "parent_message_id": parent_message_id,
+                                     "headers": headers,
+                                     "from_user": user(from_user),
+                                     "to_user": user(to_user),
+                                     "recipients": map(user, recipients),
+                                     "subject": decode(subject),
+                                     "body": decode(body) })
 
     return filename
 
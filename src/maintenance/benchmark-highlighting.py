@@ -0,0 +1,111 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2014 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Measure the throughput of the syntax highlighters, in lines per second, per
+# file and per language.  The input is a directory with one sub-directory per
+# language, named as in syntaxhighlight.LANGUAGES (e.g. "c++" or "python"),
+# containing the files to highlight.  A corpus is included in the source tree,
+# in testing/input/highlight-benchmark/.
+#
+# Usage: python benchmark-highlighting.py [--rounds N] [--language L] <path>
+
+import sys
+import os
+import time
+import argparse
+import StringIO
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), "..")))
+
+import syntaxhighlight.generate
+import textutils
+import progress
+
+parser = argparse.ArgumentParser(description="Benchmark syntax highlighting.")
+parser.add_argument("--rounds", type=int, default=3,
+                    help="number of times to highlight each file (best time is reported)")
+parser.add_argument("--language", action="append",
+                    help="only highlight files in this language (can be repeated)")
+parser.add_argument("path", help="path of directory containing files to highlight")
+
+arguments = parser.parse_args()
+
+files = []
+
+for language in sorted(os.listdir(arguments.path)):
+    directory = os.path.join(arguments.path, language)
+    if not os.path.isdir(directory):
+        continue
+    if arguments.language and language not in arguments.language:
+        continue
+    if not syntaxhighlight.generate.createHighlighter(language):
+        print "%s: not a supported language, skipping" % language
+        continue
+    for filename in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, filename)) as source_file:
+            source = textutils.decode(source_file.read())
+        files.append((language, filename, source))
+
+if not files:
+    print "no files to highlight"
+    sys.exit(1)
+
+def measure(language, source):
+    best = None
+    for _ in range(arguments.rounds):
+        # Create a new highlighter each time, like the highlight service does.
+        highlighter = syntaxhighlight.generate.createHighlighter(language)
+        output = StringIO.StringIO()
+        before = time.time()
+        # Code contexts (C++ only) are generated, but thrown away.
+        highlighter(source, output, os.devnull)
+        duration = time.time() - before
+        if best is None or duration < best:
+            best = duration
+        progress.update()
+    return best
+
+results = []
+
+progress.start(len(files) * arguments.rounds,
+               prefix="Highlighting %d files %d times ..." % (len(files), arguments.rounds))
+
+for language, filename, source in files:
+    lines = source.count("\n")
+    results.append((language, filename, lines, len(source), measure(language, source)))
+
+progress.end(" done.")
+
+def report(language, filename, lines, size, duration):
+    duration = max(duration, 1e-6)
+    print "%-12s %-20s %8d %12.0f %12.2f" % (language, filename, lines,
+                                              lines / duration,
+                                              size / duration / 1024 ** 2)
+
+print
+print "%-12s %-20s %8s %12s %12s" % ("language", "file", "lines", "lines/s", "MB/s")
+
+for result in results:
+    report(*result)
+
+print
+
+for language in sorted(set(result[0] for result in results)):
+    selected = [result for result in results if result[0] == language]
+    report(language, "(total)",
+           sum(result[2] for result in selected),
+           sum(result[3] for result in selected),
+           sum(result[4] for result in selected))
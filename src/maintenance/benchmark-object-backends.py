@@ -0,0 +1,105 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2014 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Compare the throughput of the "cat-file" and "packfile" object backends (see
+# GIT_OBJECT_BACKEND in configuration/limits.py) when fetching the commits,
+# trees and blobs of a repository.
+#
+# Usage: python benchmark-object-backends.py [--rounds N] [--limit N] <path>
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), "..")))
+
+import gitutils
+import progress
+
+BACKENDS = ("cat-file", "packfile")
+
+parser = argparse.ArgumentParser(description="Benchmark Git object backends.")
+parser.add_argument("--rounds", type=int, default=3,
+                    help="number of times to fetch each set of objects (best time is reported)")
+parser.add_argument("--limit", type=int, default=10000,
+                    help="maximum number of objects of each type to fetch")
+parser.add_argument("path", help="path of Git repository")
+
+arguments = parser.parse_args()
+
+repository = gitutils.Repository(path=os.path.abspath(arguments.path))
+
+# Measure the backends, not the object cache.
+repository.disableCache()
+
+commits = repository.run("rev-list", "--all").split()[:arguments.limit]
+trees = []
+blobs = []
+
+for line in repository.run("ls-tree", "-r", "-t", "HEAD").splitlines():
+    mode, object_type, sha1 = line.split("\t", 1)[0].split()
+    if object_type == "tree":
+        trees.append(sha1)
+    elif object_type == "blob":
+        blobs.append(sha1)
+
+trees = trees[:arguments.limit]
+blobs = blobs[:arguments.limit]
+
+def measure(backend, sha1s, fetch):
+    repository.setObjectBackend(backend)
+    best = None
+    for _ in range(arguments.rounds):
+        size = 0
+        before = time.time()
+        for git_object in fetch(sha1s):
+            size += git_object.size
+            progress.update()
+        duration = time.time() - before
+        if best is None or duration < best:
+            best = duration
+    return best, size
+
+def fetchOneByOne(sha1s):
+    for sha1 in sha1s:
+        yield repository.fetch(sha1)
+
+def fetchPipelined(sha1s):
+    return repository.fetchMany(sha1s)
+
+results = []
+
+for object_type, sha1s in (("commit", commits), ("tree", trees), ("blob", blobs)):
+    if not sha1s:
+        continue
+    for method, fetch in (("fetch", fetchOneByOne), ("fetchMany", fetchPipelined)):
+        print
+        progress.start(len(sha1s) * arguments.rounds * len(BACKENDS),
+                       prefix="Fetching %d %ss using %s() ..." % (len(sha1s), object_type, method))
+        for backend in BACKENDS:
+            duration, size = measure(backend, sha1s, fetch)
+            results.append((object_type, method, backend, len(sha1s), size, duration))
+        progress.end(" done.")
+
+print
+print "%-8s %-10s %-10s %8s %12s %12s" % ("type", "method", "backend", "objects", "objects/s", "MB/s")
+
+for object_type, method, backend, count, size, duration in results:
+    duration = max(duration, 1e-6)
+    print "%-8s %-10s %-10s %8d %12.0f %12.2f" % (object_type, method, backend, count,
+                                                  count / duration,
+                                                  size / duration / 1024 ** 2)
@@ -418,6 +418,119 @@ def restart(command, argv):
 
     return 0
 
+def metrics(command, argv):
+    parser = argparse.ArgumentParser(
+        description="Critic administration interface: metrics",
+        prog="criticctl [options] metrics")
+
+    parser.add_argument("--format", choices=("prometheus", "json"),
+                        default="prometheus",
+                        help="Output format [default: prometheus]")
+
+    arguments = parser.parse_args(argv)
+
+    import socket
+
+    import background.metrics
+    import textutils
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        connection.connect(configuration.services.SERVICEMANAGER["address"])
+    except socket.error as error:
+        print >>sys.stderr, "ERROR: Service manager not responding: %s" % error[1]
+        return 1
+
+    connection.send(textutils.json_encode({ "query": "metrics" }))
+    connection.shutdown(socket.SHUT_WR)
+
+    data = ""
+    while True:
+        received = connection.recv(4096)
+        if not received: break
+        data += received
+
+    result = textutils.json_decode(data)
+
+    if result["status"] == "error":
+        print >>sys.stderr, "ERROR: %s" % result["error"]
+        return 1
+
+    if arguments.format == "json":
+        print textutils.json_encode(result["services"], indent=2)
+    else:
+        sys.stdout.write(background.metrics.formatPrometheus(result["services"]))
+
+    return 0
+
+def querystats(command, argv):
+    import querystatistics
+
+    parser = argparse.ArgumentParser(
+        description="Critic administration interface: querystats",
+        prog="criticctl [options] querystats")
+
+    parser.add_argument("--order-by", choices=sorted(querystatistics.ORDER_BY.keys()),
+                        default="total",
+                        help="Order queries by [default: total time]")
+    parser.add_argument("--limit", type=int, default=20,
+                        help="Number of queries to list [default: 20]")
+    parser.add_argument("--context",
+                        help=("Only list queries executed in this context, e.g. "
+                              "'page: showreview' or 'process: highlight'"))
+    parser.add_argument("--reset", action="store_true",
+                        help="Delete all recorded statistics (after listing them)")
+
+    arguments = parser.parse_args(argv)
+
+    entries = querystatistics.fetchReport(
+        db, arguments.order_by, arguments.limit, arguments.context)
+
+    if entries:
+        print querystatistics.formatReport(entries)
+    else:
+        print "No query statistics recorded."
+
+    if arguments.reset:
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM querystatistics")
+        db.commit()
+
+    return 0
+
+def reviewprogress(command, argv):
+    import reviewing.progress
+
+    parser = argparse.ArgumentParser(
+        description="Critic administration interface: reviewprogress",
+        prog="criticctl [options] reviewprogress")
+
+    parser.add_argument("--rebuild", action="store_true",
+                        help=("Recompute the stored progress of the reviews "
+                              "instead of just verifying it"))
+    parser.add_argument("--review", type=int, action="append", dest="review_ids",
+                        metavar="REVIEW_ID",
+                        help="Only process this review [default: all reviews]")
+
+    arguments = parser.parse_args(argv)
+
+    if arguments.rebuild:
+        reviewing.progress.rebuildReviewProgress(db, arguments.review_ids)
+
+    problems = reviewing.progress.verifyReviewProgress(db, arguments.review_ids)
+
+    for problem in problems:
+        print problem
+
+    if problems:
+        print >>sys.stderr, ("ERROR: Stored review progress is incorrect; run "
+                             "'criticctl reviewprogress --rebuild' to fix it.")
+        return 1
+
+    print "Stored review progress is correct."
+    return 0
+
 def main(parser, show_help, command, argv):
     returncode = 0
 
@@ -445,6 +558,12 @@ def main(parser, show_help, command, argv):
             return configtest(command, argv)
         elif command == "restart":
             return restart(command, argv)
+        elif command == "metrics":
+            return metrics(command, argv)
+        elif command == "querystats":
+            return querystats(command, argv)
+        elif command == "reviewprogress":
+            return reviewprogress(command, argv)
         else:
             print >>sys.stderr, "ERROR: Invalid command: %s" % command
             returncode = 1
@@ -465,6 +584,10 @@ Available commands are:
 
   configtest Test system configuration.
   restart    Restart host web server and Critic's background services.
+  metrics    Output metrics of Critic's background services.
+  querystats List the database queries that take the most time.
+  reviewprogress
+             Verify (or rebuild) the stored progress of reviews.
 
 Use 'criticctl COMMAND --help' to see per command options."""
 
@@ -16,6 +16,7 @@
 
 import dbutils
 import profiling
+import reviewing.progress
 
 from operation import Operation, OperationResult, Optional
 from reviewing.comment import CommentChain, createCommentChain, createComment
@@ -438,6 +439,10 @@ class SubmitChanges(Operation):
         if not cursor.fetchone():
             cursor.execute("INSERT INTO reviewusers (review, uid) VALUES (%s, %s)", (review.id, user.id))
 
+        reviewing.progress.updateReviewProgress(db, [review.id])
+
+        profiler.check("reviewprogress")
+
         generate_emails = profiler.start("generate emails")
 
         is_accepted = review.state == "open" and review.accepted(db)
@@ -18,6 +18,7 @@ import itertools
 
 import dbutils
 import mailutils
+import reviewing.progress
 import reviewing.utils
 
 from operation import Operation, OperationResult
@@ -108,6 +109,8 @@ class SetAssignedChanges(Operation):
         if delete_file_ids or new_file_ids:
             cursor.execute("UPDATE reviews SET serial=serial+1 WHERE id=%s", (review_id,))
 
+            reviewing.progress.updateReviewProgress(db, [review_id])
+
             pending_mails = reviewing.utils.generateMailsForAssignmentsTransaction(db, transaction_id)
 
             db.commit()
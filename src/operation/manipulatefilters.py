@@ -20,6 +20,7 @@ import mailutils
 import htmlutils
 import reviewing.utils
 import reviewing.filters
+import reviewing.progress
 
 from operation import Operation, OperationResult, OperationError, \
     OperationFailure, OperationFailureMustLogin, Optional
@@ -235,6 +236,8 @@ class ReapplyFilters(Operation):
                                    VALUES (%s, %s)""",
                            [(review_file_id, user.id) for review_file_id in assign_changes])
 
+        reviewing.progress.updateReviewProgress(db, assigned_reviews)
+
         db.commit()
 
         watched_reviews &= new_reviews
@@ -17,6 +17,7 @@
 import dbutils
 import gitutils
 import log.commitset
+import reviewing.progress
 
 from operation import (Operation, OperationResult, OperationError, Optional,
                        Review)
@@ -265,6 +266,8 @@ class RevertRebase(Operation):
         cursor.execute("UPDATE branches SET head=%s WHERE id=%s", (old_head_id, review.branch.id))
         cursor.execute("DELETE FROM reviewrebases WHERE id=%s", (rebase_id,))
 
+        reviewing.progress.updateReviewProgress(db, [review.id])
+
         review.incrementSerial(db)
         db.commit()
 
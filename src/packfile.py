@@ -0,0 +1,439 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2014 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""Reading Git objects directly from a repository's pack files.
+
+   Pack index (.idx) and pack (.pack) files are memory-mapped, objects are
+   located via the index's fan-out table and a binary search, inflated with
+   zlib and, if stored as deltas, reconstructed from their delta bases (with
+   a cache of recently used delta bases.)
+
+   Loose objects, objects in alternate object stores and anything else not
+   found in a pack are not handled; PackReader.read() returns None for them,
+   and the caller is expected to fall back to 'git cat-file'."""
+
+import os
+import mmap
+import zlib
+import struct
+import bisect
+import threading
+import collections
+
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = { OBJ_COMMIT: "commit",
+               OBJ_TREE: "tree",
+               OBJ_BLOB: "blob",
+               OBJ_TAG: "tag" }
+
+class PackError(Exception):
+    pass
+
+def mapFile(path):
+    with open(path, "rb") as opened:
+        return mmap.mmap(opened.fileno(), 0, access=mmap.ACCESS_READ)
+
+def toBinary(sha1):
+    # Other object names (refs, abbreviated SHA-1s, "<commit>:<path>" and so
+    # on) are left for 'git cat-file' to resolve.
+    if len(sha1) != 40:
+        return None
+    try:
+        return str(sha1).decode("hex")
+    except TypeError:
+        return None
+
+class PackIndex(object):
+    """A memory-mapped version 1 or version 2 pack index file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.__data = data = mapFile(path)
+
+        if data[:4] == "\377tOc":
+            version, = struct.unpack(">I", data[4:8])
+            if version != 2:
+                raise PackError("%s: unsupported index version %d" % (path, version))
+            self.version = 2
+            fanout_offset = 8
+        else:
+            self.version = 1
+            fanout_offset = 0
+
+        self.__fanout = struct.unpack(">256I", data[fanout_offset:fanout_offset + 1024])
+        self.count = count = self.__fanout[255]
+
+        if self.version == 2:
+            self.__sha1s_offset = fanout_offset + 1024
+            self.__offsets_offset = self.__sha1s_offset + count * 24
+            self.__large_offsets_offset = self.__offsets_offset + count * 4
+        else:
+            self.__entries_offset = fanout_offset + 1024
+
+    def __sha1(self, index):
+        if self.version == 2:
+            offset = self.__sha1s_offset + index * 20
+        else:
+            offset = self.__entries_offset + index * 24 + 4
+        return self.__data[offset:offset + 20]
+
+    def __offset(self, index):
+        if self.version == 1:
+            offset = self.__entries_offset + index * 24
+            return struct.unpack(">I", self.__data[offset:offset + 4])[0]
+
+        offset = self.__offsets_offset + index * 4
+        value, = struct.unpack(">I", self.__data[offset:offset + 4])
+
+        if value & 0x80000000:
+            offset = self.__large_offsets_offset + (value & 0x7fffffff) * 8
+            value, = struct.unpack(">Q", self.__data[offset:offset + 8])
+
+        return value
+
+    def lookup(self, binary_sha1):
+        """Return the pack offset of an object, or None if not in this pack"""
+
+        first = ord(binary_sha1[0])
+        low = self.__fanout[first - 1] if first else 0
+        high = self.__fanout[first]
+
+        while low < high:
+            middle = (low + high) // 2
+            candidate = self.__sha1(middle)
+            if candidate < binary_sha1:
+                low = middle + 1
+            elif candidate > binary_sha1:
+                high = middle
+            else:
+                return self.__offset(middle)
+
+        return None
+
+class DeltaBaseCache(object):
+    """LRU cache of inflated delta bases, bounded by total size in bytes"""
+
+    def __init__(self, budget):
+        self.__budget = budget
+        self.__size = 0
+        self.__items = collections.OrderedDict()
+
+    def get(self, key):
+        item = self.__items.pop(key, None)
+        if item is not None:
+            self.__items[key] = item
+        return item
+
+    def add(self, key, item):
+        size = len(item[1])
+        if size > self.__budget / 4 or key in self.__items:
+            return
+        while self.__items and self.__size + size > self.__budget:
+            _, (_, evicted_data) = self.__items.popitem(last=False)
+            self.__size -= len(evicted_data)
+        self.__items[key] = item
+        self.__size += size
+
+def readVarint(data, offset):
+    # Little-endian base-128 integer, as used in delta headers.
+    value = shift = 0
+    while True:
+        byte = ord(data[offset])
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+def applyDelta(base, delta):
+    source_size, offset = readVarint(delta, 0)
+    target_size, offset = readVarint(delta, offset)
+
+    if source_size != len(base):
+        raise PackError("delta base size mismatch")
+
+    pieces = []
+    length = len(delta)
+
+    while offset < length:
+        opcode = ord(delta[offset])
+        offset += 1
+
+        if opcode & 0x80:
+            # Copy from base.
+            copy_offset = copy_size = 0
+            for bit, shift in ((0x01, 0), (0x02, 8), (0x04, 16), (0x08, 24)):
+                if opcode & bit:
+                    copy_offset |= ord(delta[offset]) << shift
+                    offset += 1
+            for bit, shift in ((0x10, 0), (0x20, 8), (0x40, 16)):
+                if opcode & bit:
+                    copy_size |= ord(delta[offset]) << shift
+                    offset += 1
+            if copy_size == 0:
+                copy_size = 0x10000
+            pieces.append(base[copy_offset:copy_offset + copy_size])
+        elif opcode:
+            # Insert literal data.
+            pieces.append(delta[offset:offset + opcode])
+            offset += opcode
+        else:
+            raise PackError("invalid delta opcode 0")
+
+    result = "".join(pieces)
+
+    if len(result) != target_size:
+        raise PackError("delta result size mismatch")
+
+    return result
+
+class Pack(object):
+    """A memory-mapped pack file and its index"""
+
+    def __init__(self, reader, index_path):
+        self.reader = reader
+        self.index = PackIndex(index_path)
+        self.path = index_path[:-4] + ".pack"
+        self.__data = mapFile(self.path)
+
+        if self.__data[:4] != "PACK":
+            raise PackError("%s: not a pack file" % self.path)
+
+    def __header(self, offset):
+        data = self.__data
+        byte = ord(data[offset])
+        offset += 1
+        object_type = (byte >> 4) & 7
+        size = byte & 0x0f
+        shift = 4
+        while byte & 0x80:
+            byte = ord(data[offset])
+            offset += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+        return object_type, size, offset
+
+    def __baseOffset(self, offset):
+        # Big-endian base-128 with an "add one" per continuation byte, as used
+        # for OFS_DELTA base offsets.
+        data = self.__data
+        byte = ord(data[offset])
+        offset += 1
+        value = byte & 0x7f
+        while byte & 0x80:
+            byte = ord(data[offset])
+            offset += 1
+            value = ((value + 1) << 7) | (byte & 0x7f)
+        return value, offset
+
+    def __inflate(self, offset, size, partial=False):
+        decompressor = zlib.decompressobj()
+        chunk_size = max(4096, size + 64)
+        pieces = []
+        produced = 0
+
+        while produced < size:
+            chunk = self.__data[offset:offset + chunk_size]
+            if not chunk:
+                raise PackError("%s: truncated object data" % self.path)
+            offset += len(chunk)
+            piece = decompressor.decompress(chunk, size - produced)
+            pieces.append(piece)
+            produced += len(piece)
+            while decompressor.unconsumed_tail and produced < size:
+                piece = decompressor.decompress(decompressor.unconsumed_tail,
+                                                size - produced)
+                pieces.append(piece)
+                produced += len(piece)
+            if partial:
+                break
+
+        return "".join(pieces)
+
+    def __deltaBase(self, object_type, offset, data_offset):
+        # Return the offset of the base object (in this pack) or None, and the
+        # offset of the compressed delta data.
+        if object_type == OBJ_OFS_DELTA:
+            relative, data_offset = self.__baseOffset(data_offset)
+            return self, offset - relative, data_offset
+        else:
+            base_sha1 = self.__data[data_offset:data_offset + 20]
+            base_pack, base_offset = self.reader.locate(base_sha1)
+            return base_pack, base_offset, data_offset + 20
+
+    def readObject(self, offset):
+        """Return (type name, data) for the object at 'offset'"""
+
+        cache = self.reader.delta_base_cache
+        key = (self.path, offset)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        object_type, size, data_offset = self.__header(offset)
+
+        if object_type in TYPE_NAMES:
+            result = (TYPE_NAMES[object_type], self.__inflate(data_offset, size))
+        elif object_type in (OBJ_OFS_DELTA, OBJ_REF_DELTA):
+            base_pack, base_offset, data_offset = self.__deltaBase(object_type, offset, data_offset)
+            if base_pack is None:
+                return None
+            base = base_pack.readObject(base_offset)
+            if base is None:
+                return None
+            base_type, base_data = base
+            delta = self.__inflate(data_offset, size)
+            result = (base_type, applyDelta(base_data, delta))
+        else:
+            raise PackError("%s: invalid object type %d at offset %d"
+                            % (self.path, object_type, offset))
+
+        cache.add(key, result)
+        return result
+
+    def readObjectHeader(self, offset):
+        """Return (type name, size) for the object at 'offset'
+
+           Deltified objects are not reconstructed; the size is read from the
+           delta header, and the type from the end of the delta chain."""
+
+        object_type, size, data_offset = self.__header(offset)
+
+        if object_type in TYPE_NAMES:
+            return TYPE_NAMES[object_type], size
+
+        base_pack, base_offset, data_offset = self.__deltaBase(object_type, offset, data_offset)
+        if base_pack is None:
+            return None
+        delta_head = self.__inflate(data_offset, min(size, 32), partial=True)
+        _, delta_offset = readVarint(delta_head, 0)
+        target_size, _ = readVarint(delta_head, delta_offset)
+        base = base_pack.readObjectHeader(base_offset)
+        if base is None:
+            return None
+        return base[0], target_size
+
+class PackReader(object):
+    """Reader for all objects in a repository's pack files
+
+       The set of pack files is rescanned when an object isn't found, so that
+       packs added (by pushes or 'git gc') since the last scan are picked up.
+       Packs whose files have been deleted are dropped at the same time; their
+       memory mappings remain valid until then."""
+
+    def __init__(self, path, delta_base_cache_size):
+        self.path = path
+        self.delta_base_cache = DeltaBaseCache(delta_base_cache_size)
+        self.__lock = threading.Lock()
+        self.__packs = {}
+        self.__mtime = None
+        self.__scan()
+
+    def __packDirectory(self):
+        objects_dir = os.path.join(self.path, "objects")
+        if not os.path.isdir(objects_dir):
+            # Non-bare repository.
+            objects_dir = os.path.join(self.path, ".git", "objects")
+        return os.path.join(objects_dir, "pack")
+
+    def __scan(self):
+        pack_dir = self.__packDirectory()
+        try:
+            # Adding or removing packs changes the directory's modification
+            # time, so skip the rescan if it hasn't changed.
+            mtime = os.stat(pack_dir).st_mtime
+            if mtime == self.__mtime:
+                return
+            filenames = os.listdir(pack_dir)
+        except OSError:
+            mtime = None
+            filenames = []
+        self.__mtime = mtime
+        index_paths = set(os.path.join(pack_dir, filename)
+                          for filename in filenames
+                          if filename.endswith(".idx")
+                          and filename[:-4] + ".pack" in filenames)
+        for index_path in set(self.__packs) - index_paths:
+            del self.__packs[index_path]
+        for index_path in index_paths - set(self.__packs):
+            try:
+                self.__packs[index_path] = Pack(self, index_path)
+            except (EnvironmentError, ValueError, PackError):
+                # Unreadable, or being written right now; ignore it for now.
+                pass
+
+    def locate(self, binary_sha1, rescan=True):
+        for pack in self.__packs.values():
+            offset = pack.index.lookup(binary_sha1)
+            if offset is not None:
+                return pack, offset
+        if rescan:
+            self.__scan()
+            return self.locate(binary_sha1, rescan=False)
+        return None, None
+
+    def contains(self, sha1):
+        binary_sha1 = toBinary(sha1)
+        if binary_sha1 is None:
+            return False
+        with self.__lock:
+            pack, _ = self.locate(binary_sha1)
+            return pack is not None
+
+    def read(self, sha1, fetchData=True):
+        """Return (type, size, data) for an object, or None if not found
+
+           If 'fetchData' is false, data is None and the object is not fully
+           reconstructed."""
+
+        binary_sha1 = toBinary(sha1)
+        if binary_sha1 is None:
+            return None
+
+        with self.__lock:
+            pack, offset = self.locate(binary_sha1)
+            if pack is None:
+                return None
+            if fetchData:
+                result = pack.readObject(offset)
+                if result is None:
+                    return None
+                object_type, data = result
+                return object_type, len(data), data
+            else:
+                result = pack.readObjectHeader(offset)
+                if result is None:
+                    return None
+                object_type, size = result
+                return object_type, size, None
+
+readers = {}
+readers_lock = threading.Lock()
+
+def get(path, delta_base_cache_size):
+    """Return the (process-wide) PackReader for the repository at 'path'"""
+
+    with readers_lock:
+        reader = readers.get(path)
+        if reader is None:
+            reader = readers[path] = PackReader(path, delta_base_cache_size)
+        return reader
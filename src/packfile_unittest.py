@@ -0,0 +1,81 @@
+import sys
+import os
+import shutil
+import tempfile
+import subprocess
+
+def basic():
+    import packfile
+
+    path = tempfile.mkdtemp()
+
+    try:
+        def git(*args, **kwargs):
+            return subprocess.check_output(["git"] + list(args), cwd=path, **kwargs)
+
+        git("init", "-q")
+        git("config", "user.name", "Tester")
+        git("config", "user.email", "tester@example.org")
+
+        # Similar versions of a file, so that the repack produces deltas.
+        lines = ["line %d\n" % index for index in range(1000)]
+        for version in range(10):
+            lines[version * 97] = "changed in version %d\n" % version
+            with open(os.path.join(path, "file.txt"), "w") as text_file:
+                text_file.write("".join(lines))
+            git("add", "file.txt")
+            git("commit", "-q", "-m", "Version %d" % version)
+
+        git("repack", "-q", "-a", "-d", "-f", "--depth=50")
+
+        # A loose object, which the reader should not find.
+        loose_file = os.path.join(path, "loose.txt")
+        with open(loose_file, "w") as text_file:
+            text_file.write("loose\n")
+        loose_sha1 = git("hash-object", "-w", "loose.txt").strip()
+
+        reader = packfile.PackReader(path, 1024 ** 2)
+
+        sha1s = git("rev-list", "--objects", "--all").split("\n")
+        sha1s = [line.split()[0] for line in sha1s if line]
+
+        assert len(sha1s) == 30
+
+        for sha1 in sha1s:
+            object_type = git("cat-file", "-t", sha1).strip()
+            data = git("cat-file", object_type, sha1)
+
+            assert reader.contains(sha1)
+            assert reader.read(sha1) == (object_type, len(data), data), sha1
+            assert reader.read(sha1, fetchData=False) == (object_type, len(data), None), sha1
+
+        assert not reader.contains(loose_sha1)
+        assert reader.read(loose_sha1) is None
+        assert reader.read("HEAD") is None
+        assert reader.read("0" * 40) is None
+    finally:
+        shutil.rmtree(path)
+
+def delta():
+    import packfile
+
+    base = "abcdefghijklmnopqrstuvwxyz"
+
+    # Source size 26, target size 10: copy 5 bytes from offset 2, insert
+    # "XYZ", copy 2 bytes from offset 0.
+    instructions = "\x1a\x0a" + "\x91\x02\x05" + "\x03XYZ" + "\x90\x02"
+
+    assert packfile.applyDelta(base, instructions) == "cdefgXYZab"
+
+    try:
+        packfile.applyDelta(base[:-1], instructions)
+    except packfile.PackError:
+        pass
+    else:
+        assert False, "base size mismatch not detected"
+
+if __name__ == "__main__":
+    if "basic" in sys.argv[1:]:
+        basic()
+    if "delta" in sys.argv[1:]:
+        delta()
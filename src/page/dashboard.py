@@ -19,6 +19,7 @@ import gitutils
 import htmlutils
 import profiling
 import page.utils
+import reviewing.progress
 
 def renderDashboard(req, db, user):
     if user.isAnonymous(): default_show = "open"
@@ -103,18 +104,9 @@ def renderDashboard(req, db, user):
         return reviews
 
     def isAccepted(review_ids):
-        cursor.execute("""SELECT reviews.id, COUNT(reviewfiles.id)=0 AND COUNT(commentchains.id)=0
-                            FROM reviews
-                 LEFT OUTER JOIN reviewfiles ON (reviewfiles.review=reviews.id
-                                             AND reviewfiles.state='pending')
-                 LEFT OUTER JOIN commentchains ON (commentchains.review=reviews.id
-                                               AND commentchains.type='issue'
-                                               AND commentchains.state='open')
-                           WHERE reviews.id=ANY (%s)
-                        GROUP BY reviews.id""",
-                       (review_ids,))
-
-        return dict(cursor)
+        progress = reviewing.progress.fetchReviewProgress(db, review_ids)
+        return dict((review_id, review_progress.isAccepted())
+                    for review_id, review_progress in progress.items())
 
     def renderReviews(target, reviews, lines_and_comments=True, links=True):
         cursor.execute("SELECT id, name FROM branches WHERE id=ANY (%s)",
@@ -274,16 +266,13 @@ def renderDashboard(req, db, user):
             with_comments = {}
             with_both = {}
 
-            cursor.execute("""SELECT reviews.id, reviews.summary, reviews.branch, SUM(reviewfiles.deleted), SUM(reviewfiles.inserted)
+            cursor.execute("""SELECT reviews.id, reviews.summary, reviews.branch, reviewuserprogress.deleted, reviewuserprogress.inserted
                                 FROM reviews
                                 JOIN reviewusers ON (reviewusers.review=reviews.id
                                                  AND reviewusers.uid=%s)
-                                JOIN reviewfiles ON (reviewfiles.review=reviews.id)
-                                JOIN reviewuserfiles ON (reviewuserfiles.file=reviewfiles.id
-                                                     AND reviewuserfiles.uid=%s)
-                               WHERE reviews.state='open'
-                                 AND reviewfiles.state='pending'
-                            GROUP BY reviews.id, reviews.summary, reviews.branch""",
+                                JOIN reviewuserprogress ON (reviewuserprogress.review=reviews.id
+                                                        AND reviewuserprogress.uid=%s)
+                               WHERE reviews.state='open'""",
                            (user.id, user.id))
 
             profiler.check("query: active lines")
@@ -485,8 +474,10 @@ def renderDashboard(req, db, user):
             accepted = []
             pending = []
 
+            is_accepted = isAccepted(other_open.keys())
+
             for review_id, (summary, branch_id, lines, comments) in sortedReviews(other_open):
-                if dbutils.Review.isAccepted(db, review_id):
+                if is_accepted[review_id]:
                     accepted.append((review_id, (summary, branch_id, lines, comments)))
                 else:
                     pending.append((review_id, (summary, branch_id, lines, comments)))
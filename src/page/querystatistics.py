@@ -0,0 +1,94 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2014 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import urllib
+
+import page.utils
+import htmlutils
+import querystatistics
+
+def renderQueryStatistics(req, db, user):
+    if not user.hasRole(db, "administrator"):
+        raise page.utils.DisplayMessage(
+            title="Not allowed!",
+            body="Only users with the 'administrator' role can view query statistics.")
+
+    order_by = req.getParameter("order", "total")
+    limit = req.getParameter("limit", 50, filter=int)
+    context = req.getParameter("context", None)
+
+    if order_by not in querystatistics.ORDER_BY:
+        raise page.utils.DisplayMessage("Invalid order: %s" % order_by)
+
+    document = htmlutils.Document(req)
+    document.setTitle("Query Statistics")
+
+    html = document.html()
+    head = html.head()
+    body = html.body()
+
+    page.utils.generateHeader(body, db, user)
+
+    document.addExternalStylesheet("resource/querystatistics.css")
+
+    entries = querystatistics.fetchReport(db, order_by, limit, context)
+
+    paleyellow = page.utils.PaleYellowTable(body, "Query Statistics")
+
+    def orderLink(target, key, title):
+        parameters = { "order": key, "limit": limit }
+        if context is not None:
+            parameters["context"] = context
+        if key == order_by:
+            target.text(title)
+        else:
+            target.a(href="querystatistics?" + urllib.urlencode(parameters)).text(title)
+
+    def render(target):
+        table = target.table("querystatistics callout")
+
+        headings = table.tr("headings")
+        orderLink(headings.th("count"), "count", "Count")
+        orderLink(headings.th("slow"), "slow", "Slow")
+        orderLink(headings.th("total"), "total", "Total (ms)")
+        orderLink(headings.th("average"), "average", "Average (ms)")
+        orderLink(headings.th("max"), "max", "Max (ms)")
+        headings.th("rows").text("Rows")
+        headings.th("query").text("Context / Query")
+
+        if not entries:
+            table.tr("empty").td("empty", colspan=7).text("No query statistics recorded.")
+
+        for (entry_context, query, count, slow, total_ms, max_ms, rows,
+             first_seen, last_seen) in entries:
+            row = table.tr("entry")
+            row.td("count").text(count)
+            row.td("slow").text(slow)
+            row.td("total").text("%.1f" % total_ms)
+            row.td("average").text("%.2f" % (total_ms / count) if count else "")
+            row.td("max").text("%.1f" % max_ms)
+            row.td("rows").text(rows)
+
+            cell = row.td("query")
+            parameters = { "order": order_by, "limit": limit, "context": entry_context }
+            cell.a("context", href="querystatistics?" + urllib.urlencode(parameters)).text(entry_context)
+            cell.span("seen").text(" (from %s to %s)" % (first_seen.strftime("%Y-%m-%d %H:%M"),
+                                                          last_seen.strftime("%Y-%m-%d %H:%M")))
+            cell.div("query").text(query)
+
+    paleyellow.addCentered(render)
+
+    return document
@@ -25,22 +25,7 @@ import dbutils
 import configuration
 import textutils
 
-def renderServices(req, db, user):
-    req.content_type = "text/html; charset=utf-8"
-
-    document = htmlutils.Document(req)
-    document.setTitle("Services")
-
-    html = document.html()
-    head = html.head()
-    body = html.body()
-
-    page.utils.generateHeader(body, db, user, current_page="services")
-
-    document.addExternalStylesheet("resource/services.css")
-    document.addExternalScript("resource/services.js")
-    document.addInternalScript(user.getJS())
-
+def queryServiceManager(query):
     delay = 0.5
     connected = False
 
@@ -65,7 +50,7 @@ def renderServices(req, db, user):
     if not connected:
         raise page.utils.DisplayMessage("Service manager not responding!")
 
-    connection.send(textutils.json_encode({ "query": "status" }))
+    connection.send(textutils.json_encode(query))
     connection.shutdown(socket.SHUT_WR)
 
     data = ""
@@ -79,6 +64,26 @@ def renderServices(req, db, user):
     if result["status"] == "error":
         raise page.utils.DisplayMessage(result["error"])
 
+    return result
+
+def renderServices(req, db, user):
+    req.content_type = "text/html; charset=utf-8"
+
+    document = htmlutils.Document(req)
+    document.setTitle("Services")
+
+    html = document.html()
+    head = html.head()
+    body = html.body()
+
+    page.utils.generateHeader(body, db, user, current_page="services")
+
+    document.addExternalStylesheet("resource/services.css")
+    document.addExternalScript("resource/services.js")
+    document.addInternalScript(user.getJS())
+
+    result = queryServiceManager({ "query": "status" })
+
     paleyellow = page.utils.PaleYellowTable(body, "Services")
 
     def render(target):
@@ -161,3 +166,19 @@ def renderServices(req, db, user):
     paleyellow.addCentered(render)
 
     return document
+
+def renderMetrics(req, db, user):
+    """Metrics of the background services, in Prometheus text format"""
+
+    if not user.hasRole(db, "administrator"):
+        req.setStatus(403)
+        req.setContentType("text/plain")
+        return "permission denied: administrator role required\n"
+
+    import background.metrics
+
+    result = queryServiceManager({ "query": "metrics" })
+
+    req.setContentType("text/plain; version=0.0.4")
+
+    return background.metrics.formatPrometheus(result["services"])
@@ -147,15 +147,12 @@ def renderShowBatch(req, db, user):
     renderFiles("Unreviewed:", cursor)
 
     def renderChains(title, cursor, replies):
-        all_chains = [review_comment.CommentChain.fromId(db, chain_id, user, review=review)
-                      for (chain_id,) in cursor]
+        all_chains = review_comment.loadCommentChainsById(
+            db, [chain_id for (chain_id,) in cursor], user, review=review)
 
         if not all_chains:
             return
 
-        for chain in all_chains:
-            chain.loadComments(db, user)
-
         issue_chains = filter(lambda chain: chain.type == "issue", all_chains)
         draft_issues = filter(lambda chain: chain.state == "draft", issue_chains)
         open_issues = filter(lambda chain: chain.state == "open", issue_chains)
@@ -140,10 +140,9 @@ def renderShowFile(req, db, user):
 
         comment_chain_script = ""
 
-        for (chain_id,) in cursor.fetchall():
-            chain = review_comment.CommentChain.fromId(db, chain_id, user, review=review)
-            chain.loadComments(db, user)
+        chain_ids = [chain_id for (chain_id,) in cursor.fetchall()]
 
+        for chain in review_comment.loadCommentChainsById(db, chain_ids, user, review=review):
             comment_chain_script += "commentChains.push(%s);\n" % chain.getJSConstructor(file_sha1)
 
         if comment_chain_script:
@@ -65,30 +65,46 @@ class Profiler:
         return log
 
 def formatDBProfiling(db):
-    lines = ["         | TIME (milliseconds)    | ROWS                   |",
-             "   Count | Accumulated |  Maximum | Accumulated |  Maximum | Query",
-             "  -------|-------------|----------|-------------|----------|-------"]
+    lines = ["         |          | TIME (milliseconds)    | ROWS                   |",
+             "   Count | Prepared | Accumulated |  Maximum | Accumulated |  Maximum | Query",
+             "  -------|----------|-------------|----------|-------------|----------|-------"]
     items = sorted(db.profiling.items(), key=lambda item: item[1][1], reverse=True)
+    prepared = db.profiling_prepared or {}
 
     total_count = 0
+    total_prepared = 0
     total_accumulated_ms = 0.0
     total_accumulated_rows = 0
 
     for item, (count, accumulated_ms, maximum_ms, accumulated_rows, maximum_rows) in items:
+        prepared_count = prepared.get(item, 0)
+
         total_count += count
+        total_prepared += prepared_count
         total_accumulated_ms += accumulated_ms
 
         if accumulated_rows is None:
-            lines.append("  %6d | %11.4f | %8.4f |             |          | %s" %
-                         (count, accumulated_ms, maximum_ms, re.sub(r"\s+", " ", item)))
+            lines.append("  %6d | %8d | %11.4f | %8.4f |             |          | %s" %
+                         (count, prepared_count, accumulated_ms, maximum_ms, re.sub(r"\s+", " ", item)))
         else:
             total_accumulated_rows += accumulated_rows
 
-            lines.append("  %6d | %11.4f | %8.4f | %11d | %8d | %s" %
-                         (count, accumulated_ms, maximum_ms, accumulated_rows, maximum_rows, re.sub(r"\s+", " ", item)))
+            lines.append("  %6d | %8d | %11.4f | %8.4f | %11d | %8d | %s" %
+                         (count, prepared_count, accumulated_ms, maximum_ms, accumulated_rows, maximum_rows, re.sub(r"\s+", " ", item)))
+
+
+    lines.insert(3, ("  %6d | %8d | %11.4f |          | %11d |          | TOTAL" %
+                     (total_count, total_prepared, total_accumulated_ms, total_accumulated_rows)))
+
+    import dbaccess
 
+    pool = dbaccess.getPool()
 
-    lines.insert(3, ("  %6d | %11.4f |          | %11d |          | TOTAL" %
-                     (total_count, total_accumulated_ms, total_accumulated_rows)))
+    if pool:
+        lines.extend(["",
+                      ("  Connection pool (this process): %(in_use)d in use, "
+                       "%(idle)d idle (max %(size)d); %(opened)d opened, "
+                       "%(reused)d reused, %(discarded)d closed in total"
+                       % pool.getStatistics())])
 
     return "\n".join(lines)
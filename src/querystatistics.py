@@ -0,0 +1,233 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2014 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Aggregated query statistics, across requests and processes.
+#
+# In a sample of database sessions (see Session.sampled), the execution time of
+# every query is recorded, and in all sessions, queries slower than a threshold
+# are.  Queries are normalized (literal values replaced by '?') and aggregated
+# per context (the page, operation or process that executed them) by each
+# process, which periodically adds its aggregate to the "querystatistics"
+# table.
+
+import re
+import time
+import threading
+import hashlib
+
+RE_STRING = re.compile(r"'(?:[^']|'')*'")
+RE_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+RE_LIST = re.compile(r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))+\s*\)")
+RE_WHITESPACE = re.compile(r"\s+")
+
+def normalizeQuery(query):
+    """Return 'query' with literal values replaced by '?'
+
+       Lists of values (or placeholders) in parentheses, as used with "IN",
+       are replaced by "(...)", and whitespace is collapsed."""
+
+    query = RE_STRING.sub("?", query)
+    query = RE_NUMBER.sub("?", query)
+    query = RE_LIST.sub("(...)", query)
+    return RE_WHITESPACE.sub(" ", query).strip()
+
+def hashQuery(query):
+    return hashlib.md5(query).hexdigest()
+
+class QueryStatistics(object):
+    """Per-process aggregate of query statistics, safe to use from multiple
+       threads"""
+
+    def __init__(self, sample_rate, slow_threshold, flush_interval):
+        self.sample_rate = sample_rate
+        # In seconds, like the durations passed to record().
+        self.slow_threshold = slow_threshold / 1000.0 if slow_threshold else None
+        self.flush_interval = flush_interval
+        self.__lock = threading.Lock()
+        # (context, normalized query) => [count, slow, total_ms, max_ms, rows]
+        self.__entries = {}
+        # Normalizing is relatively expensive, and the same (unnormalized)
+        # queries are executed over and over.
+        self.__normalized = {}
+        self.__flushed_at = time.time()
+
+    def isSlow(self, duration):
+        return self.slow_threshold is not None and duration >= self.slow_threshold
+
+    def record(self, context, query, duration, rows, sampled):
+        """Record an execution of 'query'
+
+           If 'sampled' is false, the execution is counted only as slow (and
+           must be, for it to be recorded at all.)"""
+
+        normalized = self.__normalized.get(query)
+        if normalized is None:
+            if len(self.__normalized) > 10000:
+                self.__normalized.clear()
+            normalized = self.__normalized[query] = normalizeQuery(query)
+
+        slow = self.isSlow(duration)
+        duration_ms = 1000 * duration
+
+        with self.__lock:
+            entry = self.__entries.get((context, normalized))
+            if entry is None:
+                entry = self.__entries[(context, normalized)] = [0, 0, 0.0, 0.0, 0]
+            if sampled:
+                entry[0] += 1
+                entry[2] += duration_ms
+                entry[4] += max(0, rows or 0)
+            if slow:
+                entry[1] += 1
+            entry[3] = max(entry[3], duration_ms)
+
+    def flush(self, force=False):
+        """Add the recorded statistics to the "querystatistics" table
+
+           Does nothing unless the flush interval has passed since the last
+           flush, or 'force' is true.  Failures are ignored (and the recorded
+           statistics dropped); these statistics are not important enough to
+           ever be the cause of a failed request."""
+
+        import dbaccess
+
+        with self.__lock:
+            if not self.__entries:
+                return
+            if not force and time.time() - self.__flushed_at < self.flush_interval:
+                return
+            entries, self.__entries = self.__entries, {}
+            self.__flushed_at = time.time()
+
+        try:
+            connection, _ = dbaccess.acquire()
+        except dbaccess.Error:
+            return
+
+        try:
+            cursor = connection.cursor()
+
+            for (context, query), (count, slow, total_ms, max_ms, rows) in sorted(entries.items()):
+                values = dict(context=context[:256], query_hash=hashQuery(query),
+                              count=count, slow=slow, total_ms=total_ms,
+                              max_ms=max_ms, rows=rows)
+
+                for attempt in range(2):
+                    cursor.execute("""UPDATE querystatistics
+                                         SET count=count + %(count)s,
+                                             slow=slow + %(slow)s,
+                                             total_ms=total_ms + %(total_ms)s,
+                                             max_ms=GREATEST(max_ms, %(max_ms)s),
+                                             rows=rows + %(rows)s,
+                                             last_seen=NOW()
+                                       WHERE context=%(context)s
+                                         AND query_hash=%(query_hash)s""",
+                                   values)
+                    if cursor.rowcount:
+                        break
+
+                    # Another process may insert the same row concurrently, in
+                    # which case we update that row instead.
+                    cursor.execute("SAVEPOINT querystatistics")
+                    try:
+                        cursor.execute("""INSERT INTO querystatistics (context, query_hash, query, count,
+                                                                       slow, total_ms, max_ms, rows)
+                                               VALUES (%(context)s, %(query_hash)s, %(query)s, %(count)s,
+                                                       %(slow)s, %(total_ms)s, %(max_ms)s, %(rows)s)""",
+                                       dict(values, query=query))
+                    except dbaccess.IntegrityError:
+                        cursor.execute("ROLLBACK TO SAVEPOINT querystatistics")
+                    else:
+                        cursor.execute("RELEASE SAVEPOINT querystatistics")
+                        break
+
+            connection.commit()
+        except dbaccess.Error:
+            pass
+        finally:
+            dbaccess.release(connection)
+
+_statistics = None
+_statistics_lock = threading.Lock()
+
+def getStatistics():
+    """Return this process's QueryStatistics object, or None if disabled"""
+
+    global _statistics
+
+    if _statistics is None:
+        import configuration
+
+        sample_rate = configuration.database.QUERY_STATISTICS_SAMPLE_RATE
+        slow_threshold = configuration.database.SLOW_QUERY_THRESHOLD
+
+        if not (sample_rate or slow_threshold):
+            return None
+
+        with _statistics_lock:
+            if _statistics is None:
+                import atexit
+
+                _statistics = QueryStatistics(
+                    sample_rate, slow_threshold,
+                    configuration.database.QUERY_STATISTICS_FLUSH_INTERVAL)
+
+                atexit.register(_statistics.flush, force=True)
+
+    return _statistics
+
+ORDER_BY = { "total": "total_ms",
+             "count": "count",
+             "max": "max_ms",
+             "slow": "slow",
+             "average": "total_ms / GREATEST(count, 1)" }
+
+def fetchReport(db, order_by="total", limit=50, context=None):
+    """Return the top entries of the "querystatistics" table
+
+       Returns a list of (context, query, count, slow, total_ms, max_ms, rows,
+       first_seen, last_seen) tuples, ordered by 'order_by', which is one of
+       the keys of ORDER_BY."""
+
+    cursor = db.cursor()
+
+    if context is None:
+        condition = "TRUE"
+    else:
+        condition = "context=%(context)s"
+
+    cursor.execute("""SELECT context, query, count, slow, total_ms, max_ms, rows,
+                             first_seen, last_seen
+                        FROM querystatistics
+                       WHERE %s
+                    ORDER BY %s DESC
+                       LIMIT %%(limit)s""" % (condition, ORDER_BY[order_by]),
+                   { "context": context, "limit": limit })
+
+    return cursor.fetchall()
+
+def formatReport(entries):
+    lines = ["         |         | TIME (milliseconds)                |             |",
+             "   Count |    Slow |       Total |  Average |    Maximum |        Rows | Context / Query",
+             "  -------|---------|-------------|----------|------------|-------------|-----------------"]
+
+    for context, query, count, slow, total_ms, max_ms, rows, _, _ in entries:
+        average_ms = total_ms / count if count else 0.0
+        lines.append("  %6d | %7d | %11.1f | %8.2f | %10.1f | %11d | %s" %
+                     (count, slow, total_ms, average_ms, max_ms, rows, context))
+        lines.append("         |         |             |          |            |             |   %s" % query)
+
+    return "\n".join(lines)
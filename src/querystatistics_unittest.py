@@ -0,0 +1,50 @@
+import sys
+
+def normalize():
+    import querystatistics
+
+    def check(query, expected):
+        normalized = querystatistics.normalizeQuery(query)
+        assert normalized == expected, "%r => %r (expected %r)" % (query, normalized, expected)
+
+    check("SELECT sha1 FROM commits WHERE id=%s", "SELECT sha1 FROM commits WHERE id=%s")
+    check("""SELECT sha1
+               FROM commits
+              WHERE id=17""", "SELECT sha1 FROM commits WHERE id=?")
+    check("SELECT id FROM users WHERE name='alice' AND status='cur''rent'",
+          "SELECT id FROM users WHERE name=? AND status=?")
+    check("SELECT 1 FROM commits WHERE id IN (1, 2, 3) LIMIT 10",
+          "SELECT ? FROM commits WHERE id IN (...) LIMIT ?")
+    check("SELECT 1 FROM commits WHERE id IN (%s, %s)",
+          "SELECT ? FROM commits WHERE id IN (...)")
+    check("SELECT sha1, md5(x) FROM t1 WHERE value > -1.5",
+          "SELECT sha1, md5(x) FROM t1 WHERE value > ?")
+    check("EXECUTE critic_1 ($1)", "EXECUTE critic_1 ($1)")
+
+def aggregate():
+    import querystatistics
+
+    statistics = querystatistics.QueryStatistics(1.0, 100, 60)
+
+    assert not statistics.isSlow(0.099)
+    assert statistics.isSlow(0.1)
+
+    statistics.record("page: a", "SELECT 1 FROM t WHERE id=1", 0.010, 1, True)
+    statistics.record("page: a", "SELECT 1 FROM t WHERE id=2", 0.030, 1, True)
+    statistics.record("page: a", "SELECT 1 FROM t WHERE id=3", 0.200, 0, False)
+    statistics.record("page: b", "SELECT 1 FROM t WHERE id=4", 0.005, 2, True)
+
+    entries = statistics._QueryStatistics__entries
+
+    count, slow, total_ms, max_ms, rows = entries[("page: a", "SELECT ? FROM t WHERE id=?")]
+    assert (count, slow, rows) == (2, 1, 2)
+    assert abs(total_ms - 40) < 0.001
+    assert abs(max_ms - 200) < 0.001
+
+    assert entries[("page: b", "SELECT ? FROM t WHERE id=?")][0] == 1
+
+if __name__ == "__main__":
+    if "normalize" in sys.argv[1:]:
+        normalize()
+    if "aggregate" in sys.argv[1:]:
+        aggregate()
@@ -99,40 +99,16 @@ class CommentChain:
         self.lines_by_sha1[sha1] = (offset, count)
         return self
 
-    def loadComments(self, db, user, include_draft_comments=True):
-        if include_draft_comments:
-            if self.state == "draft":
-                draft_user_id = self.user.id
-            else:
-                draft_user_id = user.id
+    def draftUserId(self, user):
+        # The user whose draft comments and lines are included when 'user'
+        # looks at this chain.
+        if self.state == "draft":
+            return self.user.id
         else:
-            draft_user_id = None
+            return user.id
 
-        cursor = db.cursor()
-        cursor.execute("""SELECT comments.id,
-                                 comments.batch,
-                                 comments.state,
-                                 comments.uid,
-                                 comments.time,
-                                 comments.comment,
-                                 comments.code,
-                                 commentstoread.uid IS NOT NULL AS unread
-                            FROM comments
-                 LEFT OUTER JOIN commentstoread ON (comments.id=commentstoread.comment AND commentstoread.uid=%s)
-                           WHERE comments.chain=%s
-                             AND ((comments.state='draft' AND comments.uid=%s) OR comments.state='current')
-                        ORDER BY time""",
-                       (user.id, self.id, draft_user_id))
-        last = None
-        for comment_id, batch_id, comment_state, author_id, time, comment, code, unread in cursor.fetchall():
-            author = dbutils.User.fromId(db, author_id)
-            adjusted_time = user.adjustTimestamp(db, time)
-            when = user.formatTimestamp(db, time)
-            comment = Comment(self, batch_id, comment_id, comment_state, author,
-                              adjusted_time, when, comment, code, unread)
-            if comment_state == 'draft': last = comment
-            else: self.comments.append(comment)
-        if last: self.comments.append(last)
+    def loadComments(self, db, user, include_draft_comments=True):
+        CommentChain.loadCommentsOf(db, [self], user, include_draft_comments)
 
     def when(self):
         return self.comments[0].when
@@ -243,29 +219,69 @@ class CommentChain:
 
     @staticmethod
     def fromId(db, id, user, review=None, skip=None):
-        cursor = db.cursor()
-        cursor.execute("SELECT review, batch, uid, type, state, origin, file, first_commit, last_commit, closed_by, addressed_by FROM commentchains WHERE id=%s", [id])
-        row = cursor.fetchone()
-        if not row:
+        chains = CommentChain.fromIds(db, [id], user, review=review, skip=skip)
+        if not chains:
             return None
         else:
-            review_id, batch_id, user_id, type, state, origin, file_id, first_commit_id, last_commit_id, closed_by_id, addressed_by_id = row
+            return chains[0]
+
+    @staticmethod
+    def fromIds(db, ids, user, review=None, skip=None):
+        """Return a list of CommentChain objects, one per existing chain id
+
+           Equivalent to calling fromId() for each id, but uses a constant
+           number of queries regardless of the number of chains.  Chains are
+           returned in the order their ids are listed in 'ids'; ids of chains
+           that don't exist are ignored."""
+
+        ids = list(ids)
+
+        if not ids:
+            return []
+
+        cursor = db.cursor()
+        cursor.execute("""SELECT id, review, batch, uid, type, state, origin, file,
+                                 first_commit, last_commit, closed_by, addressed_by
+                            FROM commentchains
+                           WHERE id=ANY (%s)""",
+                       (ids,))
+
+        rows = dict((row[0], row[1:]) for row in cursor)
+        ids = [chain_id for chain_id in ids if chain_id in rows]
+
+        if not ids:
+            return []
+
+        cursor.execute("""SELECT chain,
+                                 from_type, to_type,
+                                 from_state, to_state,
+                                 from_last_commit, to_last_commit,
+                                 from_addressed_by, to_addressed_by
+                            FROM commentchainchanges
+                           WHERE chain=ANY (%s)
+                             AND uid=%s
+                             AND state='draft'""",
+                       (ids, user.id))
+
+        draft_changes = {}
+        for row in cursor:
+            draft_changes.setdefault(row[0], []).append(row[1:])
+
+        chains_data = []
+        reviews = {}
+        user_ids = set()
+
+        if review is not None:
+            reviews[review.id] = review
+
+        for chain_id in ids:
+            review_id, batch_id, user_id, type, state, origin, file_id, first_commit_id, last_commit_id, closed_by_id, addressed_by_id = rows[chain_id]
             type_is_draft = False
             state_is_draft = False
             last_commit_is_draft = False
             addressed_by_is_draft = False
 
-            cursor.execute("""SELECT from_type, to_type,
-                                     from_state, to_state,
-                                     from_last_commit, to_last_commit,
-                                     from_addressed_by, to_addressed_by
-                                FROM commentchainchanges
-                               WHERE chain=%s
-                                 AND uid=%s
-                                 AND state='draft'""",
-                           [id, user.id])
-
-            for from_type, to_type, from_state, to_state, from_last_commit_id, to_last_commit_id, from_addressed_by_id, to_addressed_by_id in cursor:
+            for from_type, to_type, from_state, to_state, from_last_commit_id, to_last_commit_id, from_addressed_by_id, to_addressed_by_id in draft_changes.get(chain_id, []):
                 if from_state == state:
                     state = to_state
                     state_is_draft = True
@@ -282,47 +298,152 @@ class CommentChain:
                     addressed_by_is_draft = True
 
             if review is None:
-                review = dbutils.Review.fromId(db, review_id, load_commits=False)
+                if review_id not in reviews:
+                    reviews[review_id] = dbutils.Review.fromId(db, review_id, load_commits=False)
             else:
                 assert review.id == review_id
 
-            first_commit = last_commit = addressed_by = None
+            user_ids.add(user_id)
+            if closed_by_id:
+                user_ids.add(closed_by_id)
+
+            chains_data.append((chain_id, review_id, batch_id, user_id, type, state, origin, file_id, first_commit_id, last_commit_id, closed_by_id, addressed_by_id, type_is_draft, state_is_draft, last_commit_is_draft, addressed_by_is_draft))
+
+        dbutils.User.fromIds(db, list(user_ids))
+
+        commits = {}
+
+        if not skip or 'commits' not in skip:
+            commit_ids = set()
+            for data in chains_data:
+                commit_ids.update(commit_id for commit_id in (data[8], data[9], data[11]) if commit_id)
+
+            missing = [commit_id for commit_id in commit_ids if commit_id not in db.storage["Commit"]]
+            for commit_id in commit_ids:
+                if commit_id not in missing:
+                    commits[commit_id] = db.storage["Commit"][commit_id]
+
+            if missing:
+                cursor.execute("SELECT id, sha1 FROM commits WHERE id=ANY (%s)", (missing,))
+                sha1s = dict(cursor)
+
+                # All commits referenced by a review's comment chains are in the
+                # review's repository, so fetch them per repository.
+                missing_by_repository = {}
+                for data in chains_data:
+                    repository = reviews[data[1]].repository
+                    for commit_id in (data[8], data[9], data[11]):
+                        if commit_id in sha1s:
+                            missing_by_repository.setdefault(repository, set()).add(commit_id)
 
-            if not skip or 'commits' not in skip:
-                if first_commit_id: first_commit = gitutils.Commit.fromId(db, review.repository, first_commit_id)
-                if last_commit_id: last_commit = gitutils.Commit.fromId(db, review.repository, last_commit_id)
-                if addressed_by_id: addressed_by = gitutils.Commit.fromId(db, review.repository, addressed_by_id)
+                for repository, repository_commit_ids in missing_by_repository.items():
+                    repository_commit_ids = sorted(repository_commit_ids)
+                    gitobjects = repository.fetchMany([sha1s[commit_id] for commit_id in repository_commit_ids])
+                    for commit_id, gitobject in zip(repository_commit_ids, gitobjects):
+                        commits[commit_id] = gitutils.Commit.fromGitObject(db, repository, gitobject, commit_id)
 
+        chains = []
+
+        for chain_id, review_id, batch_id, user_id, type, state, origin, file_id, first_commit_id, last_commit_id, closed_by_id, addressed_by_id, type_is_draft, state_is_draft, last_commit_is_draft, addressed_by_is_draft in chains_data:
             if closed_by_id: closed_by = dbutils.User.fromId(db, closed_by_id)
             else: closed_by = None
 
-            chain = CommentChain(id, dbutils.User.fromId(db, user_id), review,
-                                 batch_id, type, state, origin, file_id,
-                                 first_commit, last_commit, closed_by, addressed_by,
-                                 type_is_draft=type_is_draft,
-                                 state_is_draft=state_is_draft,
-                                 last_commit_is_draft=last_commit_is_draft,
-                                 addressed_by_is_draft=addressed_by_is_draft)
-
-            if not skip or 'lines' not in skip:
-                if chain.state == "draft":
-                    draft_user_id = chain.user.id
-                else:
-                    draft_user_id = user.id
-
-                cursor.execute("""SELECT sha1, first_line, last_line
-                                    FROM commentchainlines
-                                   WHERE chain=%s
-                                     AND (state='current' OR uid=%s)""",
-                               (id, draft_user_id))
-
-                for sha1, first_line, last_line in cursor.fetchall():
+            chains.append(CommentChain(chain_id, dbutils.User.fromId(db, user_id), reviews[review_id],
+                                       batch_id, type, state, origin, file_id,
+                                       commits.get(first_commit_id), commits.get(last_commit_id),
+                                       closed_by, commits.get(addressed_by_id),
+                                       type_is_draft=type_is_draft,
+                                       state_is_draft=state_is_draft,
+                                       last_commit_is_draft=last_commit_is_draft,
+                                       addressed_by_is_draft=addressed_by_is_draft))
+
+        if not skip or 'lines' not in skip:
+            chains_by_id = dict((chain.id, chain) for chain in chains)
+
+            # Draft lines are those of the chain's author, if the chain itself
+            # is a draft, and otherwise those of the user.  The query returns
+            # a superset of the rows needed; the rest are filtered out below.
+            cursor.execute("""SELECT commentchainlines.chain, commentchainlines.uid,
+                                     commentchainlines.state, commentchainlines.sha1,
+                                     commentchainlines.first_line, commentchainlines.last_line
+                                FROM commentchainlines
+                                JOIN commentchains ON (commentchains.id=commentchainlines.chain)
+                               WHERE commentchainlines.chain=ANY (%s)
+                                 AND (commentchainlines.state='current'
+                                   OR commentchainlines.uid=%s
+                                   OR commentchainlines.uid=commentchains.uid)""",
+                           (ids, user.id))
+
+            for chain_id, line_user_id, line_state, sha1, first_line, last_line in cursor.fetchall():
+                chain = chains_by_id[chain_id]
+                if line_state == "current" or line_user_id == chain.draftUserId(user):
                     chain.setLines(sha1, first_line, last_line - first_line + 1)
 
-            return chain
+        return chains
+
+    @staticmethod
+    def loadCommentsOf(db, chains, user, include_draft_comments=True):
+        """Load the comments of each chain in 'chains'
+
+           Equivalent to calling loadComments() on each chain, but uses a
+           constant number of queries regardless of the number of chains."""
+
+        chains_by_id = dict((chain.id, chain) for chain in chains)
+
+        if not chains_by_id:
+            return
+
+        if include_draft_comments:
+            # Draft comments are those of the chain's author, if the chain
+            # itself is a draft, and otherwise those of the user.  The query
+            # returns a superset of the draft comments needed; the rest are
+            # filtered out below.
+            draft_condition = """(comments.state='draft'
+                                   AND (comments.uid=%(user)s
+                                     OR comments.uid=commentchains.uid))"""
+        else:
+            draft_condition = "FALSE"
+
+        cursor = db.cursor()
+        cursor.execute("""SELECT comments.chain,
+                                 comments.id,
+                                 comments.batch,
+                                 comments.state,
+                                 comments.uid,
+                                 comments.time,
+                                 comments.comment,
+                                 comments.code,
+                                 commentstoread.uid IS NOT NULL AS unread
+                            FROM comments
+                            JOIN commentchains ON (commentchains.id=comments.chain)
+                 LEFT OUTER JOIN commentstoread ON (comments.id=commentstoread.comment AND commentstoread.uid=%%(user)s)
+                           WHERE comments.chain=ANY (%%(chains)s)
+                             AND (comments.state='current' OR %s)
+                        ORDER BY comments.chain, comments.time""" % draft_condition,
+                       { "user": user.id, "chains": chains_by_id.keys() })
+
+        rows = cursor.fetchall()
+
+        dbutils.User.fromIds(db, list(set(row[4] for row in rows)))
+
+        drafts = {}
+
+        for chain_id, comment_id, batch_id, comment_state, author_id, time, comment, code, unread in rows:
+            chain = chains_by_id[chain_id]
+            if comment_state == "draft" and author_id != chain.draftUserId(user):
+                continue
+            author = dbutils.User.fromId(db, author_id)
+            adjusted_time = user.adjustTimestamp(db, time)
+            when = user.formatTimestamp(db, time)
+            comment = Comment(chain, batch_id, comment_id, comment_state, author,
+                              adjusted_time, when, comment, code, unread)
+            if comment_state == 'draft': drafts[chain_id] = comment
+            else: chain.comments.append(comment)
+
+        for chain_id, comment in drafts.items():
+            chains_by_id[chain_id].comments.append(comment)
 
 def loadCommentChains(db, review, user, file=None, changeset=None, commit=None, local_comments_only=False):
-    result = []
     cursor = db.cursor()
 
     chain_ids = None
@@ -362,21 +483,28 @@ def loadCommentChains(db, review, user, file=None, changeset=None, commit=None,
         if file is not None: files = [file]
         else: files = changeset.files
 
+        # One query for all files, returning a superset of the chains needed,
+        # since the relevant versions differ per file; filtered below.
+        versions = set()
         for file in files:
-            cursor.execute("""SELECT id
-                                FROM commentchains
-                                JOIN commentchainlines ON (commentchainlines.chain=commentchains.id)
-                               WHERE commentchains.review=%s
-                                 AND commentchains.file=%s
-                                 AND commentchains.state!='empty'
-                                 AND (commentchains.state!='draft' OR commentchains.uid=%s)
-                                 AND (commentchainlines.sha1=%s
-                                   OR commentchainlines.sha1=%s)
-                                 AND (commentchainlines.state='current'
-                                   OR commentchainlines.uid=%s)""",
-                           (review.id, file.id, user.id, file.old_sha1, file.new_sha1, user.id))
+            versions.add((file.id, file.old_sha1))
+            versions.add((file.id, file.new_sha1))
+
+        cursor.execute("""SELECT commentchains.id, commentchains.file, commentchainlines.sha1
+                            FROM commentchains
+                            JOIN commentchainlines ON (commentchainlines.chain=commentchains.id)
+                           WHERE commentchains.review=%s
+                             AND commentchains.file=ANY (%s)
+                             AND commentchains.state!='empty'
+                             AND (commentchains.state!='draft' OR commentchains.uid=%s)
+                             AND commentchainlines.sha1=ANY (%s)
+                             AND (commentchainlines.state='current'
+                               OR commentchainlines.uid=%s)""",
+                       (review.id, list(set(file_id for file_id, _ in versions)), user.id,
+                        list(set(sha1 for _, sha1 in versions)), user.id))
 
-            for (chain_id,) in cursor.fetchall():
+        for chain_id, file_id, sha1 in cursor.fetchall():
+            if (file_id, sha1) in versions:
                 chain_ids.add(chain_id)
 
     if chain_ids is None:
@@ -385,12 +513,17 @@ def loadCommentChains(db, review, user, file=None, changeset=None, commit=None,
         for (chain_id,) in cursor.fetchall():
             chain_ids.add(chain_id)
 
-    for chain_id in sorted(chain_ids):
-        chain = CommentChain.fromId(db, chain_id, user, review=review)
-        chain.loadComments(db, user)
-        result.append(chain)
+    return loadCommentChainsById(db, sorted(chain_ids), user, review=review)
+
+def loadCommentChainsById(db, chain_ids, user, review=None, include_draft_comments=True):
+    """Return CommentChain objects, with comments loaded, for 'chain_ids'
+
+       The chains are loaded using a constant number of queries, regardless of
+       the number of chains."""
 
-    return result
+    chains = CommentChain.fromIds(db, chain_ids, user, review=review)
+    CommentChain.loadCommentsOf(db, chains, user, include_draft_comments)
+    return chains
 
 def createCommentChain(db, user, review, chain_type, commit=None, origin=None, file=None, parent=None, child=None, offset=None, count=None):
     import reviewing.comment.propagate
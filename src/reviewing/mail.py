@@ -631,24 +631,25 @@ def sendReviewBatch(db, from_user, to_user, recipients, review, batch_id, was_ac
         return cursor.fetchone() is not None
 
     def fetchNewCommentChains():
-        chains = []
-        for (chain_id,) in cursor.fetchall():
-            if chain_id != batch_chain_id:
-                chain = review_comment.CommentChain.fromId(db, chain_id, from_user, review=review)
-                if not relevant_only or isRelevantComment(chain):
-                    chain.loadComments(db, from_user)
-                    chains.append((chain, None, None))
-        return chains
+        chain_ids = [chain_id for (chain_id,) in cursor.fetchall()
+                     if chain_id != batch_chain_id]
+        chains = [chain for chain in review_comment.CommentChain.fromIds(db, chain_ids, from_user, review=review)
+                  if not relevant_only or isRelevantComment(chain)]
+        review_comment.CommentChain.loadCommentsOf(db, chains, from_user)
+        return [(chain, None, None) for chain in chains]
 
     def fetchAdditionalCommentChains():
-        chains = []
-        for chain_id, comment_id, new_state, new_type in cursor.fetchall():
-            if comment_id is not None or new_state is not None or new_type is not None:
-                chain = review_comment.CommentChain.fromId(db, chain_id, from_user, review=review)
-                if not relevant_only or isRelevantComment(chain):
-                    chain.loadComments(db, from_user)
-                    chains.append((chain, new_state, new_type))
-        return chains
+        changes = [(chain_id, new_state, new_type)
+                   for chain_id, comment_id, new_state, new_type in cursor.fetchall()
+                   if comment_id is not None or new_state is not None or new_type is not None]
+        chain_ids = sorted(set(chain_id for chain_id, _, _ in changes))
+        chains = dict((chain.id, chain)
+                      for chain in review_comment.CommentChain.fromIds(db, chain_ids, from_user, review=review)
+                      if not relevant_only or isRelevantComment(chain))
+        review_comment.CommentChain.loadCommentsOf(db, chains.values(), from_user)
+        return [(chains[chain_id], new_state, new_type)
+                for chain_id, new_state, new_type in changes
+                if chain_id in chains]
 
     cursor.execute("SELECT id FROM commentchains WHERE batch=%s AND type='issue' ORDER BY id ASC", [batch_id])
     new_issues = fetchNewCommentChains()
@@ -994,9 +995,10 @@ Author: %(author.fullname)s <%(author.email)s> at %(author.time)s
             rows = cursor.fetchall()
 
             if rows:
-                for (chain_id,) in rows:
-                    chain = review_comment.CommentChain.fromId(db, chain_id, to_user, review=review)
-                    chain.loadComments(db, to_user, include_draft_comments=False)
+                chains = review_comment.loadCommentChainsById(
+                    db, [chain_id for (chain_id,) in rows], to_user, review=review,
+                    include_draft_comments=False)
+                for chain in chains:
                     body += "\n\n" + renderChainInMail(db, to_user, chain, None, "addressed", None, line_length, context_lines)
 
     files = []
@@ -0,0 +1,252 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2014 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Summary of the progress of reviews.
+#
+# The progress of a review (the number of lines pending review and reviewed,
+# and the number of open issues) and each reviewer's number of pending lines
+# are aggregates over all of the review's rows in the "reviewfiles",
+# "reviewuserfiles" and "commentchains" tables.  Rather than computing them
+# every time a review, or the dashboard, is displayed, they are stored in the
+# "reviewprogress" and "reviewuserprogress" tables.  Everything that changes
+# the state or assignment of a review's files, or the state or type of its
+# issues, calls updateReviewProgress() in the same transaction.
+#
+# Draft changes don't affect the progress until they are submitted, so they
+# need no updates.
+
+class ReviewProgress(object):
+    def __init__(self, review_id, pending_files, pending, reviewed, issues):
+        self.review_id = review_id
+        self.pending_files = pending_files
+        self.pending = pending
+        self.reviewed = reviewed
+        self.issues = issues
+
+    def isAccepted(self):
+        return self.pending_files == 0 and self.issues == 0
+
+    def __eq__(self, other):
+        return ((self.pending_files, self.pending, self.reviewed, self.issues) ==
+                (other.pending_files, other.pending, other.reviewed, other.issues))
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __repr__(self):
+        return ("ReviewProgress(%d, pending_files=%d, pending=%d, reviewed=%d, issues=%d)"
+                % (self.review_id, self.pending_files, self.pending, self.reviewed, self.issues))
+
+def computeReviewProgress(db, review_ids):
+    """Compute the progress of reviews from the underlying tables
+
+       Returns a tuple (progress, user_progress), where 'progress' is a
+       dictionary mapping each review id to a ReviewProgress object, and
+       'user_progress' is a dictionary mapping (review id, user id) to a tuple
+       (pending files, deleted lines, inserted lines) for each user with
+       pending changes assigned."""
+
+    review_ids = list(set(review_ids))
+    progress = dict((review_id, ReviewProgress(review_id, 0, 0, 0, 0))
+                    for review_id in review_ids)
+    user_progress = {}
+
+    if not review_ids:
+        return progress, user_progress
+
+    cursor = db.cursor()
+    cursor.execute("""SELECT review,
+                             SUM(CASE WHEN state='pending' THEN 1 ELSE 0 END),
+                             SUM(CASE WHEN state='pending' THEN deleted + inserted ELSE 0 END),
+                             SUM(CASE WHEN state!='pending' THEN deleted + inserted ELSE 0 END)
+                        FROM reviewfiles
+                       WHERE review=ANY (%s)
+                    GROUP BY review""",
+                   (review_ids,))
+
+    for review_id, pending_files, pending, reviewed in cursor:
+        item = progress[review_id]
+        item.pending_files = pending_files
+        item.pending = pending
+        item.reviewed = reviewed
+
+    cursor.execute("""SELECT review, COUNT(id)
+                        FROM commentchains
+                       WHERE review=ANY (%s)
+                         AND type='issue'
+                         AND state='open'
+                    GROUP BY review""",
+                   (review_ids,))
+
+    for review_id, issues in cursor:
+        progress[review_id].issues = issues
+
+    cursor.execute("""SELECT reviewfiles.review, reviewuserfiles.uid, COUNT(reviewfiles.id),
+                             SUM(reviewfiles.deleted), SUM(reviewfiles.inserted)
+                        FROM reviewfiles
+                        JOIN reviewuserfiles ON (reviewuserfiles.file=reviewfiles.id)
+                       WHERE reviewfiles.review=ANY (%s)
+                         AND reviewfiles.state='pending'
+                    GROUP BY reviewfiles.review, reviewuserfiles.uid""",
+                   (review_ids,))
+
+    for review_id, user_id, pending_files, deleted, inserted in cursor:
+        user_progress[(review_id, user_id)] = (pending_files, deleted, inserted)
+
+    return progress, user_progress
+
+def updateReviewProgress(db, review_ids):
+    """Recompute and store the progress of the reviews in 'review_ids'
+
+       Must be called after the changes have been made, but before they are
+       committed.  The reviews' "reviewprogress" rows are locked first, so
+       that concurrent updates of the same review are serialized; whoever
+       commits last has then seen everyone else's committed changes."""
+
+    review_ids = sorted(set(review_ids))
+
+    if not review_ids:
+        return
+
+    cursor = db.cursor()
+    cursor.execute("""SELECT review
+                        FROM reviewprogress
+                       WHERE review=ANY (%s)
+                    ORDER BY review""",
+                   (review_ids,),
+                   for_update=True)
+
+    existing = set(review_id for (review_id,) in cursor)
+
+    progress, user_progress = computeReviewProgress(db, review_ids)
+
+    cursor.executemany("""UPDATE reviewprogress
+                             SET pending_files=%s,
+                                 pending=%s,
+                                 reviewed=%s,
+                                 issues=%s
+                           WHERE review=%s""",
+                       [(item.pending_files, item.pending, item.reviewed, item.issues, review_id)
+                        for review_id, item in sorted(progress.items())
+                        if review_id in existing])
+    cursor.executemany("""INSERT INTO reviewprogress (review, pending_files, pending, reviewed, issues)
+                               SELECT id, %s, %s, %s, %s
+                                 FROM reviews
+                                WHERE id=%s""",
+                       [(item.pending_files, item.pending, item.reviewed, item.issues, review_id)
+                        for review_id, item in sorted(progress.items())
+                        if review_id not in existing])
+
+    cursor.execute("DELETE FROM reviewuserprogress WHERE review=ANY (%s)", (review_ids,))
+    cursor.executemany("""INSERT INTO reviewuserprogress (review, uid, pending_files, deleted, inserted)
+                               VALUES (%s, %s, %s, %s, %s)""",
+                       [(review_id, user_id, pending_files, deleted, inserted)
+                        for (review_id, user_id), (pending_files, deleted, inserted)
+                        in sorted(user_progress.items())])
+
+def fetchReviewProgress(db, review_ids):
+    """Return a dictionary mapping each review id to a ReviewProgress object
+
+       The progress of reviews missing from the "reviewprogress" table (which
+       should only happen if it hasn't been rebuilt since it was created) is
+       computed instead."""
+
+    review_ids = list(set(review_ids))
+
+    if not review_ids:
+        return {}
+
+    cursor = db.cursor()
+    cursor.execute("""SELECT review, pending_files, pending, reviewed, issues
+                        FROM reviewprogress
+                       WHERE review=ANY (%s)""",
+                   (review_ids,))
+
+    progress = dict((row[0], ReviewProgress(*row)) for row in cursor)
+    missing = [review_id for review_id in review_ids if review_id not in progress]
+
+    if missing:
+        progress.update(computeReviewProgress(db, missing)[0])
+
+    return progress
+
+def getAllReviewIds(db):
+    cursor = db.cursor()
+    cursor.execute("SELECT id FROM reviews ORDER BY id")
+    return [review_id for (review_id,) in cursor]
+
+def verifyReviewProgress(db, review_ids=None):
+    """Compare the stored progress of reviews with the actual progress
+
+       Returns a list of strings describing the differences found, which is
+       empty if the stored progress of all reviews (or those in 'review_ids')
+       is correct."""
+
+    if review_ids is None:
+        review_ids = getAllReviewIds(db)
+
+    review_ids = sorted(set(review_ids))
+    problems = []
+
+    if not review_ids:
+        return problems
+
+    cursor = db.cursor()
+    cursor.execute("""SELECT review, pending_files, pending, reviewed, issues
+                        FROM reviewprogress
+                       WHERE review=ANY (%s)""",
+                   (review_ids,))
+
+    stored = dict((row[0], ReviewProgress(*row)) for row in cursor)
+
+    cursor.execute("""SELECT review, uid, pending_files, deleted, inserted
+                        FROM reviewuserprogress
+                       WHERE review=ANY (%s)""",
+                   (review_ids,))
+
+    stored_users = dict(((review_id, user_id), (pending_files, deleted, inserted))
+                        for review_id, user_id, pending_files, deleted, inserted in cursor)
+
+    actual, actual_users = computeReviewProgress(db, review_ids)
+
+    for review_id in review_ids:
+        if review_id not in stored:
+            problems.append("r/%d: progress missing" % review_id)
+        elif stored[review_id] != actual[review_id]:
+            problems.append("r/%d: stored %r, actual %r"
+                            % (review_id, stored[review_id], actual[review_id]))
+
+    for key in sorted(set(stored_users) | set(actual_users)):
+        if stored_users.get(key) != actual_users.get(key):
+            problems.append("r/%d: user %d: stored %r, actual %r (pending files, deleted, inserted)"
+                            % (key + (stored_users.get(key), actual_users.get(key))))
+
+    return problems
+
+def rebuildReviewProgress(db, review_ids=None, batch_size=100):
+    """Recompute the stored progress of all reviews (or those in 'review_ids')
+
+       The reviews are processed, and the changes committed, in batches of
+       'batch_size' reviews."""
+
+    if review_ids is None:
+        review_ids = getAllReviewIds(db)
+
+    review_ids = sorted(set(review_ids))
+
+    for offset in range(0, len(review_ids), batch_size):
+        updateReviewProgress(db, review_ids[offset:offset + batch_size])
+        db.commit()
@@ -26,6 +26,7 @@ import changeset.utils as changeset_utils
 import changeset.load as changeset_load
 import reviewing.comment
 import reviewing.filters
+import reviewing.progress
 import log.commitset as log_commitset
 
 from operation import OperationError, OperationFailure
@@ -391,6 +392,8 @@ Please confirm that this is intended by loading:
 
         reviewing.comment.propagateCommentChains(db, user, review, new_commits, replayed_rebases)
 
+    reviewing.progress.updateReviewProgress(db, [review.id])
+
     if pending_mails is None: pending_mails = []
 
     notify_commits = filter(lambda commit: commit not in silent_commits, commits)
@@ -790,6 +793,9 @@ def addReviewFilters(db, creator, user, review, reviewer_paths, watcher_paths):
         cursor.executemany("INSERT INTO reviewassignmentchanges (transaction, file, uid, assigned) VALUES (%s, %s, %s, true)",
                            izip(repeat(transaction_id), insert_files, repeat(user.id)))
 
+    if delete_files or insert_files:
+        reviewing.progress.updateReviewProgress(db, [review.id])
+
     return generateMailsForAssignmentsTransaction(db, transaction_id)
 
 def parseReviewFilters(db, data):
@@ -883,6 +889,8 @@ def applyFilters(db, user, review, globalfilters=False, parentfilters=False):
         pending_mails.extend(mail.sendFiltersApplied(
                 db, user, new_watcher, review, globalfilters, parentfilters, None))
 
+    reviewing.progress.updateReviewProgress(db, [review.id])
+
     review.incrementSerial(db)
 
     db.commit()
@@ -973,3 +981,8 @@ def retireUser(db, user):
                               AND reviewuserfiles.file=reviewfiles.id
                               AND reviewfiles.state='pending'""",
                    (user.id,))
+
+    # Which means the user has no pending changes in any review.
+    cursor.execute("""DELETE FROM reviewuserprogress
+                            WHERE uid=%s""",
+                   (user.id,))
@@ -223,8 +223,12 @@ class CLexerGroupingException(Exception):
     def tokens(self):
         return self.__tokens
 
-def iskeyword(value): return (str(value)[0].isalpha() or str(value)[0] == "_") and str(value) in KEYWORDS
-def isidentifier(value): return (str(value)[0].isalpha() or str(value)[0] == "_") and str(value) not in KEYWORDS
+def iskeyword(value):
+    value = str(value)
+    return (value[0].isalpha() or value[0] == "_") and value in KEYWORDS
+def isidentifier(value):
+    value = str(value)
+    return (value[0].isalpha() or value[0] == "_") and value not in KEYWORDS
 def isspace(value): return str(value).isspace()
 def iscomment(value): return str(value)[0:2] in ("/*", "//")
 def isppdirective(value): return str(value).lstrip(" \t").startswith("#")
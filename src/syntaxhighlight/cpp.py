@@ -16,39 +16,59 @@
 
 import syntaxhighlight
 import syntaxhighlight.clexer
-import htmlutils
 import configuration
 
+from syntaxhighlight import escape
+
 class HighlightCPP:
     def highlightToken(self, token):
-        if token.iskeyword():
-            self.output.write("<b class='kw'>" + str(token) + "</b>")
-        elif token.isidentifier():
-            self.output.write("<b class='id'>" + str(token) + "</b>")
-        elif token.iscomment():
-            if str(token)[0:2] == "/*":
-                lines = str(token).splitlines()
-                self.output.write("\n".join(["<b class='com'>" + htmlutils.htmlify(line) + "</b>" for line in lines]))
+        """Output the token, and return its class (None for whitespace and
+           conflict markers)
+
+           The token is classified by looking at its string value directly,
+           instead of using the (many, and each time converting) Token.is*()
+           methods."""
+
+        value = str(token)
+        first = value[0]
+
+        if first.isalpha() or first == "_":
+            if value in syntaxhighlight.clexer.KEYWORDS:
+                cls = "kw"
             else:
-                self.output.write("<b class='com'>" + htmlutils.htmlify(token) + "</b>")
-        elif token.isppdirective():
-            lines = str(token).split("\n")
-            self.output.write("\n".join(["<b class='pp'>" + htmlutils.htmlify(line) + "</b>" for line in lines]))
-        elif token.isspace():
-            self.output.write(str(token))
-        elif token.isconflictmarker():
-            self.output.write(htmlutils.htmlify(token))
+                cls = "id"
+            self.output.append("<b class='" + cls + "'>" + value + "</b>")
+            return cls
+        elif value[0:2] == "/*":
+            self.output.append("\n".join(["<b class='com'>" + escape(line) + "</b>" for line in value.splitlines()]))
+            return "com"
+        elif value[0:2] == "//":
+            self.output.append("<b class='com'>" + escape(value) + "</b>")
+            return "com"
+        elif value.lstrip(" \t").startswith("#"):
+            self.output.append("\n".join(["<b class='pp'>" + escape(line) + "</b>" for line in value.split("\n")]))
+            return "pp"
+        elif value.isspace():
+            self.output.append(value)
+            return None
+        elif first in "<=>" and token.isconflictmarker():
+            self.output.append(escape(value))
+            return None
+        elif first == '"':
+            cls = "str"
+        elif first == "'":
+            cls = "ch"
+        elif token.isfloat():
+            self.output.append("<b class='fp'>" + value + "</b>")
+            return "fp"
+        elif token.isint():
+            self.output.append("<b class='int'>" + value + "</b>")
+            return "int"
         else:
-            if str(token)[0] == '"':
-                self.output.write("<b class='str'>" + htmlutils.htmlify(token) + "</b>")
-            elif str(token)[0] == "'":
-                self.output.write("<b class='ch'>" + htmlutils.htmlify(token) + "</b>")
-            elif token.isfloat():
-                self.output.write("<b class='fp'>" + str(token) + "</b>")
-            elif token.isint():
-                self.output.write("<b class='int'>" + str(token) + "</b>")
-            else:
-                self.output.write("<b class='op'>" + htmlutils.htmlify(token) + "</b>")
+            cls = "op"
+
+        self.output.append("<b class='" + cls + "'>" + escape(value) + "</b>")
+        return cls
 
     def outputContext(self, tokens, terminator):
         if not self.contexts: return
@@ -99,17 +119,17 @@ class HighlightCPP:
         level = 0
 
         for token in tokens:
-            self.highlightToken(token)
+            cls = self.highlightToken(token)
 
-            if token.isspace() or token.iscomment() or token.isppdirective() or token.isconflictmarker():
+            if cls is None or cls == "com" or cls == "pp":
                 pass
-            elif token.iskeyword():
+            elif cls == "kw":
                 if str(token) in ("if", "else", "for", "while", "do", "switch", "return", "break", "continue"):
                     nextContext = None
                     nextContextClosed = True
                 elif not nextContextClosed:
                     nextContext.append(token)
-            elif token.isidentifier():
+            elif cls == "id":
                 if not nextContextClosed:
                     nextContext.append(token)
             elif token == '{':
@@ -151,11 +171,14 @@ class HighlightCPP:
 
     def __call__(self, source, output, contexts_path):
         source = source.encode("utf-8")
-        self.output = output
+        # Output is collected in a list and written all at once, instead of
+        # being written to the file token by token.
+        self.output = []
         if contexts_path: self.contexts = open(contexts_path, "w")
         else: self.contexts = None
         self.processTokens(syntaxhighlight.clexer.tokenize(syntaxhighlight.clexer.split(source)))
         if contexts_path: self.contexts.close()
+        output.write("".join(self.output))
 
     @staticmethod
     def create(language):
@@ -15,11 +15,15 @@
 # the License.
 
 import os
+import re
 import errno
+import subprocess
+import StringIO
 
 import syntaxhighlight
 import gitutils
 import textutils
+import configuration
 
 def createHighlighter(language):
     import cpp
@@ -30,7 +34,80 @@ def createHighlighter(language):
     highlighter = generic.HighlightGeneric.create(language)
     if highlighter: return highlighter
 
-def generateHighlight(repository_path, sha1, language, output_file=None):
+RE_CONFLICT_MARKER = re.compile("^(?:<<<<<<<|=======|>>>>>>>)", re.MULTILINE)
+
+def diffBlobs(repository_path, old_sha1, new_sha1):
+    argv = [configuration.executables.GIT, "diff", "-U0", "--no-color",
+            old_sha1, new_sha1]
+    git = subprocess.Popen(argv, stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE, cwd=repository_path)
+    stdout, stderr = git.communicate()
+    if git.returncode != 0:
+        raise gitutils.GitCommandError(" ".join(argv), stderr.strip(), repository_path)
+    return stdout
+
+def highlightIncrementally(repository_path, base_sha1, sha1, language,
+                           highlighter, source, statistics):
+    """Highlight 'source' reusing the stored highlighting of 'base_sha1'
+
+       Returns the highlighted source, or None if incremental highlighting
+       isn't possible, in which case the caller highlights it fully."""
+
+    import generic
+    import incremental
+
+    if not isinstance(highlighter, generic.HighlightGeneric):
+        # Other highlighters produce code contexts, and need all of the source.
+        return None
+
+    # Conflict markers are handled specially by the full highlighter, and the
+    # lexers may translate other linebreaks to "\n", so avoid such sources.
+    # The lexers also add a linebreak to the last line if there is none.
+    if RE_CONFLICT_MARKER.search(source) or "\r" in source or not source.endswith("\n"):
+        return None
+
+    old_output = syntaxhighlight.readCachedHighlight(base_sha1, language)
+    if old_output is None:
+        return None
+
+    old_source = textutils.decode(
+        gitutils.Repository.readObject(repository_path, "blob", base_sha1))
+    if RE_CONFLICT_MARKER.search(old_source) or "\r" in old_source:
+        return None
+
+    chunks = incremental.parseChunks(diffBlobs(repository_path, base_sha1, sha1))
+
+    old_lines = old_output.split("\n")
+    new_lines = source.split("\n")
+
+    # Both outputs end with a linebreak, so the last item in each list is an
+    # empty string that doesn't correspond to a line in the diff.
+    try:
+        mapping = incremental.mapLines(chunks, len(old_lines) - 1, len(new_lines) - 1)
+    except ValueError:
+        return None
+    mapping.append(len(old_lines) - 1)
+
+    lines, lexed = incremental.highlightIncrementally(
+        highlighter.lines, old_lines, new_lines, mapping)
+
+    if statistics is not None:
+        statistics["incremental"] = True
+        statistics["lines"] = len(new_lines) - 1
+        statistics["lexed"] = min(lexed, len(new_lines) - 1)
+
+    return "\n".join(lines)
+
+def generateHighlight(repository_path, sha1, language, output_file=None,
+                      base_sha1=None, statistics=None):
+    """Highlight a blob and store the result
+
+       If 'base_sha1' is specified, and HIGHLIGHT["incremental"] is not "off",
+       the stored highlighting of that blob (typically an older version of the
+       same file) is reused for unchanged parts of the file.  In "check" mode,
+       the file is also highlighted fully, the full result is stored, and
+       whether the results were identical is recorded in 'statistics'."""
+
     highlighter = createHighlighter(language)
     if not highlighter: return False
 
@@ -39,18 +116,59 @@ def generateHighlight(repository_path, sha1, language, output_file=None):
 
     if output_file:
         highlighter(source, output_file, None)
-    else:
-        output_path = syntaxhighlight.generateHighlightPath(sha1, language)
+        return True
+
+    output_path = syntaxhighlight.generateHighlightPath(sha1, language)
+
+    # The code contexts file is written next to where the highlighted file
+    # would be stored in the "files" storage also when the packed store is
+    # used, and deleted by the highlight service after importing it.
+    try: os.makedirs(os.path.dirname(output_path), 0750)
+    except OSError as error:
+        if error.errno == errno.EEXIST: pass
+        else: raise
+
+    contexts_path = output_path + ".ctx"
+
+    mode = configuration.services.HIGHLIGHT.get("incremental", "off")
+    output = None
+
+    if base_sha1 and mode != "off":
+        output = highlightIncrementally(repository_path, base_sha1, sha1, language,
+                                        highlighter, source, statistics)
 
-        try: os.makedirs(os.path.dirname(output_path), 0750)
-        except OSError as error:
-            if error.errno == errno.EEXIST: pass
-            else: raise
+        if output is not None and mode == "check":
+            full_output = StringIO.StringIO()
+            highlighter(source, full_output, contexts_path)
+            full_output = full_output.getvalue()
+            if isinstance(full_output, unicode):
+                full_output = full_output.encode("utf-8")
 
+            if statistics is not None:
+                statistics["check"] = "match" if output == full_output else "mismatch"
+
+            output = full_output
+
+    store = syntaxhighlight.getPackedStore()
+
+    if store:
+        if output is None:
+            output_file = StringIO.StringIO()
+
+            highlighter(source, output_file, contexts_path)
+
+            output = output_file.getvalue()
+            if isinstance(output, unicode):
+                output = output.encode("utf-8")
+
+        store.write(sha1, language, output)
+    else:
         output_file = open(output_path + ".tmp", "w")
-        contexts_path = output_path + ".ctx"
 
-        highlighter(source, output_file, contexts_path)
+        if output is None:
+            highlighter(source, output_file, contexts_path)
+        else:
+            output_file.write(output)
 
         output_file.close()
 
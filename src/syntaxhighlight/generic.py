@@ -31,43 +31,77 @@ LANGUAGES = { "python": pygments.lexers.PythonLexer,
               "objective-c": pygments.lexers.ObjectiveCLexer,
               "xml": pygments.lexers.XmlLexer }
 
+# CSS class for each token type, and whether tokens of the type can span
+# multiple lines, in which case each line is tagged separately.  Filled in as
+# token types are first seen, so that the (relatively expensive) token type
+# hierarchy checks are done once per token type rather than once per token.
+TOKEN_CLASSES = {}
+
+def classifyToken(token):
+    Token = pygments.token.Token
+
+    if token in Token.Punctuation or token in Token.Operator:
+        result = ("op", False)
+    elif token in Token.Name or token in Token.String.Symbol:
+        result = ("id", False)
+    elif token in Token.Keyword:
+        result = ("kw", False)
+    elif token in Token.String:
+        result = ("str", True)
+    elif token in Token.Comment:
+        result = ("com", True)
+    elif token in Token.Number.Integer:
+        result = ("int", False)
+    elif token in Token.Number.Float:
+        result = ("fp", False)
+    else:
+        result = (None, False)
+
+    TOKEN_CLASSES[token] = result
+    return result
+
 class HighlightGeneric:
     def __init__(self, lexer):
         self.lexer = lexer
 
-    def highlightToken(self, token, value):
-        def tag(cls, value): return "<b class='%s'>%s</b>" % (cls, htmlutils.htmlify(value))
-        def tagm(cls, value):
-            if value == "\n": return value
+    def highlightTokens(self, tokens):
+        """Yield highlighted output for the (token type, value) pairs
+
+           Consecutive untagged tokens (mostly whitespace) are escaped and
+           yielded together."""
+
+        untagged = []
+
+        for token, value in tokens:
+            cls, multiline = TOKEN_CLASSES.get(token) or classifyToken(token)
+
+            value = value.encode("utf-8")
+
+            if cls is None:
+                untagged.append(value)
+                continue
+
+            if untagged:
+                yield syntaxhighlight.escape("".join(untagged))
+                untagged = []
+
+            if not multiline or (value and "\n" not in value and "\r" not in value):
+                yield "<b class='%s'>%s</b>" % (cls, syntaxhighlight.escape(value))
+            elif value == "\n":
+                yield value
             else:
-                res = []
-                for line in value.splitlines():
-                    if line: res.append(tag(cls, line))
-                    else: res.append(line)
-                if value.endswith("\n"): res.append("")
-                return "\n".join(res)
-
-        value = value.encode("utf-8")
-
-        if token in pygments.token.Token.Punctuation or token in pygments.token.Token.Operator:
-            self.output.write(tag("op", value))
-        elif token in pygments.token.Token.Name or token in pygments.token.Token.String.Symbol:
-            self.output.write(tag("id", value))
-        elif token in pygments.token.Token.Keyword:
-            self.output.write(tag("kw", value))
-        elif token in pygments.token.Token.String:
-            self.output.write(tagm("str", value))
-        elif token in pygments.token.Token.Comment:
-            self.output.write(tagm("com", value))
-        elif token in pygments.token.Token.Number.Integer:
-            self.output.write(tag("int", value))
-        elif token in pygments.token.Token.Number.Float:
-            self.output.write(tag("fp", value))
-        else:
-            self.output.write(htmlutils.htmlify(value))
+                lines = [("<b class='%s'>%s</b>" % (cls, syntaxhighlight.escape(line)) if line else line)
+                         for line in value.splitlines()]
+                if value.endswith("\n"): lines.append("")
+                yield "\n".join(lines)
+
+        if untagged:
+            yield syntaxhighlight.escape("".join(untagged))
 
     def __call__(self, source, output_file, contexts_path):
-        self.output = output_file
+        # Output is produced as a list of strings and written once per block,
+        # instead of being written to the file token by token.
+        output = []
 
         blocks = re.split("^((?:<<<<<<<|>>>>>>>)[^\n]*\n)", source, flags=re.MULTILINE)
 
@@ -83,16 +117,40 @@ class HighlightGeneric:
                 for index, block in enumerate(blocks):
                     if (index & 1) == 0:
                         if block:
-                            for token, value in self.lexer.get_tokens(block):
-                                self.highlightToken(token, value)
+                            output.extend(self.highlightTokens(self.lexer.get_tokens(block)))
                     else:
                         assert block[0] == "="
-                        self.output.write(htmlutils.htmlify(block))
+                        output.append(htmlutils.htmlify(block).encode("utf-8"))
             else:
                 assert block[0] == "<" or block[0] == ">"
-                self.output.write(htmlutils.htmlify(block))
+                output.append(htmlutils.htmlify(block).encode("utf-8"))
                 in_conflict = block[0] == "<"
 
+            output_file.write("".join(output))
+            del output[:]
+
+    def lines(self, source):
+        """Highlight 'source' and yield the output one line at a time
+
+           Lexing is done lazily, so abandoning the iteration early means the
+           rest of the source is never lexed.  The source must not contain
+           conflict markers; they are not handled specially here."""
+
+        partial = ""
+
+        for data in self.highlightTokens(self.lexer.get_tokens(source)):
+            if "\n" not in data:
+                partial += data
+                continue
+
+            split = (partial + data).split("\n")
+            partial = split.pop()
+
+            for line in split:
+                yield line
+
+        yield partial
+
     @staticmethod
     def create(language):
         lexer = LANGUAGES.get(language)
@@ -0,0 +1,182 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2014 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Incremental re-highlighting.
+#
+# Highlighted output is line oriented: every line of output corresponds to one
+# line of source, and markup never spans lines.  So when a file changes by a
+# few lines, the highlighted output of the previous version can be reused for
+# all lines except those near the changes.
+#
+# For each changed region, the lexer is restarted (in its initial state) a few
+# lines before the region.  If the lines it produces before the region are
+# identical to the previous output, the restart point is assumed to be safe;
+# otherwise it is moved further back (ultimately to the start of the file.)
+# After the region, lexing continues until a number of consecutive lines are
+# identical to the corresponding lines of the previous output, at which point
+# the lexer is assumed to have resynchronized, and the previous output is
+# used until the next changed region.
+
+import re
+
+# Number of lines before a changed region that lexing is first restarted at.
+# Multiplied by four each time the restart point turns out to be unsafe.
+BACKTRACK_LINES = 8
+
+# Number of consecutive (unchanged, and identical) lines, at least one of
+# which is significant, after which the lexer is considered resynchronized.
+RESYNC_LINES = 3
+
+# Lines that are blank, or entirely a string or comment, are highlighted the
+# same way in many lexer states (e.g. inside different kinds of multi-line
+# strings) and so don't show that the lexer is in the right state.
+RE_INSIGNIFICANT = re.compile(r"^(?:\s|<b class='(?:str|com)'>[^<]*</b>)*$")
+
+def isSignificant(line):
+    return not RE_INSIGNIFICANT.match(line)
+
+RE_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+def parseChunks(diff_output):
+    """Return (old offset, old count, new offset, new count) per hunk
+
+       Parses the output of "git diff -U0".  Offsets are zero-based."""
+
+    chunks = []
+    for line in diff_output.splitlines():
+        match = RE_HUNK_HEADER.match(line)
+        if match:
+            old_start, old_count, new_start, new_count = match.groups()
+            old_count = 1 if old_count is None else int(old_count)
+            new_count = 1 if new_count is None else int(new_count)
+            # A hunk with a count of zero "starts" after the line numbered.
+            old_offset = int(old_start) - (1 if old_count else 0)
+            new_offset = int(new_start) - (1 if new_count else 0)
+            chunks.append((old_offset, old_count, new_offset, new_count))
+    return chunks
+
+def mapLines(chunks, old_count, new_count):
+    """Map new line numbers to unchanged old line numbers
+
+       Returns a list with one item per new line, that is the number of the
+       same line in the old version, or None if the line is changed."""
+
+    mapping = []
+    old_index = 0
+
+    for old_offset, old_length, new_offset, new_length in chunks:
+        while len(mapping) < new_offset:
+            mapping.append(old_index)
+            old_index += 1
+        mapping.extend([None] * new_length)
+        old_index += old_length
+
+    while len(mapping) < new_count:
+        mapping.append(old_index)
+        old_index += 1
+
+    if old_index != old_count or len(mapping) != new_count:
+        raise ValueError("chunks don't match line counts")
+
+    return mapping
+
+def highlightIncrementally(generate_lines, old_lines, new_lines, mapping):
+    """Highlight the new version of a file, reusing the old version's output
+
+       The 'generate_lines' argument is called with source text and returns
+       an iterator over highlighted lines, lexing lazily.  'old_lines' is the
+       highlighted old version, 'new_lines' the new source, both split on
+       linebreaks, and 'mapping' is as returned by mapLines().
+
+       Returns a tuple of the highlighted lines and the number of lines that
+       were actually lexed."""
+
+    def isUnchanged(line):
+        # Lines following removed lines count as changed, since the removed
+        # lines might have affected the lexer state.
+        if mapping[line] is None:
+            return False
+        elif line == 0:
+            return mapping[line] == 0
+        else:
+            return mapping[line - 1] is not None and mapping[line] == mapping[line - 1] + 1
+
+    output = []
+    lexed = 0
+    index = 0
+    count = len(new_lines)
+
+    while index < count:
+        changed = index
+        while changed < count and isUnchanged(changed):
+            changed += 1
+
+        output.extend(old_lines[mapping[line]] for line in xrange(index, changed))
+
+        if changed == count:
+            break
+
+        # Find a safe point to restart the lexer at.
+        distance = BACKTRACK_LINES
+
+        while True:
+            restart = max(0, changed - distance)
+            generated = generate_lines("\n".join(new_lines[restart:]))
+
+            if restart == 0:
+                # Always safe, so no need to verify anything.
+                del output[:]
+                for line in xrange(changed):
+                    output.append(next(generated))
+                    lexed += 1
+                break
+
+            expected = output[restart:changed]
+
+            for expected_line in expected:
+                lexed += 1
+                if next(generated) != expected_line:
+                    break
+            else:
+                if any(isSignificant(line) for line in expected):
+                    break
+
+            distance *= 4
+
+        # Lex through the changed region, until resynchronized.
+        matched = 0
+        significant = False
+
+        for line in generated:
+            lexed += 1
+            output.append(line)
+            old_line = mapping[len(output) - 1]
+            if old_line is not None and line == old_lines[old_line]:
+                if not isUnchanged(len(output) - 1):
+                    # First line after removed lines; start a new sequence.
+                    matched = 0
+                    significant = False
+                matched += 1
+                significant = significant or isSignificant(line)
+                if matched >= RESYNC_LINES and significant:
+                    break
+            else:
+                matched = 0
+                significant = False
+
+        index = len(output)
+
+    return output, lexed
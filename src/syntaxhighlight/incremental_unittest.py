@@ -0,0 +1,117 @@
+import sys
+import random
+
+def generate_lines(source):
+    # A trivial "highlighter" with state spanning lines: lines inside (or
+    # starting or ending) triple-quoted strings are marked as strings, others
+    # as identifiers.  As with real highlighting, string lines look the same
+    # whether they start or end a string.
+    in_string = False
+    for line in source.split("\n"):
+        if line.count('"""') % 2:
+            in_string = not in_string
+            yield "<b class='str'>%s</b>" % line
+        elif in_string:
+            yield "<b class='str'>%s</b>" % line if line else ""
+        else:
+            yield "<b class='id'>%s</b>" % line if line.strip() else line
+
+def highlight(source):
+    return list(generate_lines(source))
+
+def diff(old_lines, new_lines):
+    # Chunks as (old offset, old count, new offset, new count), computed
+    # using difflib rather than Git.
+    import difflib
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    return [(i1, i2 - i1, j1, j2 - j1)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+            if tag != "equal"]
+
+def chunks():
+    # Imported directly (sys.path[0] is the directory containing this file)
+    # since the syntaxhighlight package itself depends on the configuration.
+    import incremental
+
+    diff_output = """\
+diff --git a/x b/y
+@@ -3 +3 @@
+-a
++b
+@@ -10,0 +11,2 @@
++c
++d
+@@ -20,2 +22,0 @@
+-e
+-f
+"""
+
+    assert incremental.parseChunks(diff_output) == [(2, 1, 2, 1),
+                                                    (10, 0, 10, 2),
+                                                    (19, 2, 22, 0)]
+
+    mapping = incremental.mapLines([(2, 1, 2, 1), (10, 0, 10, 2), (19, 2, 22, 0)],
+                                   25, 25)
+
+    assert mapping[:3] == [0, 1, None]
+    assert mapping[9:13] == [9, None, None, 10]
+    assert mapping[21:23] == [19, 22]
+    assert mapping[-1] == 24
+
+    try:
+        incremental.mapLines([(2, 1, 2, 1)], 10, 11)
+    except ValueError:
+        pass
+    else:
+        assert False, "ValueError not raised"
+
+def splice():
+    import incremental
+
+    rng = random.Random(4711)
+    words = ["x", "y", '"""', 'z"""', "", "  ", "w"]
+
+    for iteration in xrange(500):
+        old_lines = [rng.choice(words) for line in xrange(rng.randint(0, 80))]
+        new_lines = old_lines[:]
+
+        for edit in xrange(rng.randint(1, 4)):
+            offset = rng.randint(0, len(new_lines))
+            removed = rng.randint(0, 3)
+            added = [rng.choice(words) for line in xrange(rng.randint(0, 3))]
+            new_lines[offset:offset + removed] = added
+
+        old_lines.append("")
+        new_lines.append("")
+
+        mapping = incremental.mapLines(diff(old_lines[:-1], new_lines[:-1]),
+                                       len(old_lines) - 1, len(new_lines) - 1)
+        mapping.append(len(old_lines) - 1)
+
+        old_output = highlight("\n".join(old_lines))
+        expected = highlight("\n".join(new_lines))
+
+        output, lexed = incremental.highlightIncrementally(
+            generate_lines, old_output, new_lines, mapping)
+
+        assert output == expected, (old_lines, new_lines)
+
+    # Changing a single line in a long file only lexes lines near it.
+    old_lines = ["line %d" % line for line in xrange(1000)] + [""]
+    new_lines = old_lines[:]
+    new_lines[500] = "changed"
+
+    mapping = incremental.mapLines([(500, 1, 500, 1)], 1000, 1000)
+    mapping.append(1000)
+
+    output, lexed = incremental.highlightIncrementally(
+        generate_lines, highlight("\n".join(old_lines)), new_lines, mapping)
+
+    assert output == highlight("\n".join(new_lines))
+    assert lexed <= incremental.BACKTRACK_LINES + incremental.RESYNC_LINES + 1
+
+if __name__ == "__main__":
+    if "chunks" in sys.argv[1:]:
+        chunks()
+    if "splice" in sys.argv[1:]:
+        splice()
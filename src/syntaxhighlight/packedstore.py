@@ -0,0 +1,379 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2014 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+# Packed storage of syntax highlighted files.
+#
+# Instead of one file per highlighted (blob, language), highlighted files are
+# compressed and appended to a small number of segment files, and located via
+# an on-disk hash table (the index) mapping (SHA-1, language) to segment,
+# offset, length and codec.  Readers mmap the index and the segments; writers
+# serialize on a lock file.  Old data is garbage collected a segment at a time,
+# based on when the segment was last read from or appended to.
+#
+# This module deliberately doesn't depend on the configuration, so that it can
+# be used (and tested) standalone.
+
+import os
+import errno
+import fcntl
+import mmap
+import struct
+import time
+import zlib
+import bz2
+
+CODECS = { "none": 0, "zlib": 1, "bz2": 2 }
+
+INDEX_FILENAME = "index"
+LOCK_FILENAME = "lock"
+SEGMENT_PREFIX = "segment-"
+
+INDEX_MAGIC = "CHLI"
+INDEX_VERSION = 1
+
+# Index file header: magic, version, number of slots, number of entries.
+INDEX_HEADER = struct.Struct("<4sIII")
+# Index slot: binary SHA-1, language, segment, offset, length, codec.  A slot
+# whose SHA-1 is all zeroes is empty.
+INDEX_SLOT = struct.Struct("<20s16sIQIB3x")
+# Record header in segment files, preceding the (compressed) data: binary
+# SHA-1, language, codec, length.  Used to rebuild a lost index.
+RECORD_HEADER = struct.Struct("<20s16sBI")
+
+EMPTY_SHA1 = "\0" * 20
+
+MINIMUM_SLOTS = 1024
+MAXIMUM_LOAD = 0.5
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+class PackedStoreError(Exception):
+    pass
+
+def compress(codec, data):
+    if codec == CODECS["zlib"]:
+        return zlib.compress(data)
+    elif codec == CODECS["bz2"]:
+        return bz2.compress(data)
+    return data
+
+def decompress(codec, data):
+    if codec == CODECS["zlib"]:
+        return zlib.decompress(data)
+    elif codec == CODECS["bz2"]:
+        return bz2.decompress(data)
+    return data
+
+def slotPosition(sha1, language, nslots):
+    return (zlib.crc32(sha1 + language) & 0xffffffff) % nslots
+
+class Index(object):
+    """Read-only (mmap:ed) view of an index file"""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        status = os.fstat(self.file.fileno())
+        self.identity = (status.st_ino, status.st_size)
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.nslots, _ = INDEX_HEADER.unpack_from(self.data, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise PackedStoreError("%s: invalid index file" % path)
+
+    def count(self):
+        return INDEX_HEADER.unpack_from(self.data, 0)[3]
+
+    def find(self, sha1, language):
+        """Return (slot number, entry) or (free slot number, None)"""
+        position = slotPosition(sha1, language, self.nslots)
+        for _ in xrange(self.nslots):
+            entry = INDEX_SLOT.unpack_from(
+                self.data, INDEX_HEADER.size + position * INDEX_SLOT.size)
+            if entry[0] == EMPTY_SHA1:
+                return position, None
+            if entry[0] == sha1 and entry[1].rstrip("\0") == language:
+                return position, entry
+            position = (position + 1) % self.nslots
+        return None, None
+
+    def entries(self):
+        for position in xrange(self.nslots):
+            entry = INDEX_SLOT.unpack_from(
+                self.data, INDEX_HEADER.size + position * INDEX_SLOT.size)
+            if entry[0] != EMPTY_SHA1:
+                yield entry
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+class PackedStore(object):
+    def __init__(self, path, codec="zlib", segment_size=DEFAULT_SEGMENT_SIZE):
+        if codec not in CODECS:
+            raise PackedStoreError("invalid codec: %r" % codec)
+        self.path = path
+        self.__codec = CODECS[codec]
+        self.__segment_size = segment_size
+        self.__index = None
+        self.__segments = {}
+
+    def __indexPath(self):
+        return os.path.join(self.path, INDEX_FILENAME)
+
+    def __segmentPath(self, segment):
+        return os.path.join(self.path, "%s%06d" % (SEGMENT_PREFIX, segment))
+
+    def __listSegments(self):
+        try:
+            filenames = os.listdir(self.path)
+        except OSError as error:
+            if error.errno == errno.ENOENT:
+                return []
+            raise
+        return sorted(int(filename[len(SEGMENT_PREFIX):])
+                      for filename in filenames
+                      if filename.startswith(SEGMENT_PREFIX))
+
+    def __getIndex(self):
+        # The index file is replaced (renamed over) when it is grown or
+        # rebuilt, so check that we still have the current one open.
+        try:
+            status = os.stat(self.__indexPath())
+        except OSError as error:
+            if error.errno == errno.ENOENT:
+                return None
+            raise
+        if not self.__index or self.__index.identity != (status.st_ino, status.st_size):
+            if self.__index:
+                self.__index.close()
+            self.__index = Index(self.__indexPath())
+        return self.__index
+
+    def __getSegment(self, segment, required_size):
+        mapped = self.__segments.get(segment)
+        if mapped is None or len(mapped) < required_size:
+            # Not mapped yet, or appended to since it was mapped.
+            try:
+                segment_file = open(self.__segmentPath(segment), "rb")
+            except IOError as error:
+                if error.errno == errno.ENOENT:
+                    return None
+                raise
+            try:
+                if os.fstat(segment_file.fileno()).st_size < required_size:
+                    return None
+                mapped = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                segment_file.close()
+            self.__segments[segment] = mapped
+        return mapped
+
+    def __lock(self):
+        lock_file = open(os.path.join(self.path, LOCK_FILENAME), "a")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def contains(self, sha1, language):
+        index = self.__getIndex()
+        if not index:
+            return False
+        return index.find(sha1.decode("hex"), language)[1] is not None
+
+    def read(self, sha1, language):
+        """Return the stored data, or None if there is none"""
+        index = self.__getIndex()
+        if not index:
+            return None
+        entry = index.find(sha1.decode("hex"), language)[1]
+        if not entry:
+            return None
+        _, _, segment, offset, length, codec = entry
+        mapped = self.__getSegment(segment, offset + length)
+        if mapped is None or len(mapped) < offset + length:
+            return None
+        # Record the access, for garbage collection.
+        os.utime(self.__segmentPath(segment), None)
+        return decompress(codec, mapped[offset:offset + length])
+
+    def write(self, sha1, language, data):
+        """Store data, unless already stored.  Returns True if stored"""
+        if len(language) > 16:
+            raise PackedStoreError("language name too long: %r" % language)
+
+        try:
+            os.makedirs(self.path, 0750)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+
+        binary_sha1 = sha1.decode("hex")
+        data = compress(self.__codec, data)
+
+        lock_file = self.__lock()
+        try:
+            index = self.__getIndex()
+
+            if index is None:
+                self.__rebuildIndex()
+                index = self.__getIndex()
+            elif (index.count() + 1) > index.nslots * MAXIMUM_LOAD:
+                self.__rebuildIndex(index.count() + 1)
+                index = self.__getIndex()
+
+            position, entry = index.find(binary_sha1, language)
+            if entry:
+                return False
+
+            segments = self.__listSegments()
+            if not segments:
+                segment = 1
+            else:
+                segment = segments[-1]
+                if os.path.getsize(self.__segmentPath(segment)) >= self.__segment_size:
+                    segment += 1
+
+            segment_path = self.__segmentPath(segment)
+            created = not os.path.exists(segment_path)
+
+            with open(segment_path, "ab") as segment_file:
+                if created:
+                    os.chmod(segment_path, 0660)
+                segment_file.write(RECORD_HEADER.pack(binary_sha1, language, self.__codec, len(data)))
+                offset = segment_file.tell()
+                segment_file.write(data)
+
+            slot = INDEX_SLOT.pack(binary_sha1, language, segment, offset, len(data), self.__codec)
+            slot_offset = INDEX_HEADER.size + position * INDEX_SLOT.size
+
+            with open(self.__indexPath(), "r+b") as index_file:
+                # Write the SHA-1 last; until it is written, the slot is empty
+                # to readers.
+                index_file.seek(slot_offset + 20)
+                index_file.write(slot[20:])
+                index_file.flush()
+                index_file.seek(slot_offset)
+                index_file.write(slot[:20])
+                index_file.seek(0)
+                index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION,
+                                                   index.nslots, index.count() + 1))
+
+            return True
+        finally:
+            lock_file.close()
+
+    def __scanSegments(self):
+        # Recover index entries from the record headers in the segments.
+        for segment in self.__listSegments():
+            with open(self.__segmentPath(segment), "rb") as segment_file:
+                while True:
+                    header = segment_file.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        break
+                    sha1, language, codec, length = RECORD_HEADER.unpack(header)
+                    offset = segment_file.tell()
+                    segment_file.seek(length, os.SEEK_CUR)
+                    if segment_file.tell() > os.fstat(segment_file.fileno()).st_size:
+                        # Truncated record.
+                        break
+                    yield (sha1, language, segment, offset, length, codec)
+
+    def __rebuildIndex(self, minimum_count=0, excluded_segments=()):
+        # Must be called with the lock held.
+        index = self.__getIndex()
+        if index:
+            entries = list(index.entries())
+        else:
+            entries = list(self.__scanSegments())
+
+        entries = [entry for entry in entries if entry[2] not in excluded_segments]
+
+        nslots = MINIMUM_SLOTS
+        while max(len(entries), minimum_count) > nslots * MAXIMUM_LOAD:
+            nslots *= 2
+
+        data = bytearray(INDEX_HEADER.size + nslots * INDEX_SLOT.size)
+        INDEX_HEADER.pack_into(data, 0, INDEX_MAGIC, INDEX_VERSION, nslots, len(entries))
+
+        for entry in entries:
+            sha1, language = entry[0], entry[1].rstrip("\0")
+            position = slotPosition(sha1, language, nslots)
+            while True:
+                slot_offset = INDEX_HEADER.size + position * INDEX_SLOT.size
+                if data[slot_offset:slot_offset + 20] == EMPTY_SHA1:
+                    break
+                position = (position + 1) % nslots
+            INDEX_SLOT.pack_into(data, slot_offset, sha1, language, *entry[2:])
+
+        temporary_path = self.__indexPath() + ".tmp"
+        with open(temporary_path, "wb") as index_file:
+            index_file.write(data)
+        os.chmod(temporary_path, 0660)
+        os.rename(temporary_path, self.__indexPath())
+
+        return entries
+
+    def purge(self, max_age):
+        """Delete segments not accessed in 'max_age' seconds
+
+           The segment currently being appended to is never deleted.  Returns
+           a list of (SHA-1, language) for the entries that were deleted."""
+
+        if not os.path.isdir(self.path):
+            return []
+
+        lock_file = self.__lock()
+        try:
+            segments = self.__listSegments()
+            deadline = time.time() - max_age
+            expired = set(segment for segment in segments[:-1]
+                          if os.path.getmtime(self.__segmentPath(segment)) < deadline)
+
+            if not expired:
+                return []
+
+            index = self.__getIndex()
+            if index:
+                purged = [(sha1.encode("hex"), language.rstrip("\0"))
+                          for sha1, language, segment, _, _, _ in index.entries()
+                          if segment in expired]
+            else:
+                purged = []
+
+            self.__rebuildIndex(excluded_segments=expired)
+
+            for segment in expired:
+                os.unlink(self.__segmentPath(segment))
+                mapped = self.__segments.pop(segment, None)
+                if mapped is not None:
+                    mapped.close()
+
+            return purged
+        finally:
+            lock_file.close()
+
+    def statistics(self):
+        index = self.__getIndex()
+        segments = self.__listSegments()
+        return { "entries": index.count() if index else 0,
+                 "segments": len(segments),
+                 "size": sum(os.path.getsize(self.__segmentPath(segment))
+                             for segment in segments) }
+
+    def sha1s(self):
+        """Return the set of SHA-1s for which there is stored data"""
+        index = self.__getIndex()
+        if not index:
+            return set()
+        return set(entry[0].encode("hex") for entry in index.entries())
@@ -0,0 +1,82 @@
+import sys
+import os
+import shutil
+import tempfile
+import time
+
+def basic():
+    # Imported directly (sys.path[0] is the directory containing this file)
+    # since the syntaxhighlight package itself depends on the configuration.
+    import packedstore
+
+    path = tempfile.mkdtemp()
+
+    try:
+        def sha1(index):
+            return "%040x" % (index * 7919)
+
+        # Small segments, so that several are used.
+        store = packedstore.PackedStore(path, codec="zlib", segment_size=16384)
+
+        assert not store.contains(sha1(1), "python")
+        assert store.read(sha1(1), "python") is None
+        assert store.purge(0) == []
+
+        # Enough entries to grow the index a few times.
+        for index in range(1, 3001):
+            data = "<b>highlighted %d</b>\n" % index * (index % 10 + 1)
+            assert store.write(sha1(index), "python", data)
+
+        assert not store.write(sha1(1), "python", "ignored")
+        assert store.write(sha1(1), "c++", "c++ version")
+
+        assert store.read(sha1(1), "python") == "<b>highlighted 1</b>\n" * 2
+        assert store.read(sha1(1), "c++") == "c++ version"
+        assert store.read(sha1(2999), "python") == "<b>highlighted 2999</b>\n" * 10
+        assert store.read(sha1(3001), "python") is None
+        assert not store.contains(sha1(1), "java")
+
+        statistics = store.statistics()
+        assert statistics["entries"] == 3001
+        assert statistics["segments"] > 1
+
+        # A second store instance (i.e. another process) sees the same data,
+        # and data written after it opened the index.
+        other = packedstore.PackedStore(path, codec="bz2")
+        assert other.read(sha1(1000), "python") == "<b>highlighted 1000</b>\n"
+        assert other.write(sha1(5000), "java", "java data")
+        assert store.read(sha1(5000), "java") == "java data"
+        assert other.read(sha1(5000), "java") == "java data"
+
+        # The index can be rebuilt from the segments.
+        os.unlink(os.path.join(path, packedstore.INDEX_FILENAME))
+        assert not store.contains(sha1(1), "python")
+        assert store.write(sha1(6000), "python", "new")
+        assert store.read(sha1(2000), "python") == "<b>highlighted 2000</b>\n" * 1
+        assert store.statistics()["entries"] == 3003
+
+        # Make all but the two latest segments old, then purge them.
+        segments = sorted(filename for filename in os.listdir(path)
+                          if filename.startswith(packedstore.SEGMENT_PREFIX))
+        old = time.time() - 3600
+        for filename in segments[:-2]:
+            os.utime(os.path.join(path, filename), (old, old))
+
+        purged = store.purge(1800)
+        assert purged
+        assert (sha1(1), "python") in purged
+        assert (sha1(2), "python") in purged
+        assert not store.contains(sha1(1), "python")
+        assert other.read(*purged[-1]) is None
+        assert other.read(sha1(1), "c++") == "c++ version"
+        assert store.read(sha1(6000), "python") == "new"
+        assert store.statistics()["entries"] == 3003 - len(purged)
+        assert store.statistics()["segments"] == 2
+        assert sha1(6000) in store.sha1s()
+        assert sha1(2) not in store.sha1s()
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == "__main__":
+    if "basic" in sys.argv[1:]:
+        basic()
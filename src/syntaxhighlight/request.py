@@ -27,17 +27,26 @@ class HighlightBackgroundServiceError(base.ImplementationError):
         super(HighlightBackgroundServiceError, self).__init__(
             "Highlight background service failed: %s" % message)
 
-def requestHighlights(repository, sha1s):
+def requestHighlights(repository, sha1s, priority="interactive", wait=True, bases=None):
     requests = [{ "repository_path": repository.path, "sha1": sha1, "path": path, "language": language }
                 for sha1, (path, language) in sha1s.items()
                 if not syntaxhighlight.isHighlighted(sha1, language)]
 
     if not requests: return
 
+    if bases:
+        # Older versions of the same files, whose highlighting can be reused
+        # when highlighting incrementally.
+        for request in requests:
+            if request["sha1"] in bases:
+                request["base_sha1"] = bases[request["sha1"]]
+
     try:
         connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         connection.connect(configuration.services.HIGHLIGHT["address"])
-        connection.send(json_encode(requests))
+        connection.send(json_encode({ "requests": requests,
+                                      "priority": priority,
+                                      "detached": not wait }))
         connection.shutdown(socket.SHUT_WR)
 
         data = ""
@@ -57,6 +66,12 @@ def requestHighlights(repository, sha1s):
         raise HighlightBackgroundServiceError(
             "returned an invalid response (%r)" % data)
 
+    if not wait:
+        # The service only acknowledges that the requests were queued.
+        if type(results) != dict or results.get("status") != "ok":
+            raise HighlightBackgroundServiceError(str(results))
+        return
+
     if type(results) != list:
         # If not a list, the result is probably an error message.
         raise HighlightBackgroundServiceError(str(results))
@@ -0,0 +1,507 @@
+// Highlighting benchmark input: a gap buffer based text storage with undo
+// support, line indexing and a simple search facility.
+
+#include <algorithm>
+#include <cassert>
+#include <cstddef>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <map>
+#include <memory>
+#include <string>
+#include <utility>
+#include <vector>
+
+#define TEXTBUFFER_INITIAL_GAP 4096
+#define TEXTBUFFER_MAX_UNDO    1024
+#define TEXTBUFFER_ASSERT(expr) \
+    do { if (!(expr)) { std::fprintf(stderr, "%s:%d: assertion failed: %s\n", __FILE__, __LINE__, #expr); std::abort(); } } while (0)
+
+#if defined(TEXTBUFFER_DEBUG) && TEXTBUFFER_DEBUG > 1
+# define TEXTBUFFER_TRACE(fmt, ...) std::fprintf(stderr, "[textbuffer] " fmt "\n", __VA_ARGS__)
+#else
+# define TEXTBUFFER_TRACE(fmt, ...) ((void) 0)
+#endif
+
+namespace text
+{
+
+/* A position in the buffer, expressed either as an absolute character
+   offset or as a line/column pair.  Conversion between the two uses the
+   line index maintained by TextBuffer. */
+struct Position
+{
+    Position() : offset(0), line(0), column(0) {}
+    explicit Position(std::size_t offset) : offset(offset), line(0), column(0) {}
+    Position(unsigned line, unsigned column) : offset(0), line(line), column(column) {}
+
+    bool operator==(const Position &other) const { return offset == other.offset; }
+    bool operator!=(const Position &other) const { return offset != other.offset; }
+    bool operator<(const Position &other) const { return offset < other.offset; }
+
+    std::size_t offset;
+    unsigned line;
+    unsigned column;
+};
+
+struct Range
+{
+    Range(Position start, Position end) : start(start), end(end) {}
+
+    std::size_t length() const { return end.offset - start.offset; }
+    bool empty() const { return start == end; }
+    bool contains(const Position &position) const
+    {
+        return !(position < start) && position < end;
+    }
+
+    Position start;
+    Position end;
+};
+
+class UndoRecord
+{
+public:
+    enum Kind { INSERT, REMOVE };
+
+    UndoRecord(Kind kind, std::size_t offset, const std::string &text)
+        : m_kind(kind), m_offset(offset), m_text(text)
+    {
+    }
+
+    Kind kind() const { return m_kind; }
+    std::size_t offset() const { return m_offset; }
+    const std::string &text() const { return m_text; }
+
+    bool mergeWith(const UndoRecord &other)
+    {
+        if (m_kind != other.m_kind)
+            return false;
+
+        if (m_kind == INSERT && other.m_offset == m_offset + m_text.length())
+        {
+            m_text += other.m_text;
+            return true;
+        }
+        else if (m_kind == REMOVE && other.m_offset + other.m_text.length() == m_offset)
+        {
+            m_text = other.m_text + m_text;
+            m_offset = other.m_offset;
+            return true;
+        }
+
+        return false;
+    }
+
+private:
+    Kind m_kind;
+    std::size_t m_offset;
+    std::string m_text;
+};
+
+template <typename T, std::size_t Capacity>
+class RingBuffer
+{
+public:
+    RingBuffer() : m_first(0), m_count(0) {}
+
+    void push(const T &item)
+    {
+        if (m_count == Capacity)
+        {
+            m_items[m_first] = item;
+            m_first = (m_first + 1) % Capacity;
+        }
+        else
+            m_items[(m_first + m_count++) % Capacity] = item;
+    }
+
+    T pop()
+    {
+        TEXTBUFFER_ASSERT(m_count > 0);
+        return m_items[(m_first + --m_count) % Capacity];
+    }
+
+    T &top() { return m_items[(m_first + m_count - 1) % Capacity]; }
+    bool empty() const { return m_count == 0; }
+    std::size_t size() const { return m_count; }
+    void clear() { m_first = m_count = 0; }
+
+private:
+    T m_items[Capacity];
+    std::size_t m_first, m_count;
+};
+
+class TextBuffer
+{
+public:
+    TextBuffer();
+    explicit TextBuffer(const std::string &initial);
+    ~TextBuffer();
+
+    std::size_t length() const { return m_data.size() - gapLength(); }
+    unsigned lineCount() const { return static_cast<unsigned>(m_lines.size()); }
+
+    char at(std::size_t offset) const;
+    std::string text() const;
+    std::string text(const Range &range) const;
+    std::string line(unsigned index) const;
+
+    void insert(std::size_t offset, const std::string &text, bool record = true);
+    void remove(const Range &range, bool record = true);
+
+    bool undo();
+    bool redo();
+
+    Position toPosition(std::size_t offset) const;
+    std::size_t toOffset(unsigned line, unsigned column) const;
+
+    std::vector<Range> find(const std::string &needle, bool caseSensitive = true) const;
+
+private:
+    TextBuffer(const TextBuffer &);
+    TextBuffer &operator=(const TextBuffer &);
+
+    std::size_t gapLength() const { return m_gapEnd - m_gapStart; }
+    void moveGap(std::size_t offset);
+    void growGap(std::size_t minimum);
+    void rebuildLineIndex();
+
+    std::vector<char> m_data;
+    std::size_t m_gapStart, m_gapEnd;
+    std::vector<std::size_t> m_lines;
+    RingBuffer<UndoRecord *, TEXTBUFFER_MAX_UNDO> m_undo;
+    std::vector<UndoRecord *> m_redo;
+};
+
+TextBuffer::TextBuffer()
+    : m_data(TEXTBUFFER_INITIAL_GAP, '\0'),
+      m_gapStart(0),
+      m_gapEnd(TEXTBUFFER_INITIAL_GAP)
+{
+    rebuildLineIndex();
+}
+
+TextBuffer::TextBuffer(const std::string &initial)
+    : m_data(initial.size() + TEXTBUFFER_INITIAL_GAP, '\0'),
+      m_gapStart(initial.size()),
+      m_gapEnd(initial.size() + TEXTBUFFER_INITIAL_GAP)
+{
+    std::copy(initial.begin(), initial.end(), m_data.begin());
+    rebuildLineIndex();
+}
+
+TextBuffer::~TextBuffer()
+{
+    while (!m_undo.empty())
+        delete m_undo.pop();
+    for (std::vector<UndoRecord *>::iterator it = m_redo.begin(); it != m_redo.end(); ++it)
+        delete *it;
+}
+
+char
+TextBuffer::at(std::size_t offset) const
+{
+    TEXTBUFFER_ASSERT(offset < length());
+    return offset < m_gapStart ? m_data[offset] : m_data[offset + gapLength()];
+}
+
+std::string
+TextBuffer::text() const
+{
+    std::string result;
+    result.reserve(length());
+    result.append(&m_data[0], m_gapStart);
+    result.append(&m_data[0] + m_gapEnd, m_data.size() - m_gapEnd);
+    return result;
+}
+
+std::string
+TextBuffer::text(const Range &range) const
+{
+    std::string result;
+    result.reserve(range.length());
+    for (std::size_t offset = range.start.offset; offset < range.end.offset; ++offset)
+        result += at(offset);
+    return result;
+}
+
+std::string
+TextBuffer::line(unsigned index) const
+{
+    TEXTBUFFER_ASSERT(index < lineCount());
+    std::size_t start = m_lines[index];
+    std::size_t end = index + 1 < lineCount() ? m_lines[index + 1] - 1 : length();
+    return text(Range(Position(start), Position(end)));
+}
+
+void
+TextBuffer::moveGap(std::size_t offset)
+{
+    if (offset < m_gapStart)
+    {
+        std::size_t count = m_gapStart - offset;
+        std::memmove(&m_data[m_gapEnd - count], &m_data[offset], count);
+        m_gapStart -= count;
+        m_gapEnd -= count;
+    }
+    else if (offset > m_gapStart)
+    {
+        std::size_t count = offset - m_gapStart;
+        std::memmove(&m_data[m_gapStart], &m_data[m_gapEnd], count);
+        m_gapStart += count;
+        m_gapEnd += count;
+    }
+}
+
+void
+TextBuffer::growGap(std::size_t minimum)
+{
+    if (gapLength() >= minimum)
+        return;
+
+    std::size_t growth = std::max(minimum, m_data.size() / 2 + TEXTBUFFER_INITIAL_GAP);
+    std::size_t tail = m_data.size() - m_gapEnd;
+
+    m_data.resize(m_data.size() + growth);
+    std::memmove(&m_data[m_gapEnd + growth], &m_data[m_gapEnd], tail);
+    m_gapEnd += growth;
+
+    TEXTBUFFER_TRACE("grew gap by %lu bytes (total %lu)", (unsigned long) growth, (unsigned long) m_data.size());
+}
+
+void
+TextBuffer::rebuildLineIndex()
+{
+    m_lines.clear();
+    m_lines.push_back(0);
+
+    for (std::size_t offset = 0, end = length(); offset < end; ++offset)
+        if (at(offset) == '\n')
+            m_lines.push_back(offset + 1);
+}
+
+void
+TextBuffer::insert(std::size_t offset, const std::string &text, bool record)
+{
+    if (text.empty())
+        return;
+
+    moveGap(offset);
+    growGap(text.size());
+
+    std::copy(text.begin(), text.end(), m_data.begin() + m_gapStart);
+    m_gapStart += text.size();
+
+    if (record)
+    {
+        UndoRecord *undo = new UndoRecord(UndoRecord::INSERT, offset, text);
+        if (!m_undo.empty() && m_undo.top()->mergeWith(*undo))
+            delete undo;
+        else
+            m_undo.push(undo);
+
+        for (std::vector<UndoRecord *>::iterator it = m_redo.begin(); it != m_redo.end(); ++it)
+            delete *it;
+        m_redo.clear();
+    }
+
+    rebuildLineIndex();
+}
+
+void
+TextBuffer::remove(const Range &range, bool record)
+{
+    if (range.empty())
+        return;
+
+    if (record)
+        m_undo.push(new UndoRecord(UndoRecord::REMOVE, range.start.offset, text(range)));
+
+    moveGap(range.start.offset);
+    m_gapEnd += range.length();
+
+    rebuildLineIndex();
+}
+
+bool
+TextBuffer::undo()
+{
+    if (m_undo.empty())
+        return false;
+
+    UndoRecord *record = m_undo.pop();
+
+    switch (record->kind())
+    {
+    case UndoRecord::INSERT:
+        remove(Range(Position(record->offset()), Position(record->offset() + record->text().length())), false);
+        break;
+
+    case UndoRecord::REMOVE:
+        insert(record->offset(), record->text(), false);
+        break;
+
+    default:
+        TEXTBUFFER_ASSERT(!"unexpected undo record kind");
+    }
+
+    m_redo.push_back(record);
+    return true;
+}
+
+bool
+TextBuffer::redo()
+{
+    if (m_redo.empty())
+        return false;
+
+    UndoRecord *record = m_redo.back();
+    m_redo.pop_back();
+
+    if (record->kind() == UndoRecord::INSERT)
+        insert(record->offset(), record->text(), false);
+    else
+        remove(Range(Position(record->offset()), Position(record->offset() + record->text().length())), false);
+
+    m_undo.push(record);
+    return true;
+}
+
+Position
+TextBuffer::toPosition(std::size_t offset) const
+{
+    std::vector<std::size_t>::const_iterator it = std::upper_bound(m_lines.begin(), m_lines.end(), offset);
+    Position position(offset);
+    position.line = static_cast<unsigned>(it - m_lines.begin() - 1);
+    position.column = static_cast<unsigned>(offset - *(it - 1));
+    return position;
+}
+
+std::size_t
+TextBuffer::toOffset(unsigned line, unsigned column) const
+{
+    if (line >= lineCount())
+        return length();
+    return std::min(m_lines[line] + column, length());
+}
+
+static inline char
+fold(char ch, bool caseSensitive)
+{
+    if (caseSensitive || ch < 'A' || ch > 'Z')
+        return ch;
+    return static_cast<char>(ch - 'A' + 'a');
+}
+
+std::vector<Range>
+TextBuffer::find(const std::string &needle, bool caseSensitive) const
+{
+    std::vector<Range> result;
+    std::size_t total = length();
+
+    if (needle.empty() || needle.size() > total)
+        return result;
+
+    /* Boyer-Moore-Horspool: precompute how far we can skip when the last
+       character of the current window doesn't match. */
+    std::size_t skip[256];
+    for (int index = 0; index < 256; ++index)
+        skip[index] = needle.size();
+    for (std::size_t index = 0; index + 1 < needle.size(); ++index)
+        skip[static_cast<unsigned char>(fold(needle[index], caseSensitive))] = needle.size() - 1 - index;
+
+    std::size_t offset = 0;
+    while (offset + needle.size() <= total)
+    {
+        std::size_t index = needle.size();
+        while (index > 0 && fold(at(offset + index - 1), caseSensitive) == fold(needle[index - 1], caseSensitive))
+            --index;
+
+        if (index == 0)
+        {
+            result.push_back(Range(toPosition(offset), toPosition(offset + needle.size())));
+            offset += needle.size();
+        }
+        else
+            offset += skip[static_cast<unsigned char>(fold(at(offset + needle.size() - 1), caseSensitive))];
+    }
+
+    return result;
+}
+
+} // namespace text
+
+namespace
+{
+
+struct Statistics
+{
+    Statistics() : inserts(0), removes(0), bytes(0), ratio(0.0), elapsed(1.5e-3f) {}
+
+    unsigned long inserts;
+    unsigned long removes;
+    unsigned long long bytes;
+    double ratio;
+    float elapsed;
+};
+
+const char *const SAMPLE_TEXT =
+    "The quick brown fox jumps over the lazy dog.\n"
+    "Pack my box with five dozen liquor jugs.\n"
+    "\tTabs, \"quotes\" and 'apostrophes' \\ backslashes.\n";
+
+const wchar_t *const WIDE_SAMPLE = L"wide \"string\" literal";
+const wchar_t WIDE_CHARACTER = L'x';
+
+void
+exercise(text::TextBuffer &buffer, Statistics &statistics, unsigned rounds)
+{
+    for (unsigned round = 0; round < rounds; ++round)
+    {
+        buffer.insert(buffer.length() / 2, SAMPLE_TEXT);
+        statistics.inserts++;
+        statistics.bytes += std::strlen(SAMPLE_TEXT);
+
+        if (round % 3 == 2)
+        {
+            std::size_t start = buffer.length() / 4;
+            buffer.remove(text::Range(text::Position(start), text::Position(start + 0x10)));
+            statistics.removes++;
+        }
+
+        if ((round & 0xff) == 0)
+            buffer.undo();
+    }
+
+    statistics.ratio = statistics.removes ? static_cast<double>(statistics.inserts) / statistics.removes : 0.0;
+}
+
+} // anonymous namespace
+
+int
+main(int argc, char **argv)
+{
+    unsigned rounds = argc > 1 ? static_cast<unsigned>(std::atoi(argv[1])) : 1000u;
+    text::TextBuffer buffer("initial contents\nsecond line\n");
+    Statistics statistics;
+
+    exercise(buffer, statistics, rounds);
+
+    std::vector<text::Range> matches = buffer.find("LAZY", false);
+    std::map<unsigned, unsigned> perLine;
+
+    for (std::vector<text::Range>::const_iterator it = matches.begin(); it != matches.end(); ++it)
+        ++perLine[it->start.line];
+
+    std::printf("%lu inserts, %lu removes, %llu bytes, ratio %.2f\n",
+                statistics.inserts, statistics.removes, statistics.bytes, statistics.ratio);
+    std::printf("%u lines, %lu matches on %lu lines\n",
+                buffer.lineCount(), (unsigned long) matches.size(), (unsigned long) perLine.size());
+
+    while (buffer.undo())
+        ;
+
+    return buffer.length() == 0 ? 0 : 1;
+}
@@ -0,0 +1,2536 @@
+# -*- mode: python; encoding: utf-8 -*-
+#
+# Copyright 2012 Jens Lindström, Opera Software ASA
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy of
+# the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+import subprocess
+import re
+import time
+import atexit
+import os
+import traceback
+import threading
+import tempfile
+import shutil
+import stat
+import contextlib
+import collections
+import zlib
+import hashlib
+
+import base
+import configuration
+import textutils
+import htmlutils
+import communicate
+import commitgraph
+import packfile
+import diff.parse
+
+re_author_committer = re.compile("(.*) <(.*)> ([0-9]+ [-+][0-9]+)")
+re_sha1 = re.compile("^[A-Za-z0-9]{40}$")
+
+REPOSITORY_RELAYCOPY_DIR = os.path.join(configuration.paths.DATA_DIR, "relay")
+REPOSITORY_WORKCOPY_DIR = os.path.join(configuration.paths.DATA_DIR, "temporary")
+
+# Where Blame stores the results of blaming files.  Results are never
+# invalidated (they are keyed by immutable commit SHA-1s) but files not used in
+# a while are removed by the maintenance service.
+BLAME_CACHE_DIR = os.path.join(configuration.paths.CACHE_DIR, "blame")
+
+# Reference used to keep various commits alive.
+<<<<<<< HEAD
+KEEPALIVE_REF_CHAIN = "refs/internal/keepalive-chain"
+KEEPALIVE_REF_PREFIX = "refs/keepalive/"
+
+=======
+KEEPALIVE_REF_CHAIN = "refs/internal/keepalive-chain"
+KEEPALIVE_REF_PREFIX = "refs/keepalive/"
+
+# This is what an empty tree object hashes to.
+>>>>>>> topic
+KEEPALIVE_REF_CHAIN = "refs/internal/keepalive-chain"
+KEEPALIVE_REF_PREFIX = "refs/keepalive/"
+
+# This is what an empty tree object hashes to.
+EMPTY_TREE_SHA1 = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+
+def same_filesystem(pathA, pathB):
+    return os.stat(pathA).st_dev == os.stat(pathB).st_dev
+
+def getGitEnvironment(author=True, committer=True):
+    env = {}
+    def name(parameter):
+        if parameter is True:
+            return "Critic System"
+        elif isinstance(parameter, CommitUserTime):
+            return parameter.name
+        else:
+            return parameter.fullname
+    def email(parameter):
+        if parameter is True or not parameter.email:
+            return configuration.base.SYSTEM_USER_EMAIL
+        else:
+            return parameter.email
+    if author:
+        env["GIT_AUTHOR_NAME"] = name(author)
+        env["GIT_AUTHOR_EMAIL"] = email(author)
+    if committer:
+        env["GIT_COMMITTER_NAME"] = name(committer)
+        env["GIT_COMMITTER_EMAIL"] = email(committer)
+    return env
+
+class GitError(base.Error):
+    pass
+
+class GitReferenceError(GitError):
+    """Exception raised on an invalid SHA-1s or refs."""
+
+    def __init__(self, message, sha1=None, ref=None, repository=None):
+        super(GitReferenceError, self).__init__(message)
+        self.sha1 = sha1
+        self.ref = ref
+        self.repository = repository
+
+class GitCommandError(GitError):
+    """Exception raised when a Git command fails."""
+
+    def __init__(self, cmdline, output, cwd):
+        super(GitCommandError, self).__init__("'%s' failed: %s (in %s)" % (cmdline, output, cwd))
+        self.cmdline = cmdline
+        self.output = output
+        self.cwd = cwd
+
+<<<<<<< HEAD
+class GitObject:
+    def __init__(self, sha1, type, size, data):
+        self.sha1 = sha1
+=======
+class GitObject:
+    def __init__( self, sha1, type, size, data ):
+        self.sha1 = sha1
+        self.type = type
+>>>>>>> topic
+class GitObject:
+    def __init__(self, sha1, type, size, data):
+        self.sha1 = sha1
+        self.type = type
+        self.size = size
+        self.data = data
+
+    def __getitem__(self, index):
+        if index == 0: return self.type
+        elif index == 1: return self.size
+        elif index == 2: return self.data
+        raise IndexError("GitObject index out of range: %d" % index)
+
+class GitHttpBackendError(GitError):
+    def __init__(self, returncode, stderr):
+        message = "Git failed!"
+        if returncode < 0:
+            message = "Git terminated by signal %d!" % -returncode
+        elif returncode > 0:
+            message = "Git exited with status %d!" % returncode
+        if stderr.strip():
+            message += "\n" + stderr
+        super(GitHttpBackendError, self).__init__(message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+class GitHttpBackendNeedsUser(GitError):
+    pass
+
+class NoSuchRepository(base.Error):
+    """Exception raised by Repository.fromName() for invalid names."""
+
+    def __init__(self, value):
+        super(NoSuchRepository, self).__init__("No such repository: %s" % str(value))
+        self.value = value
+
+class BatchProcess(object):
+    """A running 'git cat-file --batch' or 'git cat-file --batch-check' process
+
+       Instances are owned by the process-wide BatchPool, and are checked out
+       from it by Repository objects for as long as they need them."""
+
+    def __init__(self, path, check, pooled=True):
+        if check:
+            mode = "--batch-check"
+        else:
+            mode = "--batch"
+
+        self.path = path
+        self.check = check
+        self.pooled = pooled
+        self.process = subprocess.Popen(
+<<<<<<< HEAD
+            [configuration.executables.GIT, 'cat-file', mode],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, cwd=path, bufsize=-1)
+=======
+            [configuration.executables.GIT, 'cat-file', mode],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, cwd=path, bufsize=-1 )
+        self.stdin = self.process.stdin
+>>>>>>> topic
+            [configuration.executables.GIT, 'cat-file', mode],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, cwd=path, bufsize=-1)
+        self.stdin = self.process.stdin
+        self.stdout = self.process.stdout
+        self.last_used = time.time()
+        self.uses = 0
+        self.broken = False
+        self.expired = False
+
+    def isHealthy(self):
+        return not (self.broken or self.expired) \
+            and self.process.poll() is None
+
+    def kill(self):
+        try: os.kill(self.process.pid, 9)
+        except: pass
+        try: self.process.wait()
+        except: pass
+
+    def writeObjectNames(self, sha1s):
+        try:
+            for sha1 in sha1s:
+                self.stdin.write(sha1 + "\n")
+            self.stdin.flush()
+        except IOError:
+            self.broken = True
+
+    def readObject(self, sha1):
+        """Read the next object from the process's output
+
+           Returns None if the process reported the object as missing."""
+
+        line = self.stdout.readline()
+
+        if line == ("%s missing\n" % sha1):
+            return None
+
+        try: object_sha1, object_type, object_size = line.split()
+        except ValueError:
+            raise GitError("unexpected output from 'git cat-file': %r" % line)
+
+        object_size = int(object_size)
+
+        if self.check:
+            object_data = None
+        else:
+            object_data = self.stdout.read(object_size)
+            self.stdout.read(1)
+
+        return GitObject(object_sha1, object_type, object_size, object_data)
+
+<<<<<<< HEAD
+    def readObjects(self, sha1s):
+        """Request all objects in 'sha1s' and yield them as they arrive
+
+=======
+    def readObjects( self, sha1s ):
+        """Request all objects in 'sha1s' and yield them as they arrive
+
+           The object names are written from a separate thread while objects
+>>>>>>> topic
+    def readObjects(self, sha1s):
+        """Request all objects in 'sha1s' and yield them as they arrive
+
+           The object names are written from a separate thread while objects
+           are being read, so that neither pipe fills up and blocks, and so
+           that Git can start producing output immediately.  Yields pairs of
+           requested SHA-1 and GitObject (or None if missing) in order.
+
+           If iteration is abandoned early, the process is killed, since its
+           output is no longer in sync with what has been read."""
+
+        writer = threading.Thread(target=self.writeObjectNames, args=(sha1s,))
+        writer.daemon = True
+        writer.start()
+
+        remaining = len(sha1s)
+
+        try:
+            for sha1 in sha1s:
+                git_object = self.readObject(sha1)
+                remaining -= 1
+                yield sha1, git_object
+        finally:
+            if remaining:
+                self.broken = True
+                self.kill()
+            writer.join()
+
+class BatchPool(object):
+    """Per-process pool of warm 'git cat-file' processes
+
+       Processes are keyed by repository path and mode, checked out by
+       Repository objects when first needed and checked back in when the
+       repository object's database connection is closed.  Idle processes
+       are terminated after configuration.limits.GIT_BATCH_IDLE_TIMEOUT
+       seconds.
+
+       The total number of processes is capped at
+       configuration.limits.GIT_BATCH_POOL_SIZE.  If the pool is full and no
+       idle process can be evicted, checkout() waits a short while for one to
+       be returned, and then starts an unpooled process that is terminated
+       when checked in.  (Waiting indefinitely could deadlock, since a single
+       request may hold processes for several repositories.)"""
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__pid = os.getpid()
+        self.__idle = {}
+        self.__busy = set()
+
+        self.spawned = 0
+        self.reused = 0
+<<<<<<< HEAD
+        self.reaped = 0
+
+    def __checkPid(self):
+=======
+        self.reaped = 0
+
+    def __checkPid( self ):
+        # If we've forked since the pool was last used, the processes belong to
+>>>>>>> topic
+        self.reaped = 0
+
+    def __checkPid(self):
+        # If we've forked since the pool was last used, the processes belong to
+        # our parent.  Just forget about them.
+        if self.__pid != os.getpid():
+            self.__pid = os.getpid()
+            self.__idle = {}
+            self.__busy = set()
+
+    def __count(self):
+        return len(self.__busy) + sum(map(len, self.__idle.values()))
+
+    def __reapIdle(self, now):
+        deadline = now - configuration.limits.GIT_BATCH_IDLE_TIMEOUT
+        for key, workers in self.__idle.items():
+            for worker in workers[:]:
+                if worker.last_used < deadline or not worker.isHealthy():
+                    workers.remove(worker)
+                    worker.kill()
+                    self.reaped += 1
+            if not workers:
+                del self.__idle[key]
+
+    def __evictOldest(self):
+        oldest = None
+        for workers in self.__idle.values():
+            for worker in workers:
+                if oldest is None or worker.last_used < oldest.last_used:
+                    oldest = worker
+        if oldest is None:
+            return False
+        key = (oldest.path, oldest.check)
+        self.__idle[key].remove(oldest)
+        if not self.__idle[key]:
+            del self.__idle[key]
+        oldest.kill()
+        self.reaped += 1
+        return True
+
+    def checkout(self, path, check=False):
+        with self.__condition:
+            self.__checkPid()
+
+            now = time.time()
+            self.__reapIdle(now)
+
+            key = (path, check)
+            deadline = now + configuration.limits.GIT_BATCH_WAIT_TIMEOUT
+            pooled = True
+
+            while True:
+<<<<<<< HEAD
+                workers = self.__idle.get(key)
+                while workers:
+                    worker = workers.pop()
+=======
+                workers = self.__idle.get( key )
+                while workers:
+                    worker = workers.pop(  )
+                    if not workers:
+>>>>>>> topic
+                workers = self.__idle.get(key)
+                while workers:
+                    worker = workers.pop()
+                    if not workers:
+                        del self.__idle[key]
+                    if worker.isHealthy():
+                        worker.uses += 1
+                        self.__busy.add(worker)
+                        self.reused += 1
+                        return worker
+                    worker.kill()
+                    self.reaped += 1
+                    workers = self.__idle.get(key)
+
+                if self.__count() < configuration.limits.GIT_BATCH_POOL_SIZE:
+                    break
+                if self.__evictOldest():
+                    break
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    pooled = False
+                    break
+
+                self.__condition.wait(remaining)
+
+            worker = BatchProcess(path, check, pooled=pooled)
+            worker.uses += 1
+            if pooled:
+                self.__busy.add(worker)
+            self.spawned += 1
+            return worker
+
+    def checkin(self, worker, discard=False):
+        with self.__condition:
+            self.__checkPid()
+
+            if worker not in self.__busy:
+                # Unpooled process, or one started before a fork.
+                worker.kill()
+                return
+
+            self.__busy.remove(worker)
+            worker.last_used = time.time()
+
+            if discard or not worker.isHealthy() \
+                    or worker.uses >= configuration.limits.GIT_BATCH_MAX_USES:
+                worker.kill()
+                self.reaped += 1
+            else:
+                self.__idle.setdefault((worker.path, worker.check), []).append(worker)
+
+<<<<<<< HEAD
+            self.__reapIdle(worker.last_used)
+            self.__condition.notify()
+
+=======
+            self.__reapIdle( worker.last_used )
+            self.__condition.notify(  )
+
+    def discard( self, path ):
+>>>>>>> topic
+            self.__reapIdle(worker.last_used)
+            self.__condition.notify()
+
+    def discard(self, path):
+        """Terminate all idle processes for the repository at 'path'
+
+           Processes currently checked out are terminated when checked in.
+           This is used after operations (such as 'git gc') that may leave
+           running 'git cat-file' processes with stale pack files open."""
+
+        with self.__condition:
+            self.__checkPid()
+
+            for check in (False, True):
+                for worker in self.__idle.pop((path, check), []):
+                    worker.kill()
+                    self.reaped += 1
+            for worker in self.__busy:
+                if worker.path == path:
+                    worker.expired = True
+
+    def terminate(self):
+        with self.__condition:
+            self.__checkPid()
+
+            for workers in self.__idle.values():
+                for worker in workers:
+                    worker.kill()
+            self.__idle = {}
+
+BATCH_POOL = BatchPool()
+atexit.register(BATCH_POOL.terminate)
+
+class LRUCache(object):
+    """Thread-safe mapping holding at most 'maximum' items
+
+       When full, adding an item evicts the least recently used item."""
+
+    def __init__(self, maximum):
+        self.__lock = threading.Lock()
+        self.__maximum = maximum
+        self.__items = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.__items)
+
+    def get(self, key, default=None):
+        with self.__lock:
+<<<<<<< HEAD
+            try:
+                value = self.__items.pop(key)
+            except KeyError:
+=======
+            try:
+                value = self.__items.pop( key )
+            except KeyError:
+                self.misses += 1
+>>>>>>> topic
+            try:
+                value = self.__items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.__items[key] = value
+            self.hits += 1
+            return value
+
+    def add(self, key, value):
+        with self.__lock:
+            self.__items.pop(key, None)
+            self.__items[key] = value
+            while len(self.__items) > self.__maximum:
+                self.__items.popitem(last=False)
+                self.evictions += 1
+
+class ObjectCache(object):
+    """Process-wide LRU cache of Git objects with per-type byte budgets
+
+       Since Git objects are content-addressed and thus immutable, fetched
+       objects can be shared freely between requests (and threads) handled by
+       the same process.  Objects are keyed by repository path and SHA-1, so
+       that an object is never returned from a repository that doesn't have
+       it.
+
+       Each object type has a separate budget, from
+       configuration.limits.GIT_OBJECT_CACHE_SIZE, so that a few large blobs
+       can't evict all commits and trees of active reviews.  Objects larger
+       than a quarter of their type's budget are not cached at all."""
+
+    # Approximate per-object memory overhead (object, key and LRU entry.)
+    OVERHEAD = 256
+
+    def __init__(self, budgets):
+        self.__lock = threading.Lock()
+        self.__budgets = budgets
+        self.__objects = dict((object_type, collections.OrderedDict())
+                              for object_type in budgets)
+        self.__types = {}
+        self.__sizes = dict.fromkeys(budgets, 0)
+
+        self.hits = dict.fromkeys(budgets, 0)
+        self.misses = dict.fromkeys(budgets, 0)
+        self.evictions = dict.fromkeys(budgets, 0)
+
+    def __cost(self, git_object):
+        return len(git_object.data) + ObjectCache.OVERHEAD
+
+    def get(self, path, sha1):
+        key = (path, sha1)
+        with self.__lock:
+<<<<<<< HEAD
+            object_type = self.__types.get(key)
+            if object_type is None:
+                return None
+=======
+            object_type = self.__types.get( key )
+            if object_type is None:
+                return None
+            objects = self.__objects[object_type]
+>>>>>>> topic
+            object_type = self.__types.get(key)
+            if object_type is None:
+                return None
+            objects = self.__objects[object_type]
+            # Move the object to the most recently used end.
+            git_object = objects.pop(key)
+            objects[key] = git_object
+            self.hits[object_type] += 1
+            return git_object
+
+    def add(self, path, git_object):
+        """Add a freshly fetched object to the cache
+
+           Returns the number of objects evicted to make room for it."""
+
+        object_type = git_object.type
+        budget = self.__budgets.get(object_type, 0)
+        cost = self.__cost(git_object)
+        key = (path, git_object.sha1)
+        evicted = 0
+
+        with self.__lock:
+            if object_type in self.misses:
+                self.misses[object_type] += 1
+            if cost > budget / 4 or key in self.__types:
+                return 0
+
+            objects = self.__objects[object_type]
+
+            while objects and self.__sizes[object_type] + cost > budget:
+                evicted_key, evicted_object = objects.popitem(last=False)
+                del self.__types[evicted_key]
+                self.__sizes[object_type] -= self.__cost(evicted_object)
+                evicted += 1
+
+            objects[key] = git_object
+            self.__types[key] = object_type
+            self.__sizes[object_type] += cost
+            self.evictions[object_type] += evicted
+
+        return evicted
+
+    def getStatistics(self):
+        with self.__lock:
+            return dict((object_type,
+                         { "count": len(self.__objects[object_type]),
+                           "bytes": self.__sizes[object_type],
+                           "budget": self.__budgets[object_type],
+                           "hits": self.hits[object_type],
+                           "misses": self.misses[object_type],
+                           "evictions": self.evictions[object_type] })
+                        for object_type in self.__budgets)
+<<<<<<< HEAD
+
+OBJECT_CACHE = ObjectCache(configuration.limits.GIT_OBJECT_CACHE_SIZE)
+
+=======
+
+OBJECT_CACHE = ObjectCache( configuration.limits.GIT_OBJECT_CACHE_SIZE )
+
+# Parsed Tree objects, keyed by ( repository path, tree SHA-1 ).
+>>>>>>> topic
+
+OBJECT_CACHE = ObjectCache(configuration.limits.GIT_OBJECT_CACHE_SIZE)
+
+# Parsed Tree objects, keyed by (repository path, tree SHA-1).
+TREE_CACHE = LRUCache(configuration.limits.GIT_TREE_CACHE_SIZE)
+
+# Resolved directory paths, keyed by (repository path, root tree SHA-1, path),
+# with the directory's tree SHA-1 (or None if there is no such directory) as
+# value.
+PATH_CACHE = LRUCache(configuration.limits.GIT_PATH_CACHE_SIZE)
+
+# Blame results keyed by (repository path, from SHA-1, to SHA-1, path).
+BLAME_CACHE = LRUCache(configuration.limits.BLAME_CACHE_SIZE)
+
+class Repository:
+    class FromParameter:
+        def __init__(self, db): self.db = db
+        def __call__(self, value): return Repository.fromParameter(self.db, value)
+
+    def __init__(self, db=None, repository_id=None, parent=None, main_branch_id=None, name=None, path=None):
+        assert path
+
+        self.id = repository_id
+        self.name = name
+        self.path = path
+        self.parent = parent
+
+        self.__main_branch = None
+        self.__main_branch_id = main_branch_id
+        self.__batch = None
+        self.__batchCheck = None
+        self.__cacheBlobs = False
+        self.__cacheDisabled = False
+        self.__backend = configuration.limits.GIT_OBJECT_BACKEND_OVERRIDES.get(
+            name, configuration.limits.GIT_OBJECT_BACKEND)
+
+        if db:
+            self.__db = db
+            db.storage["Repository"][repository_id] = self
+            db.storage["Repository"][name] = self
+            db.atexit(self.__terminate)
+        else:
+            self.__db = None
+            atexit.register(self.__terminate)
+
+    def __str__(self):
+        return self.path
+
+    def getURL(self, db, user):
+        return Repository.constructURL(db, user, self.path)
+
+    @staticmethod
+<<<<<<< HEAD
+    def constructURL(db, user, path):
+        path = os.path.relpath(path, configuration.paths.GIT_DIR)
+        url_type = user.getPreference(db, "repository.urlType")
+=======
+    def constructURL( db, user, path ):
+        path = os.path.relpath( path, configuration.paths.GIT_DIR )
+        url_type = user.getPreference( db, "repository.urlType" )
+
+>>>>>>> topic
+    def constructURL(db, user, path):
+        path = os.path.relpath(path, configuration.paths.GIT_DIR)
+        url_type = user.getPreference(db, "repository.urlType")
+
+        if url_type == "git":
+            url_format = "git://%s/%s"
+        elif url_type in ("ssh", "host"):
+            if url_type == "ssh":
+                prefix = "ssh://%s"
+            else:
+                prefix = "%s:"
+            url_format = prefix + os.path.join(configuration.paths.GIT_DIR, "%s")
+        elif configuration.base.ACCESS_SCHEME == "http":
+            url_format = "http://%s/%s"
+        elif configuration.base.ACCESS_SCHEME == "https":
+            url_format = "https://%s/%s"
+        elif user.isAnonymous():
+            url_format = "http://%s/%s"
+        else:
+            url_format = "https://%s/%s"
+
+        return url_format % (configuration.base.HOSTNAME, path)
+
+    def enableBlobCache(self):
+        self.__cacheBlobs = True
+
+    def disableCache(self):
+        self.__cacheDisabled = True
+
+    def getObjectBackend(self):
+        return self.__backend
+
+    def setObjectBackend(self, backend):
+        assert backend in ("cat-file", "packfile")
+        self.__backend = backend
+
+    def hasMainBranch(self):
+        return self.__main_branch_id is not None
+
+    def getMainBranch(self, db):
+        import dbutils
+        if not self.__main_branch:
+            if self.__main_branch_id is not None:
+                self.__main_branch = dbutils.Branch.fromId(db, self.__main_branch_id, load_commits=False)
+        return self.__main_branch
+
+    @staticmethod
+    def fromId(db, repository_id):
+        if repository_id in db.storage["Repository"]:
+            return db.storage["Repository"][repository_id]
+        else:
+            cursor = db.cursor()
+<<<<<<< HEAD
+            cursor.execute("SELECT parent, branch, name, path FROM repositories WHERE id=%s", (repository_id,))
+            try:
+                parent_id, main_branch_id, name, path = cursor.fetchone()
+=======
+            cursor.execute( "SELECT parent, branch, name, path FROM repositories WHERE id=%s", ( repository_id, ) )
+            try:
+                parent_id, main_branch_id, name, path = cursor.fetchone(  )
+                parent = None if parent_id is None else Repository.fromId( db, parent_id )
+>>>>>>> topic
+            cursor.execute("SELECT parent, branch, name, path FROM repositories WHERE id=%s", (repository_id,))
+            try:
+                parent_id, main_branch_id, name, path = cursor.fetchone()
+                parent = None if parent_id is None else Repository.fromId(db, parent_id)
+                return Repository(db, repository_id=repository_id, parent=parent, main_branch_id=main_branch_id, name=name, path=path)
+            except:
+                return None
+
+    @staticmethod
+    def fromName(db, name):
+        if name in db.storage["Repository"]:
+            return db.storage["Repository"][name]
+        else:
+            cursor = db.cursor()
+            cursor.execute("SELECT id FROM repositories WHERE name=%s", (name,))
+            try: return Repository.fromId(db, cursor.fetchone()[0])
+            except: return None
+
+    @staticmethod
+    def fromParameter(db, parameter):
+        try: repository = Repository.fromId(db, int(parameter))
+        except: repository = Repository.fromName(db, parameter)
+        if repository: return repository
+        else: raise NoSuchRepository(parameter)
+
+    @staticmethod
+    def fromSHA1(db, sha1):
+        cursor = db.cursor()
+        cursor.execute("SELECT id FROM repositories ORDER BY id ASC")
+        for (repository_id,) in cursor:
+            repository = Repository.fromId(db, repository_id)
+            if repository.iscommit(sha1): return repository
+        raise GitReferenceError(
+            "Couldn't find commit %s in any repository." % sha1,
+            sha1=sha1)
+
+    @staticmethod
+    def fromPath(db, path):
+        if not path.startswith(configuration.paths.GIT_DIR):
+            path = os.path.join(configuration.paths.GIT_DIR, path)
+        if not path.endswith(".git"):
+            path += ".git"
+        cursor = db.cursor()
+        cursor.execute("SELECT id FROM repositories WHERE path=%s", (path,))
+        for (repository_id,) in cursor:
+            return Repository.fromId(db, repository_id)
+        raise NoSuchRepository(path)
+
+    def __terminate(self, db=None):
+        self.__returnBatch()
+
+    def __startBatch(self):
+<<<<<<< HEAD
+        if self.__batch is None:
+            self.__batch = BATCH_POOL.checkout(self.path)
+
+=======
+        if self.__batch is None:
+            self.__batch = BATCH_POOL.checkout( self.path )
+
+    def __startBatchCheck( self ):
+>>>>>>> topic
+        if self.__batch is None:
+            self.__batch = BATCH_POOL.checkout(self.path)
+
+    def __startBatchCheck(self):
+        if self.__batchCheck is None:
+            self.__batchCheck = BATCH_POOL.checkout(self.path, check=True)
+
+    def __returnBatch(self, discard=False):
+        if self.__batch:
+            BATCH_POOL.checkin(self.__batch, discard=discard)
+            self.__batch = None
+        if self.__batchCheck:
+            BATCH_POOL.checkin(self.__batchCheck, discard=discard)
+            self.__batchCheck = None
+
+    def stopBatch(self):
+        self.__returnBatch(discard=True)
+        BATCH_POOL.discard(self.path)
+
+    @staticmethod
+    def forEach(db, fn):
+        for key, repository in db.storage["Repository"].items():
+            if isinstance(key, int):
+                fn(db, repository)
+
+    def getJS(self):
+        return "var repository = critic.repository = new Repository(%d, %s, %s);" % (self.id, htmlutils.jsify(self.name), htmlutils.jsify(self.path))
+
+    def getModuleRepository(self, db, commit, path):
+        tree = Tree.fromPath(commit, "/")
+        source = self.fetch(tree[".gitmodules"].sha1).data
+        lines = iter(source.splitlines())
+
+        for line in lines:
+            if line == ('[submodule "%s"]' % path): break
+        else: return None
+
+        for line in lines:
+            line = line.strip()
+
+            if not line or line[0] == "#": continue
+            elif line[0] == "[": return None
+
+            key, value = map(str.strip, line.split("="))
+
+            if key == "url":
+                path = os.path.abspath(os.path.join(self.path, value))
+
+                cursor = db.cursor()
+                cursor.execute("SELECT id FROM repositories WHERE path=%s", (path,))
+
+                row = cursor.fetchone()
+<<<<<<< HEAD
+                if row:
+                    return Repository.fromId(db, row[0])
+                else:
+=======
+                if row:
+                    return Repository.fromId( db, row[0] )
+                else:
+                    return None
+>>>>>>> topic
+                if row:
+                    return Repository.fromId(db, row[0])
+                else:
+                    return None
+        else:
+            return None
+
+    def fetch(self, sha1, fetchData=True):
+        cached_object = self.__getCachedObject(sha1)
+        if cached_object:
+            return cached_object
+
+        before = time.time()
+
+        git_object = self.__readFromPack(sha1, fetchData)
+        if git_object:
+            after = time.time()
+            self.__cacheObject(git_object, fetchData)
+            if self.__db:
+                self.__db.recordProfiling("fetch: " + git_object.type, after - before)
+            return git_object
+
+        if fetchData:
+            self.__startBatch()
+            batch = self.__batch
+        else:
+            self.__startBatchCheck()
+            batch = self.__batchCheck
+
+        try:
+            batch.stdin.write(sha1 + '\n')
+            batch.stdin.flush()
+        except:
+            batch.broken = True
+            raise GitError("failed when writing to 'git cat-file' stdin: %s" % batch.stdout.read())
+
+        try:
+            git_object = batch.readObject(sha1)
+        except:
+            # The process is in an unknown state; make sure it isn't reused.
+            batch.broken = True
+            raise
+
+        if git_object is None:
+            raise GitReferenceError("%s missing from %s" % (sha1[:8], self.path), sha1=sha1, repository=self)
+
+        after = time.time()
+
+        self.__cacheObject(git_object, fetchData)
+
+        if self.__db:
+            self.__db.recordProfiling("fetch: " + git_object.type, after - before)
+<<<<<<< HEAD
+
+        return git_object
+
+=======
+
+        return git_object
+
+    def fetchMany( self, sha1s, fetchData=True ):
+>>>>>>> topic
+
+        return git_object
+
+    def fetchMany(self, sha1s, fetchData=True):
+        """Fetch several objects, yielding GitObject objects in order
+
+           Unlike calling fetch() repeatedly, all object names are written to
+           'git cat-file' up front (from a separate thread) and the objects are
+           parsed as they are streamed back, so the whole sequence costs one
+           round-trip instead of one per object.  Objects already cached are
+           yielded without involving Git.
+
+           A separate 'git cat-file' process is used, so it is safe to call
+           fetch() while iterating.  With the "packfile" object backend, only
+           objects not found in pack files are requested from Git."""
+
+        sha1s = list(sha1s)
+
+        # Decide up front which objects to request, so that the stream of
+        # objects stays in sync even if the cache changes while iterating.
+        cached_objects = map(self.__getCachedObject, sha1s)
+
+        if self.__backend == "packfile":
+            reader = self.__getPackReader()
+            packed = set(sha1 for sha1, cached_object in zip(sha1s, cached_objects)
+                         if not cached_object and reader.contains(sha1))
+        else:
+            packed = set()
+
+        requested = [sha1 for sha1, cached_object in zip(sha1s, cached_objects)
+                     if not cached_object and sha1 not in packed]
+
+        remaining = len(requested)
+
+        if remaining:
+            batch = BATCH_POOL.checkout(self.path, check=not fetchData)
+            objects = batch.readObjects(requested)
+        else:
+            batch = None
+
+        try:
+            for sha1, cached_object in zip(sha1s, cached_objects):
+                if cached_object:
+                    yield cached_object
+                    continue
+
+                if sha1 in packed:
+                    # Falls back to 'git cat-file' if the pack reader fails.
+                    yield self.fetch(sha1, fetchData)
+                    continue
+
+                before = time.time()
+<<<<<<< HEAD
+
+                _, git_object = next(objects)
+
+=======
+
+                _, git_object = next( objects )
+
+                remaining -= 1
+>>>>>>> topic
+
+                _, git_object = next(objects)
+
+                remaining -= 1
+                if not remaining:
+                    # Return the process to the pool right away, rather than
+                    # when this generator is finished or garbage collected.
+                    objects.close()
+                    BATCH_POOL.checkin(batch)
+                    batch = None
+
+                if git_object is None:
+                    raise GitReferenceError("%s missing from %s" % (sha1[:8], self.path), sha1=sha1, repository=self)
+
+                after = time.time()
+
+                self.__cacheObject(git_object, fetchData)
+
+                if self.__db:
+                    self.__db.recordProfiling("fetch: " + git_object.type, after - before)
+
+                yield git_object
+        finally:
+            if batch:
+                objects.close()
+                BATCH_POOL.checkin(batch)
+
+    def __getPackReader(self):
+        return packfile.get(self.path, configuration.limits.GIT_DELTA_BASE_CACHE_SIZE)
+
+    def __readFromPack(self, sha1, fetchData):
+        # Returns None if the object should be read using 'git cat-file'
+        # instead: if the "packfile" backend isn't used, or if the object is
+        # loose, in an alternate object store, or otherwise unreadable here.
+        if self.__backend != "packfile":
+            return None
+        try:
+            result = self.__getPackReader().read(sha1, fetchData)
+        except (EnvironmentError, ValueError, zlib.error, packfile.PackError):
+            return None
+        if result is None:
+            return None
+        object_type, size, data = result
+        return GitObject(sha1, object_type, size, data)
+
+    def __getCachedObject(self, sha1):
+        if self.__cacheDisabled:
+            return None
+        cached_object = OBJECT_CACHE.get(self.path, sha1)
+        if cached_object and self.__db:
+            self.__db.recordProfiling("fetch: " + cached_object.type + " (cached)", 0)
+        return cached_object
+<<<<<<< HEAD
+
+    def __cacheObject(self, git_object, fetchData):
+        # Objects fetched without data are never cached, since a later fetch()
+=======
+
+    def __cacheObject( self, git_object, fetchData ):
+        # Objects fetched without data are never cached, since a later fetch(  )
+        # with data would otherwise return the data-less object.  Blobs are
+>>>>>>> topic
+
+    def __cacheObject(self, git_object, fetchData):
+        # Objects fetched without data are never cached, since a later fetch()
+        # with data would otherwise return the data-less object.  Blobs are
+        # only cached on request, since most blobs are read once per request
+        # and would just push commits and trees out of the cache.
+        if fetchData and not self.__cacheDisabled \
+                and (git_object.type != "blob" or self.__cacheBlobs):
+            evicted = OBJECT_CACHE.add(self.path, git_object)
+            if evicted and self.__db:
+                self.__db.recordProfiling("object cache: %s evicted" % git_object.type,
+                                          0, repetitions=evicted)
+
+    def run(self, command, *arguments, **kwargs):
+        return self.runCustom(self.path, command, *arguments, **kwargs)
+
+    def runCustom(self, cwd, command, *arguments, **kwargs):
+        argv = [configuration.executables.GIT, command]
+        argv.extend(arguments)
+        stdin_data = kwargs.get("input")
+        if stdin_data is None: stdin = None
+        else: stdin = subprocess.PIPE
+        env = Repository.__environment(kwargs.get("env", {}))
+        git = subprocess.Popen(argv, stdin=stdin, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, cwd=cwd, env=env)
+        stdout, stderr = git.communicate(stdin_data)
+        if kwargs.get("check_errors", True):
+            if git.returncode == 0:
+                if kwargs.get("include_stderr", False):
+                    return stdout + stderr
+                else:
+                    return stdout
+            else:
+                cmdline = " ".join(argv)
+                output = stderr.strip()
+                raise GitCommandError(cmdline, output, cwd)
+        else:
+            return git.returncode, stdout, stderr
+
+    def runLines(self, command, *arguments):
+        """Run a Git command, yielding its output one line at a time
+
+           Lines are yielded (without their linebreaks) as Git produces them,
+           so the whole output is never held in memory.  If Git fails, a
+           GitCommandError is raised once its output has been consumed."""
+
+        argv = [configuration.executables.GIT, command]
+        argv.extend(arguments)
+        env = Repository.__environment({})
+
+        with tempfile.TemporaryFile() as stderr:
+            git = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=stderr,
+<<<<<<< HEAD
+                                   cwd=self.path, env=env)
+
+            try:
+=======
+                                   cwd=self.path, env=env )
+
+            try:
+                for line in git.stdout:
+>>>>>>> topic
+                                   cwd=self.path, env=env)
+
+            try:
+                for line in git.stdout:
+                    if line.endswith("\n"):
+                        line = line[:-1]
+                    yield line
+                git.wait()
+            finally:
+                if git.returncode is None:
+                    # Abandoned before all output was read.
+                    git.kill()
+                    git.wait()
+                git.stdout.close()
+
+            if git.returncode != 0:
+                stderr.seek(0)
+                raise GitCommandError(" ".join(argv), stderr.read().strip(), self.path)
+
+    @staticmethod
+    def __environment(extra):
+        env = {}
+        env.update(os.environ)
+        env.update(configuration.executables.GIT_ENV)
+        env.update(extra)
+        if "GIT_DIR" in env: del env["GIT_DIR"]
+        return env
+
+    def createBranch(self, name, startpoint):
+        argv = [configuration.executables.GIT, 'branch', name, startpoint]
+        git = subprocess.Popen(argv, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, cwd=self.path)
+        stdout, stderr = git.communicate()
+        if git.returncode != 0:
+            cmdline = " ".join(argv)
+            output = stderr.strip()
+            raise GitCommandError(cmdline, output, self.path)
+
+    def deleteBranch(self, name):
+        argv = [configuration.executables.GIT, 'branch', '-D', name]
+        git = subprocess.Popen(argv, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, cwd=self.path)
+        stdout, stderr = git.communicate()
+        if git.returncode != 0:
+            cmdline = " ".join(argv)
+            output = stderr.strip()
+            raise GitCommandError(cmdline, output, self.path)
+
+    def mergebase(self, commit_or_commits, db=None):
+        if db and isinstance(commit_or_commits, Commit):
+            cursor = db.cursor()
+            cursor.execute("SELECT mergebase FROM mergebases WHERE commit=%s", (commit_or_commits.getId(db),))
+<<<<<<< HEAD
+            try:
+                return cursor.fetchone()[0]
+            except:
+=======
+            try:
+                return cursor.fetchone(  )[0]
+            except:
+                result = self.mergebase( commit_or_commits )
+>>>>>>> topic
+            try:
+                return cursor.fetchone()[0]
+            except:
+                result = self.mergebase(commit_or_commits)
+                cursor.execute("INSERT INTO mergebases (commit, mergebase) VALUES (%s, %s)", (commit_or_commits.getId(db), result))
+                return result
+
+        try: sha1s = commit_or_commits.parents
+        except: sha1s = map(str, commit_or_commits)
+
+        assert len(sha1s) >= 2
+
+        if len(sha1s) == 2:
+            graph = self.getCommitGraph()
+            if graph and sha1s[0] in graph and sha1s[1] in graph:
+                mergebases = graph.mergeBases(*sha1s)
+                # If there are several equally good merge bases, let Git pick
+                # one, so that we're consistent with what it would have said.
+                if len(mergebases) == 1:
+                    return mergebases[0]
+
+        argv = [configuration.executables.GIT, 'merge-base'] + sha1s
+        git = subprocess.Popen(argv, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, cwd=self.path)
+        stdout, stderr = git.communicate()
+        if git.returncode == 0: return stdout.strip()
+        else:
+            cmdline = " ".join(argv)
+            output = stderr.strip()
+            raise GitCommandError(cmdline, output, self.path)
+
+    def getCommitGraph(self):
+        """Return the repository's commit graph index, or None if not built"""
+        return commitgraph.get(self)
+
+    def getCommonAncestor(self, commit_or_commits):
+        try: sha1s = commit_or_commits.parents
+        except: sha1s = list(commit_or_commits)
+
+        assert len(sha1s) >= 2
+
+        mergebases = [self.mergebase([sha1s[0], sha1]) for sha1 in sha1s[1:]]
+
+        if len(mergebases) == 1: return mergebases[0]
+        else: return self.getCommonAncestor(mergebases)
+
+    def revparse(self, name):
+        git = subprocess.Popen(
+            [configuration.executables.GIT, 'rev-parse', '--verify', '--quiet', name],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=self.path)
+        stdout, stderr = git.communicate()
+        if git.returncode == 0: return stdout.strip()
+<<<<<<< HEAD
+        else: raise GitReferenceError("'git rev-parse' failed: %s" % stderr.strip(), ref=name, repository=self)
+
+    def revlist(self, included, excluded, *args, **kwargs):
+=======
+        else: raise GitReferenceError( "'git rev-parse' failed: %s" % stderr.strip(  ), ref=name, repository=self )
+
+    def revlist( self, included, excluded, *args, **kwargs ):
+        args = list( args )
+>>>>>>> topic
+        else: raise GitReferenceError("'git rev-parse' failed: %s" % stderr.strip(), ref=name, repository=self)
+
+    def revlist(self, included, excluded, *args, **kwargs):
+        args = list(args)
+        args.extend([str(ref) for ref in included])
+        args.extend(['^' + str(ref) for ref in excluded])
+        if "paths" in kwargs:
+            args.append("--")
+            args.extend(kwargs["paths"])
+        return self.run('rev-list', *args).splitlines()
+
+    def iscommit(self, name):
+        git = subprocess.Popen(
+            [configuration.executables.GIT, 'cat-file', '-t', name],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=self.path)
+        stdout, stderr = git.communicate()
+        if git.returncode == 0: return stdout.strip() == "commit"
+        else: return False
+
+    def createref(self, name, value):
+        assert name.startswith("refs/")
+        self.run("update-ref", name, str(value), "0" * 40)
+
+    def updateref(self, name, new_value, old_value):
+        assert name.startswith("refs/")
+        self.run("update-ref", name, str(new_value), str(old_value))
+
+    def deleteref(self, name, value):
+        assert name.startswith("refs/")
+        self.run("update-ref", "-d", name, str(value))
+
+    def keepalive(self, commit):
+        sha1 = str(commit)
+        self.run("update-ref", KEEPALIVE_REF_PREFIX + sha1, sha1)
+        return sha1
+
+    def packKeepaliveRefs(self):
+        """
+        Pack the repository's keepalive refs into a single chain
+        """
+
+        def splitRefs(output):
+            return [(int(timestamp.split()[0]), sha1, timestamp)
+                    for sha1, _, timestamp in
+                    (line.partition(":")
+                     for line in
+                     output.splitlines())
+                    # Skip the root commit, which has summary "Root".
+                    if len(sha1) == 40]
+
+        loose_keepalive_refs = splitRefs(
+            self.run("for-each-ref",
+<<<<<<< HEAD
+                     "--sort=committerdate",
+                     "--format=%(objectname):%(committerdate:raw)",
+                     KEEPALIVE_REF_PREFIX))
+=======
+                     "--sort=committerdate",
+                     "--format=%( objectname ):%( committerdate:raw )",
+                     KEEPALIVE_REF_PREFIX ) )
+
+>>>>>>> topic
+                     "--sort=committerdate",
+                     "--format=%(objectname):%(committerdate:raw)",
+                     KEEPALIVE_REF_PREFIX))
+
+        if not loose_keepalive_refs:
+            # No loose refs => no need to (re)pack.
+            return
+
+        try:
+            old_value = self.revparse(KEEPALIVE_REF_CHAIN)
+        except GitReferenceError:
+            old_value = "0" * 40
+            packed_keepalive_refs = []
+        else:
+            packed_keepalive_refs = splitRefs(
+                self.run("log",
+                         "--first-parent",
+                         "--date=raw",
+                         "--format=%s:%cd",
+                         old_value))
+
+        keepalive_refs = sorted(packed_keepalive_refs + loose_keepalive_refs)
+
+        env = getGitEnvironment()
+
+        def withDates(env, timestamp):
+            env["GIT_AUTHOR_DATE"] = timestamp
+            env["GIT_COMMITTER_DATE"] = timestamp
+            return env
+
+        # Note: we don't keep the generated commits alive by updating refs while
+        # doing this.  Since commit-tree itself produces unreferenced objects,
+        # it seems unlikely it will ever run an automatic GC, and if someone
+        # else triggers a GC while we're working, and it prunes our objects,
+        # then we'll fail, which is no big deal (we'd just leave the existing
+        # keepalive refs unmodified.)
+        #
+        # Also note: in most cases, the repacked keepalive chain will end up
+        # reusing the commit objects from the existing keepalive chain, since
+        # all meta-data in the generated commits come from the commits that we
+        # keep alive, and the order stable.
+
+        try:
+            processed = set()
+
+            new_value = self.run(
+                "commit-tree", EMPTY_TREE_SHA1, input="Root",
+                env=withDates(env, keepalive_refs[0][2])).strip()
+
+            for _, sha1, timestamp in keepalive_refs:
+                if sha1 in processed:
+                    continue
+<<<<<<< HEAD
+                processed.add(sha1)
+
+                new_value = self.run(
+=======
+                processed.add( sha1 )
+
+                new_value = self.run( 
+                    "commit-tree", EMPTY_TREE_SHA1, "-p", new_value, "-p", sha1,
+>>>>>>> topic
+                processed.add(sha1)
+
+                new_value = self.run(
+                    "commit-tree", EMPTY_TREE_SHA1, "-p", new_value, "-p", sha1,
+                    input=sha1, env=withDates(env, timestamp)).strip()
+
+            self.updateref(KEEPALIVE_REF_CHAIN, new_value, old_value)
+        except GitCommandError:
+            # No big deal if this fails here; this is just a maintenance
+            # operation.  We'll try again another day.
+            return False
+
+        for _, sha1, _ in loose_keepalive_refs:
+            try:
+                self.deleteref(KEEPALIVE_REF_PREFIX + sha1, sha1)
+            except GitCommandError:
+                # Ignore failures to delete loose keepalive refs.
+                pass
+
+        return True
+
+    @contextlib.contextmanager
+    def temporaryref(self, commit):
+        sha1 = self.revparse(str(commit))
+        name = "refs/temporary/%s" % sha1
+        self.createref(name, sha1)
+        try:
+            yield name
+        finally:
+            self.deleteref(name, sha1)
+
+    def __copy(self, identifier, flavor):
+        base_args = ["clone", "--quiet"]
+
+        if flavor == "relay":
+            base_args.append("--bare")
+            base_dir = REPOSITORY_RELAYCOPY_DIR
+        else:
+            assert flavor == "work"
+            base_dir = REPOSITORY_WORKCOPY_DIR
+
+        class Copy(object):
+            def __init__(self, origin, path, name):
+                self.origin = origin
+                self.path = path
+                self.name = name
+            def run(self, *args, **kwargs):
+                return self.origin.runCustom(
+                    os.path.join(self.path, self.name), *args, **kwargs)
+            def __enter__(self):
+                return self
+            def __exit__(self, *args):
+<<<<<<< HEAD
+                shutil.rmtree(self.path)
+                return False
+
+=======
+                shutil.rmtree( self.path )
+                return False
+
+        path = tempfile.mkdtemp( prefix="%s_%s_" % ( self.name, identifier ),
+>>>>>>> topic
+                shutil.rmtree(self.path)
+                return False
+
+        path = tempfile.mkdtemp(prefix="%s_%s_" % (self.name, identifier),
+                                dir=base_dir)
+        name = os.path.basename(self.path)
+
+        local_args = base_args[:]
+        if not same_filesystem(self.path, path):
+            local_args.append("--shared")
+        local_args.extend([self.path, name])
+
+        fallback_args = base_args[:]
+        fallback_args.extend(["file://" + os.path.abspath(self.path), name])
+
+        try:
+            # Try cloning with --local (implied by using a plain path as the
+            # repository URL.)  This may fail due to inaccessible pack-*.keep
+            # files in the repository.
+            self.runCustom(path, *local_args)
+        except GitCommandError:
+            try:
+                # Try cloning without --local (implied by using a file://
+                # repository URL.)  This is slower and uses more disk space, but
+                # is immune to the problems with inaccessible pack-*.keep files.
+                self.runCustom(path, *fallback_args)
+            except GitCommandError:
+                shutil.rmtree(path)
+                raise
+
+        return Copy(self, path, name)
+
+    def relaycopy(self, identifier):
+        return self.__copy(identifier, "relay")
+
+    def workcopy(self, identifier):
+        return self.__copy(identifier, "work")
+
+    def replaymerge(self, db, user, commit):
+        with self.workcopy(commit.sha1) as workcopy:
+            with self.temporaryref(commit) as ref_name:
+                # Fetch the merge to replay from the main repository into the work copy.
+                workcopy.run('fetch', 'origin', ref_name)
+
+            parent_sha1s = commit.parents
+
+            # Create and check out a branch at first parent.
+            workcopy.run('checkout', '-b', 'replay', parent_sha1s[0])
+
+            # Then perform the merge with the other parents.
+            returncode, stdout, stderr = workcopy.run("merge", *parent_sha1s[1:],
+                env=getGitEnvironment(author=commit.author),
+<<<<<<< HEAD
+                check_errors=False)
+
+            # If the merge produced conflicts, just stage and commit them:
+=======
+                check_errors=False )
+
+            # If the merge produced conflicts, just stage and commit them:
+            if returncode != 0:
+>>>>>>> topic
+                check_errors=False)
+
+            # If the merge produced conflicts, just stage and commit them:
+            if returncode != 0:
+                # Reset any submodule gitlinks with conflicts: since we don't
+                # have the submodules checked out, "git commit --all" below
+                # may fail to index them.
+                for line in stdout.splitlines():
+                    if line.startswith("CONFLICT (submodule):"):
+                        submodule_path = line.split()[-1]
+                        workcopy.run("reset", "--", submodule_path, check_errors=False)
+
+                # Then stage and commit the result, with conflict markers and all.
+                workcopy.run("commit", "--all", "--message=replay of merge that produced %s" % commit.sha1,
+                             env=getGitEnvironment(author=commit.author))
+
+            sha1 = workcopy.run("rev-parse", "HEAD").strip()
+
+            # Then push the commit to the main repository.
+            workcopy.run('push', 'origin', 'HEAD:refs/keepalive/' + sha1)
+
+            commit = Commit.fromSHA1(db, self, sha1)
+
+            # Finally, return the resulting commit.
+            return commit
+
+    def getDefaultRemote(self, db):
+        cursor = db.cursor()
+        cursor.execute("""SELECT remote
+                            FROM trackedbranches
+                           WHERE repository=%s
+                             AND local_name IN ('*', 'master')
+                        ORDER BY local_name
+                           LIMIT 1""",
+                       (self.id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def updateBranchFromRemote(self, db, remote, branch_name):
+        cursor = db.cursor()
+        cursor.execute("""SELECT 1
+                            FROM trackedbranches
+                           WHERE repository=%s
+                             AND local_name=%s
+                             AND NOT disabled""",
+                       (self.id, branch_name))
+        if cursor.fetchone():
+            # Don't update a branch that the branch tracker service owns;
+            # instead just assume it's already up-to-date.
+            return
+
+        if not branch_name.startswith("refs/"):
+<<<<<<< HEAD
+            branch_name = "refs/heads/%s" % branch_name
+
+        with self.relaycopy("updateBranchFromRemote") as relay:
+=======
+            branch_name = "refs/heads/%s" % branch_name
+
+        with self.relaycopy( "updateBranchFromRemote" ) as relay:
+            try:
+>>>>>>> topic
+            branch_name = "refs/heads/%s" % branch_name
+
+        with self.relaycopy("updateBranchFromRemote") as relay:
+            try:
+                relay.run("fetch", remote, branch_name)
+            except GitCommandError as error:
+                if error.output.startswith("fatal: Couldn't find remote ref "):
+                    raise GitReferenceError("Couldn't find ref %s in %s." % (branch_name, remote),
+                                            ref=branch_name, repository=remote)
+                raise
+
+            relay.run("push", "-f", "origin", "FETCH_HEAD:%s" % branch_name)
+
+    @contextlib.contextmanager
+    def fetchTemporaryFromRemote(self, remote, ref):
+        with self.relaycopy("fetchTemporaryFromRemote") as relay:
+            try:
+                relay.run("fetch", remote, ref)
+            except GitCommandError as error:
+                if error.output.startswith("fatal: Couldn't find remote ref "):
+                    raise GitReferenceError("Couldn't find ref %s in %s." % (ref, remote), ref=ref, repository=remote)
+                elif error.output.startswith("fatal: Invalid refspec "):
+                    raise GitReferenceError("Invalid ref %r." % ref, ref=ref)
+                raise
+
+            sha1 = relay.run("rev-parse", "--verify", "FETCH_HEAD").strip()
+            name = "refs/temporary/%s" % sha1
+
+            relay.run("push", "-f", "origin", "%s:%s" % (sha1, name))
+
+        try:
+            yield sha1
+        finally:
+            self.deleteref(name, sha1)
+
+    @staticmethod
+    def readObject(repository_path, object_type, object_sha1):
+        argv = [configuration.executables.GIT, 'cat-file', object_type, object_sha1]
+        git = subprocess.Popen(argv, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, cwd=repository_path)
+        stdout, stderr = git.communicate()
+        if git.returncode != 0:
+            raise GitCommandError(" ".join(argv), stderr.strip(), repository_path)
+        return stdout
+
+    @staticmethod
+    def lsremote(remote, include_heads=False, include_tags=False, pattern=None, regexp=None):
+        if regexp: name_check = lambda item: bool(regexp.match(item[1]))
+        else: name_check = lambda item: True
+
+        argv = [configuration.executables.GIT, 'ls-remote']
+
+<<<<<<< HEAD
+        if include_heads: argv.append("--heads")
+        if include_tags: argv.append("--tags")
+
+=======
+        if include_heads: argv.append( "--heads" )
+        if include_tags: argv.append( "--tags" )
+
+        argv.append( remote )
+>>>>>>> topic
+        if include_heads: argv.append("--heads")
+        if include_tags: argv.append("--tags")
+
+        argv.append(remote)
+
+        if pattern: argv.append(pattern)
+
+        git = subprocess.Popen(argv, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+        stdout, stderr = git.communicate()
+
+        if git.returncode == 0:
+            return filter(name_check, (line.split() for line in stdout.splitlines()))
+        else:
+            cmdline = " ".join(argv)
+            output = stderr.strip()
+            cwd = os.getcwd()
+            raise GitCommandError(cmdline, output, cwd)
+
+    def findInterestingTag(self, db, sha1):
+        cursor = db.cursor()
+        cursor.execute("SELECT name FROM tags WHERE repository=%s AND sha1=%s",
+                       (self.id, sha1))
+
+        tags = [tag for (tag,) in cursor]
+
+        try:
+            from customization.filtertags import filterTags
+            tags = filterTags(self, tags)
+        except ImportError:
+            pass
+
+        if tags: return tags[0]
+        else: return None
+
+    def getHead(self, db):
+        return Commit.fromSHA1(db, self, self.revparse("HEAD"))
+
+    def isEmpty(self):
+        try:
+            self.revparse("HEAD")
+            return False
+        except GitError:
+            return True
+
+    def invokeGitHttpBackend(self, req, user, path):
+        request_environ = req.getEnvironment()
+
+        environ = { "GIT_HTTP_EXPORT_ALL": "true",
+                    "REMOTE_ADDR": request_environ.get("REMOTE_ADDR", "unknown"),
+                    "PATH_TRANSLATED": os.path.join(self.path, path),
+                    "REQUEST_METHOD": req.method,
+<<<<<<< HEAD
+                    "QUERY_STRING": req.query }
+
+        if "CONTENT_TYPE" in request_environ:
+=======
+                    "QUERY_STRING": req.query }
+
+        if "CONTENT_TYPE" in request_environ:
+            environ["CONTENT_TYPE"] = request_environ["CONTENT_TYPE"]
+>>>>>>> topic
+                    "QUERY_STRING": req.query }
+
+        if "CONTENT_TYPE" in request_environ:
+            environ["CONTENT_TYPE"] = request_environ["CONTENT_TYPE"]
+
+        for name, value in req.getEnvironment().items():
+            if name.startswith("HTTP_"):
+                environ[name] = value
+
+        if not user.isAnonymous():
+            environ["REMOTE_USER"] = user.name
+        elif not configuration.base.ALLOW_ANONYMOUS_USER \
+                or path == "git-receive-pack" \
+                or req.getParameter("service", None) == "git-receive-pack":
+            # The git-receive-pack service fails without a user, so request
+            # authorization.
+            raise GitHttpBackendNeedsUser
+
+        git_http_backend = communicate.Communicate(subprocess.Popen(
+            [configuration.executables.GIT, "http-backend"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, env=environ))
+
+        def produceInput():
+            data = req.read(65536)
+            if not data:
+                return None
+            return data
+
+        def handleHeaderLine(line):
+            line = line.strip()
+
+            if not line:
+                req.start()
+                git_http_backend.setCallbacks(stdout=handleOutput)
+                return
+
+            name, _, value = line.partition(":")
+            name = name.strip()
+            value = value.strip()
+
+            if name.lower() == "status":
+                status_code, _, status_text = value.partition(" ")
+                req.setStatus(int(status_code), status_text.strip())
+            elif name.lower() == "content-type":
+                req.setContentType(value)
+            else:
+                req.addResponseHeader(name, value)
+
+        def handleOutput(data):
+            req.write(data)
+
+<<<<<<< HEAD
+        git_http_backend.setInput(produceInput)
+        git_http_backend.setCallbacks(stdout_line=handleHeaderLine)
+
+=======
+        git_http_backend.setInput( produceInput )
+        git_http_backend.setCallbacks( stdout_line=handleHeaderLine )
+
+        try:
+>>>>>>> topic
+        git_http_backend.setInput(produceInput)
+        git_http_backend.setCallbacks(stdout_line=handleHeaderLine)
+
+        try:
+            _, stderr = git_http_backend.run()
+        except communicate.ProcessError as error:
+            raise GitHttpBackendError(error.process.returncode, error.stderr)
+
+    def describe(self, db, sha1):
+        tag = self.findInterestingTag(db, sha1)
+        if tag: return tag
+
+        cursor = db.cursor()
+        cursor.execute("""SELECT branches.name, commits.sha1
+                            FROM repositories
+                            JOIN branches ON (branches.id=repositories.branch)
+                            JOIN commits ON (commits.id=branches.head)
+                           WHERE repositories.id=%s""",
+                       (self.id,))
+
+        for branch_name, head_sha1 in cursor:
+            if sha1 == head_sha1:
+                return "tip of " + branch_name
+            try:
+                if self.mergebase([sha1, head_sha1]) == sha1:
+                    return branch_name
+            except GitError:
+                pass
+
+        cursor.execute("""SELECT branches.name, commits.sha1
+                            FROM trackedbranches
+                            JOIN branches ON (branches.repository=trackedbranches.repository
+                                          AND branches.name=trackedbranches.local_name)
+                            JOIN commits ON (commits.id=branches.head)
+                           WHERE trackedbranches.repository=%s
+                             AND branches.type='normal'""",
+                       (self.id,))
+
+        for branch_name, head_sha1 in cursor:
+            if sha1 == head_sha1:
+                return "tip of " + branch_name
+            try:
+                if self.mergebase([sha1, head_sha1]) == sha1:
+                    return branch_name
+            except GitError:
+                pass
+
+        return None
+
+class CommitUserTime(object):
+    def __init__(self, name, email, time):
+        self.name = name
+<<<<<<< HEAD
+        self.email = email
+        self.time = time
+
+=======
+        self.email = email
+        self.time = time
+
+    def __getIds( self, db ):
+>>>>>>> topic
+        self.email = email
+        self.time = time
+
+    def __getIds(self, db):
+        cache = db.storage["CommitUserTime"]
+        cache_key = (self.name, self.email)
+
+        if cache_key not in cache:
+            cursor = db.cursor()
+            cursor.execute("""SELECT id
+                                FROM gitusers
+                               WHERE fullname=%s
+                                 AND email=%s""",
+                           (self.name, self.email))
+            row = cursor.fetchone()
+            if not row:
+                cursor.execute("""INSERT INTO gitusers (fullname, email)
+                                       VALUES (%s, %s)
+                                    RETURNING id""",
+                               (self.name, self.email))
+                row = cursor.fetchone()
+            gituser_id, = row
+
+            cursor.execute("""SELECT uid
+                                FROM usergitemails
+                               WHERE email=%s""",
+                           (self.email,))
+            user_ids = frozenset(user_id for user_id, in cursor)
+
+            cache[cache_key] = user_ids, gituser_id
+
+        return cache.get(cache_key)
+
+    def getUserIds(self, db):
+        return self.__getIds(db)[0]
+
+    def getGitUserId(self, db):
+        return self.__getIds(db)[1]
+
+    def getFullname(self, db):
+        user_ids = self.getUserIds(db)
+        if len(user_ids) == 1:
+            import dbutils
+            return dbutils.User.fromId(db, tuple(user_ids)[0]).fullname
+        else:
+            return self.name
+
+    def __str__(self):
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", self.time)
+        return "%s <%s> at %s" % (self.name, self.email, timestamp)
+
+    @staticmethod
+<<<<<<< HEAD
+    def fromValue(value):
+        match = re_author_committer.match(value)
+        return CommitUserTime(textutils.decode(match.group(1)).encode("utf-8"),
+=======
+    def fromValue( value ):
+        match = re_author_committer.match( value )
+        return CommitUserTime( textutils.decode( match.group( 1 ) ).encode( "utf-8" ),
+                              textutils.decode( match.group( 2 ) ).encode( "utf-8" ),
+>>>>>>> topic
+    def fromValue(value):
+        match = re_author_committer.match(value)
+        return CommitUserTime(textutils.decode(match.group(1)).encode("utf-8"),
+                              textutils.decode(match.group(2)).encode("utf-8"),
+                              time.gmtime(int(match.group(3).split(" ")[0])))
+
+class Commit:
+    def __init__(self, repository, id, sha1, parents, author, committer, message, tree):
+        self.repository = repository
+        self.id = id
+        self.sha1 = sha1
+        self.parents = parents
+        self.author = author
+        self.committer = committer
+        self.message = message
+        self.tree = tree
+
+    def __cache(self, db):
+        if not db:
+            return
+        cache = db.storage["Commit"]
+        if self.id: cache[self.id] = self
+        cache[self.sha1] = self
+
+    @staticmethod
+    def fromGitObject(db, repository, gitobject, commit_id=None):
+        assert gitobject.type == "commit"
+
+        data = gitobject.data
+        parents = []
+
+        while True:
+            line, data = data.split('\n', 1)
+
+            if not line:
+                break
+
+            key, value = line.split(' ', 1)
+
+            if key == 'tree': tree = value
+            elif key == 'parent': parents.append(value)
+            elif key == 'author': author = CommitUserTime.fromValue(value)
+            elif key == 'committer': committer = CommitUserTime.fromValue(value)
+
+        message = textutils.decode(data).encode("utf-8")
+
+        commit = Commit(repository, commit_id, gitobject.sha1, parents, author,
+                        committer, message, tree)
+        commit.__cache(db)
+        return commit
+
+    @staticmethod
+<<<<<<< HEAD
+    def fromSHA1(db, repository, sha1, commit_id=None):
+        return Commit.fromGitObject(db, repository, repository.fetch(sha1), commit_id)
+
+=======
+    def fromSHA1( db, repository, sha1, commit_id=None ):
+        return Commit.fromGitObject( db, repository, repository.fetch( sha1 ), commit_id )
+
+    @staticmethod
+>>>>>>> topic
+    def fromSHA1(db, repository, sha1, commit_id=None):
+        return Commit.fromGitObject(db, repository, repository.fetch(sha1), commit_id)
+
+    @staticmethod
+    def fromId(db, repository, commit_id):
+        commit = db.storage["Commit"].get(commit_id)
+        if not commit:
+            cursor = db.cursor()
+            cursor.execute("SELECT sha1 FROM commits WHERE id=%s", (commit_id,))
+            sha1 = cursor.fetchone()[0]
+            commit = Commit.fromSHA1(db, repository, sha1, commit_id)
+        return commit
+
+    def __hash__(self): return hash(self.sha1)
+    def __eq__(self, other): return self.sha1 == str(other)
+    def __ne__(self, other): return self.sha1 != str(other)
+    def __str__(self): return self.sha1
+    def __repr__(self):
+        if self.id is None: return "Commit(sha1=%r)" % self.sha1
+        else: return "Commit(sha1=%r, id=%d)" % (self.sha1, self.id)
+
+    def summary(self, maxlen=None):
+        summary = self.message.split("\n", 1)[0].strip()
+        if maxlen and len(summary) > maxlen:
+            summary = summary[:maxlen - 3].strip() + "..."
+        return summary
+
+    def niceSummary(self, include_tag=True):
+        try:
+            summary, _, rest = self.message.partition("\n")
+
+            if summary.startswith("fixup! ") or summary.startswith("squash! "):
+                fixup_summary = rest.strip().partition("\n")[0].strip()
+                if fixup_summary:
+                    what = summary[:summary.index("!")]
+                    if include_tag:
+                        return "[%s] %s" % (what, fixup_summary)
+                    else:
+                        return fixup_summary
+
+            return summary
+        except:
+            return self.summary()
+
+    def getId(self, db):
+        if self.id is None:
+            cursor = db.cursor()
+            cursor.execute("SELECT id FROM commits WHERE sha1=%s", (self.sha1,))
+            self.id = cursor.fetchone()[0]
+            self.__cache(db)
+        return self.id
+
+<<<<<<< HEAD
+    def findInterestingTag(self, db):
+        return self.repository.findInterestingTag(db, self.sha1)
+
+=======
+    def findInterestingTag( self, db ):
+        return self.repository.findInterestingTag( db, self.sha1 )
+
+    def describe( self, db ):
+>>>>>>> topic
+    def findInterestingTag(self, db):
+        return self.repository.findInterestingTag(db, self.sha1)
+
+    def describe(self, db):
+        if db:
+            tag = self.findInterestingTag(db)
+            if tag: return tag
+        return self.sha1[:8]
+
+    def oneline(self, db, decorate=False):
+        line = "%s %s" % (self.sha1[:8], self.niceSummary())
+        if decorate:
+            decorations = []
+            if self == self.repository.getHead(db):
+                decorations.append("HEAD")
+            cursor = db.cursor()
+            cursor.execute("""SELECT branches.name
+                                FROM branches
+                                JOIN reachable ON (reachable.branch=branches.id)
+                                JOIN commits ON (commits.id=reachable.commit)
+                               WHERE commits.sha1=%s""",
+                           (self.sha1,))
+            decorations.extend(branch for (branch,) in cursor)
+            if decorations:
+                line += " (%s)" % ", ".join(decorations)
+        return line
+
+    def isAncestorOf(self, other):
+        if isinstance(other, Commit):
+            if self.repository != other.repository: return False
+            other_sha1 = other.sha1
+        else:
+            other_sha1 = str(other)
+
+        graph = self.repository.getCommitGraph()
+        if graph and self.sha1 in graph and other_sha1 in graph:
+            return graph.isAncestor(self.sha1, other_sha1)
+
+        try:
+            mergebase_sha1 = self.repository.mergebase([self.sha1, other_sha1])
+        except GitCommandError:
+            # Merge-base fails if there is no common ancestor.  And if two
+            # commits have no common ancestor, neither can be an ancestor of the
+            # other, obviously.
+            return False
+        else:
+            return mergebase_sha1 == self.sha1
+
+    def getTree(self, path):
+        return Tree.fromPath(self, "/" + path.lstrip("/"))
+
+    def getFileEntry(self, path):
+<<<<<<< HEAD
+        return Tree.resolvePaths(self, [path])[path]
+
+    def getFileSHA1(self, path):
+=======
+        return Tree.resolvePaths( self, [path] )[path]
+
+    def getFileSHA1( self, path ):
+        entry = self.getFileEntry( path )
+>>>>>>> topic
+        return Tree.resolvePaths(self, [path])[path]
+
+    def getFileSHA1(self, path):
+        entry = self.getFileEntry(path)
+        if entry is None:
+            return None
+        return entry.sha1
+
+    def isDirectory(self, path):
+        return self.getTree(path) is not None
+
+class Tree:
+    class Entry:
+        class Mode(int):
+            def __new__(cls, value):
+                return super(Tree.Entry.Mode, cls).__new__(cls, int(value, 8))
+
+            def __str__(self):
+                if stat.S_ISDIR(self):
+                    return "d---------"
+                elif self == 0160000:
+                    return "m---------"
+                else:
+                    if stat.S_ISLNK(self): string = "l"
+                    else: string = "-"
+
+                    flags = ["---", "--x", "-w-", "-wx", "r--", "r-x", "rw-", "rwx"]
+                    return string + flags[(self & 0700) >> 6] + flags[(self & 070) >> 3] + flags[self & 07]
+
+        def __init__(self, name, mode, type, sha1, size):
+            if len(name) > 2 and name[0] in ('"', "'") and name[-1] == name[0]:
+                name = diff.parse.demunge(name[1:-1])
+
+            self.name = name
+            self.mode = Tree.Entry.Mode(mode)
+            self.type = type
+            self.sha1 = sha1
+            self.size = size
+
+        def __str__(self):
+            return self.name
+
+        def __repr__(self):
+            return "[%s %s %s %s%s]" % (self.mode, self.type, self.name, self.sha1[:8], " %d" % self.size if self.size else "")
+
+    def __init__(self, entries, commit=None):
+        self.__entries_list = entries
+        self.__entries_dict = dict([(entry.name, entry) for entry in entries])
+
+    def __getitem__(self, item):
+        if type(item) == int:
+            return self.__entries_list[item]
+<<<<<<< HEAD
+        else:
+            return self.__entries_dict[str(item)]
+
+=======
+        else:
+            return self.__entries_dict[str( item )]
+
+    def __len__( self ):
+>>>>>>> topic
+        else:
+            return self.__entries_dict[str(item)]
+
+    def __len__(self):
+        return len(self.__entries_list)
+    def __iter__(self):
+        return iter(self.__entries_list)
+
+    def keys(self):
+        return self.__entries_dict.keys()
+    def items(self):
+        return self.__entries_dict.items()
+    def values(self):
+        return self.__entries_dict.values()
+    def get(self, key, default=None):
+        return self.__entries_dict.get(key, default)
+
+    @staticmethod
+    def parse(data):
+        """Parse raw tree object data into a list of (mode, name, sha1)"""
+
+        offset = 0
+        parsed = []
+
+        while offset < len(data):
+            space = data.index(" ", offset)
+            null = data.index("\0", space + 1)
+
+            mode = data[offset:space]
+            name = data[space + 1:null]
+
+            sha1_binary = data[null + 1:null + 21]
+            sha1 = "".join([("%02x" % ord(c)) for c in sha1_binary])
+
+            parsed.append((mode, name, sha1))
+
+            offset = null + 21
+
+        return parsed
+
+    @staticmethod
+    def fromSHA1s(repository, sha1s):
+        """Return a list of Tree objects, one per tree SHA-1 in 'sha1s'
+
+           Trees are looked up in (and added to) the process-wide TREE_CACHE.
+           Trees not cached are fetched with one pipelined fetch, and the sizes
+           of all blobs in them with another."""
+
+        trees = [TREE_CACHE.get((repository.path, sha1)) for sha1 in sha1s]
+        missing = [sha1 for sha1, tree in zip(sha1s, trees) if tree is None]
+
+        if missing:
+<<<<<<< HEAD
+            parsed = dict((git_object.sha1, Tree.parse(git_object.data))
+                          for git_object in repository.fetchMany(missing))
+
+=======
+            parsed = dict( ( git_object.sha1, Tree.parse( git_object.data ) )
+                          for git_object in repository.fetchMany( missing ) )
+
+            blob_sha1s = set(  )
+>>>>>>> topic
+            parsed = dict((git_object.sha1, Tree.parse(git_object.data))
+                          for git_object in repository.fetchMany(missing))
+
+            blob_sha1s = set()
+            for items in parsed.values():
+                for mode, _, sha1 in items:
+                    if Tree.typeFromMode(mode) == "blob":
+                        blob_sha1s.add(sha1)
+            blob_sha1s = list(blob_sha1s)
+
+            sizes = dict((sha1, git_object.size)
+                         for sha1, git_object
+                         in zip(blob_sha1s, repository.fetchMany(blob_sha1s, fetchData=False)))
+
+            for index, sha1 in enumerate(sha1s):
+                if trees[index] is None:
+                    entries = []
+                    for mode, name, entry_sha1 in parsed[sha1]:
+                        entry_type = Tree.typeFromMode(mode)
+                        entries.append(Tree.Entry(name, mode, entry_type, entry_sha1,
+                                                  sizes.get(entry_sha1)))
+                    trees[index] = Tree(entries)
+                    TREE_CACHE.add((repository.path, sha1), trees[index])
+
+        return trees
+
+    @staticmethod
+    def fromSHA1(repository, sha1):
+        return Tree.fromSHA1s(repository, [sha1])[0]
+
+    @staticmethod
+    def typeFromMode(mode):
+        mode = int(mode, 8)
+        if stat.S_ISDIR(mode):
+            return "tree"
+        elif mode == 0160000:
+            return "commit"
+        else:
+            return "blob"
+
+    @staticmethod
+    def fromPath(commit, path):
+        assert path[0] == "/"
+
+        return Tree.resolvePaths(commit, [path], directories=True)[path]
+
+    @staticmethod
+    def resolvePaths(commit, paths, directories=False):
+        """Resolve several paths in a commit's tree
+
+           Returns a dictionary mapping each path to its Tree.Entry (or the Tree
+           object, if 'directories' is true), or None if there is no such file
+<<<<<<< HEAD
+           (or directory.)
+
+           Paths are resolved one directory level at a time for all paths at
+=======
+           ( or directory. )
+
+           Paths are resolved one directory level at a time for all paths at
+           once, so shared leading directories are only looked up once, and all
+>>>>>>> topic
+           (or directory.)
+
+           Paths are resolved one directory level at a time for all paths at
+           once, so shared leading directories are only looked up once, and all
+           trees needed at one level are fetched with a single pipelined fetch.
+           Resolved directories are remembered across requests in PATH_CACHE,
+           keyed by the commit's root tree."""
+
+        repository = commit.repository
+
+        def normalize(path):
+            return "/".join(filter(None, path.split("/")))
+
+        # Maps directory path (without leading or trailing slash) to the
+        # directory's tree SHA-1, or None.
+        directories_sha1 = { "": commit.tree }
+
+        def lookupDirectories(wanted):
+            pending = set()
+            for directory in wanted:
+                if directory in directories_sha1:
+                    continue
+                cached = PATH_CACHE.get((repository.path, commit.tree, directory), False)
+                if cached is not False:
+                    directories_sha1[directory] = cached
+                else:
+                    pending.add(directory)
+
+            if not pending:
+                return
+
+            # Resolve the parent directories first (level by level, since each
+            # call recurses one level up only for directories still missing.)
+            lookupDirectories(set(os.path.dirname(directory) for directory in pending))
+
+            parents = sorted(set(directories_sha1[os.path.dirname(directory)]
+                                 for directory in pending) - set([None]))
+            trees = dict(zip(parents, Tree.fromSHA1s(repository, parents)))
+
+            for directory in pending:
+                parent_sha1 = directories_sha1[os.path.dirname(directory)]
+                sha1 = None
+                if parent_sha1 is not None:
+                    entry = trees[parent_sha1].get(os.path.basename(directory))
+                    if entry and entry.type == "tree":
+                        sha1 = entry.sha1
+                directories_sha1[directory] = sha1
+                PATH_CACHE.add((repository.path, commit.tree, directory), sha1)
+
+        normalized = dict((path, normalize(path)) for path in paths)
+
+        if directories:
+<<<<<<< HEAD
+            lookupDirectories(set(normalized.values()))
+            wanted = sorted(set(directories_sha1[directory]
+                                for directory in normalized.values()) - set([None]))
+=======
+            lookupDirectories( set( normalized.values(  ) ) )
+            wanted = sorted( set( directories_sha1[directory]
+                                for directory in normalized.values(  ) ) - set( [None] ) )
+            trees = dict( zip( wanted, Tree.fromSHA1s( repository, wanted ) ) )
+>>>>>>> topic
+            lookupDirectories(set(normalized.values()))
+            wanted = sorted(set(directories_sha1[directory]
+                                for directory in normalized.values()) - set([None]))
+            trees = dict(zip(wanted, Tree.fromSHA1s(repository, wanted)))
+            return dict((path, trees.get(directories_sha1[directory]))
+                        for path, directory in normalized.items())
+
+        lookupDirectories(set(os.path.dirname(path) for path in normalized.values()))
+        wanted = sorted(set(directories_sha1[os.path.dirname(path)]
+                            for path in normalized.values()) - set([None]))
+        trees = dict(zip(wanted, Tree.fromSHA1s(repository, wanted)))
+
+        result = {}
+        for path, normalized_path in normalized.items():
+            tree = trees.get(directories_sha1[os.path.dirname(normalized_path)])
+            if tree is None or not normalized_path:
+                result[path] = None
+            else:
+                result[path] = tree.get(os.path.basename(normalized_path))
+        return result
+
+def getTaggedCommit(repository, sha1):
+    """Returns the SHA-1 of the tagged commit.
+
+       If the supplied SHA-1 sum is a commit object, then it is returned,
+       otherwise it must be a tag object, which is parsed to retrieve the
+       tagged object SHA-1 sum."""
+
+    while True:
+        git_object = repository.fetch(sha1)
+
+        if git_object.type == "commit":
+            return sha1
+        elif git_object.type != "tag":
+            return
+
+        sha1 = git_object.data.split("\n", 1)[0].split(" ", 1)[-1]
+
+class Blame:
+    """Line-by-line blame of files between two commits
+
+       The first time a file is blamed between a given pair of commits, the
+       whole file is blamed, and the result is stored in an in-process cache
+       and on disk (under BLAME_CACHE_DIR), so that blaming other ranges of
+       the same file, now or in later requests, doesn't run Git again."""
+
+    def __init__(self, from_commit, to_commit):
+        assert from_commit.repository == to_commit.repository
+
+        self.repository = from_commit.repository
+        self.from_commit = from_commit
+        self.to_commit = to_commit
+<<<<<<< HEAD
+        self.commits = []
+        self.__commit_ids = {}
+
+=======
+        self.commits = []
+        self.__commit_ids = {}
+
+    def __cachePath( self, path ):
+>>>>>>> topic
+        self.commits = []
+        self.__commit_ids = {}
+
+    def __cachePath(self, path):
+        key = hashlib.sha1("\0".join([self.repository.path,
+                                       self.from_commit.sha1,
+                                       self.to_commit.sha1,
+                                       path])).hexdigest()
+        return os.path.join(BLAME_CACHE_DIR, key[:2], key[2:] + ".json")
+
+    def __blameFile(self, path):
+        # Returns a dictionary with the keys "commits", a list of
+        # [sha1, author name, author email], and "lines", a list containing
+        # for each line in the file an index into "commits".
+        output = self.repository.run("blame",
+                                     "--porcelain",
+                                     "%s..%s" % (self.from_commit.sha1, self.to_commit.sha1),
+                                     "--", path)
+
+        inlines = iter(output.splitlines())
+        commits = []
+        commit_indices = {}
+        lines = []
+
+        try:
+            while True:
+                sha1 = inlines.next().split(" ")[0]
+
+                author = None
+                author_email = None
+
+                line = inlines.next()
+                while not line.startswith("\t"):
+                    if line.startswith("author "): author = line[7:]
+                    elif line.startswith("author-mail "): author_email = line[13:-1]
+                    line = inlines.next()
+
+                if sha1 not in commit_indices:
+                    commit_indices[sha1] = len(commits)
+                    commits.append([sha1, author, author_email])
+
+                lines.append(commit_indices[sha1])
+        except StopIteration:
+            pass
+
+        return { "commits": commits, "lines": lines }
+
+    def __getFileBlame(self, db, path):
+        key = (self.repository.path, self.from_commit.sha1, self.to_commit.sha1, path)
+
+        file_blame = BLAME_CACHE.get(key)
+        if file_blame:
+<<<<<<< HEAD
+            if db: db.recordProfiling("blame (cached)", 0)
+            return file_blame
+
+=======
+            if db: db.recordProfiling( "blame ( cached )", 0 )
+            return file_blame
+
+        cache_path = self.__cachePath( path )
+>>>>>>> topic
+            if db: db.recordProfiling("blame (cached)", 0)
+            return file_blame
+
+        cache_path = self.__cachePath(path)
+
+        try:
+            with open(cache_path) as cache_file:
+                file_blame = textutils.json_decode(cache_file.read())
+        except (IOError, ValueError):
+            before = time.time()
+            file_blame = self.__blameFile(path)
+            if db: db.recordProfiling("blame", time.time() - before)
+
+            try:
+                if not os.path.isdir(os.path.dirname(cache_path)):
+                    os.makedirs(os.path.dirname(cache_path), 0750)
+                temporary_path = "%s.%d" % (cache_path, os.getpid())
+                with open(temporary_path, "w") as cache_file:
+                    cache_file.write(textutils.json_encode(file_blame))
+                os.rename(temporary_path, cache_path)
+            except (IOError, OSError):
+                # Failing to store the result is not a problem; we'll just have
+                # to blame again in a later request.
+                pass
+        else:
+            if db: db.recordProfiling("blame (cached on disk)", 0)
+
+            # Keep it from being purged by the maintenance service.
+            try: os.utime(cache_path, None)
+            except OSError: pass
+
+        BLAME_CACHE.add(key, file_blame)
+        return file_blame
+
+    def blame(self, db, path, first_line, last_line):
+        file_blame = self.__getFileBlame(db, path)
+        file_commits = file_blame["commits"]
+        indices = file_blame["lines"][first_line - 1:last_line]
+
+        # Fetch all commits not seen before with one round-trip to Git.
+        new_commits = []
+        for index in indices:
+            sha1 = file_commits[index][0]
+            if sha1 not in self.__commit_ids:
+                self.__commit_ids[sha1] = None
+                new_commits.append(file_commits[index])
+
+        new_sha1s = [sha1 for sha1, _, _ in new_commits]
+
+        for (sha1, author, author_email), gitobject \
+                in zip(new_commits, self.repository.fetchMany(new_sha1s)):
+            commit = Commit.fromGitObject(db, self.repository, gitobject)
+<<<<<<< HEAD
+
+            self.__commit_ids[sha1] = len(self.commits)
+            self.commits.append({ "sha1": sha1,
+=======
+
+            self.__commit_ids[sha1] = len( self.commits )
+            self.commits.append( { "sha1": sha1,
+                                  "author_name": author,
+>>>>>>> topic
+
+            self.__commit_ids[sha1] = len(self.commits)
+            self.commits.append({ "sha1": sha1,
+                                  "author_name": author,
+                                  "author_email": author_email,
+                                  "summary": commit.niceSummary(),
+                                  "message": commit.message,
+                                  "original": sha1 == self.from_commit.sha1,
+                                  "current": sha1 == self.to_commit.sha1 })
+
+        return [{ "offset": first_line + offset,
+                  "commit": self.__commit_ids[file_commits[index][0]] }
+                for offset, index in enumerate(indices)]
+
+class FetchCommits(threading.Thread):
+    def __init__(self, repository, sha1s):
+        super(FetchCommits, self).__init__()
+
+        self.repository = repository
+        self.sha1s = sha1s
+        self.gitobjects = []
+        self.commits = None
+        self.error = None
+        self.joined = False
+
+        self.start()
+
+    def run(self):
+        batch = BATCH_POOL.checkout(self.repository.path)
+
+        try:
+            sha1s = self.sha1s.keys()
+            objects = batch.readObjects(sha1s)
+            gitobjects = []
+
+            try:
+                for sha1, gitobject in objects:
+                    assert gitobject is not None, "%s missing" % sha1
+                    assert gitobject.sha1 == sha1, "%s != %s" % (gitobject.sha1, sha1)
+                    assert gitobject.type == "commit"
+
+                    gitobjects.append((gitobject, self.sha1s[sha1]))
+            finally:
+                objects.close()
+
+            self.gitobjects = gitobjects
+        except Exception:
+            self.error = traceback.format_exc()
+        finally:
+            BATCH_POOL.checkin(batch)
+
+    def getCommits(self, db):
+        self.join()
+
+        for gitobject, commit_id in self.gitobjects:
+            Commit.fromGitObject(db, self.repository, gitobject, commit_id)
@@ -0,0 +1,9 @@
+# @dependency 001-main/002-createrepository.py
+
+# Check that the stored progress of the reviews created, assigned and reviewed
+# by the preceding tests matches the progress computed from scratch.
+try:
+    instance.execute(["sudo", "criticctl", "reviewprogress"])
+except testing.virtualbox.GuestCommandError as error:
+    logger.error("stored review progress is incorrect:\n%s"
+                 % error.stdout)
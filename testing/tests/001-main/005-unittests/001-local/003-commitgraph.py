@@ -0,0 +1,4 @@
+# @dependency 001-main/005-unittests/001-local/001-independence.py
+# @flag local
+
+instance.unittest("commitgraph", ["basic"])